@@ -35,6 +35,7 @@ import hubblestack.splunklogging
 import hubblestack.log
 import hubblestack.hec.opt
 import hubblestack.utils.stdrec
+import hubblestack.utils.emission
 from hubblestack import __version__
 from croniter import croniter
 from datetime import datetime
@@ -384,10 +385,12 @@ def schedule():
             sf_count += 1
             if __opts__['log_level'] == 'debug':
                 log.debug('Job returned:\n{0}'.format(ret))
+            delivered = bool(returners)
             for returner in returners:
                 returner = '{0}.returner'.format(returner)
                 if returner not in __returners__:
                     log.error('Could not find {0} returner.'.format(returner))
+                    delivered = False
                     continue
                 log.debug('Returning job data to {0}'.format(returner))
                 returner_ret = {'id': __grains__['id'],
@@ -395,7 +398,11 @@ def schedule():
                                 'fun': func,
                                 'fun_args': args + ([kwargs] if kwargs else []),
                                 'return': ret}
-                __returners__[returner](returner_ret)
+                if __returners__[returner](returner_ret) is False:
+                    delivered = False
+            if delivered:
+                # nova delta results are only taken as reported once delivered
+                hubblestack.utils.emission.commit(ret)
     return sf_count
 
 
@@ -434,7 +441,8 @@ def run_function():
                             'fun': __opts__['function'],
                             'fun_args': args + ([kwargs] if kwargs else []),
                             'return': ret}
-            __returners__[returner](returner_ret)
+            if __returners__[returner](returner_ret) is not False:
+                hubblestack.utils.emission.commit(ret)
 
     # TODO instantiate the salt outputter system?
     if __opts__['json_print']:
@@ -49,6 +49,8 @@ import os
 import re
 
 from salt.exceptions import CommandExecutionError
+import hubblestack.utils.facts as facts
+import hubblestack.utils.grep as grep_engine
 
 LOG = logging.getLogger(__name__)
 
@@ -154,8 +156,14 @@ def _grep(path,
                                                     pattern=pattern,
                                                     path=path)
 
+    ret = grep_engine.run(cmd)
+    if ret is not None:
+        # cmd.run folds stderr into stdout; the engine never writes stderr
+        return ret['stdout']
+
     try:
-        ret = __salt__['cmd.run'](cmd, python_shell=False, ignore_retcode=True)
+        ret = facts.salt_call(__salt__, 'cmd.run', cmd, python_shell=False, ignore_retcode=True,
+                               cost=1)
     except (IOError, OSError) as exc:
         raise CommandExecutionError(exc.strerror)
 
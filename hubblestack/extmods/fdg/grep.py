@@ -10,6 +10,7 @@ import logging
 import os.path
 
 from salt.exceptions import CommandExecutionError
+import hubblestack.utils.facts as facts
 
 LOG = logging.getLogger(__name__)
 
@@ -131,7 +132,12 @@ def _grep(pattern, path=None, string=None, args=None):
         cmd += [path]
 
     try:
-        ret = __salt__['cmd.run_stdout'](cmd, python_shell=False, ignore_retcode=True, stdin=string)
+        if string is None:
+            # file greps can't change during a run, so share them
+            ret = facts.salt_call(__salt__, 'cmd.run_stdout', cmd,
+                                  python_shell=False, ignore_retcode=True, stdin=None, cost=1)
+        else:
+            ret = __salt__['cmd.run_stdout'](cmd, python_shell=False, ignore_retcode=True, stdin=string)
     except (IOError, OSError) as exc:
         raise CommandExecutionError(exc.strerror)
 
@@ -105,6 +105,7 @@ import yaml
 
 from distutils.version import StrictVersion
 from hubblestack.status import HubbleStatus
+import hubblestack.utils.facts as facts
 from salt.exceptions import CommandExecutionError
 
 LOG = logging.getLogger(__name__)
@@ -168,29 +169,9 @@ def audit(audit_files=None,
                                        pack={'__salt__': __salt__,
                                              '__grains__': __grains__})
 
-    for audit_file in audit_files:
-        # Cache audit file
-        path = __salt__['cp.cache_file'](audit_file)
-
-        # Fileserver will return False if the file is not found
-        if not path:
-            LOG.error('Could not find audit file {0}'.format(audit_file))
-            continue
-
-        # Load current audit file
-        audit_data = None
-        if os.path.isfile(path):
-            try:
-                with open(path, 'r') as fh:
-                    audit_data = yaml.safe_load(fh)
-            except Exception as e:
-                LOG.exception('Error loading audit file {0}: {1}'.format(audit_file, e))
-                continue
-        if not audit_data or not isinstance(audit_data, dict):
-            LOG.error('audit data from {0} was not formed as a dict'.format(audit_file))
-            continue
-
-        ret = _run_audit(ret, audit_data, tags, labels, audit_file)
+    with facts.run_scope():
+        for audit_file in audit_files:
+            ret = _run_audit_file(ret, audit_file, tags, labels)
 
     # If verbose=False, reduce each check to a dictionary with {tag: description}
     if not verbose or verbose == 'False':
@@ -257,6 +238,36 @@ def top(topfile='salt://hubblestack_audit/top.audit',
                  )
 
 
+def _run_audit_file(ret, audit_file, tags, labels):
+    """
+    Cache, load and run a single audit file, returning the updated ``ret``
+    """
+    # Cache audit file
+    path = __salt__['cp.cache_file'](audit_file)
+
+    # Fileserver will return False if the file is not found
+    if not path:
+        LOG.error('Could not find audit file {0}'.format(audit_file))
+        return ret
+
+    # Load current audit file
+    audit_data = None
+    if os.path.isfile(path):
+        try:
+            with open(path, 'r') as fh:
+                audit_data = yaml.safe_load(fh)
+        except Exception as e:
+            LOG.exception('Error loading audit file {0}: {1}'.format(audit_file, e))
+            return ret
+    if not audit_data or not isinstance(audit_data, dict):
+        LOG.error('audit data from {0} was not formed as a dict'.format(audit_file))
+        return ret
+
+    ret = _run_audit(ret, audit_data, tags, labels, audit_file)
+
+    return ret
+
+
 def _get_top_data(topfile):
 
     topfile = __salt__['cp.cache_file'](topfile)
@@ -121,6 +121,7 @@ import yaml
 
 import salt.loader
 import salt.utils
+import hubblestack.utils.facts as facts
 from salt.exceptions import CommandExecutionError
 
 LOG = logging.getLogger(__name__)
@@ -172,7 +173,8 @@ def fdg(fdg_file, starting_chained=None):
                                            '__grains__': __grains__})
 
     # Recursive execution of the blocks
-    ret = _fdg_execute('main', block_data, chained=starting_chained)
+    with facts.run_scope():
+        ret = _fdg_execute('main', block_data, chained=starting_chained)
     return (fdg_file, str(starting_chained)), ret
 
 
@@ -207,14 +209,15 @@ def top(fdg_topfile='salt://fdg/top.fdg'):
     fdg_routines = _get_top_data(fdg_topfile)
 
     ret = {}
-    for fdg_file in fdg_routines:
-        if isinstance(fdg_file, dict):
-            for key, val in fdg_file.iteritems():
-                retkey, retval = fdg(_fdg_saltify(key), val)
+    with facts.run_scope():
+        for fdg_file in fdg_routines:
+            if isinstance(fdg_file, dict):
+                for key, val in fdg_file.iteritems():
+                    retkey, retval = fdg(_fdg_saltify(key), val)
+                    ret[retkey] = retval
+            else:
+                retkey, retval = fdg(_fdg_saltify(fdg_file))
                 ret[retkey] = retval
-        else:
-            retkey, retval = fdg(_fdg_saltify(fdg_file))
-            ret[retkey] = retval
     return ret
 
 
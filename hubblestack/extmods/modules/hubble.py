@@ -10,17 +10,50 @@ Configuration:
     - hubblestack:nova:saltenv
     - hubblestack:nova:autoload
     - hubblestack:nova:autosync
+    - hubblestack:nova:concurrent
+        Run the nova modules of an audit on a thread pool instead of one
+        after another (default False)
+    - hubblestack:nova:max_workers
+        Size of that thread pool (default 4)
+    - hubblestack:nova:module_timeout
+        Seconds a nova module may run in concurrent mode before it is
+        abandoned and reported as an error (default 300)
+    - hubblestack:nova:audit_timeout
+        Seconds the modules of a concurrent audit may take in all; modules
+        still running or not yet started by then are reported as timed out
+        (default: module_timeout times the number of modules per worker)
+    - hubblestack:nova:incremental
+        Reuse the last results of nova modules whose inputs haven't changed
+        since the previous audit (default False); see
+        hubblestack.utils.incremental
+    - hubblestack:nova:incremental_full_every
+        In incremental mode, evaluate every module regardless on every N-th
+        audit (default 12)
+    - hubblestack:nova:emit
+        'full' to return every check of an audit (the default), 'delta' to
+        return only the checks whose result changed since the last audit
+        the returners delivered (best-effort: as far as the returners tell);
+        see hubblestack.utils.emission
+    - hubblestack:nova:heartbeat
+        In delta mode, return the full results anyway when the last full
+        results are this many seconds old (default 86400)
 """
 from __future__ import absolute_import
 
 import logging
 import os
+import time
 import traceback
 import yaml
 
 from salt.exceptions import CommandExecutionError
 from hubblestack import __version__
 from hubblestack.status import HubbleStatus
+from hubblestack.utils.workers import Task, WorkerPool
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.emission as emission
+import hubblestack.utils.facts as facts
+import hubblestack.utils.incremental as incremental
 
 LOG = logging.getLogger(__name__)
 
@@ -44,6 +77,7 @@ def audit(configs=None,
           called_from_top=None,
           debug=None,
           labels=None,
+          emit=None,
           **kwargs):
     """
     Primary entry point for audit calls.
@@ -97,6 +131,12 @@ def audit(configs=None,
         Tests with matching labels are executed. If multiple labels are passed,
         then tests which have all those labels are executed.
 
+    emit
+        'full' to return every check, 'delta' to return only the checks whose
+        result changed since the last audit with the same arguments. Defaults
+        to 'full'. Configurable via `hubblestack:nova:emit` in minion
+        config/pillar.
+
     **kwargs
         Any parameters & values that are not explicitly defined will be passed
         directly through to the Nova module(s).
@@ -111,7 +151,8 @@ def audit(configs=None,
         return top(verbose=verbose,
                    show_success=show_success,
                    show_compliance=show_compliance,
-                   labels=labels)
+                   labels=labels,
+                   emit=emit)
     if labels:
         if not isinstance(labels, list):
             labels = labels.split(',')
@@ -146,8 +187,14 @@ def audit(configs=None,
 
     LOG.debug('nova_kwargs: %s', str(nova_kwargs))
 
-    ret = _run_audit(configs, tags, debug, labels, **nova_kwargs)
-    results = _build_results(verbose, ret, show_success, show_compliance, called_from_top)
+    with facts.run_scope():
+        ret = _run_audit(configs, tags, debug, labels, **nova_kwargs)
+    emit = None if called_from_top else _emit_mode(emit)
+    # delta mode tracks the successes even when they aren't shown
+    results = _build_results(verbose, ret, show_success or emit == 'delta', show_compliance,
+                             called_from_top)
+    if emit == 'delta':
+        results = _emit(results, ['audit', configs, tags, verbose, labels], show_success)
 
     return results
 
@@ -298,24 +345,33 @@ def _run_audit(configs, tags, debug, labels, **kwargs):
     # have available with the data list, so data will be processed multiple
     # times. However, for the scale we're working at this should be fine.
     # We can revisit if this ever becomes a big bottleneck
-    for key, func in __nova__._dict.iteritems():
-        try:
-            ret = func(data_list, tags, labels, **kwargs)
-        except Exception:
-            LOG.error('Exception occurred in nova module:')
-            LOG.error(traceback.format_exc())
+    modules = list(__nova__._dict.iteritems())
+    inc_audit = _incremental_audit()
+    reused = {}
+    if inc_audit is not None:
+        modules, reused = _apply_incremental(inc_audit, modules, data_list, tags, labels, kwargs)
+    if __salt__['config.get']('hubblestack:nova:concurrent', False):
+        module_runs = _run_modules_concurrently(modules, data_list, tags, labels, **kwargs)
+    else:
+        module_runs = _run_modules_serially(modules, data_list, tags, labels, **kwargs)
+    if inc_audit is not None:
+        inc_audit.save(keep=set(__nova__._dict))
+        module_runs = _merge_module_runs(module_runs, reused)
+
+    for key, ret, error, elapsed in module_runs:
+        if debug:
+            LOG.debug('nova module %s ran in %.3fs', key, elapsed)
+        if error:
             if 'Errors' not in results:
                 results['Errors'] = []
-            results['Errors'].append({key: {'error': 'exception occurred',
-                                            'data': traceback.format_exc().splitlines()[-1]}})
+            results['Errors'].append({key: error})
+            continue
+        if not isinstance(ret, dict):
+            if 'Errors' not in results:
+                results['Errors'] = []
+            results['Errors'].append({key: {'error': 'bad return type',
+                                            'data': ret}})
             continue
-        else:
-            if not isinstance(ret, dict):
-                if 'Errors' not in results:
-                    results['Errors'] = []
-                results['Errors'].append({key: {'error': 'bad return type',
-                                                'data': ret}})
-                continue
 
         # Merge in the results
         for ret_key, ret_val in ret.iteritems():
@@ -340,10 +396,169 @@ def _run_audit(configs, tags, debug, labels, **kwargs):
     return results
 
 
+def _emit_mode(emit):
+    """
+    The emission mode to use, 'full' or 'delta'
+    """
+    if emit is None:
+        emit = __salt__['config.get']('hubblestack:nova:emit', 'full')
+    if emit not in emission.MODES:
+        LOG.error('Unknown nova emission mode %s, returning the full results', emit)
+        return 'full'
+    return emit
+
+
+def _emit(results, job, show_success):
+    """
+    The results to return in delta mode: only what changed since the last
+    delivered run of the same job. The new state is committed by the daemon
+    once the returners delivered the results (see emission.commit).
+    """
+    heartbeat = __salt__['config.get']('hubblestack:nova:heartbeat', emission.DEFAULT_HEARTBEAT)
+    name = 'nova_emission-{0}.json'.format(incremental.data_digest(*job)[:16])
+    state = emission.DeltaState(os.path.join(__opts__['cachedir'], name))
+    return emission.emit(results, state, heartbeat=heartbeat, show_success=show_success)
+
+
+def _incremental_audit():
+    """
+    The IncrementalAudit state if ``hubblestack:nova:incremental`` is on
+    """
+    if not __salt__['config.get']('hubblestack:nova:incremental', False):
+        return None
+    full_every = __salt__['config.get']('hubblestack:nova:incremental_full_every', 12)
+    return incremental.IncrementalAudit(os.path.join(__opts__['cachedir'], 'nova_incremental.json'),
+                                        full_every=full_every)
+
+
+def _apply_incremental(inc_audit, modules, data_list, tags, labels, kwargs):
+    """
+    Split off the modules whose last results can be reused. Returns the
+    modules still to run (the declared ones wrapped to record their inputs)
+    and ``{key: ret}`` of the reused results.
+    """
+    grains = dict((grain, __grains__.get(grain))
+                  for grain in ('osfinger', 'os', 'osrelease', 'kernelrelease'))
+    to_run = []
+    reused = {}
+    for key, func in modules:
+        if not incremental.declared(func):
+            to_run.append((key, func))
+            continue
+        digest = incremental.data_digest(key, data_list, tags, labels, kwargs, grains)
+        ret = inc_audit.reusable(key, digest)
+        if ret is not None:
+            reused[key] = ret
+            continue
+        to_run.append((key, inc_audit.tracked(key, func, digest)))
+    return to_run, reused
+
+
+def _merge_module_runs(module_runs, reused):
+    """
+    Put the reused results back in between the module runs, in module order
+    """
+    by_key = dict((run[0], run) for run in module_runs)
+    for key, ret in reused.iteritems():
+        by_key[key] = (key, ret, None, 0.0)
+    return [by_key[key] for key in __nova__._dict if key in by_key]
+
+
+def _timed_module_call(key, func, *args, **kwargs):
+    """
+    Run a single nova module, recording its wall time in hubblestack.status
+    under ``nova_module.<module>``
+    """
+    resource = 'nova_module.' + os.path.splitext(key)[0].replace(os.path.sep, '.').strip('.')
+    hubble_status.add_resource(resource)
+    stat_handle = hubble_status.mark(resource)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        stat_handle.fin()
+
+
+def _run_modules_serially(modules, data_list, tags, labels, **kwargs):
+    """
+    Run the nova modules (``(key, func)`` pairs) one after another. Returns a
+    list of ``(key, ret, error, elapsed)`` tuples in module order.
+    """
+    module_runs = []
+    for key, func in modules:
+        start = time.time()
+        ret = error = None
+        try:
+            ret = _timed_module_call(key, func, data_list, tags, labels, **kwargs)
+        except Exception:
+            LOG.error('Exception occurred in nova module:')
+            LOG.error(traceback.format_exc())
+            error = {'error': 'exception occurred',
+                     'data': traceback.format_exc().splitlines()[-1]}
+        module_runs.append((key, ret, error, time.time() - start))
+    return module_runs
+
+
+def _run_modules_concurrently(modules, data_list, tags, labels, **kwargs):
+    """
+    Run the nova modules on a bounded thread pool. Most modules spend their
+    time waiting on subprocesses or the network, so this overlaps that waiting.
+
+    Each module may run for at most ``hubblestack:nova:module_timeout``
+    seconds, and all of them for ``hubblestack:nova:audit_timeout``; modules
+    that exceed it are abandoned, modules that never got a worker (because
+    abandoned ones still hold them) are cancelled, and both are reported in
+    ``Errors``.
+    Returns the same ``(key, ret, error, elapsed)`` tuples as
+    _run_modules_serially(), in the same (module) order, so merging stays
+    deterministic.
+    """
+    max_workers = __salt__['config.get']('hubblestack:nova:max_workers', 4)
+    module_timeout = __salt__['config.get']('hubblestack:nova:module_timeout', 300)
+    rounds = -(-len(modules) // max(int(max_workers), 1))
+    audit_timeout = __salt__['config.get']('hubblestack:nova:audit_timeout',
+                                           module_timeout * max(rounds, 1))
+    deadline = time.time() + audit_timeout
+
+    pool = WorkerPool(max_workers=max_workers, name='nova')
+    tasks = []
+    for key, func in modules:
+        task = Task(_timed_module_call, (key, func, data_list, tags, labels), kwargs, name=key)
+        tasks.append(pool.submit_task(task))
+
+    module_runs = []
+    try:
+        for task in tasks:
+            ret = error = None
+            if not task.join(timeout=module_timeout, deadline=deadline):
+                if task.cancel():
+                    LOG.error('nova module %s did not start within the audit timeout of %ss',
+                              task.name, audit_timeout)
+                    error = {'error': 'timed out',
+                             'data': 'module did not start within the audit timeout of '
+                                     '{0}s'.format(audit_timeout)}
+                else:
+                    LOG.error('nova module %s did not finish within %ss', task.name,
+                              module_timeout)
+                    error = {'error': 'timed out',
+                             'data': 'module did not finish within {0}s'.format(module_timeout)}
+            elif task.exception is not None:
+                LOG.error('Exception occurred in nova module:')
+                LOG.error(task.traceback)
+                error = {'error': 'exception occurred',
+                         'data': task.traceback.splitlines()[-1]}
+            else:
+                ret = task.value
+            module_runs.append((task.name, ret, error, task.elapsed))
+    finally:
+        pool.shutdown()
+    return module_runs
+
+
 def _build_audit_data(configs, results):
     """
     Helper function that goes over each config and extract the audit data sets
-    that need to be run.
+    that need to be run, along with the stamp of the profile files they came
+    from (see hubblestack.utils.checkplan.Profiles).
     """
     to_run = set()
     for config in configs:
@@ -366,8 +581,11 @@ def _build_audit_data(configs, results):
             results['Errors'].append(
                 {config: {'error': 'No matching profiles found for {0}'.format(config)}})
 
-    return [(key.split('.yaml')[0].split(os.path.sep)[-1],
-             __nova__.__data__[key]) for key in to_run]
+    to_run = list(to_run)
+    stamps = tuple(__nova__.__stamps__.get(key) for key in to_run)
+    return checkplan.Profiles([(key.split('.yaml')[0].split(os.path.sep)[-1],
+                                __nova__.__data__[key]) for key in to_run],
+                              None if None in stamps else stamps)
 
 
 def _build_processed_controls(data_list, debug):
@@ -419,7 +637,8 @@ def top(topfile='top.nova',
         show_success=None,
         show_compliance=None,
         show_profile=None,
-        labels=None):
+        labels=None,
+        emit=None):
     """
     Compile and run all yaml data from the specified nova topfile.
 
@@ -481,6 +700,12 @@ def top(topfile='top.nova',
         False. Configurable via `hubblestack:nova:debug` in minion
         config/pillar.
 
+    emit
+        'full' to return every check, 'delta' to return only the checks whose
+        result changed since the last top run of the same topfile. Defaults
+        to 'full'. Configurable via `hubblestack:nova:emit` in minion
+        config/pillar.
+
     CLI Examples:
 
     .. code-block:: bash
@@ -516,29 +741,34 @@ def top(topfile='top.nova',
     if not data_by_tag:
         return results
 
-    # Run the audits
-    for tag, data in data_by_tag.iteritems():
-        ret = audit(configs=data,
-                    tags=tag,
-                    verbose=verbose,
-                    show_success=True,
-                    show_compliance=False,
-                    called_from_top=True,
-                    labels=labels)
-
-        # Merge in the results
-        for key, val in ret.iteritems():
-            if key not in results:
-                results[key] = []
-            results[key].extend(val)
+    # Run the audits, sharing one fact snapshot across all of them
+    with facts.run_scope():
+        for tag, data in data_by_tag.iteritems():
+            ret = audit(configs=data,
+                        tags=tag,
+                        verbose=verbose,
+                        show_success=True,
+                        show_compliance=False,
+                        called_from_top=True,
+                        labels=labels)
+
+            # Merge in the results
+            for key, val in ret.iteritems():
+                if key not in results:
+                    results[key] = []
+                results[key].extend(val)
 
     if show_compliance:
         compliance = _calculate_compliance(results)
         if compliance:
             results['Compliance'] = compliance
 
-    _clean_up_results(results, show_success)
+    emit = _emit_mode(emit)
+    # delta mode tracks the successes even when they aren't shown
+    _clean_up_results(results, show_success or emit == 'delta')
 
+    if emit == 'delta':
+        results = _emit(results, ['top', topfile, verbose, labels], show_success)
     return results
 
 
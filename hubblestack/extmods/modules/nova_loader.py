@@ -39,6 +39,9 @@ import salt.modules.cmdmod
 
 # Import 3rd-party libs
 import salt.ext.six as six
+
+import hubblestack.utils.checkplan as checkplan
+
 try:
     import pkg_resources
     HAS_PKG_RESOURCES = True
@@ -1832,6 +1835,7 @@ class NovaLazyLoader(LazyLoader):
         self.__opts__ = opts
         self.__data__ = {}
         self.__missing_data__ = {}
+        self.__stamps__ = {}
         super(NovaLazyLoader, self).__init__(hubble_dir,
                                              opts=opts,
                                              tag='nova')
@@ -1907,6 +1911,9 @@ class NovaLazyLoader(LazyLoader):
         fpath, suffix = self.file_mapping[name]
         self.loaded_files.add(name)
         if suffix == '.yaml':
+            # Taken before reading, so a file changing under us gets a new
+            # stamp on the next load rather than a stale plan
+            stamp = checkplan.file_stamp(fpath)
             try:
                 with open(fpath) as fh_:
                     data = yaml.safe_load(fh_)
@@ -1916,6 +1923,7 @@ class NovaLazyLoader(LazyLoader):
                 return False
 
             self.__data__[name] = data
+            self.__stamps__[name] = stamp
             return True
         try:
             sys.path.append(os.path.dirname(fpath))
@@ -16,9 +16,7 @@ from __future__ import absolute_import
 import types
 import base64
 import collections
-import fnmatch
 import os
-import re
 import yaml
 import time
 from salt.exceptions import CommandExecutionError
@@ -53,7 +51,15 @@ import logging
 log = logging.getLogger(__name__)
 
 from hubblestack.status import HubbleStatus
-hubble_status = HubbleStatus(__name__, 'top', 'process')
+import hubblestack.utils.checksums as checksums
+import hubblestack.utils.coalesce as coalesce
+import hubblestack.utils.eventloop as eventloop
+import hubblestack.utils.fanotify as fanotify
+import hubblestack.utils.pathmatch as pathmatch
+import hubblestack.utils.snapshot as snapshot
+import hubblestack.utils.watchsetup as watchsetup
+from hubblestack.utils.workers import WorkerPool
+hubble_status = HubbleStatus(__name__, 'top', 'process', 'service', 'overflow')
 
 def __virtual__():
     if salt.utils.platform.is_windows():
@@ -76,6 +82,8 @@ def _enqueue(revent):
 class ConfigManager(object):
     _config = {}
     _last_update = 0
+    _excludes = {}
+    _paths = None
 
     @property
     def config(self):
@@ -90,9 +98,11 @@ class ConfigManager(object):
     @nc_config.setter
     def nc_config(self, v):
         self.__class__._config = v
+        self.__class__._paths = None
 
     @config.setter
     def config(self, v):
+        self.__class__._paths = None
         return self.nc_config.update(v)
 
     @property
@@ -127,7 +137,35 @@ class ConfigManager(object):
         c.update( config.get(path, {}) )
         return c
 
+    def excludes(self, path):
+        """ the compiled exclude matcher of the config for path, kept until
+            the config is updated
+        """
+        matchers = self.__class__._excludes
+        matcher = matchers.get(path)
+        if matcher is None:
+            pconf = self.nc_config.get(path)
+            excludes = pconf.get('exclude') if isinstance(pconf, dict) else None
+            matcher = matchers[path] = _preprocess_excludes(excludes)
+        return matcher
+
+    @property
+    def config_paths(self):
+        """ PathTrie of the configured paths and their configs, kept until
+            the config changes
+        """
+        paths = self.__class__._paths
+        if paths is None:
+            paths = pathmatch.PathTrie( (k,v) for k,v in salt.ext.six.iteritems(self.nc_config)
+                if isinstance(k, salt.ext.six.string_types) and k.startswith('/') )
+            self.__class__._paths = paths
+        return paths
+
     def path_of_config(self, path):
+        if path.startswith('/'):
+            found = self.config_paths.longest_prefix(path)
+            if found is not None:
+                return found[0]
         ncc = self.nc_config
         while len(path)>1 and path not in ncc:
             path = os.path.dirname(path)
@@ -140,6 +178,8 @@ class ConfigManager(object):
                 l = os.path.abspath(k)
                 if k != l:
                     c[l] = c.pop(k)
+                    # the config_paths are only rebuilt when a key changed
+                    self.__class__._paths = None
 
     def update(self):
         config = self.nc_config
@@ -160,13 +200,14 @@ class ConfigManager(object):
 
         to_set['paths'] = config.get('paths')
         self.nc_config = to_set
+        self.__class__._excludes = {}
         self._abspathify()
         if config.get('verbose'):
             log.debug('Pulsar config updated')
 
         self.last_update = time.time()
 
-    def __init__(self, configfile=None, verbose=False):
+    def __init__(self, configfile=None, verbose=False, refresh=True):
         if configfile is not None:
             if isinstance(configfile, (list,tuple)):
                 self.nc_config['paths'] = configfile
@@ -174,13 +215,14 @@ class ConfigManager(object):
                 self.nc_config['paths'] = [configfile]
         else:
             self.nc_config['paths'] = []
-        config = self.config
+        config = self.config if refresh else self.nc_config
         config['verbose'] = verbose
         self._abspathify()
 
 class PulsarWatchManager(pyinotify.WatchManager):
     """ Subclass of pyinotify.WatchManager for the purposes:
-        * adding dict() based watch_db (for faster lookups)
+        * adding dict() based watch_db (for faster lookups), with a wd -> paths
+          index, a child -> parents index and a PathTrie of the watched paths
         * adding file watches (to notice changes to hardlinks outside the watched locations)
         * adding various convenience functions
 
@@ -204,6 +246,12 @@ class PulsarWatchManager(pyinotify.WatchManager):
         self.__super.__init__(*a, **kw)
         self.watch_db  = dict()
         self.parent_db = dict()
+        self.wd_db     = dict() # wd -> set(paths); the inverse of watch_db
+        self.child_db  = dict() # path -> set(parents); the inverse of parent_db
+        self.watch_paths = pathmatch.PathTrie()
+        self.setups = dict()    # path -> (params, watchsetup.TreeSetup)
+        self.setup_pool = None
+        self.restored = None    # path -> (dirs, files, rescan) from a snapshot
 
         self._last_config_update = 0
         self.update_config()
@@ -239,13 +287,28 @@ class PulsarWatchManager(pyinotify.WatchManager):
         for i in items:
             if items[i] > 0:
                 todo[i] = items[i]
-        self.watch_db.update(todo)
+        for path,wd in salt.ext.six.iteritems(todo):
+            old = self.watch_db.get(path)
+            if old is not None and old != wd:
+                self._unindex_wd(path, old)
+            self.watch_db[path] = wd
+            self.wd_db.setdefault(wd, set()).add(path)
+            self.watch_paths[path] = wd
         if parent in todo:
             del todo[parent]
         if todo:
             if parent not in self.parent_db:
                 self.parent_db[parent] = set()
             self.parent_db[parent].update(todo)
+            for child in todo:
+                self.child_db.setdefault(child, set()).add(parent)
+
+    def _unindex_wd(self, path, wd):
+        paths = self.wd_db.get(wd)
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del self.wd_db[wd]
 
     def _get_wdl(self, *pathlist):
         """ inverse pathlist and return a flat list of wd's for the paths and their child paths
@@ -257,7 +320,7 @@ class PulsarWatchManager(pyinotify.WatchManager):
 
     def _get_paths(self, *wdl):
         wdl = self._listify_anything(wdl)
-        return self._listify_anything([ k for k,v in salt.ext.six.iteritems(self.watch_db) if v in wdl ])
+        return self._listify_anything([ self.wd_db.get(wd) for wd in wdl ])
 
     def update_config(self):
         """ (re)check the config files for inotify_limits:
@@ -265,6 +328,7 @@ class PulsarWatchManager(pyinotify.WatchManager):
             * inotify_limits:highwater - the highest we should set MUW (default: 1000000)
             * inotify_limits:increment - the amount we should increase MUW when applicable
             * inotify_limits:initial   - if given, and if MUW is initially lower at startup: set MUW to this
+            and for watch_setup (budget, max_workers, batch_size); see process()
         """
 
         if not hasattr(self, 'cm'):
@@ -277,6 +341,17 @@ class PulsarWatchManager(pyinotify.WatchManager):
         self.update_muw_highwater = config.get('highwater', 1000000)
         self.update_muw_bump = config.get('increment', 1000)
 
+        setup = self.cm.config.get('watch_setup', {})
+        if not isinstance(setup, dict):
+            setup = {}
+        self.setup_budget = setup.get('budget', 10)
+        self.setup_batch_size = setup.get('batch_size', watchsetup.DEFAULT_BATCH_SIZE)
+        workers = max(int(setup.get('max_workers', 4)), 1)
+        if self.setup_pool is None or self.setup_pool.max_workers != workers:
+            if self.setup_pool is not None:
+                self.setup_pool.shutdown()
+            self.setup_pool = WorkerPool(max_workers=workers, name='pulsar-setup')
+
         initial = config.get('initial', 0)
         if initial > 0:
             muw = self.max_user_watches
@@ -314,9 +389,8 @@ class PulsarWatchManager(pyinotify.WatchManager):
         path = os.path.abspath(path)
         up_path = kw.pop('parent', False)
         if not up_path:
-            up_path = os.path.dirname(path)
-            while len(up_path) > 1 and up_path not in self.watch_db:
-                up_path = os.path.dirname(up_path)
+            found = self.watch_paths.longest_prefix(os.path.dirname(path))
+            up_path = found[0] if found else None
         if up_path and up_path in self.watch_db:
             # we already did many of the lookups add_watch would do
             # so we say no_db=True and manually add the (up_path,**res)
@@ -332,6 +406,11 @@ class PulsarWatchManager(pyinotify.WatchManager):
         """
         path     = os.path.abspath(path)
         new_file = kw.pop('new_file', False)
+        deadline = kw.pop('deadline', None)
+        excludes = kw.get('exclude_filter') or _preprocess_excludes(None)
+        if isinstance(excludes, (list,tuple)):
+            pfft = excludes
+            excludes = lambda x: x in pfft
 
         if not os.path.exists(path):
             log.debug("watch({0}): NOENT (skipping)".format(path))
@@ -360,37 +439,101 @@ class PulsarWatchManager(pyinotify.WatchManager):
             kw['rec'] = kw.get('rec')
             if kw['rec'] is None:
                 kw['rec'] = pconf['recurse']
-            self.add_watch(path,mask,**kw)
+            if kw['rec'] and os.path.isdir(path):
+                # the directories below are watched by the tree setup
+                self.add_watch(path,mask,**dict(kw, rec=False))
+            else:
+                self.add_watch(path,mask,**kw)
             log.debug('add-watch wd={0} path={1} watch_files={2} recurse={3}'.format(
                 self.watch_db.get(path), path, pconf['watch_files'], kw['rec']))
 
         if new_file: # process() says this is a new file
             self._add_recursed_file_watch(path)
 
-        else: # watch_files if configured to do so
-            if pconf['watch_files']:
-                rec = kw.get('rec')
-                excludes = kw.get('exclude_filter', lambda x: False)
-                if isinstance(excludes, (list,tuple)):
-                    pfft = excludes
-                    excludes = lambda x: x in pfft
-                file_track = self.parent_db.get(path, {})
-                pre_count = len(self.watch_db)
-                for wpath,wdirs,wfiles in os.walk(path):
-                    if rec or wpath == path:
-                        for f in wfiles:
-                            wpathname = os.path.join(wpath,f)
-                            if excludes(wpathname):
-                                continue
-                            if not os.path.isfile(wpathname):
-                                continue
-                            if wpathname in file_track: # checking file_track isn't strictly necessary
-                                continue                # but gives a slight speedup
-                            self._add_recursed_file_watch( wpathname, parent=path )
-                ft_count = len(self.watch_db) - pre_count
-                if ft_count > 0:
-                    log.debug('recursive file-watch totals for path={0} new-this-loop: {1}'.format(path, ft_count))
+        elif os.path.isdir(path):
+            rec = kw.get('rec')
+            if rec is None:
+                rec = pconf['recurse']
+            # watch the tree below (and its files if configured to do so); a
+            # recursive setup that already completed with these settings
+            # isn't walked again unless there are files to pick up
+            params = (mask, bool(rec), kw.get('auto_add'), excludes, bool(pconf['watch_files']))
+            previous = self.setups.get(path)
+            if previous is not None and previous[0] == params and not previous[1].done:
+                self._run_setup(previous[1], deadline)
+            elif pconf['watch_files'] or (rec and (previous is None or previous[0] != params)):
+                self._start_setup(path, mask, params, excludes, deadline=deadline)
+
+    def _start_setup(self, path, mask, params, excludes, deadline=None):
+        _, rec, auto_add, _, watch_files = params
+
+        def add_dirs(paths):
+            res = {}
+            for dirpath in paths:
+                if dirpath not in self.watch_db:
+                    res.update(self.add_watch(dirpath, mask, rec=False, auto_add=auto_add,
+                        exclude_filter=excludes, no_db=True))
+            self._add_db(path, res)
+            return len(res)
+
+        def add_files(paths):
+            pre_count = len(self.watch_db)
+            for wpathname in paths:
+                if wpathname not in self.watch_db:
+                    self._add_recursed_file_watch(wpathname, parent=path)
+            return len(self.watch_db) - pre_count
+
+        setup = watchsetup.TreeSetup(path, add_dirs, add_files if watch_files else None,
+            excluded=excludes, recurse=rec, batch_size=self.setup_batch_size)
+        known = self.restored.pop(path, None) if self.restored else None
+        if known is not None:
+            # watch what the snapshot knew of, and walk only what's new
+            dirs, files, rescan = known
+            setup.restore(dirs, [ f for f in files if not excludes(f) ],
+                [ d for d in rescan if not excludes(d) ])
+        self.setups[path] = (params, setup)
+        self._run_setup(setup, deadline)
+
+    def _run_setup(self, setup, deadline):
+        done = setup.run(self.setup_pool, deadline=deadline)
+        progress = setup.progress()
+        if done:
+            if progress['watched'] > 0:
+                log.debug('watch setup for path={0} complete: {1} new watches, {2} directories '
+                    'scanned, {3} pruned in {4:0.2f}s'.format(setup.root, progress['watched'],
+                    progress['scanned'], progress['pruned'], progress['elapsed']))
+        else:
+            log.info('watch setup for path={0} continues next sweep: {1} new watches, '
+                '{2} directories scanned, {3} pending'.format(setup.root, progress['watched'],
+                progress['scanned'], progress['pending']))
+        return done
+
+    def resume_setups(self, deadline=None):
+        """ continue the tree setups that ran out of time; returns the number
+            still incomplete
+        """
+        pending = 0
+        for path, (params, setup) in list(self.setups.items()):
+            if setup.done:
+                continue
+            if self.cm.path_config(path, falsifyable=True) is False:
+                del self.setups[path]
+                continue
+            if deadline is not None and time.time() >= deadline:
+                pending += 1
+                continue
+            if not self._run_setup(setup, deadline):
+                pending += 1
+        return pending
 
+    def headroom(self):
+        """ (watch count, fs.inotify.max_user_watches, fraction in use) """
+        count = len(self.watch_db)
+        try:
+            muw = self.max_user_watches
+        except (IOError, OSError, ValueError):
+            return count, None, None
+        return count, muw, float(count) / muw if muw else None
 
     def add_watch(self, path, mask, **kw):
         """ Curry of pyinotify.WatchManager.add_notify
@@ -447,10 +590,6 @@ class PulsarWatchManager(pyinotify.WatchManager):
         return res
 
     def _prune_paths_to_stop_watching(self):
-        inverse_parent_db = {}
-        for k,v in salt.ext.six.iteritems(self.parent_db):
-            for i in v:
-                inverse_parent_db[i] = k
         for dirpath in self.watch_db:
             pc = self.cm.path_config(dirpath, falsifyable=True)
             if pc is False:
@@ -460,7 +599,7 @@ class PulsarWatchManager(pyinotify.WatchManager):
                     for item in self.parent_db[dirpath]:
                         yield item
                     yield dirpath
-                elif dirpath not in inverse_parent_db:
+                elif dirpath not in self.child_db:
                     # this doesn't seem to be in parent_db or the reverse
                     # probably nolonger configured
                     yield dirpath
@@ -486,20 +625,25 @@ class PulsarWatchManager(pyinotify.WatchManager):
         plist = set( self._get_paths(wd) )
         for dirpath in plist:
             if dirpath in self.watch_db:
-                del self.watch_db[dirpath]
-            if dirpath in self.parent_db:
-                del self.parent_db[dirpath]
-
-        # in the interests of being really really thourough make sure none of
-        # the parent_db sets contain any of the removed dirpaths
-        # and then make sure there's no empty sets in the parent_db
-        to_fully_delete = set()
-        for d,s in salt.ext.six.iteritems(self.parent_db):
-            s -= plist
-            if not s:
-                to_fully_delete.add(d)
-        for item in to_fully_delete:
-            del self.parent_db[item]
+                self._unindex_wd(dirpath, self.watch_db.pop(dirpath))
+            self.watch_paths.pop(dirpath)
+            for child in self.parent_db.pop(dirpath, ()):
+                parents = self.child_db.get(child)
+                if parents is not None:
+                    parents.discard(dirpath)
+                    if not parents:
+                        del self.child_db[child]
+
+        # make sure none of the parent_db sets contain any of the removed
+        # dirpaths and that there's no empty sets left in the parent_db;
+        # child_db says which sets to look at
+        for dirpath in plist:
+            for parent in self.child_db.pop(dirpath, ()):
+                s = self.parent_db.get(parent)
+                if s is not None:
+                    s.discard(dirpath)
+                    if not s:
+                        del self.parent_db[parent]
 
     def del_watch(self, wd):
         """ remove a watch from the watchmanager database
@@ -517,69 +661,247 @@ class PulsarWatchManager(pyinotify.WatchManager):
         self._rm_db(wdl)
         return res
 
-def _get_notifier():
+class FanotifyWatchManager(object):
+    """ Stands in for PulsarWatchManager with the fanotify backend: one mark
+        covers each filesystem with configured paths on it, and events are
+        matched to the config (paths, recurse, mask) in user space. The
+        watch_db holds the configured paths and their masks.
+    """
+
+    def __init__(self):
+        self.fan = fanotify.Fanotify()
+        self.watch_db = dict()
+        self.parent_db = dict()
+        self.setups = dict()
+        self.setup_budget = 0
+        self.cm = ConfigManager()
+
+    def _remark(self):
+        masks = {}
+        for path,mask in salt.ext.six.iteritems(self.watch_db):
+            try:
+                dev = os.stat(path).st_dev
+            except OSError:
+                continue
+            marked_path, marked_mask = masks.get(dev, (path, 0))
+            masks[dev] = (marked_path, marked_mask | mask)
+        for dev,(path,_) in list(self.fan.marks.items()):
+            if dev not in masks:
+                try:
+                    self.fan.unmark(path)
+                except OSError as e:
+                    log.error("unable to remove the fanotify mark of {0}: {1}".format(path, e))
+        for dev,(path,mask) in salt.ext.six.iteritems(masks):
+            try:
+                self.fan.mark(path, mask)
+            except OSError as e:
+                log.error("unable to add a fanotify mark for {0}: {1}".format(path, e))
+
+    def watch(self, path, mask=None, **kw):
+        """ start reporting the events in mask under path (new_file watches
+            are implied by the filesystem mark)
+        """
+        if kw.get('new_file'):
+            return
+        path = os.path.abspath(path)
+        if not os.path.exists(path):
+            log.debug("watch({0}): NOENT (skipping)".format(path))
+            return
+        if mask is None:
+            mask = DEFAULT_MASK
+        if self.watch_db.get(path) != mask:
+            self.watch_db[path] = mask
+            self._remark()
+
+    def rm_watch(self, *paths, **kw):
+        """ stop reporting the events under the configured paths given """
+        removed = [ p for p in PulsarWatchManager._iterate_anything(paths) if p in self.watch_db ]
+        for path in removed:
+            del self.watch_db[path]
+        if removed:
+            self._remark()
+
+    def prune(self):
+        self.rm_watch([ path for path in self.watch_db
+            if self.cm.path_config(path, falsifyable=True) is False ])
+
+    def resume_setups(self, deadline=None):
+        return 0
+
+    def headroom(self):
+        return len(self.watch_db), None, None
+
+    def wants(self, event):
+        """ whether the event is under a watched path, by its config """
+        if event.pathname is None:
+            return True
+        found = self.cm.config_paths.longest_prefix(event.pathname)
+        if found is None or found[0] not in self.watch_db:
+            return False
+        cpath, pconf = found
+        if not event.mask & self.watch_db[cpath]:
+            return False
+        if event.pathname == cpath or os.path.dirname(event.pathname) == cpath:
+            return True
+        return isinstance(pconf, dict) and bool(pconf.get('recurse'))
+
+class FanotifyNotifier(object):
+    """ the part of pyinotify.Notifier that process() uses, over fanotify """
+
+    def __init__(self, watch_manager, default_proc_fun):
+        self._watch_manager = watch_manager
+        self._default_proc_fun = default_proc_fun
+        self._events = []
+
+    def check_events(self, timeout=None):
+        """ timeout in milliseconds, like pyinotify's """
+        return self._watch_manager.fan.wait(None if timeout is None else timeout / 1000.0)
+
+    def read_events(self):
+        self._events.extend(self._watch_manager.fan.read_events())
+
+    def process_events(self):
+        wm = self._watch_manager
+        events, self._events = self._events, []
+        for event in events:
+            if wm.wants(event):
+                self._default_proc_fun(event)
+
+def _backend(config):
+    """
+    The notification backend to use: the backend setting of the config,
+    inotify (the default), fanotify, or auto (fanotify where the kernel and
+    our capabilities allow it)
+    """
+    backend = config.get('backend', 'inotify') if config else 'inotify'
+    if backend not in ('fanotify', 'auto'):
+        return 'inotify'
+    ok, reason = fanotify.available()
+    if not ok:
+        if backend == 'fanotify':
+            log.error("the fanotify backend is unavailable ({0}); using inotify".format(reason))
+        return 'inotify'
+    return 'fanotify'
+
+def _get_notifier(config=None):
     """
     Check the context for the notifier and construct it if not present
     """
     if 'pulsar.notifier' not in __context__:
         __context__['pulsar.queue'] = collections.deque()
-        log.info("creating new watch manager")
-        wm = PulsarWatchManager()
-        __context__['pulsar.notifier'] = pyinotify.Notifier(wm, _enqueue)
+        if _backend(config) == 'fanotify':
+            log.info("creating new fanotify watch manager")
+            wm = FanotifyWatchManager()
+            __context__['pulsar.notifier'] = FanotifyNotifier(wm, _enqueue)
+        else:
+            log.info("creating new watch manager")
+            wm = PulsarWatchManager()
+            __context__['pulsar.notifier'] = pyinotify.Notifier(wm, _enqueue)
     return __context__['pulsar.notifier']
 
-def _preprocess_excludes(excludes):
+def _get_coalescer(config):
     """
-    Wrap excludes in simple decision curry functions.
+    Return the event coalescer, (re)configured from the coalesce section of
+    the config; without a window, events pass straight through it
     """
-
-    # silently discard non-list excludes
-    if not isinstance(excludes, (list,tuple)) or not excludes:
-        return lambda x: False
-
-    # wrap whatever in a decision problem
-    def re_wrapper(robj):
-        # log.debug('wrapping re {0}'.format(robj.pattern))
-        def _wrapped(val):
-            return bool(robj.search(val))
-        return _wrapped
-    def fn_wrapper(rpat):
-        # log.debug('wrapping fnmatch {0}'.format(rpat))
-        def _wrapped(val):
-            return bool(fnmatch.fnmatch(rpat, val))
-        return _wrapped
-    def str_wrapper(rstr):
-        # log.debug('wrapping strmatch {0}'.format(rstr))
-        def _wrapped(val):
-            return bool( val.startswith(rstr) )
-        return _wrapped
-
-    # figure out what to wrap things with
-    the_list = []
-    for e in excludes:
-        if isinstance(e,dict):
-            if e.values()[0].get('regex'):
-                r = e.keys()[0]
-                try:
-                    c = re.compile(r)
-                    the_list.append(re_wrapper(c))
-                except Exception as e:
-                    log.warn('Failed to compile regex "%s": %s', r,e)
+    opts = config.get('coalesce')
+    if not isinstance(opts, dict):
+        opts = {}
+    if 'pulsar.coalescer' not in __context__:
+        __context__['pulsar.coalescer'] = coalesce.EventCoalescer()
+    coalescer = __context__['pulsar.coalescer']
+    coalescer.configure(opts.get('window') or None,
+                        opts.get('max_delay', coalesce.DEFAULT_MAX_DELAY),
+                        opts.get('max_pending', coalesce.DEFAULT_MAX_PENDING))
+    return coalescer
+
+def _get_checksummer(config):
+    """
+    Return the checksum service, (re)configured from the checksum_cache
+    section of the config; files over checksum_size are skipped, or sampled
+    """
+    opts = config.get('checksum_cache')
+    if not isinstance(opts, dict):
+        opts = {}
+    if 'pulsar.checksums' not in __context__:
+        __context__['pulsar.checksums'] = checksums.ChecksumService()
+    service = __context__['pulsar.checksums']
+    service.configure(max_entries=opts.get('max_entries', checksums.DEFAULT_MAX_ENTRIES),
+                      max_workers=opts.get('max_workers', checksums.DEFAULT_MAX_WORKERS),
+                      inline_size=opts.get('inline_size', checksums.DEFAULT_INLINE_SIZE),
+                      size_cap=config.get('checksum_size', checksums.DEFAULT_SIZE_CAP),
+                      sample=opts.get('sample', False),
+                      sample_size=opts.get('sample_size', checksums.DEFAULT_SAMPLE_SIZE),
+                      sample_blocks=opts.get('sample_blocks', checksums.DEFAULT_SAMPLE_BLOCKS))
+    return service
+
+def _get_snapshot(config):
+    """
+    Return the snapshot of the watches and baselines, if the config has a
+    snapshot section
+    """
+    opts = config.get('snapshot')
+    if opts is True:
+        opts = {}
+    if not isinstance(opts, dict):
+        return None
+    path = opts.get('path') or os.path.join(__opts__.get('cachedir', '/var/cache/hubble'),
+        'pulsar_snapshot.z')
+    snap = __context__.get('pulsar.snapshot')
+    if snap is None or snap.path != path:
+        snap = __context__['pulsar.snapshot'] = snapshot.Snapshot(path)
+    snap.interval = opts.get('interval', snapshot.DEFAULT_INTERVAL)
+    snap.refresh_interval = opts.get('refresh', snapshot.DEFAULT_REFRESH)
+    return snap
+
+def _restore_snapshot(snap, config, wm, checksummer):
+    """
+    Reconcile the files with the snapshot of the last run and hand the
+    watches it holds to the tree setups; returns the changes found (as
+    snapshot.OfflineEvents)
+    """
+    state = snap.load(snapshot.config_digest(config))
+    if state is None:
+        return []
+    baselines = state['baselines']
+    found = snapshot.reconcile(baselines)
+    checksummer.prime(dict( (path,base[4]) for path,base in salt.ext.six.iteritems(baselines)
+        if base[4] and path not in found.deleted ))
+    # files created meanwhile get a watch too, if the path has watch_files
+    created = [ e.pathname for e in found.events if e.mask & snapshot.IN_CREATE and not e.dir ]
+    for root,paths in salt.ext.six.iteritems(state['watches']):
+        dirs, files = [], []
+        for path in paths:
+            if path in found.deleted:
                 continue
-            else:
-                e = e.keys()[0]
-        if '*' in e:
-            the_list.append(fn_wrapper(e))
-        else:
-            the_list.append(str_wrapper(e))
+            base = baselines.get(path)
+            isdir = base[3] if base is not None else os.path.isdir(path)
+            (dirs if isdir else files).append(path)
+        prefix = os.path.join(root, '')
+        files.extend(path for path in created if path.startswith(prefix))
+        wm.restored[root] = (dirs, files, [ d for d in found.new_dirs if d.startswith(prefix) ])
+    log.info("restored pulsar snapshot {0} of {1:0.0f}s ago: {2} watches; {checked} paths checked "
+        "in {elapsed:0.2f}s, {modified} modified, {created} created, {deleted} deleted while "
+        "offline".format(snap.path, time.time() - state['saved'],
+            sum(len(d) + len(f) for d,f,_ in wm.restored.values()), **found.counts))
+    return found.events
+
+def _save_snapshot(snap, config, wm, checksummer):
+    """
+    Save the watches, and the baselines of the watched paths and of the
+    entries of the watched directories
+    """
+    baselines = snapshot.scan_baselines(list(wm.watch_db), checksummer.known())
+    if snap.save(snapshot.config_digest(config), wm.parent_db, baselines):
+        log.debug("saved pulsar snapshot {0}: {1} watches, {2} baselines".format(
+            snap.path, len(wm.watch_db), len(baselines)))
 
-    # finally, wrap the whole decision set in a decision wrapper
-    def _final(val):
-        for i in the_list:
-            if i( val ):
-                return True
-        return False
-    return _final
+def _preprocess_excludes(excludes):
+    """
+    Compile excludes into a single decision function (see
+    hubblestack.utils.pathmatch); equal exclude lists share one.
+    """
+    return pathmatch.compile_excludes(excludes)
 
 class delta_t(object):
     def __init__(self):
@@ -659,6 +981,25 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
         batch: True
         contents_size: 20480
         checksum_size: 104857600
+        backend: inotify
+        watch_setup:
+          budget: 10
+          max_workers: 4
+          batch_size: 1000
+        checksum_cache:
+          max_entries: 10000
+          max_workers: 2
+          deadline: 0.5
+        coalesce:
+          window: 0.5
+          max_delay: 5
+          max_pending: 10000
+        service:
+          interval: 1
+          max_queue: 10000
+        snapshot:
+          interval: 300
+          refresh: 10
 
     Note that if `batch: True`, the configured returner must support receiving
     a list of events, rather than single one-off events.
@@ -708,10 +1049,66 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
       decide, "Don't fetch contents for any file over contents_size or where
       the checksum is unchanged."
 
+    backend:
+      inotify (the default), fanotify or auto. fanotify (Linux 5.9+, as root)
+      marks each filesystem with configured paths once, instead of a watch
+      per directory, and filters its events by the config in user space; the
+      config and the alerts are the same. auto picks fanotify where it's
+      available. The backend is chosen when pulsar starts.
+
+    watch_setup:
+      Recursive watches (and watch_files) are set up by walking the tree with
+      ``max_workers`` threads (default 4), skipping excluded directories, and
+      adding watches ``batch_size`` (default 1000) at a time. A sweep spends
+      at most ``budget`` seconds (default 10) on it; the setup then continues
+      where it left off on the next sweeps. See hubblestack.utils.watchsetup.
+
+    checksum_cache:
+      Checksums are cached per version of a file (device, inode, size, mtime,
+      ctime), at most ``max_entries`` (default 10000) of them. Files over
+      ``inline_size`` (default 1MB) are hashed by ``max_workers`` (default 2)
+      threads, and a sweep waits for them at most ``deadline`` seconds
+      (default 0.5) in all; the alerts of files whose hashes take longer
+      carry ``checksum_pending: True`` instead of a checksum, which a later
+      event of the file reports. Files over checksum_size are skipped, unless ``sample`` is set:
+      they are then hashed from ``sample_blocks`` (default 8) blocks of
+      ``sample_size`` bytes (default 1MB) and reported as e.g. sha256-sampled.
+      See hubblestack.utils.checksums.
+
+    coalesce:
+      Merge the events of a path that arrive within ``window`` seconds of each
+      other into one alert (off unless a window is given). The alert's change
+      is the last create/delete/move of the path, else its most significant
+      change; ``change_count`` and ``changes`` count the merged events. An
+      event is held at most ``max_delay`` seconds (default 5), and at most
+      ``max_pending`` paths (default 10000) are held at once.
+
+    snapshot:
+      Keep a snapshot of the watches and of the files under them (inode,
+      size, mtime and last checksum) in ``path`` (default
+      cachedir/pulsar_snapshot.z), saved every ``interval`` seconds (default
+      300) once the watch setups are complete; the files alerted on are
+      re-baselined in it every ``refresh`` seconds (default 10), so they
+      aren't alerted on again after a restart. After a restart with the same
+      config, the files are checked against it first -- changes made while
+      hubble was down are alerted on with ``offline: True`` -- and the
+      watches are added from it, walking only the directories created
+      meanwhile. inotify backend only. See hubblestack.utils.snapshot.
+
+    service:
+      The options of pulsar.service(), which runs pulsar in a thread of its
+      own instead of as a scheduled process(); see there.
+
     If pillar/grains/minion config key `hubblestack:pulsar:maintenance` is set to
     True, then changes will be discarded.
     """
+    return _sweep(configfile, verbose)
 
+def _sweep(configfile, verbose, maintain=True):
+    """
+    One pass of process(): alert on the events read; with maintain, also
+    refresh the config and update the watches when it's due
+    """
     dt = delta_t()
     dt.mark('read_config')
 
@@ -719,23 +1116,35 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
         log.debug('Not running beacon pulsar. No python-inotify installed.')
         return []
 
-    cm = ConfigManager(configfile=configfile, verbose=verbose)
-    config = cm.config
+    cm = ConfigManager(configfile=configfile, verbose=verbose, refresh=maintain)
+    config = cm.nc_config
 
     if config.get('verbose'):
         log.debug('Pulsar beacon called.')
         log.debug('Pulsar beacon config from pillar:\n{0}'.format(config))
 
     ret = []
-    notifier = _get_notifier()
+    notifier = _get_notifier(config)
     wm = notifier._watch_manager
-    update_watches = cm.freshness(2)
+    update_watches = maintain and cm.freshness(2)
     initial_count = len(wm.watch_db)
 
     recent = set()
+    coalescer = _get_coalescer(config)
+    checksummer = _get_checksummer(config)
+    snap = _get_snapshot(config)
 
     dt.fin()
 
+    offline = []
+    if maintain and getattr(wm, 'restored', {}) is None:
+        # the first sweep of this watch manager
+        wm.restored = {}
+        if snap is not None:
+            dt.mark('restore')
+            offline = _restore_snapshot(snap, config, wm, checksummer)
+            dt.fin()
+
     # Read in existing events
     if notifier.check_events(1):
         dt.mark('check_events')
@@ -744,9 +1153,19 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
         queue = __context__['pulsar.queue']
         if config.get('verbose'):
             log.debug('Pulsar found {0} inotify events.'.format(len(queue)))
-        while queue:
-            event = queue.popleft()
+        coalescer.add_all(queue)
+        dt.fin()
+
+    events = offline + coalescer.ready()
+    alerted = []
+    if events:
+        dt.mark('alerts')
+        hash_budget = config.get('checksum_cache')
+        hash_budget = hash_budget.get('deadline', 0.5) if isinstance(hash_budget, dict) else 0.5
+        hash_deadline = time.time() + hash_budget
+        for event in events:
             if event.maskname == 'IN_Q_OVERFLOW':
+                hubble_status.mark('overflow')
                 log.warn('Your inotify queue is overflowing.')
                 log.warn('Fix by increasing /proc/sys/fs/inotify/max_queued_events')
                 continue
@@ -768,7 +1187,7 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
             # wpath = event.path : the path of the watch that triggered (not actually populated
             #                    : in wpath)
 
-            excludes = _preprocess_excludes( config[cpath].get('exclude') )
+            excludes = cm.excludes(cpath)
             _append = not excludes(pathname)
             if _append:
                 config_path = config['paths'][0]
@@ -778,20 +1197,27 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
                         'tag':  dirname,  # goes to file_path in splunk
                         'name': basename, # goes to file_name in splunk
                         'pulsar_config': pulsar_config}
+                if isinstance(event, coalesce.CoalescedEvent):
+                    sub['change_count'] = event.count
+                    sub['changes'] = dict(event.changes)
+                elif isinstance(event, snapshot.OfflineEvent):
+                    sub['offline'] = True
 
                 if config.get('checksum', False) and os.path.isfile(pathname):
-                    if 'pulsar_checksums' not in __context__:
-                        __context__['pulsar_checksums'] = {}
-                    # Don't checksum any file over 100MB
-                    if os.path.getsize(pathname) < config.get('checksum_size', 104857600):
-                        sum_type = config['checksum']
-                        if not isinstance(sum_type, salt.ext.six.string_types):
-                            sum_type = 'sha256'
-                        old_checksum = __context__['pulsar_checksums'].get(pathname)
-                        new_checksum = __salt__['file.get_hash'](pathname, sum_type)
-                        __context__['pulsar_checksums'][pathname] = new_checksum
-                        sub['checksum'] = __context__['pulsar_checksums'][pathname]
-                        sub['checksum_type'] = sum_type
+                    sum_type = config['checksum']
+                    if not isinstance(sum_type, salt.ext.six.string_types):
+                        sum_type = 'sha256'
+                    # files over checksum_size (100MB) are skipped or sampled,
+                    # and large files are given until hash_deadline; those
+                    # still hashing are marked checksum_pending
+                    res = checksummer.checksum(pathname, sum_type, deadline=hash_deadline)
+                    if res.pending:
+                        sub['checksum_pending'] = True
+                    if res.checksum:
+                        old_checksum = res.previous
+                        new_checksum = res.checksum
+                        sub['checksum'] = new_checksum
+                        sub['checksum_type'] = res.checksum_type
 
                         # File contents? Don't fetch contents for any file over
                         # 20KB or where the checksum is unchanged
@@ -806,7 +1232,7 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
                                 log.debug('Could not get file contents for {0}: {1}'
                                           .format(pathname, e))
 
-                if cm.config.get('stats', False):
+                if config.get('stats', False):
                     if os.path.exists(pathname):
                         sub['stats'] = __salt__['file.stats'](pathname)
                     else:
@@ -817,9 +1243,17 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
 
 
                 ret.append(sub)
-
-                if not event.mask & pyinotify.IN_ISDIR:
-                    if event.mask & pyinotify.IN_CREATE:
+                alerted.append(pathname)
+
+                # changes made while offline are picked up by the watch setup
+                if not event.mask & pyinotify.IN_ISDIR and not isinstance(event, snapshot.OfflineEvent):
+                    created = event.mask & pyinotify.IN_CREATE
+                    deleted = event.mask & pyinotify.IN_DELETE
+                    if created and deleted:
+                        # coalesced; what counts is whether the file is still there
+                        created = os.path.exists(pathname)
+                        deleted = not created
+                    if created:
                         watch_this = config[cpath].get('watch_new_files', False) \
                             or config[cpath].get('watch_files', False)
                         if watch_this:
@@ -827,7 +1261,7 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
                                 log.debug("add file-watch path={0}".format(pathname))
                                 wm.watch(pathname, pyinotify.IN_MODIFY, new_file=True)
 
-                    elif event.mask & pyinotify.IN_DELETE:
+                    elif deleted:
                         wm.rm_watch(pathname)
             else:
                 log.debug('Excluding {0} from event for {1}'.format(pathname, cpath))
@@ -836,13 +1270,15 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
     if update_watches:
         dt.mark('update_watches')
         log.debug("update watches")
+        setup_deadline = time.time() + wm.setup_budget
         # Update existing watches and add new ones
         # TODO: make the config handle more options
         for path in config:
             excludes = lambda x: False
             if path in ['return', 'checksum', 'stats', 'batch', 'verbose',
                         'paths', 'refresh_interval', 'contents_size',
-                        'checksum_size']:
+                        'checksum_size', 'checksum_cache', 'coalesce', 'watch_setup',
+                        'backend', 'service', 'snapshot']:
                 continue
             if isinstance(config[path], dict):
                 mask = config[path].get('mask', DEFAULT_MASK)
@@ -862,7 +1298,7 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
              #          log.debug("mask={0} -= mask & pyinotify.IN_MODIFY={1} ==> {2}".format(
              #              mask, a, mask-a))
              #          mask -= mask & pyinotify.IN_MODIFY
-                excludes = _preprocess_excludes( config[path].get('exclude') )
+                excludes = cm.excludes(path)
                 if isinstance(mask, list):
                     r_mask = 0
                     for sub in mask:
@@ -879,11 +1315,28 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
                 rec = False
                 auto_add = False
 
-            wm.watch(path, mask, rec=rec, auto_add=auto_add, exclude_filter=excludes)
+            wm.watch(path, mask, rec=rec, auto_add=auto_add, exclude_filter=excludes,
+                deadline=setup_deadline)
         dt.fin()
         dt.mark('prune_watches')
         wm.prune()
         dt.fin()
+    elif maintain and wm.setups:
+        dt.mark('resume_watches')
+        wm.resume_setups(time.time() + wm.setup_budget)
+        dt.fin()
+
+    if snap is not None:
+        snap.touch(alerted)
+    if snap is not None and maintain and isinstance(wm, PulsarWatchManager):
+        if snap.due() and all(setup.done for _,setup in wm.setups.values()):
+            dt.mark('snapshot')
+            _save_snapshot(snap, config, wm, checksummer)
+            dt.fin()
+        elif snap.refresh_due():
+            dt.mark('snapshot_refresh')
+            snap.refresh(checksummer.known())
+            dt.fin()
 
     if __salt__['config.get']('hubblestack:pulsar:maintenance', False):
         # We're in maintenance mode, throw away findings
@@ -894,10 +1347,25 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
     spam_dt = now_t - SPAM_TIME
     current_count = len(wm.watch_db)
     delta_c = current_count - initial_count
+    counts = coalescer.sweep_stats()
+    if counts['raw'] or counts['emitted']:
+        log.debug("events: {raw} raw, {emitted} emitted, {evicted} evicted, {pending} pending".format(**counts))
+
+    sums = checksummer.stats()
 
     if dt.get() >= 0.1 or abs(delta_c)>0 or spam_dt >= 60:
         SPAM_TIME = now_t
-        log.info("process() sweep {0}; watch count: {1} (delta: {2})".format(dt, current_count, delta_c))
+        log.info("process() sweep {0}; watch count: {1} (delta: {2}); events: {3} raw, {4} emitted".format(
+            dt, current_count, delta_c, counts['raw'], counts['emitted']))
+        count, muw, used = wm.headroom()
+        if used is not None:
+            log.info("watches: {0} of max_user_watches {1} ({2:0.1%}); {3} tree setups pending".format(
+                count, muw, used, sum(1 for _,setup in wm.setups.values() if not setup.done)))
+            if used >= 0.9:
+                log.warning("pulsar is using {0:0.1%} of fs.inotify.max_user_watches ({1}); "
+                    "consider raising it or setting inotify_limits:update".format(used, muw))
+        log.info("checksums: {hits} hits, {misses} misses, {bytes_hashed} bytes hashed, "
+                 "{timeouts} past deadline, {entries} cached".format(**sums))
         if 'DUMP_WATCH_DB' in os.environ:
             import json
             f = os.path.basename(os.environ['DUMP_WATCH_DB'])
@@ -911,6 +1379,118 @@ def process(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml
     return ret
 
 
+class PulsarService(object):
+    """
+    process() in a thread of its own (see service()): a sweep as soon as the
+    notifier's fd is readable, and a maintaining sweep every interval
+    seconds, queueing the alerts for service() to hand out
+    """
+
+    def __init__(self, configfile, verbose, fileno, opts=None):
+        self.configfile = configfile
+        self.verbose = verbose
+        self.sweep = _sweep
+        # when the loop first woke for events that haven't all been alerted on
+        self.waiting = None
+        self.alerts = eventloop.AlertQueue()
+        self.loop = eventloop.EventLoop(fileno, self.on_ready, self.on_tick,
+                                        name='pulsar-service')
+        self.configure(opts)
+
+    def configure(self, opts):
+        if not isinstance(opts, dict):
+            opts = {}
+        self.alerts.configure(opts.get('max_queue', eventloop.DEFAULT_MAX_SIZE),
+                              opts.get('block', eventloop.DEFAULT_BLOCK))
+        self.loop.interval = max(float(opts.get('interval', eventloop.DEFAULT_INTERVAL)), 0.01)
+
+    def _run(self, now, maintain):
+        ret = self.sweep(self.configfile, self.verbose, maintain=maintain)
+        self.alerts.put(ret, arrived=self.waiting or now)
+        # the events still held by the coalescer have waited since then
+        coalescer = __context__.get('pulsar.coalescer')
+        if coalescer is None or len(coalescer) == 0:
+            self.waiting = None
+
+    def on_ready(self, now):
+        if self.waiting is None:
+            self.waiting = now
+        self._run(now, False)
+
+    def on_tick(self, now):
+        self._run(now, True)
+        self.configure(ConfigManager._config.get('service'))
+
+    def stats(self):
+        """ the alert queue's counts and latency, and the loop's """
+        ret = self.alerts.stats()
+        ret.update(self.loop.stats())
+        return ret
+
+def _notifier_fd(notifier):
+    wm = notifier._watch_manager
+    if isinstance(wm, FanotifyWatchManager):
+        return wm.fan.fileno()
+    return wm.get_fd()
+
+@hubble_status.watch
+def service(configfile='salt://hubblestack_pulsar/hubblestack_pulsar_config.yaml',
+            verbose=False):
+    """
+    Run pulsar as a service, and return the alerts it found since the last
+    call
+
+    The first call starts a thread that blocks on the inotify (or fanotify)
+    fd and alerts on events as they arrive, rather than when the next sweep
+    comes around, and does the config and watch maintenance of process()
+    every ``interval`` seconds. Schedule it instead of process(), as often as
+    the alerts should go out:
+
+    .. code-block:: yaml
+
+        schedule:
+          pulsar:
+            function: pulsar.service
+            seconds: 1
+            returner: splunk_pulsar_return
+
+    The config is that of process(), with a service section:
+
+    .. code-block:: yaml
+
+        service:
+          interval: 1
+          max_queue: 10000
+
+    The alerts wait in a queue of at most ``max_queue`` (default 10000); when
+    it's full, the thread waits for service() to drain it, leaving events in
+    the kernel queue, where an overflow is counted as overflow below. To drop
+    alerts instead, set ``block`` to the seconds to wait before the oldest
+    alerts are dropped. The queue's counts (blocked, dropped), the
+    latency from the thread noticing events to their alerts being returned,
+    and the thread's counts are reported in the hubble status as
+    service_loop; inotify queue overflows are counted as overflow.
+    """
+    if not HAS_PYINOTIFY:
+        log.debug('Not running pulsar service. No python-inotify installed.')
+        return []
+
+    svc = __context__.get('pulsar.service')
+    if svc is None:
+        cm = ConfigManager(configfile=configfile, verbose=verbose)
+        notifier = _get_notifier(cm.config)
+        svc = PulsarService(configfile, verbose, _notifier_fd(notifier),
+                            cm.config.get('service'))
+        __context__['pulsar.service'] = svc
+        hubble_status.add_report('service_loop', svc.stats)
+    # sweep with this module, which is the reloaded one after refresh_grains
+    svc.sweep = _sweep
+    if not svc.loop.alive:
+        log.info("starting the pulsar service thread")
+        svc.loop.start()
+    return svc.alerts.get_all()
+
+
 def canary(change_file=None):
     """
     Simple module to change a file to trigger a FIM event (daily, etc)
@@ -24,15 +24,22 @@ plugin. Required config/pillar settings:
 """
 
 import json
+import logging
 import socket
 import requests
 from requests.auth import HTTPBasicAuth
 
+import hubblestack.utils.emission as emission
+
+log = logging.getLogger(__name__)
+
 
 def returner(ret):
     """
     """
     opts_list = _get_options()
+    # whether every post went through; see hubblestack.utils.emission.commit
+    delivered = True
 
     # Get cloud details
     cloud_details = __grains__.get('cloud_details', {})
@@ -68,53 +75,20 @@ def returner(ret):
                       'dict:\n{0}'.format(data))
             return
 
-        for fai in data.get('Failure', []):
-            check_id = fai.keys()[0]
-            payload = {}
-            event = {}
-            event.update({'check_result': 'Failure'})
-            event.update({'check_id': check_id})
-            event.update({'job_id': jid})
-            if not isinstance(fai[check_id], dict):
-                event.update({'description': fai[check_id]})
-            elif 'description' in fai[check_id]:
-                for key, value in fai[check_id].iteritems():
-                    if key not in ['tag']:
-                        event[key] = value
-            event.update({'minion_id': minion_id})
-            event.update({'dest_host': fqdn})
-            event.update({'dest_ip': fqdn_ip4})
-
-            event.update(cloud_details)
-
-            for custom_field in custom_fields:
-                custom_field_name = 'custom_' + custom_field
-                custom_field_value = __salt__['config.get'](custom_field, '')
-                if isinstance(custom_field_value, str):
-                    event.update({custom_field_name: custom_field_value})
-                elif isinstance(custom_field_value, list):
-                    custom_field_value = ','.join(custom_field_value)
-                    event.update({custom_field_name: custom_field_value})
-
-            payload.update({'host': fqdn})
-            payload.update({'index': opts['index']})
-            payload.update({'sourcetype': opts['sourcetype']})
-            payload.update({'event': event})
-
-            rdy = json.dumps(payload)
-            requests.post('{}:{}/hubble/nova'.format(indexer, port), rdy, auth=HTTPBasicAuth(user, password))
-
-        for suc in data.get('Success', []):
-            check_id = suc.keys()[0]
+        for record in emission.records(data):
+            check_id = record['check_id']
+            check = record['value']
             payload = {}
             event = {}
-            event.update({'check_result': 'Success'})
+            event.update({'check_result': record['check_result']})
             event.update({'check_id': check_id})
             event.update({'job_id': jid})
-            if not isinstance(suc[check_id], dict):
-                event.update({'description': suc[check_id]})
-            elif 'description' in suc[check_id]:
-                for key, value in suc[check_id].iteritems():
+            if record['transition']:
+                event.update({'check_transition': record['transition']})
+            if not isinstance(check, dict):
+                event.update({'description': check})
+            elif 'description' in check:
+                for key, value in check.iteritems():
                     if key not in ['tag']:
                         event[key] = value
             event.update({'minion_id': minion_id})
@@ -138,7 +112,8 @@ def returner(ret):
             payload.update({'event': event})
 
             rdy = json.dumps(payload)
-            requests.post('{}:{}/hubble/nova'.format(indexer, port), rdy, auth=HTTPBasicAuth(user, password))
+            if not _post('{}:{}/hubble/nova'.format(indexer, port), rdy, auth=HTTPBasicAuth(user, password)):
+                delivered = False
 
         if data.get('Compliance', None):
             payload = {}
@@ -166,8 +141,11 @@ def returner(ret):
             payload.update({'event': event})
 
             rdy = json.dumps(payload)
-            requests.post('{}:{}/hubble/nova'.format(indexer, port), rdy, auth=HTTPBasicAuth(user, password))
+            if not _post('{}:{}/hubble/nova'.format(indexer, port), rdy, auth=HTTPBasicAuth(user, password)):
+                delivered = False
 
+    if not delivered:
+        return False
     return
 
 
@@ -210,3 +188,14 @@ def _get_options():
         logstash_opts['timeout'] = __salt__['config.get']('hubblestack:nova:returner:logstash:timeout', 9.05)
 
         return [logstash_opts]
+
+
+def _post(*args, **kwargs):
+    """ requests.post(); False (and logged) if it failed or was rejected """
+    try:
+        r = requests.post(*args, **kwargs)
+        r.raise_for_status()
+    except requests.exceptions.RequestException as exc:
+        log.error('logstash_nova_return failed to deliver: %s', exc)
+        return False
+    return True
@@ -37,6 +37,11 @@ gateway is not defined.
             custom_fields:
               - site
               - product_group
+
+Results from an audit in delta mode (``hubblestack:nova:emit: delta``, see
+hubblestack.utils.emission) only hold the checks whose result changed; their
+events carry a ``check_transition`` field, and a summary event of the run is
+sent along with them.
 """
 import socket
 
@@ -47,11 +52,14 @@ import time
 import logging
 
 from hubblestack.hec import http_event_collector, get_splunk_options, make_hec_args
+import hubblestack.utils.emission as emission
 
 log = logging.getLogger(__name__)
 
 
 def returner(ret):
+    # whether every batch went through; see hubblestack.utils.emission.commit
+    delivered = True
     try:
         opts_list = get_splunk_options( sourcetype='hubble_audit',
             _nick={'sourcetype_nova': 'sourcetype'})
@@ -111,19 +119,22 @@ def returner(ret):
             # Get cloud details
             cloud_details = __grains__.get('cloud_details', {})
 
-            for fai in data.get('Failure', []):
-                check_id = fai.keys()[0]
+            for record in emission.records(data):
+                check_id = record['check_id']
+                value = record['value']
                 payload = {}
                 event = {}
-                event.update({'check_result': 'Failure'})
+                event.update({'check_result': record['check_result']})
                 event.update({'check_id': check_id})
                 event.update({'job_id': jid})
-                if not isinstance(fai[check_id], dict):
-                    event.update({'description': fai[check_id]})
-                elif 'description' in fai[check_id]:
-                    for key, value in fai[check_id].iteritems():
+                if record['transition']:
+                    event.update({'check_transition': record['transition']})
+                if not isinstance(value, dict):
+                    event.update({'description': value})
+                elif 'description' in value:
+                    for key, val in value.iteritems():
                         if key not in ['tag']:
-                            event[key] = value
+                            event[key] = val
                 event.update({'minion_id': minion_id})
                 event.update({'dest_host': fqdn})
                 event.update({'dest_ip': fqdn_ip4})
@@ -144,6 +155,13 @@ def returner(ret):
                 payload.update({'host': fqdn})
                 payload.update({'index': opts['index']})
                 payload.update({'sourcetype': opts['sourcetype']})
+
+                if record['check_result'] != 'Failure':
+                    # Remove any empty fields from the event payload
+                    remove_keys = [k for k in event if event[k] == ""]
+                    for k in remove_keys:
+                        del event[k]
+
                 payload.update({'event': event})
 
                 # Potentially add metadata fields:
@@ -156,19 +174,12 @@ def returner(ret):
 
                 hec.batchEvent(payload)
 
-            for suc in data.get('Success', []):
-                check_id = suc.keys()[0]
+            run_summary = emission.summary(data)
+            if run_summary:
                 payload = {}
                 event = {}
-                event.update({'check_result': 'Success'})
-                event.update({'check_id': check_id})
                 event.update({'job_id': jid})
-                if not isinstance(suc[check_id], dict):
-                    event.update({'description': suc[check_id]})
-                elif 'description' in suc[check_id]:
-                    for key, value in suc[check_id].iteritems():
-                        if key not in ['tag']:
-                            event[key] = value
+                event.update({'emission_%s' % key: val for key, val in run_summary.items()})
                 event.update({'minion_id': minion_id})
                 event.update({'dest_host': fqdn})
                 event.update({'dest_ip': fqdn_ip4})
@@ -177,34 +188,11 @@ def returner(ret):
 
                 event.update(cloud_details)
 
-                for custom_field in custom_fields:
-                    custom_field_name = 'custom_' + custom_field
-                    custom_field_value = __salt__['config.get'](custom_field, '')
-                    if isinstance(custom_field_value, (str, unicode)):
-                        event.update({custom_field_name: custom_field_value})
-                    elif isinstance(custom_field_value, list):
-                        custom_field_value = ','.join(custom_field_value)
-                        event.update({custom_field_name: custom_field_value})
-
                 payload.update({'host': fqdn})
                 payload.update({'sourcetype': opts['sourcetype']})
                 payload.update({'index': opts['index']})
-
-                # Remove any empty fields from the event payload
-                remove_keys = [k for k in event if event[k] == ""]
-                for k in remove_keys:
-                    del event[k]
-
                 payload.update({'event': event})
 
-                # Potentially add metadata fields:
-                fields = {}
-                for item in index_extracted_fields:
-                    if item in payload['event'] and not isinstance(payload['event'][item], (list, dict, tuple)):
-                        fields["meta_%s" % item] = str(payload['event'][item])
-                if fields:
-                    payload.update({'fields': fields})
-
                 hec.batchEvent(payload)
 
             if data.get('Compliance', None):
@@ -245,8 +233,14 @@ def returner(ret):
                 hec.batchEvent(payload)
 
             hec.flushBatch()
+            if hec.failed_sends:
+                log.error('splunk_nova_return failed to deliver %d batches', hec.failed_sends)
+                delivered = False
     except Exception:
         log.exception('Error ocurred in splunk_nova_return')
+        delivered = False
+    if not delivered:
+        return False
     return
 
 
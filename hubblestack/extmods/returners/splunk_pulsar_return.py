@@ -162,6 +162,11 @@ def returner(ret):
                     event['pulsar_config'] = alert['pulsar_config']
                     if 'contents' in alert:
                         event['contents'] = alert['contents']
+                    if 'change_count' in alert:  # coalesced events
+                        event['change_count'] = alert['change_count']
+                        event['changes'] = alert['changes']
+                    if alert.get('offline'):  # changed while hubble was down
+                        event['offline'] = True
 
                     if alert['stats']:  # Gather more data if the change wasn't a delete
                         stats = alert['stats']
@@ -177,6 +182,8 @@ def returner(ret):
                             if chk:
                                 event['file_hash'] = chk
                                 event['file_hash_type'] = alert.get('checksum_type', 'unknown')
+                            elif alert.get('checksum_pending'):  # still hashing
+                                event['file_hash_pending'] = True
 
                 else:  # Windows, win_pulsar
                     if alert.get('Accesses', None):
@@ -32,6 +32,20 @@ firewall:
       labels:
         - critical
 
+    default_drop:
+      data:
+        tag: 'FIREWALL-INPUT-POLICY'
+        table: 'filter'
+        chain: INPUT
+        policy: DROP    # check the chain policy instead of a rule
+        family: 'ipv4'
+      description: 'INPUT chain drops by default'
+
+The ruleset is read once per run with iptables-save/ip6tables-save (see
+hubblestack.utils.iptables) and every rule and policy check is a lookup in it,
+with rules compared regardless of option order or aliases. If the ruleset
+can't be read, iptables.check/iptables.get_policy are used instead.
+
 A few words about the auditing logic
 The audit function uses the iptables.build_rule salt
 execution module to build the actual iptables rule to be checked.
@@ -84,6 +98,8 @@ import salt.utils
 import salt.utils.platform
 import salt.utils.path
 
+import hubblestack.utils.iptables as iptables
+
 log = logging.getLogger(__name__)
 
 __tags__ = None
@@ -141,6 +157,23 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                 table = tag_data['table']
                 chain = tag_data['chain']
                 family = tag_data['family']
+                ruleset = iptables.ruleset(__salt__, family)
+
+                if 'policy' in tag_data:
+                    if ruleset is not None:
+                        policy = ruleset.policy(table, chain)
+                    else:
+                        policy = __salt__['iptables.get_policy'](table=table, chain=chain, family=family)
+                    passed = str(policy).upper() == str(tag_data['policy']).upper()
+                    if tag_data['type'] == 'blacklist':
+                        passed = not passed
+                    if passed:
+                        ret['Success'].append(tag_data)
+                    else:
+                        tag_data['failure_reason'] = "Policy of chain '{0}' in table '{1}' is '{2}'" \
+                                                     .format(chain, table, policy)
+                        ret['Failure'].append(tag_data)
+                    continue
 
                 # creating the arguments for the iptables.build_rule salt execution module
                 args = {'table': table,
@@ -165,7 +198,10 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                 tag_data['rule'] = rule
 
                 # checking the existence of the rule
-                salt_ret = __salt__['iptables.check'](table=table, chain=chain, rule=rule, family=family)
+                if ruleset is not None:
+                    salt_ret = ruleset.has_rule(table, chain, rule)
+                else:
+                    salt_ret = __salt__['iptables.check'](table=table, chain=chain, rule=rule, family=family)
 
                 if salt_ret not in (True, False):
                     log.error(salt_ret)
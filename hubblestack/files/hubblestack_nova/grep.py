@@ -54,7 +54,7 @@ If the file exists, this setting is ignored.
 from __future__ import absolute_import
 import logging
 
-import fnmatch
+import glob
 import os
 import copy
 import salt.utils
@@ -63,9 +63,15 @@ import re
 
 from distutils.version import LooseVersion
 from salt.exceptions import CommandExecutionError
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.facts as facts
+import hubblestack.utils.grep as grep_engine
 
 log = logging.getLogger(__name__)
 
+# see hubblestack.utils.incremental
+__incremental__ = True
+
 
 def __virtual__():
     if salt.utils.platform.is_windows():
@@ -101,7 +107,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('grep', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('grep audit __data__:')
@@ -111,7 +118,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
@@ -172,6 +179,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                                                          tag_data['match_output'],
                                                          grep_ret)
 
+                facts.note_input(('file', name))
                 if not os.path.exists(name) and 'match_on_file_missing' in tag_data:
                     if tag_data['match_on_file_missing']:
                         found = True
@@ -231,20 +239,7 @@ def _get_tags(data):
                 # grep:blacklist:0:telnet
                 tags_dict = audit_data.get('data', {})
                 # grep:blacklist:0:telnet:data
-                tags = None
-                for osfinger in tags_dict:
-                    if osfinger == '*':
-                        continue
-                    osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                    for osfinger_glob in osfinger_list:
-                        if fnmatch.fnmatch(distro, osfinger_glob):
-                            tags = tags_dict.get(osfinger)
-                            break
-                    if tags is not None:
-                        break
-                # If we didn't find a match, check for a '*'
-                if tags is None:
-                    tags = tags_dict.get('*', [])
+                tags = checkplan.select_target(tags_dict, distro)
                 # grep:blacklist:0:telnet:data:Debian-8
                 if isinstance(tags, dict):
                     # malformed yaml, convert to list of dicts
@@ -272,6 +267,19 @@ def _get_tags(data):
     return ret
 
 
+def _recursive(args):
+    """
+    Whether the grep options make grep descend into directories
+    """
+    for option in ' '.join(args).split():
+        if option.startswith('--'):
+            if option in ('--recursive', '--dereference-recursive', '--directories=recurse'):
+                return True
+        elif option.startswith('-') and ('r' in option or 'R' in option):
+            return True
+    return False
+
+
 def _grep(path,
           pattern,
           *args):
@@ -326,6 +334,15 @@ def _grep(path,
         )
     )
 
+    ret = grep_engine.run(cmd)
+    if ret is not None:
+        return ret
+
+    if glob.has_magic(path) or ' ' in path or os.path.isdir(path) or _recursive(args):
+        # what's read can't be pinned down to the stat of one file
+        facts.note_input(('volatile', 'grep ' + path))
+    else:
+        facts.note_input(('file', path))
     try:
         ret = __salt__['cmd.run_all'](cmd, python_shell=False, ignore_retcode=True)
     except (IOError, OSError) as exc:
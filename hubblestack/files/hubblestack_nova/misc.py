@@ -43,11 +43,20 @@ import logging
 
 import fnmatch
 import os
+import pwd
 import re
+import stat
 import salt.utils
 from salt.ext import six
 from salt.exceptions import CommandExecutionError
-from collections import Counter
+import hubblestack.utils.facts as facts
+from hubblestack.utils.accounts import account_db
+import hubblestack.utils.fsscan as fsscan
+import hubblestack.utils.grep as grep_engine
+import hubblestack.utils.iptables as iptables
+import hubblestack.utils.procfs as procfs
+import hubblestack.utils.systemd as systemd
+from hubblestack.utils.pkgindex import package_index
 
 log = logging.getLogger(__name__)
 
@@ -196,6 +205,16 @@ def _execute_shell_command(cmd, python_shell=False):
     return __salt__['cmd.run'](cmd, python_shell=python_shell, shell='/bin/bash', ignore_retcode=True)
 
 
+def _login_users():
+    """
+    The (user, home) pairs of ``cat /etc/passwd | egrep -v '(root|halt|sync|shutdown)'
+    | awk -F: '($7 != "/sbin/nologin") {print $1" "$6}'``
+    """
+    return [(entry.name, entry.home) for entry in account_db().passwd
+            if not re.search('(root|halt|sync|shutdown)', entry.line)
+            and entry.shell != '/sbin/nologin']
+
+
 def _is_valid_home_directory(directory_path, check_slash_home=False):
     directory_path = None if directory_path is None else directory_path.strip()
     if directory_path is not None and directory_path != "" and os.path.isdir(directory_path):
@@ -254,12 +273,26 @@ def check_all_ports_firewall_rules(reason=''):
     """
     Ensure firewall rule for all open ports
     """
-    start_open_ports = (_execute_shell_command('netstat -ln | grep "Active Internet connections (only servers)" -n | cut -d ":" -f1', python_shell=True)).strip()
-    end_open_ports = (_execute_shell_command('netstat -ln | grep "Active UNIX domain sockets (only servers)" -n  | cut -d ":" -f1', python_shell=True)).strip()
-    open_ports = (_execute_shell_command('netstat -ln | awk \'FNR > ' + start_open_ports + ' && FNR < ' + end_open_ports + ' && $6 == "LISTEN" && $4 !~ /127.0.0.1/ {print $4}\' | sed -e "s/.*://"', python_shell=True)).strip()
-    open_ports = open_ports.split('\n') if open_ports != "" else []
-    firewall_ports = (_execute_shell_command('iptables -L INPUT -v -n | awk \'FNR > 2 && $11 != "" && $11 ~ /^dpt:/ {print $11}\' | sed -e "s/.*://"', python_shell=True)).strip()
-    firewall_ports = firewall_ports.split('\n') if firewall_ports != "" else []
+    listening = procfs.netstat()
+    if listening is not None:
+        open_ports = [conn['local-address'].rsplit(':', 1)[-1] for conn in listening
+                      if conn['state'] == 'LISTEN' and '127.0.0.1' not in conn['local-address']]
+    else:
+        start_open_ports = (_execute_shell_command('netstat -ln | grep "Active Internet connections (only servers)" -n | cut -d ":" -f1', python_shell=True)).strip()
+        end_open_ports = (_execute_shell_command('netstat -ln | grep "Active UNIX domain sockets (only servers)" -n  | cut -d ":" -f1', python_shell=True)).strip()
+        open_ports = (_execute_shell_command('netstat -ln | awk \'FNR > ' + start_open_ports + ' && FNR < ' + end_open_ports + ' && $6 == "LISTEN" && $4 !~ /127.0.0.1/ {print $4}\' | sed -e "s/.*://"', python_shell=True)).strip()
+        open_ports = open_ports.split('\n') if open_ports != "" else []
+    ruleset = iptables.ruleset(__salt__, 'ipv4')
+    if ruleset is not None:
+        # the dpt:N column of iptables -L INPUT: single --dport matches
+        firewall_ports = []
+        for rule in ruleset.rules('filter', 'INPUT'):
+            for option, negated, value in iptables.normalize_rule(rule):
+                if option == '--dport' and not negated and ':' not in value:
+                    firewall_ports.append(value)
+    else:
+        firewall_ports = (_execute_shell_command('iptables -L INPUT -v -n | awk \'FNR > 2 && $11 != "" && $11 ~ /^dpt:/ {print $11}\' | sed -e "s/.*://"', python_shell=True)).strip()
+        firewall_ports = firewall_ports.split('\n') if firewall_ports != "" else []
     no_firewall_ports = []
 
     for open_port in open_ports:
@@ -273,7 +306,11 @@ def check_password_fields_not_empty(reason=''):
     """
     Ensure password fields are not empty
     """
-    result = _execute_shell_command('cat /etc/shadow | awk -F: \'($2 == "" ) { print $1 " does not have a password "}\'', python_shell=True)
+    error = account_db().error('shadow')
+    if error:
+        return error
+    result = '\n'.join(entry.name + " does not have a password "
+                       for entry in account_db().shadow if entry.passwd == '').rstrip()
     return True if result == '' else result
 
 
@@ -281,44 +318,72 @@ def ungrouped_files_or_dir(reason=''):
     """
     Ensure no ungrouped files or directories exist
     """
-    raise CommandExecutionError('Module disabled due to performance concerns')
-    result = _execute_shell_command('df --local -P | awk {\'if (NR!=1) print $6\'} | xargs -I \'{}\' find \'{}\' -xdev -nogroup', python_shell=True)
-    return True if result == '' else result
+    return _fs_scan_result('ungrouped')
 
 
 def unowned_files_or_dir(reason=''):
     """
     Ensure no unowned files or directories exist
     """
-    raise CommandExecutionError('Module disabled due to performance concerns')
-    result = _execute_shell_command('df --local -P | awk {\'if (NR!=1) print $6\'} | xargs -I \'{}\' find \'{}\' -xdev -nouser', python_shell=True)
-    return True if result == '' else result
+    return _fs_scan_result('unowned')
 
 
 def world_writable_file(reason=''):
     """
     Ensure no world writable files exist
     """
-    raise CommandExecutionError('Module disabled due to performance concerns')
-    result = _execute_shell_command('df --local -P | awk {\'if (NR!=1) print $6\'} | xargs -I \'{}\' find \'{}\' -xdev -type f -perm -0002', python_shell=True)
-    return True if result == '' else result
+    return _fs_scan_result('world_writable')
+
+
+_INCOMPLETE_SCAN = 'The filesystem scan did not complete within its budget ' \
+                   '(hubblestack:nova:fsscan)'
+
+
+def _fs_scan():
+    """
+    The shared single-pass filesystem scan (see hubblestack.utils.fsscan),
+    configured by hubblestack:nova:fsscan
+    """
+    config = __salt__['config.get']('hubblestack:nova:fsscan', {}) or {}
+    return fsscan.scan(roots=config.get('roots'),
+                       prune=config.get('prune'),
+                       max_workers=config.get('max_workers', 4),
+                       max_seconds=config.get('max_seconds'),
+                       max_entries=config.get('max_entries'),
+                       throttle=config.get('throttle', 0),
+                       ttl=config.get('ttl', 3600))
+
+
+def _fs_scan_result(predicate):
+    """
+    True if nothing matched predicate in a complete scan, otherwise the
+    matching paths (one per line, as find printed them)
+    """
+    result = _fs_scan()
+    paths = result.failures(predicate)
+    if paths:
+        return '\n'.join(paths)
+    if not result.complete:
+        return _INCOMPLETE_SCAN
+    return True
 
 
 def system_account_non_login(non_login_shell='/sbin/nologin', max_system_uid='500', except_for_users=''):
     """
     Ensure system accounts are non-login
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
     users_list = ['root','halt','sync','shutdown']
     for user in except_for_users.split(","):
         if user.strip() != "":
             users_list.append(user.strip())
     result = []
-    cmd = __salt__["cmd.run_all"]('egrep -v "^\+" /etc/passwd ')
-    for line in cmd['stdout'].split('\n'):
-        tokens = line.split(':')
-        if tokens[0] not in users_list and int(tokens[2]) < int(max_system_uid) and tokens[6] not in ( non_login_shell , "/bin/false" ):
-           result.append(line)
+    for entry in account_db().users():
+        if entry.name not in users_list and int(entry.uid) < int(max_system_uid) and entry.shell not in ( non_login_shell , "/bin/false" ):
+           result.append(entry.line)
     return True if result == [] else str(result)
 
 
@@ -326,25 +391,30 @@ def sticky_bit_on_world_writable_dirs(reason=''):
     """
     Ensure sticky bit is set on all world-writable directories
     """
-    raise CommandExecutionError('Module disabled due to performance concerns')
-    result = _execute_shell_command('df --local -P | awk {\'if (NR!=1) print $6\'} | xargs -I \'{}\' find \'{}\' -xdev -type d \( -perm -0002 -a ! -perm -1000 \) 2>/dev/null', python_shell=True)
-    return True if result == '' else "There are failures"
+    result = _fs_scan_result('sticky_missing')
+    return True if result is True else "There are failures"
 
 
 def default_group_for_root(reason=''):
     """
     Ensure default group for the root account is GID 0
     """
-    result = _execute_shell_command('grep "^root:" /etc/passwd | cut -f4 -d:', python_shell=True)
-    result = result.strip()
-    return True if result == '0' else False
+    error = account_db().error('passwd')
+    if error:
+        return error
+    result = [entry.gid for entry in account_db().passwd if entry.name == 'root']
+    return True if result == ['0'] else False
 
 
 def root_is_only_uid_0_account(reason=''):
     """
     Ensure root is the only UID 0 account
     """
-    result = _execute_shell_command('cat /etc/passwd | awk -F: \'($3 == 0) { print $1 }\'', python_shell=True)
+    error = account_db().error('passwd')
+    if error:
+        return error
+    result = '\n'.join(entry.name for entry in account_db().passwd
+                       if entry.uid.isdigit() and int(entry.uid) == 0)
     return True if result.strip() == 'root' else result
 
 
@@ -355,20 +425,28 @@ def test_mount_attrs(mount_name, attribute, check_type='hard'):
     If check_type is hard, then in absence of volume, False will be returned
     """
     # check that the path exists on system
-    command = 'test -e ' + mount_name
-    results = __salt__['cmd.run_all'](command, ignore_retcode=True)
-    retcode = results['retcode']
-    if str(retcode) == '1':
+    if not os.path.exists(mount_name):
         return True if check_type == "soft" else (mount_name + " folder does not exist")
 
     # if the path exits, proceed with following code
-    output = __salt__['cmd.run']('cat /proc/mounts')
-    if not re.search(mount_name, output, re.M):
-        return True if check_type == "soft" else (mount_name + " is not mounted")
-    else:
+    mounts = procfs.mounts()
+    if mounts is None:
+        output = '\n'.join(facts.file_lines('/proc/mounts'))
+        if not re.search(mount_name, output, re.M):
+            return True if check_type == "soft" else (mount_name + " is not mounted")
         for line in output.splitlines():
             if mount_name in line and attribute not in line:
                 return str(line)
+        return True
+
+    matches = [mount_point for mount_point in mounts if re.search(mount_name, mount_point)]
+    if not matches:
+        return True if check_type == "soft" else (mount_name + " is not mounted")
+    for mount_point in matches:
+        mount = mounts[mount_point]
+        opts = ','.join(mount['opts'] + mount['superopts'])
+        if attribute not in opts:
+            return ' '.join((mount['device'], mount_point, mount['fstype'], opts))
     return True
 
 
@@ -388,7 +466,7 @@ def restrict_permissions(path, permission):
     """
     Ensure that the file permissions on path are equal or more strict than the  pemissions given in argument
     """
-    path_details = __salt__['file.stats'](path)
+    path_details = facts.salt_call(__salt__, 'file.stats', path)
     given_permission = path_details.get('mode')
     given_permission = given_permission[-3:]
     max_permission = str(permission)
@@ -447,9 +525,10 @@ def check_duplicate_uids(reason=''):
     """
     Return False if any duplicate user id exist in /etc/group file, else return True
     """
-    uids = _execute_shell_command("cat /etc/passwd | cut -f3 -d\":\"", python_shell=True).strip()
-    uids = uids.split('\n') if uids != "" else []
-    duplicate_uids = [k for k, v in Counter(uids).items() if v > 1]
+    error = account_db().error('passwd')
+    if error:
+        return error
+    duplicate_uids = account_db().duplicate_uids()
     if duplicate_uids is None or duplicate_uids == []:
         return True
     return str(duplicate_uids)
@@ -459,9 +538,10 @@ def check_duplicate_gids(reason=''):
     """
     Return False if any duplicate group id exist in /etc/group file, else return True
     """
-    gids = _execute_shell_command("cat /etc/group | cut -f3 -d\":\"", python_shell=True).strip()
-    gids = gids.split('\n') if gids != "" else []
-    duplicate_gids = [k for k, v in Counter(gids).items() if v > 1]
+    error = account_db().error('group')
+    if error:
+        return error
+    duplicate_gids = account_db().duplicate_gids()
     if duplicate_gids is None or duplicate_gids == []:
         return True
     return str(duplicate_gids)
@@ -471,9 +551,10 @@ def check_duplicate_unames(reason=''):
     """
     Return False if any duplicate user names exist in /etc/group file, else return True
     """
-    unames = _execute_shell_command("cat /etc/passwd | cut -f1 -d\":\"", python_shell=True).strip()
-    unames = unames.split('\n') if unames != "" else []
-    duplicate_unames = [k for k, v in Counter(unames).items() if v > 1]
+    error = account_db().error('passwd')
+    if error:
+        return error
+    duplicate_unames = account_db().duplicate_user_names()
     if duplicate_unames is None or duplicate_unames == []:
         return True
     return str(duplicate_unames)
@@ -483,9 +564,10 @@ def check_duplicate_gnames(reason=''):
     """
     Return False if any duplicate group names exist in /etc/group file, else return True
     """
-    gnames = _execute_shell_command("cat /etc/group | cut -f1 -d\":\"", python_shell=True).strip()
-    gnames = gnames.split('\n') if gnames != "" else []
-    duplicate_gnames = [k for k, v in Counter(gnames).items() if v > 1]
+    error = account_db().error('group')
+    if error:
+        return error
+    duplicate_gnames = account_db().duplicate_group_names()
     if duplicate_gnames is None or duplicate_gnames == []:
         return True
     return str(duplicate_gnames)
@@ -512,8 +594,13 @@ def check_core_dumps(reason=''):
     """
     Ensure core dumps are restricted
     """
-    hard_core_dump_value = _execute_shell_command("grep -R -E \"hard +core\" /etc/security/limits.conf /etc/security/limits.d/ | awk '{print $4}'", python_shell=True).strip()
-    hard_core_dump_value = hard_core_dump_value.split('\n') if hard_core_dump_value != "" else []
+    hard_core_dump_value = []
+    for path in _limits_files():
+        for line in facts.file_lines(path):
+            if re.search('hard +core', line):
+                # the 4th field of grep -R's 'path:line' output
+                fields = (path + ':' + line).split()
+                hard_core_dump_value.append(fields[3] if len(fields) > 3 else '')
     if '0' in hard_core_dump_value:
         return True
 
@@ -523,18 +610,42 @@ def check_core_dumps(reason=''):
     return str(hard_core_dump_value)
 
 
+def _limits_files():
+    """
+    /etc/security/limits.conf and everything under /etc/security/limits.d/
+    """
+    ret = ['/etc/security/limits.conf']
+    for root, dirs, files in os.walk('/etc/security/limits.d'):
+        dirs.sort()
+        ret.extend(os.path.join(root, name) for name in sorted(files))
+    return ret
+
+
 def check_service_status(service_name, state):
     """
     Ensure that the given service is in the required state. Return False if it is not in desired state
     Return True otherwise
     state can be enabled or disabled.
     """
-    all_services = __salt__['cmd.run']('systemctl list-unit-files')
+    table = systemd.unit_table(__salt__)
+    if table is not None:
+        all_services = '\n'.join(table.names())
+    else:
+        all_services = facts.salt_call(__salt__, 'cmd.run', 'systemctl list-unit-files', cost=1)
     if re.search(service_name, all_services, re.M):
+        unit_state = table.file_state(service_name) if table is not None else None
+        if unit_state is not None:
+            enabled = unit_state in systemd.ENABLED_STATES
+            if (state == "disabled" and not enabled) or (state == "enabled" and enabled):
+                return True
+            # what `systemctl is-enabled` prints
+            return unit_state
+        facts.snapshot().count('systemctl is-enabled')
         output = __salt__['cmd.retcode']('systemctl is-enabled ' + service_name, ignore_retcode=True)
         if (state == "disabled" and str(output) == "1") or (state == "enabled" and str(output) == "0"):
             return True
         else:
+            facts.snapshot().count('systemctl is-enabled')
             return __salt__['cmd.run_stdout']('systemctl is-enabled ' + service_name, ignore_retcode=True)
     else:
         if state == "disabled":
@@ -563,53 +674,50 @@ def check_unowned_files(reason=''):
     """
     Ensure no unowned files or directories exist
     """
-    raise CommandExecutionError('Module disabled due to performance concerns')
-    unowned_files = _execute_shell_command("df --local -P | awk 'NR!=1 {print $6}' | xargs -I '{}' find '{}' -xdev -nouser 2>/dev/null", python_shell=True).strip()
-    unowned_files = unowned_files.split('\n') if unowned_files != "" else []
-    # The command above only searches local filesystems, there may still be compromised items on network
-    # mounted partitions.
-    # Following command will check each partition for unowned files
-    unowned_partition_files = _execute_shell_command("mount | awk '{print $3}' | xargs -I '{}' find '{}' -xdev -nouser 2>/dev/null", python_shell=True).strip()
-    unowned_partition_files = unowned_partition_files.split('\n') if unowned_partition_files != "" else []
-    unowned_files = unowned_files + unowned_partition_files
-    return True if unowned_files == [] else str(list(set(unowned_files)))
+    return _fs_scan_result('unowned')
 
 
 def check_ungrouped_files(reason=''):
     """
     Ensure no ungrouped files or directories exist
     """
-    raise CommandExecutionError('Module disabled due to performance concerns')
-    ungrouped_files = _execute_shell_command("df --local -P | awk 'NR!=1 {print $6}' | xargs -I '{}' find '{}' -xdev -nogroup 2>/dev/null", python_shell=True).strip()
-    ungrouped_files = ungrouped_files.split('\n') if ungrouped_files != "" else []
-    # The command above only searches local filesystems, there may still be compromised items on network
-    # mounted partitions.
-    # Following command will check each partition for unowned files
-    ungrouped_partition_files = _execute_shell_command("mount | awk '{print $3}' | xargs -I '{}' find '{}' -xdev -nogroup 2>/dev/null", python_shell=True).strip()
-    ungrouped_partition_files = ungrouped_partition_files.split('\n') if ungrouped_partition_files != "" else []
-    ungrouped_files = ungrouped_files + ungrouped_partition_files
-    return True if ungrouped_files == [] else str(list(set(ungrouped_files)))
+    return _fs_scan_result('ungrouped')
+
+
+def check_suid_sgid_files(allowed_files=''):
+    """
+    Ensure no SUID/SGID executables exist other than the comma separated
+    allowed_files (globs are allowed)
+    """
+    allowed = [path.strip() for path in allowed_files.split(',') if path.strip()]
+    result = _fs_scan()
+    found = sorted(set(result.failures('suid') + result.failures('sgid')))
+    found = [path for path in found
+             if not any(fnmatch.fnmatch(path, pattern) for pattern in allowed)]
+    if found:
+        return str(found)
+    if not result.complete:
+        return _INCOMPLETE_SCAN
+    return True
 
 
 def check_all_users_home_directory(max_system_uid):
     """
     Ensure all users' home directories exist
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
     max_system_uid = int(max_system_uid)
-    users_uids_dirs = _execute_shell_command("cat /etc/passwd | awk -F: '{ print $1 \" \" $3 \" \" $6 \" \" $7}'", python_shell=True).strip()
-    users_uids_dirs = users_uids_dirs.split('\n') if users_uids_dirs else []
     error = []
-    for user_data in users_uids_dirs:
-        user_uid_dir = user_data.strip().split(" ")
-        if len(user_uid_dir) < 4:
-                user_uid_dir = user_uid_dir + [''] * (4 - len(user_uid_dir))
-        if user_uid_dir[1].isdigit():
-            if not _is_valid_home_directory(user_uid_dir[2], True) and int(user_uid_dir[1]) >= max_system_uid and user_uid_dir[0] != "nfsnobody" \
-                    and 'nologin' not in user_uid_dir[3] and 'false' not in user_uid_dir[3]:
-                error += ["Either home directory " + user_uid_dir[2] + " of user " + user_uid_dir[0] + " is invalid or does not exist."]
+    for entry in account_db().passwd:
+        if entry.uid.isdigit():
+            if not _is_valid_home_directory(entry.home, True) and int(entry.uid) >= max_system_uid and entry.name != "nfsnobody" \
+                    and 'nologin' not in entry.shell and 'false' not in entry.shell:
+                error += ["Either home directory " + entry.home + " of user " + entry.name + " is invalid or does not exist."]
         else:
-            error += ["User " + user_uid_dir[0] + " has invalid uid " + user_uid_dir[1]]
+            error += ["User " + entry.name + " has invalid uid " + entry.uid]
     return True if not error else str(error)
 
 
@@ -617,26 +725,22 @@ def check_users_home_directory_permissions(max_allowed_permission='750', except_
     """
     Ensure users' home directories permissions are 750 or more restrictive
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
     users_list = ['root','halt','sync','shutdown']
     for user in except_for_users.split(","):
         if user.strip() != "":
             users_list.append(user.strip())
 
-    users_dirs = []
-    cmd = __salt__["cmd.run_all"]('egrep -v "^\+" /etc/passwd ')
-    for line in cmd['stdout'].split('\n'):
-        tokens = line.split(':')
-        if tokens[0] not in users_list and 'nologin' not in tokens[6] and 'false' not in tokens[6]:
-            users_dirs.append(tokens[0] + " " + tokens[5])
     error = []
-    for user_dir in users_dirs:
-        user_dir = user_dir.split(" ")
-        if len(user_dir) < 2:
-                user_dir = user_dir + [''] * (2 - len(user_dir))
-        if _is_valid_home_directory(user_dir[1]):
-            result = restrict_permissions(user_dir[1], max_allowed_permission)
+    for entry in account_db().users():
+        if entry.name in users_list or 'nologin' in entry.shell or 'false' in entry.shell:
+            continue
+        if _is_valid_home_directory(entry.home):
+            result = restrict_permissions(entry.home, max_allowed_permission)
             if result is not True:
-                error += ["permission on home directory " + user_dir[1] + " of user " + user_dir[0] + " is wrong: " + result]
+                error += ["permission on home directory " + entry.home + " of user " + entry.name + " is wrong: " + result]
 
     return True if error == [] else str(error)
 
@@ -645,75 +749,89 @@ def check_users_own_their_home(max_system_uid):
     """
     Ensure users own their home directories
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
     max_system_uid = int(max_system_uid)
 
-    users_uids_dirs = _execute_shell_command("cat /etc/passwd | awk -F: '{ print $1 \" \" $3 \" \" $6 \" \" $7}'", python_shell=True).strip()
-    users_uids_dirs = users_uids_dirs.split('\n') if users_uids_dirs != "" else []
     error = []
-    for user_data in users_uids_dirs:
-        user_uid_dir = user_data.strip().split(" ")
-        if len(user_uid_dir) < 4:
-            user_uid_dir = user_uid_dir + [''] * (4 - len(user_uid_dir))
-        if user_uid_dir[1].isdigit():
-            if not _is_valid_home_directory(user_uid_dir[2]):
-                if int(user_uid_dir[1]) >= max_system_uid and 'nologin' not in user_uid_dir[3] and 'false' not in user_uid_dir[3]:
-                    error += ["Either home directory " + user_uid_dir[2] + " of user " + user_uid_dir[0] + " is invalid or does not exist."]
-            elif int(user_uid_dir[1]) >= max_system_uid and user_uid_dir[0] != "nfsnobody" and 'nologin' not in user_uid_dir[3] \
-                    and 'false' not in user_uid_dir[3]:
-                owner = __salt__['cmd.run']("stat -L -c \"%U\" \"" + user_uid_dir[2] + "\"")
-                if owner != user_uid_dir[0]:
-                    error += ["The home directory " + user_uid_dir[2] + " of user " + user_uid_dir[0] + " is owned by " + owner]
+    for entry in account_db().passwd:
+        if entry.uid.isdigit():
+            if not _is_valid_home_directory(entry.home):
+                if int(entry.uid) >= max_system_uid and 'nologin' not in entry.shell and 'false' not in entry.shell:
+                    error += ["Either home directory " + entry.home + " of user " + entry.name + " is invalid or does not exist."]
+            elif int(entry.uid) >= max_system_uid and entry.name != "nfsnobody" and 'nologin' not in entry.shell \
+                    and 'false' not in entry.shell:
+                owner = _owner_name(entry.home)
+                if owner != entry.name:
+                    error += ["The home directory " + entry.home + " of user " + entry.name + " is owned by " + owner]
         else:
-            error += ["User " + user_uid_dir[0] + " has invalid uid " + user_uid_dir[1]]
+            error += ["User " + entry.name + " has invalid uid " + entry.uid]
 
     return True if not error else str(error)
 
 
+def _owner_name(path):
+    """
+    The owner of path, following symlinks, as ``stat -L -c %U`` prints it
+    """
+    uid = os.stat(path).st_uid
+    users = account_db().users_by_uid(uid)
+    if users:
+        return users[0].name
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return 'UNKNOWN'
+
+
 def check_users_dot_files(reason=''):
     """
     Ensure users' dot files are not group or world writable
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
-    users_dirs = _execute_shell_command("cat /etc/passwd | egrep -v '(root|halt|sync|shutdown)' | awk -F: '($7 != \"/sbin/nologin\") {print $1\" \"$6}'", python_shell=True).strip()
-    users_dirs = users_dirs.split('\n') if users_dirs != "" else []
     error = []
-    for user_dir in users_dirs:
-        user_dir = user_dir.split()
-        if len(user_dir) < 2:
-                user_dir = user_dir + [''] * (2 - len(user_dir))
-        if _is_valid_home_directory(user_dir[1]):
-            dot_files = _execute_shell_command("find " + user_dir[1] + " -name \".*\"").strip()
-            dot_files = dot_files.split('\n') if dot_files != "" else []
-            for dot_file in dot_files:
+    for user, home in _login_users():
+        if _is_valid_home_directory(home):
+            for dot_file in _find_dot_files(home):
                 if os.path.isfile(dot_file):
-                    path_details = __salt__['file.stats'](dot_file)
-                    given_permission = path_details.get('mode')
-                    file_permission = given_permission[-3:]
+                    file_permission = '{0:03o}'.format(stat.S_IMODE(os.stat(dot_file).st_mode))[-3:]
                     if file_permission[1] in ["2", "3", "6", "7"]:
-                        error += ["Group Write permission set on file " + dot_file + " for user " + user_dir[0]]
+                        error += ["Group Write permission set on file " + dot_file + " for user " + user]
                     if file_permission[2] in ["2", "3", "6", "7"]:
-                        error += ["Other Write permission set on file " + dot_file + " for user " + user_dir[0]]
+                        error += ["Other Write permission set on file " + dot_file + " for user " + user]
 
     return True if error == [] else str(error)
 
 
+def _find_dot_files(directory):
+    """
+    Everything named ``.*`` under directory (``find <directory> -name ".*"``)
+    """
+    ret = []
+    for root, dirs, files in os.walk(directory):
+        ret.extend(os.path.join(root, name) for name in dirs + files if name.startswith('.'))
+    return ret
+
+
 def check_users_forward_files(reason=''):
     """
     Ensure no users have .forward files
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
-    users_dirs = _execute_shell_command("cat /etc/passwd | awk -F: '{ print $1\" \"$6 }'", python_shell=True).strip()
-    users_dirs = users_dirs.split('\n') if users_dirs != "" else []
     error = []
-    for user_dir in users_dirs:
-        user_dir = user_dir.split()
-        if len(user_dir) < 2:
-                user_dir = user_dir + [''] * (2 - len(user_dir))
-        if _is_valid_home_directory(user_dir[1]):
-            forward_file = _execute_shell_command("find " + user_dir[1] + " -maxdepth 1 -name \".forward\"").strip()
-            if forward_file is not None and os.path.isfile(forward_file):
-                error += ["Home directory: " + user_dir[1] + ", for user: " + user_dir[0] + " has " + forward_file + " file"]
+    for entry in account_db().passwd:
+        if _is_valid_home_directory(entry.home):
+            forward_file = os.path.join(entry.home, ".forward")
+            if os.path.isfile(forward_file):
+                error += ["Home directory: " + entry.home + ", for user: " + entry.name + " has " + forward_file + " file"]
 
     return True if error == [] else str(error)
 
@@ -722,18 +840,15 @@ def check_users_netrc_files(reason=''):
     """
     Ensure no users have .netrc files
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
-    users_dirs = _execute_shell_command("cat /etc/passwd | awk -F: '{ print $1\" \"$6 }'", python_shell=True).strip()
-    users_dirs = users_dirs.split('\n') if users_dirs != "" else []
     error = []
-    for user_dir in users_dirs:
-        user_dir = user_dir.split()
-        if len(user_dir) < 2:
-                user_dir = user_dir + [''] * (2 - len(user_dir))
-        if _is_valid_home_directory(user_dir[1]):
-            netrc_file = _execute_shell_command("find " + user_dir[1] + " -maxdepth 1 -name \".netrc\"").strip()
-            if netrc_file is not None and os.path.isfile(netrc_file):
-                error += ["Home directory: " + user_dir[1] + ", for user: " + user_dir[0] + " has .netrc file"]
+    for entry in account_db().passwd:
+        if _is_valid_home_directory(entry.home):
+            if os.path.isfile(os.path.join(entry.home, ".netrc")):
+                error += ["Home directory: " + entry.home + ", for user: " + entry.name + " has .netrc file"]
 
     return True if error == [] else str(error)
 
@@ -742,14 +857,15 @@ def check_groups_validity(reason=''):
     """
     Ensure all groups in /etc/passwd exist in /etc/group
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
-    group_ids_in_passwd = _execute_shell_command("cut -s -d: -f4 /etc/passwd 2>/dev/null", python_shell=True).strip()
-    group_ids_in_passwd = group_ids_in_passwd.split('\n') if group_ids_in_passwd != "" else []
-    group_ids_in_passwd = list(set(group_ids_in_passwd))
+    db = account_db()
+    group_ids_in_passwd = list(set(entry.gid for entry in db.passwd if ':' in entry.line))
     invalid_groups = []
     for group_id in group_ids_in_passwd:
-        group_presence_validity = _execute_shell_command("getent group " + group_id + " 2>/dev/null 1>/dev/null; echo $?", python_shell=True).strip()
-        if str(group_presence_validity) != "0":
+        if not db.group_exists(group_id):
             invalid_groups += ["Invalid groupid: " + group_id + " in /etc/passwd file"]
 
     return True if invalid_groups == [] else str(invalid_groups)
@@ -760,22 +876,16 @@ def ensure_reverse_path_filtering(reason=''):
     Ensure Reverse Path Filtering is enabled
     """
     error_list = []
-    command = "sysctl net.ipv4.conf.all.rp_filter 2> /dev/null"
-    output = _execute_shell_command(command, python_shell=True)
-    if output.strip() == '':
-        error_list.append("net.ipv4.conf.all.rp_filter not found")
-    search_results = re.findall("rp_filter = (\d+)", output)
-    result = int(search_results[0])
-    if result < 1:
-        error_list.append("net.ipv4.conf.all.rp_filter  value set to " + str(result))
-    command = "sysctl net.ipv4.conf.default.rp_filter 2> /dev/null"
-    output = _execute_shell_command(command, python_shell=True)
-    if output.strip() == '':
-        error_list.append("net.ipv4.conf.default.rp_filter not found")
-    search_results = re.findall("rp_filter = (\d+)", output)
-    result = int(search_results[0])
-    if result < 1:
-        error_list.append("net.ipv4.conf.default.rp_filter  value set to " + str(result))
+    for name in ('net.ipv4.conf.all.rp_filter', 'net.ipv4.conf.default.rp_filter'):
+        value = procfs.sysctl(name)
+        if value is None:
+            value = _execute_shell_command('sysctl -n ' + name + ' 2> /dev/null', python_shell=True)
+        if value.strip() == '':
+            error_list.append(name + " not found")
+            continue
+        result = int(value.strip())
+        if result < 1:
+            error_list.append(name + "  value set to " + str(result))
     if len(error_list) > 0:
         return str(error_list)
     else:
@@ -786,18 +896,15 @@ def check_users_rhosts_files(reason=''):
     """
     Ensure no users have .rhosts files
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
-    users_dirs = _execute_shell_command("cat /etc/passwd | egrep -v '(root|halt|sync|shutdown)' | awk -F: '($7 != \"/sbin/nologin\") {print $1\" \"$6}'", python_shell=True).strip()
-    users_dirs = users_dirs.split('\n') if users_dirs != "" else []
     error = []
-    for user_dir in users_dirs:
-        user_dir = user_dir.split()
-        if len(user_dir) < 2:
-            user_dir = user_dir + [''] * (2 - len(user_dir))
-        if _is_valid_home_directory(user_dir[1]):
-            rhosts_file = _execute_shell_command("find " + user_dir[1] + " -maxdepth 1 -name \".rhosts\"").strip()
-            if rhosts_file is not None and os.path.isfile(rhosts_file):
-                error += ["Home directory: " + user_dir[1] + ", for user: " + user_dir[0] + " has .rhosts file"]
+    for user, home in _login_users():
+        if _is_valid_home_directory(home):
+            if os.path.isfile(os.path.join(home, ".rhosts")):
+                error += ["Home directory: " + home + ", for user: " + user + " has .rhosts file"]
     return True if error == [] else str(error)
 
 
@@ -805,37 +912,24 @@ def check_netrc_files_accessibility(reason=''):
     """
     Ensure users' .netrc Files are not group or world accessible
     """
+    error = account_db().error('passwd')
+    if error:
+        return error
 
-    script = """
-    for dir in `cat /etc/passwd | egrep -v '(root|sync|halt|shutdown)' | awk -F: '($7 != "/sbin/nologin") { print $6 }'`; do
-      for file in $dir/.netrc; do
-        if [ ! -h "$file" -a -f "$file" ]; then
-          fileperm=`ls -ld $file | cut -f1 -d" "`
-          if [ `echo $fileperm | cut -c5` != "-" ]; then
-            echo "Group Read set on $file"
-          fi
-          if [ `echo $fileperm | cut -c6` != "-" ]; then
-            echo "Group Write set on $file"
-          fi
-          if [ `echo $fileperm | cut -c7` != "-" ]; then
-            echo "Group Execute set on $file"
-          fi
-          if [ `echo $fileperm | cut -c8` != "-" ]; then
-            echo "Other Read set on $file"
-          fi
-          if [ `echo $fileperm | cut -c9` != "-" ]; then
-            echo "Other Write set on $file"
-          fi
-          if [ `echo $fileperm | cut -c10` != "-" ]; then
-            echo "Other Execute set on $file"
-          fi
-        fi
-      done
-    done
-
-    """
-    output = _execute_shell_command(script, python_shell=True)
-    return True if output.strip() == '' else output
+    output = []
+    for user, home in _login_users():
+        if not home.strip():
+            continue
+        netrc_file = home + '/.netrc'
+        if os.path.islink(netrc_file) or not os.path.isfile(netrc_file):
+            continue
+        mode = os.stat(netrc_file).st_mode
+        for bit, who, what in ((stat.S_IRGRP, 'Group', 'Read'), (stat.S_IWGRP, 'Group', 'Write'),
+                               (stat.S_IXGRP, 'Group', 'Execute'), (stat.S_IROTH, 'Other', 'Read'),
+                               (stat.S_IWOTH, 'Other', 'Write'), (stat.S_IXOTH, 'Other', 'Execute')):
+            if mode & bit:
+                output.append(who + " " + what + " set on " + netrc_file)
+    return True if output == [] else '\n'.join(output)
 
 
 def _grep(path,
@@ -892,6 +986,10 @@ def _grep(path,
         )
     )
 
+    ret = grep_engine.run(cmd)
+    if ret is not None:
+        return ret
+
     try:
         ret = __salt__['cmd.run_all'](cmd, python_shell=False, ignore_retcode=True)
     except (IOError, OSError) as exc:
@@ -975,8 +1073,9 @@ def check_if_any_pkg_installed(args):
     :return: True if any of the input package is installed else False
     """
     result = False
+    index = package_index(__salt__, __grains__)
     for pkg in args.split(','):
-        if __salt__['pkg.version'](pkg):
+        if index.installed(pkg):
             result = True
             break
     return result
@@ -1055,7 +1154,7 @@ def check_sshd_paramters(pattern, values=None, comparetype='regex'):
            comparetype: only
       description: Ensure only approved ciphers are used
     """
-    output = __salt__['cmd.run']('sshd -T')
+    output = facts.salt_call(__salt__, 'cmd.run', 'sshd -T', cost=1)
     if comparetype == 'only':
         if not values:
             return "You need to provide values for comparetype 'only'."
@@ -1128,6 +1227,7 @@ FUNCTION_MAP = {
     'check_ssh_timeout_config': check_ssh_timeout_config,
     'check_unowned_files': check_unowned_files,
     'check_ungrouped_files': check_ungrouped_files,
+    'check_suid_sgid_files': check_suid_sgid_files,
     'check_all_users_home_directory': check_all_users_home_directory,
     'check_users_home_directory_permissions': check_users_home_directory_permissions,
     'check_users_own_their_home': check_users_own_their_home,
@@ -30,13 +30,14 @@ mount:
 from __future__ import absolute_import
 import logging
 
-import fnmatch
 import os
 import copy
 import salt.utils
 import salt.utils.platform
 
 from distutils.version import LooseVersion
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.procfs as procfs
 
 log = logging.getLogger(__name__)
 
@@ -77,7 +78,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('mount', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('mount audit __data__:')
@@ -87,7 +89,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
@@ -168,20 +170,7 @@ def _get_tags(data):
                 # mount:blacklist:0:telnet
                 tags_dict = audit_data.get('data', {})
                 # mount:blacklist:0:telnet:data
-                tags = None
-                for osfinger in tags_dict:
-                    if osfinger == '*':
-                        continue
-                    osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                    for osfinger_glob in osfinger_list:
-                        if fnmatch.fnmatch(distro, osfinger_glob):
-                            tags = tags_dict.get(osfinger)
-                            break
-                    if tags is not None:
-                        break
-                # If we didn't find a match, check for a '*'
-                if tags is None:
-                    tags = tags_dict.get('*', [])
+                tags = checkplan.select_target(tags_dict, distro)
                 # mount:blacklist:0:telnet:data:Debian-8
                 if isinstance(tags, dict):
                     # malformed yaml, convert to list of dicts
@@ -222,7 +211,9 @@ def _check_mount_attribute(path, attribute, check_type):
         else:
             return True
 
-    mount_object = __salt__['mount.active']()
+    mount_object = procfs.mounts()
+    if mount_object is None:
+        mount_object = __salt__['mount.active']()
 
     if path in mount_object:
         attributes = mount_object.get(path)
@@ -22,6 +22,8 @@ import logging
 
 import salt.utils
 
+import hubblestack.utils.procfs as procfs
+
 log = logging.getLogger(__name__)
 
 
@@ -55,8 +57,13 @@ def audit(data_list, tags, labels, debug=True, **kwargs):
         # No yaml data found, don't do any work
         return ret
 
-    for address_data in __salt__['network.netstat']():
+    connections = procfs.netstat()
+    if connections is None:
+        connections = __salt__['network.netstat']()
 
+    for address_data in connections:
+        # procfs entries are shared for the run; don't tag them in place
+        address_data = dict(address_data)
         success = False
         for whitelisted_address in __tags__:
             if fnmatch.fnmatch(address_data['local-address'], whitelisted_address):
@@ -72,10 +72,11 @@ import fnmatch
 import copy
 import salt.utils
 import salt.utils.platform
+import calendar
 import datetime
 import time
 
-import ssl
+import hubblestack.utils.certs as certs
 
 try:
     import OpenSSL
@@ -129,6 +130,7 @@ def audit(data_list, tags, labels, debug=True, **kwargs):
         log.debug(__tags__)
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
+    endpoint_certs = _fetch_endpoint_certs(__tags__, tags)
     for tag in __tags__:
         if fnmatch.fnmatch(tag, tags):
             for tag_data in __tags__[tag]:
@@ -155,8 +157,11 @@ def audit(data_list, tags, labels, debug=True, **kwargs):
                     ret['Failure'].append(tag_data)
                     continue
 
-                cert = _get_cert(endpoint, port) if endpoint else _get_cert(pem_file, from_file=True)
-                x509 = _load_x509(cert)
+                if endpoint:
+                    cert = endpoint_certs.get((endpoint, int(port)))
+                else:
+                    cert = _get_cert(pem_file, from_file=True)
+                x509 = certs.parsed(cert, _load_x509) if cert else _load_x509(cert)
                 (passed, failing_reason) = _check_x509(x509=x509,
                                                        not_before=not_before,
                                                        not_after=not_after,
@@ -171,6 +176,46 @@ def audit(data_list, tags, labels, debug=True, **kwargs):
     return ret
 
 
+def _fetch_endpoint_certs(__tags__, tags):
+    """
+    Fetch the certificates of every endpoint the audit checks, concurrently.
+
+    Each endpoint gets ``hubblestack:nova:openssl:timeout`` seconds (default
+    10) and all of them together ``hubblestack:nova:openssl:deadline`` seconds
+    (default 60). Certificates are reused for
+    ``hubblestack:nova:openssl:cache_ttl`` seconds (default 3600), or until
+    they expire.
+    """
+    endpoints = []
+    for tag in __tags__:
+        if fnmatch.fnmatch(tag, tags):
+            for tag_data in __tags__[tag]:
+                if 'control' in tag_data or not tag_data.get('endpoint') or tag_data.get('file'):
+                    continue
+                endpoints.append((tag_data['endpoint'], int(tag_data.get('port', 443))))
+    if not endpoints:
+        return {}
+    config = __salt__['config.get']('hubblestack:nova:openssl', {}) or {}
+    deadline = config.get('deadline', 60)
+    return certs.fetch(endpoints,
+                       timeout=config.get('timeout', 10),
+                       deadline=time.time() + deadline if deadline else None,
+                       max_workers=config.get('max_workers', 8),
+                       ttl=config.get('cache_ttl', 3600),
+                       expires=_cert_expires)
+
+
+def _cert_expires(cert):
+    """
+    The notAfter of a PEM certificate, as an epoch
+    """
+    x509 = certs.parsed(cert, _load_x509)
+    if x509 is None:
+        return None
+    not_after = time.strptime(x509.get_notAfter(), '%Y%m%d%H%M%SZ')
+    return calendar.timegm(not_after)
+
+
 def _merge_yaml(ret, data, profile=None):
     if 'openssl' not in ret:
         ret['openssl'] = []
@@ -246,11 +291,7 @@ def _get_cert(source, port=443, from_file=False):
 
 
 def _get_cert_from_endpoint(server, port=443):
-    try:
-        cert = ssl.get_server_certificate((server, port))
-    except Exception:
-        log.error('Unable to retrieve certificate from {0}'.format(server))
-        cert = None
+    cert = certs.fetch([(server, port)]).get((server, int(port)))
     if not cert:
         return None
 
@@ -258,14 +299,7 @@ def _get_cert_from_endpoint(server, port=443):
 
 
 def _get_cert_from_file(cert_file_path):
-    try:
-        with open(cert_file_path) as cert_file:
-            cert = cert_file.read()
-    except IOError:
-        log.error('File not found: {0}'.format(cert_file_path))
-        return None
-
-    return cert
+    return certs.read_file(cert_file_path)
 
 
 def _get_x509_days_left(x509):
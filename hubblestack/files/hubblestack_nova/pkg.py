@@ -10,6 +10,7 @@ Sample YAML data, with inline comments:
 
 pkg:
   # Must not be installed
+  # Package names may be globs, e.g. 'telnet*'
   blacklist:
     # Unique ID for this set of audits
     telnet:
@@ -37,7 +38,10 @@ pkg:
           - 'rsh':
               tag: 'CIS-2.1.3'
               version: '4.3.2'
-          # Dict format can also define ranges (only >= and <= supported)
+          # Dict format can also define ranges (only >= and <= supported).
+          # Versions are compared with rpm or dpkg semantics, depending on
+          # the os_family; with several versions installed the newest one is
+          # compared
           - 'rsh-client':
               tag: 'CIS-2.1.3'
               version: '>=4.3.2'
@@ -59,15 +63,18 @@ pkg:
 from __future__ import absolute_import
 import logging
 
-import fnmatch
 import copy
 import salt.utils
 import salt.utils.platform
 
-from distutils.version import LooseVersion
+import hubblestack.utils.checkplan as checkplan
+from hubblestack.utils.pkgindex import package_index
 
 log = logging.getLogger(__name__)
 
+# see hubblestack.utils.incremental
+__incremental__ = True
+
 
 def __virtual__():
     if salt.utils.platform.is_windows():
@@ -103,7 +110,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('pkg', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('pkg audit __data__:')
@@ -112,18 +120,22 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
         log.debug(__tags__)
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
+    index = None
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
                     continue
                 name = tag_data['name']
                 audittype = tag_data['type']
+                if index is None:
+                    # One package listing per audit, everything else is a lookup
+                    index = package_index(__salt__, __grains__)
 
                 # Blacklisted packages (must not be installed)
                 if audittype == 'blacklist':
-                    if __salt__['pkg.version'](name):
+                    if index.installed(name):
                         tag_data['failure_reason'] = "Found blacklisted package '{0}'" \
                                                      " installed on the system" \
                                                      .format(name)
@@ -140,8 +152,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                             mod = ''
 
                         if mod == '<':
-                            if (LooseVersion(__salt__['pkg.version'](name)) <=
-                                    LooseVersion(version)):
+                            if index.satisfies(name, '<=', version):
                                 ret['Success'].append(tag_data)
                             else:
                                 tag_data['failure_reason'] = "Could not find requisite package '{0}' with" \
@@ -151,8 +162,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                                 ret['Failure'].append(tag_data)
 
                         elif mod == '>':
-                            if (LooseVersion(__salt__['pkg.version'](name)) >=
-                                    LooseVersion(version)):
+                            if index.satisfies(name, '>=', version):
                                 ret['Success'].append(tag_data)
                             else:
                                 tag_data['failure_reason'] = "Could not find requisite package '{0}' " \
@@ -163,7 +173,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
                         elif not mod:
                             # Just peg to the version, no > or <
-                            if __salt__['pkg.version'](name) == version:
+                            if index.satisfies(name, '==', version):
                                 ret['Success'].append(tag_data)
                             else:
                                 tag_data['failure_reason'] = "Could not find the version '{0}' of requisite" \
@@ -184,7 +194,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                             ret['Failure'].append(tag_data)
 
                     else:  # No version checking
-                        if __salt__['pkg.version'](name):
+                        if index.installed(name):
                             ret['Success'].append(tag_data)
                         else:
                             tag_data['failure_reason'] = "Could not find requisite package '{0}' installed" \
@@ -225,20 +235,7 @@ def _get_tags(data):
                 # pkg:blacklist:0:telnet
                 tags_dict = audit_data.get('data', {})
                 # pkg:blacklist:0:telnet:data
-                tags = None
-                for osfinger in tags_dict:
-                    if osfinger == '*':
-                        continue
-                    osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                    for osfinger_glob in osfinger_list:
-                        if fnmatch.fnmatch(distro, osfinger_glob):
-                            tags = tags_dict.get(osfinger)
-                            break
-                    if tags is not None:
-                        break
-                # If we didn't find a match, check for a '*'
-                if tags is None:
-                    tags = tags_dict.get('*', [])
+                tags = checkplan.select_target(tags_dict, distro)
                 # pkg:blacklist:0:telnet:data:Debian-8
                 if isinstance(tags, dict):
                     # malformed yaml, convert to list of dicts
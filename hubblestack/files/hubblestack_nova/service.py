@@ -53,11 +53,13 @@ service:
 from __future__ import absolute_import
 import logging
 
-import fnmatch
 import salt.utils
 import salt.utils.platform
 
 from distutils.version import LooseVersion
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.facts as facts
+import hubblestack.utils.systemd as systemd
 
 log = logging.getLogger(__name__)
 
@@ -94,7 +96,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('service', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('service audit __data__:')
@@ -104,7 +107,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
@@ -114,7 +117,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
                 # Blacklisted packages (must not be installed)
                 if audittype == 'blacklist':
-                    if __salt__['service.available'](name) and __salt__['service.status'](name):
+                    if _service_running(name):
                         tag_data['failure_reason'] = "Found blacklisted service '{0}' " \
                                                      "running on the system" \
                                                      .format(name)
@@ -124,7 +127,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
                 # Whitelisted packages (must be installed)
                 elif audittype == 'whitelist':
-                    if __salt__['service.available'](name) and __salt__['service.status'](name):
+                    if _service_running(name):
                         ret['Success'].append(tag_data)
                     else:
                         tag_data['failure_reason'] = "Could not find requisite service" \
@@ -135,6 +138,22 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     return ret
 
 
+def _service_running(name):
+    """
+    Whether the service ``name`` exists and is running, answered from the
+    run's systemd unit table when possible
+    """
+    table = systemd.unit_table(__salt__)
+    if table is not None:
+        exists, active = table.exists(name), table.is_active(name)
+        if exists is False:
+            return False
+        if exists and active is not None:
+            return active
+    return (facts.salt_call(__salt__, 'service.available', name, cost=1) and
+            facts.salt_call(__salt__, 'service.status', name, cost=1))
+
+
 def _merge_yaml(ret, data, profile=None):
     """
     Merge two yaml dicts together at the service:blacklist and service:whitelist level
@@ -166,20 +185,7 @@ def _get_tags(data):
                 # service:blacklist:0:telnet
                 tags_dict = audit_data.get('data', {})
                 # service:blacklist:0:telnet:data
-                tags = None
-                for osfinger in tags_dict:
-                    if osfinger == '*':
-                        continue
-                    osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                    for osfinger_glob in osfinger_list:
-                        if fnmatch.fnmatch(distro, osfinger_glob):
-                            tags = tags_dict.get(osfinger)
-                            break
-                    if tags is not None:
-                        break
-                # If we didn't find a match, check for a '*'
-                if tags is None:
-                    tags = tags_dict.get('*', [])
+                tags = checkplan.select_target(tags_dict, distro)
                 # service:blacklist:0:telnet:data:Debian-8
                 if isinstance(tags, dict):
                     # malformed yaml, convert to list of dicts
@@ -47,15 +47,19 @@ If the file exists, this setting is ignored.
 from __future__ import absolute_import
 import logging
 import os
-import fnmatch
 import copy
 import salt.utils
 import salt.utils.platform
 
 from distutils.version import LooseVersion
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.facts as facts
 
 log = logging.getLogger(__name__)
 
+# see hubblestack.utils.incremental
+__incremental__ = True
+
 __virtualname__ = 'stat'
 
 
@@ -90,7 +94,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('stat_nova', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('service audit __data__:')
@@ -101,7 +106,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
 
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
@@ -122,8 +127,9 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                     continue
 
                 # getting the stats using salt
+                facts.note_input(('file', name))
                 if os.path.exists(name):
-                    salt_ret = __salt__['file.stats'](name)
+                    salt_ret = facts.salt_call(__salt__, 'file.stats', name)
                 else:
                     salt_ret = {}
                 if not salt_ret:
@@ -206,20 +212,7 @@ def _get_tags(data):
     for audit_dict in data.get('stat', []):
         for audit_id, audit_data in audit_dict.iteritems():
             tags_dict = audit_data.get('data', {})
-            tags = None
-            for osfinger in tags_dict:
-                if osfinger == '*':
-                    continue
-                osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                for osfinger_glob in osfinger_list:
-                    if fnmatch.fnmatch(distro, osfinger_glob):
-                        tags = tags_dict.get(osfinger)
-                        break
-                if tags is not None:
-                    break
-            # If we didn't find a match, check for a '*'
-            if tags is None:
-                tags = tags_dict.get('*', [])
+            tags = checkplan.select_target(tags_dict, distro)
             if isinstance(tags, dict):
                 # malformed yaml, convert to list of dicts
                 tmp = []
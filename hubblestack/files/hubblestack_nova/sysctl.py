@@ -29,15 +29,20 @@ sysctl:
 from __future__ import absolute_import
 import logging
 
-import fnmatch
 import copy
 import salt.utils
 import salt.utils.platform
 
 from distutils.version import LooseVersion
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.facts as facts
+import hubblestack.utils.procfs as procfs
 
 log = logging.getLogger(__name__)
 
+# see hubblestack.utils.incremental
+__incremental__ = True
+
 
 def __virtual__():
     if salt.utils.platform.is_windows():
@@ -70,7 +75,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('sysctl', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('service audit __data__:')
@@ -81,7 +87,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
 
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 passed = True
                 if 'control' in tag_data:
@@ -90,7 +96,9 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                 name = tag_data['name']
                 match_output = tag_data['match_output']
 
-                salt_ret = __salt__['sysctl.get'](name)
+                salt_ret = procfs.sysctl(name)
+                if salt_ret is None:
+                    salt_ret = facts.salt_call(__salt__, 'sysctl.get', name, cost=1)
                 if not salt_ret:
                     passed = False
                     tag_data['failure_reason'] = "Could not find attribute '{0}' in" \
@@ -135,20 +143,7 @@ def _get_tags(data):
     for audit_dict in data.get('sysctl', []):
         for audit_id, audit_data in audit_dict.iteritems():
             tags_dict = audit_data.get('data', {})
-            tags = None
-            for osfinger in tags_dict:
-                if osfinger == '*':
-                    continue
-                osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                for osfinger_glob in osfinger_list:
-                    if fnmatch.fnmatch(distro, osfinger_glob):
-                        tags = tags_dict.get(osfinger)
-                        break
-                if tags is not None:
-                    break
-            # If we didn't find a match, check for a '*'
-            if tags is None:
-                tags = tags_dict.get('*', [])
+            tags = checkplan.select_target(tags_dict, distro)
             if isinstance(tags, dict):
                 # malformed yaml, convert to list of dicts
                 tmp = []
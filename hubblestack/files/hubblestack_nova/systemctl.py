@@ -30,12 +30,14 @@ systemctl:
 from __future__ import absolute_import
 import logging
 
-import fnmatch
 import copy
 import salt.utils
 import salt.utils.platform
 
 from distutils.version import LooseVersion
+import hubblestack.utils.checkplan as checkplan
+import hubblestack.utils.facts as facts
+import hubblestack.utils.systemd as systemd
 
 log = logging.getLogger(__name__)
 
@@ -71,7 +73,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('systemctl', __data__, _get_tags, __grains__.get('osfinger'),
+                                      data_list, labels)
 
     if debug:
         log.debug('systemctl audit __data__:')
@@ -81,7 +84,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
@@ -89,7 +92,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
                 name = tag_data['name']
                 audittype = tag_data['type']
 
-                enabled = __salt__['service.enabled'](name)
+                enabled = _service_enabled(name)
                 # Blacklisted service (must not be running or not found)
                 if audittype == 'blacklist':
                     if not enabled:
@@ -112,6 +115,19 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     return ret
 
 
+def _service_enabled(name):
+    """
+    Whether the service ``name`` is enabled, answered from the run's systemd
+    unit table when possible
+    """
+    table = systemd.unit_table(__salt__)
+    if table is not None:
+        enabled = table.is_enabled(name)
+        if enabled is not None:
+            return enabled
+    return facts.salt_call(__salt__, 'service.enabled', name, cost=1)
+
+
 def _merge_yaml(ret, data, profile=None):
     """
     Merge two yaml dicts together at the systemctl:blacklist and systemctl:whitelist level
@@ -140,20 +156,7 @@ def _get_tags(data):
         for audit_dict in toplevel:
             for audit_id, audit_data in audit_dict.iteritems():
                 tags_dict = audit_data.get('data', {})
-                tags = None
-                for osfinger in tags_dict:
-                    if osfinger == '*':
-                        continue
-                    osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                    for osfinger_glob in osfinger_list:
-                        if fnmatch.fnmatch(distro, osfinger_glob):
-                            tags = tags_dict.get(osfinger)
-                            break
-                    if tags is not None:
-                        break
-                # If we didn't find a match, check for a '*'
-                if tags is None:
-                    tags = tags_dict.get('*', [])
+                tags = checkplan.select_target(tags_dict, distro)
                 # systemctl:blacklist:0:telnet:data:Debian-8
                 if isinstance(tags, dict):
                     # malformed yaml, convert to list of dicts
@@ -15,14 +15,21 @@ vulners_api_key: REDACTED
 
 It does not matter what `<random data>` is, as long as the top key of the file is named `vulners_scanner`.
 This allows the module to run under a certain profile, as all of the other Nova modules do.
+
+The audit response is cached in the minion cachedir together with a fingerprint of the installed
+packages and the OS. Runs that see the same package set reuse it instead of querying the API again,
+until it is older than ``hubblestack:nova:vulners:cache_ttl`` seconds (default 21600; 0 disables the
+cache). ``hubblestack:nova:vulners:url`` points the scanner at another audit endpoint; without it the
+vulners library is used when it's installed.
 """
 
 from __future__ import absolute_import
 import logging
 
+import os
 import sys
-import requests
-import vulners
+
+import hubblestack.utils.vulners_audit as vulners_audit
 
 
 log = logging.getLogger(__name__)
@@ -122,8 +129,24 @@ def _vulners_query(packages=None, os=None, version=None, api_key=None):
         error['data']['error'] = 'Missing the operating system version.'
         return error
 
-    vulners_api = vulners.Vulners(api_key=api_key)
-    return vulners_api.audit(str(os), str(version), packages)
+    config = __salt__['config.get']('hubblestack:nova:vulners', {}) or {}
+    if config.get('url') or not vulners_audit.HAS_VULNERS:
+        fetch = vulners_audit.HTTPFetcher(api_key=api_key,
+                                          url=config.get('url') or vulners_audit.AUDIT_URL,
+                                          timeout=config.get('timeout', 60))
+    else:
+        fetch = vulners_audit.LibraryFetcher(api_key=api_key)
+    ttl = config.get('cache_ttl', vulners_audit.DEFAULT_TTL)
+    cache_path = _audit_cache_path() if ttl else None
+    return vulners_audit.audit(packages, str(os), str(version), fetch, cache_path=cache_path, ttl=ttl)
+
+
+def _audit_cache_path():
+    """
+    Where the last audit response is cached.
+    """
+    return os.path.join(__opts__['cachedir'], 'vulners_audit.json')
+
 
 def _process_vulners(vulners):
     """
@@ -6,10 +6,10 @@ Windows auditpol audit module
 from __future__ import absolute_import
 import copy
 import csv
-import fnmatch
 import logging
 import salt.utils
 import salt.utils.platform
+import hubblestack.utils.checkplan as checkplan
 
 
 log = logging.getLogger(__name__)
@@ -52,7 +52,8 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
     for profile, data in data_list:
         _merge_yaml(__data__, data, profile)
     __data__ = apply_labels(__data__, labels)
-    __tags__ = _get_tags(__data__)
+    __tags__ = checkplan.compile_plan('win_auditpol', __data__, _get_tags, __grains__.get('osfullname'),
+                                      data_list, labels)
     __is_domain_controller__ = _is_domain_controller()
     if debug:
         log.debug('auditpol audit __data__:')
@@ -62,7 +63,7 @@ def audit(data_list, tags, labels, debug=False, **kwargs):
 
     ret = {'Success': [], 'Failure': [], 'Controlled': []}
     for tag in __tags__:
-        if fnmatch.fnmatch(tag, tags):
+        if checkplan.matches(tag, tags):
             for tag_data in __tags__[tag]:
                 if 'control' in tag_data:
                     ret['Controlled'].append(tag_data)
@@ -141,20 +142,7 @@ def _get_tags(data):
                 # secedit:whitelist:PasswordComplexity
                 tags_dict = audit_data.get('data', {})
                 # secedit:whitelist:PasswordComplexity:data
-                tags = None
-                for osfinger in tags_dict:
-                    if osfinger == '*':
-                        continue
-                    osfinger_list = [finger.strip() for finger in osfinger.split(',')]
-                    for osfinger_glob in osfinger_list:
-                        if fnmatch.fnmatch(distro, osfinger_glob):
-                            tags = tags_dict.get(osfinger)
-                            break
-                    if tags is not None:
-                        break
-                # If we didn't find a match, check for a '*'
-                if tags is None:
-                    tags = tags_dict.get('*', [])
+                tags = checkplan.select_target(tags_dict, distro)
                 # secedit:whitelist:PasswordComplexity:data:Windows 2012
                 if isinstance(tags, dict):
                     # malformed yaml, convert to list of dicts
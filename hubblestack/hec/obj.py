@@ -146,6 +146,8 @@ class HEC(object):
         self.maxByteLength = max_bytes
         self.currentByteLength = 0
         self.server_uri = []
+        # sends that no server accepted (dropped, or queued to disk)
+        self.failed_sends = 0
 
         if proxy and http_event_server_ssl:
             self.proxy = 'https://{0}'.format(proxy)
@@ -281,6 +283,7 @@ class HEC(object):
         servers = [ x for x in self.server_uri if not x.bad ]
         if not servers:
             log.error("all servers are marked 'bad', aborting send")
+            self.failed_sends += 1
             return
 
         # This logic is overly complicated originally the plan was to have the
@@ -330,8 +333,10 @@ class HEC(object):
                 return r
             elif r.status == 400 and r.reason.lower() == 'bad request':
                 log.error('message not accepted (%d %s), dropping payload: %s', r.status, r.reason, r.data)
+                self.failed_sends += 1
                 return r
 
+        self.failed_sends += 1
         # if we get here and something above thinks a queue is a good idea
         # then queue it! \o/
         if possible_queue:
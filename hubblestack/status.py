@@ -163,6 +163,7 @@ class HubbleStatus(object):
     _signaled = False
     dat = dict()
     resources = list()
+    reports = dict()
     class Stat(object):
         """ Data sample container for a named mark.
             Stat objects have the following properties
@@ -299,6 +300,13 @@ class HubbleStatus(object):
         if r not in self.dat:
             self.dat[r] = self.Stat()
 
+    def add_report(self, name, func):
+        """ include the return of func() (eg, the state of a service thread,
+            which marks can't capture) as the (namespaced) section `name` of
+            the stats() output
+        """
+        self.reports[self._namespaced(name)] = func
+
     def _namespaced(self, n):
         """ resolve `n` as a namespaced resource identifier
             e.g.: hs._namespaced('blah') → 'hubblestack.daemon.blah'
@@ -485,6 +493,11 @@ class HubbleStatus(object):
             h2['alive'] = 'warn'
         if h1['dt'] <= get_hubble_status_opt('good_time'):
             h2['alive'] = 'yes'
+        for name, func in cls.reports.items():
+            try:
+                r[name] = func()
+            except Exception as e:
+                log.debug('unable to report {0}: {1}'.format(name, e))
         return r
 
     @classmethod
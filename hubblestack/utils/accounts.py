@@ -0,0 +1,219 @@
+# -*- encoding: utf-8 -*-
+"""
+An in-process, indexed view of /etc/passwd, /etc/group and /etc/shadow.
+
+The misc account checks used to re-read these files through a shell pipeline
+each (``cat /etc/passwd | awk -F: ...``, ``cut``, ``getent``). Here each file
+is parsed once and kept until its mtime (or size or inode) changes, so every
+check in a run -- and in the runs after it, until the file is edited --
+shares one parse.
+
+.. code-block:: python
+
+    from hubblestack.utils.accounts import account_db
+
+    db = account_db()
+    db.users_by_uid('0')                 # [PasswdEntry(name='root', ...)]
+    db.duplicate_uids()
+    db.group_exists('1000')
+
+Entries are namedtuples of strings, exactly as they appear in the file
+(missing trailing fields are ''), plus the raw ``line``. Blank lines are
+skipped; NIS ``+``/``-`` lines are kept, like the pipelines saw them, and
+flagged by ``is_nis()``.
+
+A file that can't be read (e.g. /etc/shadow when hubble doesn't run as
+root) is an empty ``Unreadable`` table rather than an empty file; checks
+must not pass on it:
+
+.. code-block:: python
+
+    error = db.error('shadow')   # 'unable to read /etc/shadow: ...' or None
+    if error:
+        return error
+"""
+
+import collections
+import grp
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+__all__ = ['PasswdEntry', 'GroupEntry', 'ShadowEntry', 'AccountDB', 'Unreadable',
+           'account_db', 'is_nis', 'load_table']
+
+PasswdEntry = collections.namedtuple('PasswdEntry', 'name passwd uid gid gecos home shell line')
+GroupEntry = collections.namedtuple('GroupEntry', 'name passwd gid members line')
+ShadowEntry = collections.namedtuple('ShadowEntry',
+                                     'name passwd lastchg min max warn inactive expire reserved line')
+
+# path -> ((mtime, size, inode), [entries])
+_TABLES = {}
+# root -> ((passwd, group, shadow), AccountDB)
+_DBS = {}
+_LOCK = threading.Lock()
+
+
+class Unreadable(tuple):
+    """ the (empty) table of a file that couldn't be read """
+
+    def __new__(cls, path, error):
+        self = tuple.__new__(cls)
+        self.path = path
+        self.error = error
+        return self
+
+    def __repr__(self):
+        return '<Unreadable {0}: {1}>'.format(self.path, self.error)
+
+
+def is_nis(entry):
+    """ whether entry is a NIS compat (+/-) line """
+    return entry.name[:1] in ('+', '-')
+
+
+def _parse(lines, entry_type):
+    width = len(entry_type._fields) - 1
+    ret = []
+    for line in lines:
+        if not line.strip():
+            continue
+        fields = line.split(':')
+        if len(fields) < width:
+            fields += [''] * (width - len(fields))
+        elif len(fields) > width:
+            # extra colons belong to the last field
+            fields = fields[:width - 1] + [':'.join(fields[width - 1:])]
+        ret.append(entry_type(*(fields + [line])))
+    return ret
+
+
+def load_table(path, entry_type):
+    """ the parsed entries of a colon separated file, reparsed only when
+        the file changes; an unreadable file yields an Unreadable (empty)
+        table
+    """
+    try:
+        st = os.stat(path)
+    except OSError as exc:
+        log.debug('unable to stat %s: %s', path, exc)
+        return Unreadable(path, exc.strerror or str(exc))
+    key = (st.st_mtime, st.st_size, st.st_ino)
+    with _LOCK:
+        cached = _TABLES.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    try:
+        with open(path) as fh:
+            lines = fh.read().splitlines()
+    except (IOError, OSError) as exc:
+        log.debug('unable to read %s: %s', path, exc)
+        return Unreadable(path, exc.strerror or str(exc))
+    entries = _parse(lines, entry_type)
+    with _LOCK:
+        _TABLES[path] = (key, entries)
+    return entries
+
+
+def _index(entries, field):
+    ret = {}
+    for entry in entries:
+        ret.setdefault(getattr(entry, field), []).append(entry)
+    return ret
+
+
+def _duplicates(entries, field):
+    counts = collections.Counter(getattr(entry, field) for entry in entries)
+    return [value for value, count in counts.items() if count > 1]
+
+
+class AccountDB(object):
+    """ passwd/group/shadow entries with lookups by name, uid and gid """
+
+    def __init__(self, passwd, group, shadow):
+        self.passwd = passwd
+        self.group = group
+        self.shadow = shadow
+        self._by_user = _index(passwd, 'name')
+        self._by_uid = _index(passwd, 'uid')
+        self._by_group = _index(group, 'name')
+        self._by_gid = _index(group, 'gid')
+        self._shadow_by_user = _index(shadow, 'name')
+
+    def error(self, *tables):
+        """ why the named tables ('passwd', 'group', 'shadow') couldn't be
+            read, or None if they could
+        """
+        failed = [getattr(self, table) for table in tables
+                  if isinstance(getattr(self, table), Unreadable)]
+        if not failed:
+            return None
+        return '; '.join('unable to read {0}: {1}'.format(table.path, table.error)
+                         for table in failed)
+
+    def users(self, nis=False):
+        """ the passwd entries, without NIS lines unless nis is True """
+        return [entry for entry in self.passwd if nis or not is_nis(entry)]
+
+    def user(self, name):
+        entries = self._by_user.get(name)
+        return entries[0] if entries else None
+
+    def users_by_uid(self, uid):
+        return self._by_uid.get(str(uid), [])
+
+    def group_by_name(self, name):
+        entries = self._by_group.get(name)
+        return entries[0] if entries else None
+
+    def groups_by_gid(self, gid):
+        return self._by_gid.get(str(gid), [])
+
+    def shadow_entry(self, name):
+        entries = self._shadow_by_user.get(name)
+        return entries[0] if entries else None
+
+    def group_exists(self, key):
+        """ whether ``getent group <key>`` would succeed: key is a gid or a
+            group name, found in /etc/group or any other NSS source
+        """
+        key = str(key)
+        if not key or key in self._by_gid or key in self._by_group:
+            return True
+        try:
+            if key.isdigit():
+                grp.getgrgid(int(key))
+            else:
+                grp.getgrnam(key)
+        except (KeyError, OverflowError):
+            return False
+        return True
+
+    def duplicate_uids(self):
+        return _duplicates(self.passwd, 'uid')
+
+    def duplicate_gids(self):
+        return _duplicates(self.group, 'gid')
+
+    def duplicate_user_names(self):
+        return _duplicates(self.passwd, 'name')
+
+    def duplicate_group_names(self):
+        return _duplicates(self.group, 'name')
+
+
+def account_db(root='/etc'):
+    """ the AccountDB for the files under root (reparsed when they change) """
+    tables = (load_table(os.path.join(root, 'passwd'), PasswdEntry),
+              load_table(os.path.join(root, 'group'), GroupEntry),
+              load_table(os.path.join(root, 'shadow'), ShadowEntry))
+    with _LOCK:
+        cached = _DBS.get(root)
+        if cached is not None and all(old is new for old, new in zip(cached[0], tables)):
+            return cached[1]
+    db = AccountDB(*tables)
+    with _LOCK:
+        _DBS[root] = (tables, db)
+    return db
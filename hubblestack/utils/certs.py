@@ -0,0 +1,222 @@
+# -*- encoding: utf-8 -*-
+"""
+Concurrent, cached retrieval of TLS certificates for the openssl nova module.
+
+The openssl checks used to fetch every endpoint's certificate one after the
+other, each with ``ssl.get_server_certificate`` and no timeout of its own, so
+one unreachable host held up the whole audit. Here the endpoints are fetched
+together on a bounded WorkerPool, each with a connect/handshake timeout,
+under one deadline for the batch. Certificates (and certificate files) are
+cached between audits and only fetched (or read) again when stale.
+
+.. code-block:: python
+
+    import hubblestack.utils.certs as certs
+
+    pems = certs.fetch([('www.example.com', 443), ('10.0.0.1', 8443)],
+                       timeout=10, deadline=time.time() + 60)
+    pem = pems[('www.example.com', 443)]          # None if it failed
+    pem = certs.read_file('/etc/pki/tls/certs/server.pem')
+    x509 = certs.parsed(pem, load_pem)
+
+An endpoint's certificate is stale ``ttl`` seconds after it was fetched, or
+as soon as it expires (``expires(pem)`` returns its notAfter as an epoch; the
+server has presumably rotated it by then). A file is re-read when its inode,
+mtime or size changes. Parsed certificates are shared by fingerprint, so the
+same certificate served by several endpoints, or in a file, parses once.
+Failed fetches aren't cached.
+"""
+
+import hashlib
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+
+from hubblestack.utils.workers import WorkerPool
+
+log = logging.getLogger(__name__)
+
+__all__ = ['CachedCert', 'fetch', 'get_server_certificate', 'read_file', 'parsed',
+           'fingerprint', 'clear_cache']
+
+PARSED_CACHE_SIZE = 256
+
+# (host, port) -> CachedCert
+_ENDPOINTS = {}
+# path -> ((inode, mtime, size), pem)
+_FILES = {}
+# (fingerprint, load) -> parsed certificate
+_PARSED = {}
+_LOCK = threading.Lock()
+
+
+class CachedCert(object):
+    """ a fetched certificate and when it stops being usable """
+
+    __slots__ = ('pem', 'fingerprint', 'fetched', 'expires')
+
+    def __init__(self, pem, fetched, expires=None):
+        self.pem = pem
+        self.fingerprint = fingerprint(pem)
+        self.fetched = fetched
+        self.expires = expires
+
+    def fresh(self, ttl, now=None):
+        now = time.time() if now is None else now
+        if ttl is not None and now - self.fetched >= ttl:
+            return False
+        return self.expires is None or now < self.expires
+
+
+def fingerprint(pem):
+    """ the sha256 hex digest of a PEM certificate's DER encoding """
+    try:
+        der = ssl.PEM_cert_to_DER_cert(pem)
+    except (ValueError, TypeError):
+        der = pem.encode('utf-8') if not isinstance(pem, bytes) else pem
+    return hashlib.sha256(der).hexdigest()
+
+
+def clear_cache():
+    with _LOCK:
+        _ENDPOINTS.clear()
+        _FILES.clear()
+        _PARSED.clear()
+
+
+def get_server_certificate(host, port=443, timeout=10):
+    """ the PEM certificate the server presents, without verifying it; the
+        timeout applies to the connect and to the handshake
+    """
+    context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_CLIENT', ssl.PROTOCOL_SSLv23))
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    sock = socket.create_connection((host, port), timeout=timeout)
+    try:
+        tls = context.wrap_socket(sock, server_hostname=host)
+        try:
+            der = tls.getpeercert(binary_form=True)
+        finally:
+            tls.close()
+    finally:
+        sock.close()
+    if not der:
+        return None
+    return ssl.DER_cert_to_PEM_cert(der)
+
+
+def _fetch_one(endpoint, timeout):
+    host, port = endpoint
+    try:
+        return get_server_certificate(host, port, timeout=timeout)
+    except Exception as exc:
+        log.error('Unable to retrieve certificate from %s:%s: %s', host, port, exc)
+        return None
+
+
+def fetch(endpoints, timeout=10, deadline=None, max_workers=8, ttl=3600, expires=None):
+    """ the PEM certificates of (host, port) endpoints, fetched concurrently
+
+        timeout
+            seconds each endpoint may take (connect plus handshake)
+        deadline
+            time.time() by which the whole batch has to be done; endpoints
+            still outstanding then count as failed
+        ttl
+            seconds a fetched certificate is reused for
+        expires
+            func(pem) -> the certificate's notAfter as an epoch (or None);
+            a certificate isn't reused past it
+
+        Returns {(host, port): pem or None}.
+    """
+    now = time.time()
+    ret = {}
+    todo = []
+    with _LOCK:
+        for endpoint in endpoints:
+            endpoint = (endpoint[0], int(endpoint[1]))
+            if endpoint in ret or endpoint in todo:
+                continue
+            cached = _ENDPOINTS.get(endpoint)
+            if cached is not None and cached.fresh(ttl, now):
+                ret[endpoint] = cached.pem
+            else:
+                todo.append(endpoint)
+    if not todo:
+        return ret
+    log.debug('fetching %d certificates (%d cached)', len(todo), len(ret))
+
+    with WorkerPool(max_workers=min(max_workers, len(todo)), name='hubble-certs') as pool:
+        tasks = [pool.submit(_fetch_one, endpoint, timeout) for endpoint in todo]
+        for endpoint, task in zip(todo, tasks):
+            if not task.join(timeout=timeout, deadline=deadline):
+                # abandoned; its socket timeout will end it eventually
+                task.cancel()
+                log.error('Unable to retrieve certificate from %s:%s: %s', endpoint[0], endpoint[1],
+                          'audit deadline reached' if deadline and time.time() >= deadline
+                          else 'timed out after {0}s'.format(timeout))
+                ret[endpoint] = None
+                continue
+            pem = task.value
+            ret[endpoint] = pem
+            if pem:
+                cached = CachedCert(pem, time.time(), _expires(expires, pem))
+                with _LOCK:
+                    _ENDPOINTS[endpoint] = cached
+    return ret
+
+
+def _expires(expires, pem):
+    if expires is None:
+        return None
+    try:
+        return expires(pem)
+    except Exception:
+        log.debug('unable to get the expiry of a certificate', exc_info=True)
+        return None
+
+
+def read_file(path):
+    """ the contents of a certificate file, re-read only when it changes;
+        None if it can't be read
+    """
+    try:
+        st = os.stat(path)
+        key = (st.st_ino, st.st_mtime, st.st_size)
+    except OSError as exc:
+        log.error('File not found: %s (%s)', path, exc)
+        return None
+    with _LOCK:
+        cached = _FILES.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    try:
+        with open(path) as fh:
+            pem = fh.read()
+    except (IOError, OSError) as exc:
+        log.error('File not found: %s (%s)', path, exc)
+        return None
+    with _LOCK:
+        _FILES[path] = (key, pem)
+    return pem
+
+
+def parsed(pem, load):
+    """ load(pem), shared between every caller with the same certificate """
+    if not pem:
+        return None
+    key = (fingerprint(pem), load)
+    with _LOCK:
+        if key in _PARSED:
+            return _PARSED[key]
+    value = load(pem)
+    if value is not None:
+        with _LOCK:
+            if len(_PARSED) >= PARSED_CACHE_SIZE:
+                _PARSED.clear()
+            _PARSED[key] = value
+    return value
@@ -0,0 +1,185 @@
+# -*- encoding: utf-8 -*-
+"""
+Compiled check plans for the nova modules.
+
+Every nova module used to turn its merged profile data into its checks on
+every audit: for each check, ``fnmatch`` of the host's osfinger against each
+target pattern of the check, then ``fnmatch`` of each tag against the tag
+filter. The same patterns were translated and matched again by every module,
+every run. Here glob patterns are translated to regexes once, which target of
+a check applies to a host is resolved once per set of targets, and a module's
+checks (its ``_get_tags`` output, the plan) are built once and kept until the
+profile files, the labels or the grain they were resolved against change.
+
+The profile files are told apart by their stamp -- path, mtime and size, as
+the nova loader saw them (see ``Profiles``) -- so looking up the plan of an
+unchanged profile costs a stat at load time, not a pass over its data. Data
+that doesn't come with a stamp is keyed on a digest of its content instead.
+
+.. code-block:: python
+
+    import hubblestack.utils.checkplan as checkplan
+
+    def _get_tags(data):
+        ...
+        tags = checkplan.select_target(tags_dict, __grains__.get('osfinger'))
+        ...
+
+    __tags__ = checkplan.compile_plan('grep', __data__, _get_tags,
+                                      __grains__.get('osfinger'), data_list, labels)
+    for tag in __tags__:
+        if checkplan.matches(tag, tags):
+            ...
+
+A plan is kept serialized, so every audit gets its own copy of the checks to
+annotate (``failure_reason``, ...) without touching the cached one.
+"""
+
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+log = logging.getLogger(__name__)
+
+__all__ = ['glob_regex', 'matches', 'select_target', 'compile_plan', 'clear_cache',
+           'Profiles', 'file_stamp']
+
+MATCH_CACHE_SIZE = 16384
+
+# pattern -> compiled regex
+_REGEXES = {}
+# (name, pattern) -> bool
+_MATCHES = {}
+# (target keys, distro) -> the matching key, or None for '*'
+_TARGETS = {}
+# (module, distro) -> (profile stamp or data digest, pickled plan)
+_PLANS = {}
+_LOCK = threading.Lock()
+
+
+def clear_cache():
+    with _LOCK:
+        _REGEXES.clear()
+        _MATCHES.clear()
+        _TARGETS.clear()
+        _PLANS.clear()
+
+
+def glob_regex(pattern):
+    """ the compiled regex of a glob pattern, as fnmatch.fnmatch applies it """
+    regex = _REGEXES.get(pattern)
+    if regex is None:
+        regex = re.compile(fnmatch.translate(os.path.normcase(pattern)))
+        with _LOCK:
+            if len(_REGEXES) >= MATCH_CACHE_SIZE:
+                _REGEXES.clear()
+            _REGEXES[pattern] = regex
+    return regex
+
+
+def matches(name, pattern):
+    """ fnmatch.fnmatch(name, pattern), remembered for the pair """
+    key = (name, pattern)
+    ret = _MATCHES.get(key)
+    if ret is None:
+        ret = glob_regex(pattern).match(os.path.normcase(name)) is not None
+        with _LOCK:
+            if len(_MATCHES) >= MATCH_CACHE_SIZE:
+                _MATCHES.clear()
+            _MATCHES[key] = ret
+    return ret
+
+
+def _target_key(targets, distro):
+    """ the first target key with a comma-separated glob matching distro """
+    distro = distro or ''
+    for target in targets:
+        if target == '*':
+            continue
+        for target_glob in target.split(','):
+            if matches(distro, target_glob.strip()):
+                return target
+    return None
+
+
+def select_target(tags_dict, distro):
+    """ the checks of tags_dict for distro: those under the first key with a
+        matching glob (keys are comma-separated osfinger globs), or those
+        under '*' if none matches
+    """
+    targets = tuple(target for target in tags_dict
+                    if target != '*' and tags_dict[target] is not None)
+    key = (targets, distro)
+    if key in _TARGETS:
+        target = _TARGETS[key]
+    else:
+        target = _target_key(targets, distro)
+        with _LOCK:
+            if len(_TARGETS) >= MATCH_CACHE_SIZE:
+                _TARGETS.clear()
+            _TARGETS[key] = target
+    if target is None:
+        return tags_dict.get('*', [])
+    return tags_dict[target]
+
+
+class Profiles(list):
+    """ the ``[(profile, data), ...]`` handed to the nova modules, with the
+        stamp of the profile files they were loaded from (a tuple of
+        ``file_stamp``, in order), or None if one of them has none
+    """
+
+    def __init__(self, entries=(), stamp=None):
+        super(Profiles, self).__init__(entries)
+        self.stamp = stamp
+
+
+def file_stamp(path):
+    """ (path, mtime, size) of a profile file, None if it can't be stat'd """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_mtime, st.st_size)
+
+
+def _digest(data):
+    blob = json.dumps(data, sort_keys=True, default=repr)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def compile_plan(module, data, build, distro, profiles=None, labels=None):
+    """ build(data) -- a module's ``{tag: [check, ...]}`` -- built only when
+        the profiles data was merged from (their stamp, or data itself if
+        they have none), labels or distro changed since module's last plan;
+        each call gets its own copy of the checks
+    """
+    stamp = getattr(profiles, 'stamp', None)
+    if stamp is not None:
+        key = (stamp, tuple(labels or ()))
+    else:
+        key = _digest(data)
+    with _LOCK:
+        cached = _PLANS.get((module, distro))
+    if cached is not None and cached[0] == key:
+        return pickle.loads(cached[1])
+    plan = build(data)
+    try:
+        blob = pickle.dumps(plan, pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        log.debug('check plan of %s can not be cached', module, exc_info=True)
+        return plan
+    with _LOCK:
+        _PLANS[(module, distro)] = (key, blob)
+    log.debug('compiled the %s check plan: %d tags, %d checks', module, len(plan),
+              sum(len(checks) for checks in plan.values()))
+    return pickle.loads(blob)
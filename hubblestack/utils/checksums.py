@@ -0,0 +1,268 @@
+# -*- encoding: utf-8 -*-
+"""
+A checksum service for pulsar.
+
+Pulsar used to call ``file.get_hash`` for every qualifying event, hashing
+the whole file inside the sweep -- a multi-GB file being appended to was
+read end to end on every write -- and kept the results in an unbounded dict.
+Here checksums are kept in a bounded LRU keyed by what identifies a version
+of a file, ``(dev, inode, size, mtime_ns, ctime_ns)``, so an unchanged file
+(or another link to it) isn't hashed again. Small files are hashed inline;
+larger ones on a bounded WorkerPool, and the caller waits for them only
+until its deadline -- a hash that isn't done by then is reported as
+``pending`` and picked up from the cache by a later event. Files over
+``size_cap`` are skipped, or, with
+``sample``, hashed from a few blocks spread over the file.
+
+.. code-block:: python
+
+    import hubblestack.utils.checksums as checksums
+
+    service = checksums.ChecksumService(max_entries=10000, max_workers=2)
+    res = service.checksum('/var/log/messages', 'sha256', deadline=time.time() + 0.5)
+    if res.checksum:
+        res.checksum, res.checksum_type, res.previous, res.cached
+    elif res.pending:
+        pass  # still hashing in the background
+    service.stats()   # {'hits': 10, 'misses': 2, 'bytes_hashed': 1048576, ...}
+
+Options (pulsar reads them from the ``checksum_cache`` section of its config):
+
+max_entries
+    checksums kept (default 10000)
+max_workers
+    threads hashing large files (default 2)
+inline_size
+    files up to this size are hashed in the caller (default 1MB)
+size_cap
+    files over this size aren't hashed in full (default 100MB)
+sample
+    hash files over size_cap from ``sample_blocks`` blocks of ``sample_size``
+    bytes (and their size) instead of skipping them; the checksum type is
+    then reported as e.g. ``sha256-sampled``
+"""
+
+import collections
+import hashlib
+import logging
+import os
+import stat
+import threading
+import time
+
+from hubblestack.utils.workers import Task, WorkerPool
+
+log = logging.getLogger(__name__)
+
+__all__ = ['ChecksumService', 'Checksum', 'file_key', 'hash_file']
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_MAX_WORKERS = 2
+DEFAULT_INLINE_SIZE = 1024 * 1024
+DEFAULT_SIZE_CAP = 104857600
+DEFAULT_SAMPLE_SIZE = 1024 * 1024
+DEFAULT_SAMPLE_BLOCKS = 8
+CHUNK_SIZE = 65536
+
+Checksum = collections.namedtuple('Checksum', 'checksum checksum_type previous cached pending')
+_NONE = Checksum(None, None, None, False, False)
+_PENDING = Checksum(None, None, None, False, True)
+
+
+def _ns(st, name):
+    value = getattr(st, name + '_ns', None)
+    if value is None:
+        value = int(getattr(st, name) * 1000000000)
+    return value
+
+
+def file_key(st):
+    """ what identifies a version of a file: (dev, inode, size, mtime_ns, ctime_ns) """
+    return (st.st_dev, st.st_ino, st.st_size, _ns(st, 'st_mtime'), _ns(st, 'st_ctime'))
+
+
+def hash_file(path, hash_type, size=None, sample_size=None, sample_blocks=None):
+    """ the hex digest of the file and the bytes read; with sample_size,
+        of sample_blocks blocks spread evenly over the file and its size
+    """
+    digest = hashlib.new(hash_type)
+    read = 0
+    with open(path, 'rb') as fh:
+        if sample_size is None:
+            while True:
+                chunk = fh.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                read += len(chunk)
+        else:
+            size = os.fstat(fh.fileno()).st_size if size is None else size
+            blocks = max(int(sample_blocks or 1), 1)
+            step = max((size - sample_size) // max(blocks - 1, 1), 0)
+            digest.update(str(size).encode())
+            for i in range(blocks):
+                fh.seek(min(i * step, max(size - sample_size, 0)))
+                chunk = fh.read(sample_size)
+                digest.update(chunk)
+                read += len(chunk)
+    return digest.hexdigest(), read
+
+
+class ChecksumService(object):
+    """ cached, deadline bounded file checksums """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_workers=DEFAULT_MAX_WORKERS,
+                 inline_size=DEFAULT_INLINE_SIZE, size_cap=DEFAULT_SIZE_CAP, sample=False,
+                 sample_size=DEFAULT_SAMPLE_SIZE, sample_blocks=DEFAULT_SAMPLE_BLOCKS):
+        self.cache = collections.OrderedDict()   # (hash_type, file_key) -> checksum
+        self.last = collections.OrderedDict()    # path -> last checksum reported
+        self.running = {}                        # path -> Task
+        self.pool = None
+        self.counts = collections.defaultdict(int)
+        self._lock = threading.Lock()
+        self.configure(max_entries, max_workers, inline_size, size_cap, sample,
+                       sample_size, sample_blocks)
+
+    def configure(self, max_entries=DEFAULT_MAX_ENTRIES, max_workers=DEFAULT_MAX_WORKERS,
+                  inline_size=DEFAULT_INLINE_SIZE, size_cap=DEFAULT_SIZE_CAP, sample=False,
+                  sample_size=DEFAULT_SAMPLE_SIZE, sample_blocks=DEFAULT_SAMPLE_BLOCKS):
+        self.max_entries = max(int(max_entries), 1)
+        self.inline_size = int(inline_size)
+        self.size_cap = int(size_cap)
+        self.sample = bool(sample)
+        self.sample_size = max(int(sample_size), 1)
+        self.sample_blocks = max(int(sample_blocks), 1)
+        max_workers = max(int(max_workers), 1)
+        if self.pool is None or self.pool.max_workers != max_workers:
+            if self.pool is not None:
+                self.pool.shutdown()
+            self.pool = WorkerPool(max_workers=max_workers, name='pulsar-checksum')
+        with self._lock:
+            self._trim()
+
+    def _trim(self):
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+            self.counts['evicted'] += 1
+        while len(self.last) > self.max_entries:
+            self.last.popitem(last=False)
+
+    def _store(self, key, checksum):
+        with self._lock:
+            self.cache[key] = checksum
+            self._trim()
+
+    def _hash(self, path, hash_type, key, sampled):
+        """ hash the file and cache the result, unless it changed meanwhile """
+        if sampled:
+            checksum, read = hash_file(path, hash_type, key[1][2], self.sample_size,
+                                       self.sample_blocks)
+        else:
+            checksum, read = hash_file(path, hash_type)
+        with self._lock:
+            self.counts['bytes_hashed'] += read
+        try:
+            unchanged = file_key(os.stat(path)) == key[1]
+        except OSError:
+            unchanged = False
+        if unchanged:
+            self._store(key, checksum)
+        return checksum
+
+    def _remember(self, path, checksum, checksum_type, cached):
+        with self._lock:
+            previous = self.last.pop(path, None)
+            self.last[path] = checksum
+            self._trim()
+        return Checksum(checksum, checksum_type, previous, cached, False)
+
+    def checksum(self, path, hash_type='sha256', deadline=None):
+        """ the Checksum of the file at path; its checksum is None for
+            non-regular files, files skipped for their size, and hashes that
+            didn't finish by the deadline (an absolute time.time()), which
+            are pending
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return _NONE
+        if not stat.S_ISREG(st.st_mode):
+            return _NONE
+        sampled = st.st_size > self.size_cap
+        if sampled and not self.sample:
+            self.counts['skipped'] += 1
+            return _NONE
+        checksum_type = '{0}-sampled'.format(hash_type) if sampled else hash_type
+        key = (checksum_type, file_key(st))
+        with self._lock:
+            checksum = self.cache.get(key)
+            if checksum is not None:
+                self.cache.pop(key)
+                self.cache[key] = checksum
+        if checksum is not None:
+            self.counts['hits'] += 1
+            task = self.running.get(path)
+            if task is not None and task.done:
+                del self.running[path]
+            return self._remember(path, checksum, checksum_type, True)
+        self.counts['misses'] += 1
+
+        if st.st_size <= self.inline_size:
+            try:
+                checksum = self._hash(path, hash_type, key, sampled)
+            except (IOError, OSError, ValueError) as exc:
+                log.debug('unable to checksum %s: %s', path, exc)
+                return _NONE
+            return self._remember(path, checksum, checksum_type, False)
+
+        task = self.running.get(path)
+        if task is not None and task.args[2] != key:
+            if not task.done:
+                # still hashing an older version of the file; let that finish
+                # rather than queueing a hash per write
+                self.counts['busy'] += 1
+                return _PENDING
+            task = None
+        if task is None:
+            task = self.pool.submit_task(Task(self._hash, (path, hash_type, key, sampled),
+                                              name='checksum {0}'.format(path)))
+            self.running[path] = task
+            self.counts['background'] += 1
+        if not task.join(deadline=deadline if deadline is not None else time.time()):
+            self.counts['timeouts'] += 1
+            return _PENDING
+        del self.running[path]
+        if task.exception is not None:
+            log.debug('unable to checksum %s: %s', path, task.exception)
+            return _NONE
+        return self._remember(path, task.value, checksum_type, False)
+
+    def known(self):
+        """ the last checksum reported per path """
+        with self._lock:
+            return dict(self.last)
+
+    def prime(self, checksums):
+        """ take the last checksums of paths from elsewhere (e.g. from before
+            a restart), as if they had been reported
+        """
+        with self._lock:
+            for path, checksum in checksums.items():
+                if checksum and path not in self.last:
+                    self.last[path] = checksum
+            self._trim()
+
+    def stats(self):
+        """ hits, misses, bytes_hashed, background, timeouts, busy, skipped,
+            evicted, and the entries cached
+        """
+        ret = dict((key, 0) for key in ('hits', 'misses', 'bytes_hashed', 'background',
+                                        'timeouts', 'busy', 'skipped', 'evicted'))
+        ret.update(self.counts)
+        ret['entries'] = len(self.cache)
+        ret['running'] = sum(1 for task in self.running.values() if not task.done)
+        return ret
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
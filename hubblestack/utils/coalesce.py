@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+"""
+Coalescing of bursts of pulsar (inotify) events.
+
+A package update or a log rotation touches the same files over and over --
+IN_OPEN, IN_MODIFY, IN_CLOSE_WRITE, IN_ATTRIB -- and pulsar used to stat,
+checksum and return every one of those events as an alert of its own. An
+EventCoalescer sits between the inotify queue and the alerts and merges the
+events of a path (and move cookie) that arrive within ``window`` seconds of
+each other into one event, carrying the union of their masks and a count per
+change. An event is held back at most ``max_delay`` seconds after its first
+change, and at most ``max_pending`` paths are held at once (the oldest are
+let go early).
+
+.. code-block:: python
+
+    import hubblestack.utils.coalesce as coalesce
+
+    coalescer = coalesce.EventCoalescer(window=0.5, max_delay=5, max_pending=10000)
+    coalescer.add_all(queue)
+    for event in coalescer.ready():
+        event.pathname, event.mask, event.maskname, event.count, event.changes
+
+    coalescer.sweep_stats()  # {'raw': 40, 'emitted': 3, 'pending': 1, ...}
+
+The coalesced events have the attributes of the pyinotify events pulsar uses
+(pathname, path, name, wd, mask, maskname, cookie, dir). ``maskname`` names
+one change, as pyinotify's does for a single event (``IN_CREATE|IN_ISDIR``
+for a directory): the last create, delete or move of the path if there was
+one, else the most significant of the other changes.
+"""
+
+import collections
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+__all__ = ['EventCoalescer', 'CoalescedEvent']
+
+DEFAULT_WINDOW = 0.5
+DEFAULT_MAX_DELAY = 5
+DEFAULT_MAX_PENDING = 10000
+
+# changes that say what happened to the path itself; the last one wins
+_STRUCTURAL = ('IN_CREATE', 'IN_DELETE', 'IN_DELETE_SELF', 'IN_MOVED_FROM',
+               'IN_MOVED_TO', 'IN_MOVE_SELF')
+# the other changes, most significant first
+_CONTENT = ('IN_MODIFY', 'IN_CLOSE_WRITE', 'IN_ATTRIB', 'IN_CLOSE_NOWRITE',
+            'IN_OPEN', 'IN_ACCESS')
+# events that are passed along as they come
+_PASS = ('IN_Q_OVERFLOW', 'IN_IGNORED')
+
+
+def _names(maskname):
+    parts = (maskname or '').split('|')
+    return parts[0], 'IN_ISDIR' in parts[1:]
+
+
+class CoalescedEvent(object):
+    """ the merged events of one path and cookie """
+
+    def __init__(self, event, now):
+        self.pathname = event.pathname
+        self.path = getattr(event, 'path', None)
+        self.name = getattr(event, 'name', None)
+        self.wd = getattr(event, 'wd', None)
+        self.cookie = getattr(event, 'cookie', None)
+        self.dir = False
+        self.mask = 0
+        self.count = 0
+        self.changes = collections.OrderedDict()
+        self.structural = None
+        self.first = self.last = now
+        self.merge(event, now)
+
+    def merge(self, event, now):
+        change, isdir = _names(event.maskname)
+        self.mask |= event.mask
+        self.dir = self.dir or isdir or bool(getattr(event, 'dir', False))
+        self.count += 1
+        self.changes[change] = self.changes.get(change, 0) + 1
+        if change in _STRUCTURAL:
+            self.structural = change
+        self.wd = getattr(event, 'wd', self.wd)
+        self.last = now
+
+    @property
+    def maskname(self):
+        change = self.structural
+        if change is None:
+            for name in _CONTENT:
+                if name in self.changes:
+                    change = name
+                    break
+            else:
+                change = next(iter(self.changes))
+        if self.dir:
+            return '{0}|IN_ISDIR'.format(change)
+        return change
+
+    def __repr__(self):
+        return '<CoalescedEvent {0} {1} x{2}>'.format(self.pathname, self.maskname, self.count)
+
+
+class EventCoalescer(object):
+    """ holds events back to merge them per (pathname, cookie) """
+
+    def __init__(self, window=DEFAULT_WINDOW, max_delay=DEFAULT_MAX_DELAY,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.pending = collections.OrderedDict()
+        self.released = collections.deque()
+        self.configure(window, max_delay, max_pending)
+        self.totals = {'raw': 0, 'emitted': 0, 'evicted': 0}
+        self._sweep = dict(self.totals)
+
+    def configure(self, window=DEFAULT_WINDOW, max_delay=DEFAULT_MAX_DELAY,
+                  max_pending=DEFAULT_MAX_PENDING):
+        """ window=None passes the events along as they come """
+        self.window = None if window is None else max(float(window), 0)
+        self.max_delay = max(float(max_delay), self.window or 0)
+        self.max_pending = max(int(max_pending), 1)
+
+    def _count(self, key, amount=1):
+        self.totals[key] += amount
+        self._sweep[key] += amount
+
+    def add(self, event, now=None):
+        """ take in one raw event """
+        now = time.time() if now is None else now
+        self._count('raw')
+        change, _ = _names(event.maskname)
+        if self.window is None or change in _PASS or not getattr(event, 'pathname', None):
+            self.released.append(event)
+            return
+        cookie = getattr(event, 'cookie', None) or 0
+        key = (event.pathname, cookie)
+        entry = self.pending.get(key)
+        if entry is not None:
+            entry.merge(event, now)
+            return
+        while len(self.pending) >= self.max_pending:
+            _, oldest = self.pending.popitem(last=False)
+            self.released.append(oldest)
+            self._count('evicted')
+        self.pending[key] = CoalescedEvent(event, now)
+
+    def add_all(self, queue, now=None):
+        """ take in (and empty) a deque of raw events """
+        now = time.time() if now is None else now
+        while queue:
+            self.add(queue.popleft(), now)
+
+    def ready(self, now=None):
+        """ the events whose window closed, or that waited max_delay; all of
+            them once the window is turned off
+        """
+        now = time.time() if now is None else now
+        ret = list(self.released)
+        self.released.clear()
+        for key in [key for key, entry in self.pending.items()
+                    if self.window is None or now - entry.last >= self.window
+                    or now - entry.first >= self.max_delay]:
+            ret.append(self.pending.pop(key))
+        self._count('emitted', len(ret))
+        return ret
+
+    def flush(self):
+        """ every event held, ready or not """
+        ret = list(self.released) + list(self.pending.values())
+        self.released.clear()
+        self.pending.clear()
+        self._count('emitted', len(ret))
+        return ret
+
+    def sweep_stats(self):
+        """ the counts since the last call, and the events still held """
+        ret = dict(self._sweep)
+        ret['pending'] = len(self.pending)
+        self._sweep = dict((key, 0) for key in self._sweep)
+        return ret
+
+    def __len__(self):
+        return len(self.pending) + len(self.released)
@@ -0,0 +1,264 @@
+# -*- encoding: utf-8 -*-
+"""
+Delta-only emission of nova results.
+
+A scheduled audit used to ship every Success, Failure and Controlled check
+to the returners on every run, although from one run to the next hardly any
+of them change. In delta mode the last reported result of every check is
+kept in the cachedir and an audit only returns the transitions since then:
+
+* a check that fails now and didn't before (new or regressed)
+* a failure that is fixed
+* a check that is newly controlled (or newly passing)
+* a check that disappeared from the results (``Removed``)
+
+Every ``heartbeat`` seconds (and on the first run) the complete results are
+returned instead, so the index can always be rebuilt from the last full
+snapshot and the deltas after it. Either way the results carry an
+``Emission`` summary of the run.
+
+emit() only stages the new state next to the old one; ``commit()`` makes it
+the last reported state once the returners delivered the results. Results
+that never reach a returner (a CLI call, a failed delivery) are therefore
+reported again by the next run. This is best-effort: a returner is taken to
+have delivered the results unless it returns False, which the nova
+returners shipped here do when a post fails or is rejected (the splunk one
+when a batch isn't accepted, even if it was queued to disk). With ``show_success=False`` the successes
+are tracked but not returned -- except for the failures that got fixed, so
+those don't show up as ``Removed``.
+
+.. code-block:: python
+
+    import hubblestack.utils.emission as emission
+
+    results = emission.emit(results, emission.DeltaState(path), heartbeat=86400)
+    ...
+    # after the returners delivered them
+    emission.commit(results)
+    # in a returner, for full and delta results alike
+    for record in emission.records(data):
+        record['check_result'], record['check_id'], record['value'], record['transition']
+    summary = emission.summary(data)
+
+The results keep their usual shape -- ``{'Failure': [{check_id: value}, ...],
+...}`` -- so a returner unaware of delta mode simply sends fewer events.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+__all__ = ['DeltaState', 'emit', 'commit', 'records', 'summary', 'check_key', 'MODES',
+           'RESULTS']
+
+MODES = ('full', 'delta')
+RESULTS = ('Failure', 'Success', 'Controlled')
+STATE_VERSION = 1
+DEFAULT_HEARTBEAT = 86400
+
+# the fields that tell apart the checks sharing a tag in verbose results
+_TARGET_FIELDS = ('module', 'nova_profile', 'name', 'type')
+
+
+def check_key(check_id, value):
+    """ what identifies a check across runs: its id and, in verbose results,
+        its target; terse results have one result per id, the first of
+        Failure, Success and Controlled listing it
+    """
+    target = None
+    if isinstance(value, dict):
+        target = [value.get(field) for field in _TARGET_FIELDS]
+    return json.dumps([check_id, target], sort_keys=True, default=repr)
+
+
+def _entries(results):
+    for result in RESULTS:
+        for item in results.get(result) or []:
+            if isinstance(item, dict) and len(item) == 1:
+                check_id, value = next(iter(item.items()))
+                yield result, check_id, value
+
+
+def _transition(previous, result):
+    if previous is None:
+        return 'new'
+    if result == 'Failure':
+        return 'failed'
+    if previous == 'Failure':
+        return 'fixed'
+    return result.lower()
+
+
+class DeltaState(object):
+    """ the last reported result of every check, stored as JSON in one file;
+        the state of a run not yet delivered is staged in path.pending
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending = path + '.pending'
+        self.state = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                state = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {'checks': {}}
+        if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+            return {'checks': {}}
+        return state
+
+    @property
+    def checks(self):
+        return self.state['checks']
+
+    @property
+    def last_full(self):
+        return self.state.get('last_full')
+
+    @property
+    def runs(self):
+        return self.state.get('runs', 0)
+
+    def stage(self, checks, full, now):
+        """ write the state of this run to the pending file; True if staged """
+        state = {'version': STATE_VERSION,
+                 'runs': self.runs + 1,
+                 'last_full': now if full else self.last_full,
+                 'checks': checks}
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.nova-emission-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(state, fh)
+            os.rename(tmp, self.pending)
+        except (IOError, OSError) as exc:
+            log.warning('unable to save the nova emission state to %s: %s', self.pending, exc)
+            return False
+        return True
+
+
+def commit(data):
+    """ make the state staged by emit() for the results the last reported
+        one; call it once the results were delivered. Returns whether there
+        was a state to commit.
+    """
+    info = data.get('Emission') if isinstance(data, dict) else None
+    pending = (info or {}).get('pending')
+    if not pending:
+        return False
+    try:
+        os.rename(pending, pending[:-len('.pending')])
+    except (IOError, OSError) as exc:
+        log.warning('unable to commit the nova emission state %s: %s', pending, exc)
+        return False
+    return True
+
+
+def emit(results, state, heartbeat=DEFAULT_HEARTBEAT, now=None, show_success=True):
+    """ the results to return for this run: only the transitions since the
+        results last returned, or all of them when a heartbeat is due
+
+        The results must hold the successes; with show_success False they're
+        left out of the returned results, but for the fixed ones in delta mode.
+    """
+    now = time.time() if now is None else now
+    previous = state.checks
+    current = {}
+    delta = dict((result, []) for result in RESULTS)
+    delta['Removed'] = []
+    transitions = dict((result, []) for result in RESULTS)
+    for result, check_id, value in _entries(results):
+        key = check_key(check_id, value)
+        if key in current:
+            continue
+        current[key] = {'result': result, 'check_id': check_id, 'value': value}
+        was = previous.get(key, {}).get('result')
+        if was != result:
+            delta[result].append({check_id: value})
+            transitions[result].append(_transition(was, result))
+    for key, entry in previous.items():
+        if key not in current:
+            delta['Removed'].append({entry['check_id']: entry['value']})
+
+    last_full = state.last_full
+    full = last_full is None or (heartbeat is not None and now - last_full >= heartbeat)
+    changed = sum(len(delta[result]) for result in RESULTS) + len(delta['Removed'])
+    info = {'mode': 'full' if full else 'delta',
+            'run': state.runs + 1,
+            'checks': len(current),
+            'transitions': changed,
+            'removed': len(delta['Removed'])}
+    for result in RESULTS:
+        info[result] = sum(1 for entry in current.values() if entry['result'] == result)
+    if state.stage(current, full, now):
+        info['pending'] = state.pending
+    log.debug('nova emission: run %d, %s, %d checks, %d transitions', info['run'], info['mode'],
+              info['checks'], changed)
+
+    if not show_success:
+        fixed = [i for i, label in enumerate(transitions['Success']) if label == 'fixed']
+        delta['Success'] = [delta['Success'][i] for i in fixed]
+        transitions['Success'] = ['fixed'] * len(fixed)
+    if full:
+        ret = dict(results)
+        if not show_success:
+            ret.pop('Success', None)
+    else:
+        ret = dict((key, val) for key, val in results.items() if key not in RESULTS)
+        for result in RESULTS + ('Removed',):
+            if delta[result]:
+                ret[result] = delta[result]
+        info['transition'] = dict((result, transitions[result]) for result in RESULTS
+                                  if transitions[result])
+    ret['Emission'] = info
+    return ret
+
+
+def records(data):
+    """ yield a dict per check to report, with its check_result, check_id,
+        value and transition ('new', 'failed', 'fixed', 'success',
+        'controlled', 'removed', or None for full results)
+
+        Full results report their failures and successes, delta results
+        every transition.
+    """
+    info = data.get('Emission') or {}
+    transitions = info.get('transition')
+    if transitions is None:
+        reported = ('Failure', 'Success')
+        transitions = {}
+    else:
+        reported = RESULTS
+    for result in reported:
+        labels = transitions.get(result) or []
+        for i, item in enumerate(data.get(result) or []):
+            check_id = next(iter(item))
+            yield {'check_result': result,
+                   'check_id': check_id,
+                   'value': item[check_id],
+                   'transition': labels[i] if i < len(labels) else None}
+    for item in data.get('Removed') or []:
+        check_id = next(iter(item))
+        yield {'check_result': 'Removed',
+               'check_id': check_id,
+               'value': item[check_id],
+               'transition': 'removed'}
+
+
+def summary(data):
+    """ the run summary of the results, or None for results not from emit """
+    info = data.get('Emission')
+    if not info:
+        return None
+    ret = dict((key, val) for key, val in info.items() if key not in ('transition', 'pending'))
+    if 'Compliance' in data:
+        ret['compliance_percentage'] = data['Compliance']
+    return ret
@@ -0,0 +1,260 @@
+# -*- encoding: utf-8 -*-
+"""
+An event loop thread and a bounded alert queue, for running pulsar as a
+service rather than as a scheduled sweep.
+
+Scheduled every few seconds, pulsar left its events in the kernel queue
+between sweeps (where they overflow under load) and its alerts waited on
+whatever else the daemon's main loop was doing. An EventLoop is a thread of
+its own that blocks (with epoll, or select where there is none) on a file
+descriptor -- the inotify or fanotify fd -- and calls ``on_ready`` as soon
+as it is readable, and ``on_tick`` every ``interval`` seconds for the
+periodic work (config refreshes, watch updates, releasing coalesced
+events). The alerts go to an AlertQueue, which the main loop drains to the
+returners.
+
+.. code-block:: python
+
+    import hubblestack.utils.eventloop as eventloop
+
+    alerts = eventloop.AlertQueue(max_size=10000)
+    loop = eventloop.EventLoop(fd, on_ready, on_tick, interval=1, name='pulsar')
+    loop.start()
+    ...
+    for alert in alerts.get_all():   # in the main loop
+        ...
+    alerts.stats()   # {'queued': 0, 'dropped': 0, 'latency': {'avg': 0.02, ...}, ...}
+    loop.stop()
+
+The queue pushes back on its producer: a ``put()`` into a full queue waits
+for the consumer to make room, while the loop thread leaves its events in
+the kernel queue -- where an overflow is reported by the kernel
+(IN_Q_OVERFLOW) rather than alerts being lost silently. Dropping is opt-in:
+with ``block`` set to a number of seconds, a put waits at most that long
+and then drops the oldest alerts, counting them. The latency reported is
+the time from the ``arrived`` time given to ``put()`` to the alert being
+handed out.
+"""
+
+import collections
+import errno
+import logging
+import os
+import select
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+__all__ = ['EventLoop', 'AlertQueue']
+
+DEFAULT_INTERVAL = 1
+DEFAULT_MAX_SIZE = 10000
+# wait for room as long as it takes
+DEFAULT_BLOCK = None
+# latencies kept for the percentiles
+LATENCY_SAMPLES = 1000
+
+
+class AlertQueue(object):
+    """ a bounded FIFO of alerts and their arrival times """
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, block=DEFAULT_BLOCK):
+        self.items = collections.deque()
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.counts = dict((key, 0) for key in ('put', 'delivered', 'dropped', 'overflows',
+                                                'blocked'))
+        self.latency_max = 0
+        self.latency_total = 0
+        self._cond = threading.Condition()
+        self.configure(max_size, block)
+
+    def configure(self, max_size=DEFAULT_MAX_SIZE, block=DEFAULT_BLOCK):
+        self.max_size = max(int(max_size), 1)
+        self.block = None if block is None else max(float(block), 0)
+
+    def put(self, alerts, arrived=None):
+        """ queue the alerts, waiting for room (up to block seconds, unless
+            block is None); returns the number of (the oldest) alerts dropped
+            to make room
+        """
+        alerts = list(alerts)
+        if not alerts:
+            return 0
+        arrived = time.time() if arrived is None else arrived
+        with self._cond:
+            if len(self.items) + len(alerts) > self.max_size:
+                self.counts['blocked'] += 1
+                if self.block is None:
+                    # a batch larger than max_size goes into an empty queue
+                    while self.items and len(self.items) + len(alerts) > self.max_size:
+                        self._cond.wait()
+                else:
+                    deadline = time.time() + self.block
+                    while len(self.items) + len(alerts) > self.max_size:
+                        left = deadline - time.time()
+                        if left <= 0:
+                            break
+                        self._cond.wait(left)
+            self.items.extend((arrived, alert) for alert in alerts)
+            dropped = 0
+            if self.block is not None:
+                dropped = max(len(self.items) - self.max_size, 0)
+            for _ in range(dropped):
+                self.items.popleft()
+            self.counts['put'] += len(alerts)
+            if dropped:
+                self.counts['dropped'] += dropped
+                self.counts['overflows'] += 1
+        if dropped:
+            log.warning('alert queue full; dropped the %d oldest alerts', dropped)
+        return dropped
+
+    def get_all(self, max_items=None, now=None):
+        """ take (up to max_items of) the queued alerts, oldest first """
+        with self._cond:
+            count = len(self.items) if max_items is None else min(int(max_items), len(self.items))
+            taken = [self.items.popleft() for _ in range(count)]
+            self._cond.notify_all()
+        if not taken:
+            return []
+        now = time.time() if now is None else now
+        for arrived, _ in taken:
+            latency = max(now - arrived, 0)
+            self.latencies.append(latency)
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+        self.counts['delivered'] += len(taken)
+        return [alert for _, alert in taken]
+
+    def stats(self):
+        """ the counts, the alerts queued, and the latency of the alerts
+            handed out (avg and max over all, p50 and p95 of the recent ones)
+        """
+        ret = dict(self.counts)
+        ret['queued'] = len(self.items)
+        ret['max_size'] = self.max_size
+        recent = sorted(self.latencies)
+        latency = {'avg': self.latency_total / self.counts['delivered']
+                          if self.counts['delivered'] else 0,
+                   'max': self.latency_max, 'p50': 0, 'p95': 0}
+        if recent:
+            latency['p50'] = recent[len(recent) // 2]
+            latency['p95'] = recent[min(int(len(recent) * 0.95), len(recent) - 1)]
+        ret['latency'] = latency
+        return ret
+
+    def __len__(self):
+        return len(self.items)
+
+
+class _Poller(object):
+    """ waits for a file descriptor (or the wakeup pipe) to be readable """
+
+    def __init__(self, fileno):
+        self.fileno = fileno
+        self.pipe = os.pipe()
+        if hasattr(select, 'epoll'):
+            self.epoll = select.epoll()
+            self.epoll.register(fileno, select.EPOLLIN)
+            self.epoll.register(self.pipe[0], select.EPOLLIN)
+        else:
+            self.epoll = None
+
+    def wait(self, timeout):
+        """ whether the descriptor is readable, within timeout seconds """
+        try:
+            if self.epoll is not None:
+                ready = [fd for fd, _ in self.epoll.poll(max(timeout, 0))]
+            else:
+                ready, _, _ = select.select([self.fileno, self.pipe[0]], [], [], max(timeout, 0))
+        except (IOError, OSError, select.error) as exc:
+            if getattr(exc, 'errno', None) == errno.EINTR or exc.args[0] == errno.EINTR:
+                return False
+            raise
+        if self.pipe[0] in ready:
+            os.read(self.pipe[0], 512)
+        return self.fileno in ready
+
+    def wakeup(self):
+        os.write(self.pipe[1], b'x')
+
+    def close(self):
+        if self.epoll is not None:
+            self.epoll.close()
+        for fd in self.pipe:
+            os.close(fd)
+
+
+class EventLoop(object):
+    """ a thread calling on_ready(now) when fileno is readable and
+        on_tick(now) every interval seconds (first thing, too)
+    """
+
+    def __init__(self, fileno, on_ready, on_tick=None, interval=DEFAULT_INTERVAL,
+                 name='event-loop'):
+        self.fileno = fileno
+        self.on_ready = on_ready
+        self.on_tick = on_tick
+        self.interval = max(float(interval), 0.01)
+        self.name = name
+        self.counts = dict((key, 0) for key in ('wakeups', 'ticks', 'errors'))
+        self.started = None
+        self._stopping = threading.Event()
+        self._thread = None
+        self._poller = None
+
+    @property
+    def alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.alive:
+            return
+        self._stopping.clear()
+        self._poller = _Poller(self.fileno)
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self.started = time.time()
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """ stop the thread (after the call in progress); returns whether it stopped """
+        if self._thread is None:
+            return True
+        self._stopping.set()
+        self._poller.wakeup()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            return False
+        self._poller.close()
+        self._thread = self._poller = None
+        return True
+
+    def _call(self, func, count):
+        self.counts[count] += 1
+        try:
+            func(time.time())
+        except Exception:
+            self.counts['errors'] += 1
+            log.exception('%s: %s failed', self.name, count)
+            # don't spin on a descriptor that stays readable
+            self._stopping.wait(self.interval)
+
+    def _run(self):
+        next_tick = time.time()
+        while not self._stopping.is_set():
+            now = time.time()
+            if self.on_tick is not None and now >= next_tick:
+                self._call(self.on_tick, 'ticks')
+                next_tick = time.time() + self.interval
+                continue
+            timeout = next_tick - now if self.on_tick is not None else self.interval
+            if self._poller.wait(timeout) and not self._stopping.is_set():
+                self._call(self.on_ready, 'wakeups')
+
+    def stats(self):
+        ret = dict(self.counts)
+        ret['alive'] = self.alive
+        ret['uptime'] = time.time() - self.started if self.started else 0
+        return ret
@@ -0,0 +1,277 @@
+# -*- encoding: utf-8 -*-
+"""
+Run-scoped host fact snapshots.
+
+Within a single ``hubble.top`` (or ``audit.top``/``fdg.top``) run the same
+host facts are gathered over and over: ``pkg.version`` per pkg check,
+``file.stats`` per stat check, ``sysctl.get`` per key, ``/etc/passwd`` and
+``/proc/mounts`` in most of the misc checks. Many of those are a subprocess
+each.
+
+A FactSnapshot lazily collects and memoizes such facts. The audit entry points
+open a run with ``run_scope()`` (runs nest, so ``hubble.top`` calling
+``hubble.audit`` shares one snapshot) and the snapshot is dropped when the
+outermost run ends. Outside of a run ``snapshot()`` hands out a throwaway
+snapshot, so callers never need to care whether they're inside one.
+
+.. code-block:: python
+
+    import hubblestack.utils.facts as facts
+
+    with facts.run_scope():
+        stats = facts.salt_call(__salt__, 'file.stats', '/etc/passwd')
+        passwd = facts.file_lines('/etc/passwd')
+
+Facts must be treated as read-only by callers; they're shared.
+"""
+
+import collections
+import logging
+import threading
+import time
+from functools import wraps
+
+log = logging.getLogger(__name__)
+
+__all__ = ['FactSnapshot', 'run_scope', 'start_run', 'end_run', 'snapshot',
+           'salt_call', 'file_lines', 'recording', 'note_input',
+           'LAST_RUN']
+
+# stats of the most recently finished run (see FactSnapshot.stats)
+LAST_RUN = {}
+
+_STATE_LOCK = threading.RLock()
+_CURRENT = None
+_DEPTH = 0
+# per thread: the recorder the facts asked for are reported to (see recording)
+_RECORDING = threading.local()
+
+
+class FactSnapshot(object):
+    """ A memo of host facts
+
+        get(key, collector) returns the memoized value for key, calling
+        collector() the first time. ``cost`` is the number of subprocesses a
+        collection spawns, which is what a cache hit saves; 0 for facts
+        collected in-process.
+    """
+
+    def __init__(self):
+        self.facts = {}
+        self.started = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.subprocesses = 0
+        self.subprocesses_saved = 0
+        # subprocesses run, by kind of fact (see _kind)
+        self.forks = collections.Counter()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def get(self, key, collector, cost=0):
+        """ return the fact named by key, collecting it if necessary
+
+            Concurrent callers asking for the same key wait for a single
+            collection rather than racing.
+        """
+        note_input(key)
+        try:
+            value = self.facts[key]
+        except KeyError:
+            pass
+        else:
+            self._count_hit(cost)
+            return value
+        with self._key_lock(key):
+            if key in self.facts:
+                self._count_hit(cost)
+                return self.facts[key]
+            value = collector()
+            with self._lock:
+                self.misses += 1
+                self.subprocesses += cost
+                if cost:
+                    self.forks[_kind(key)] += cost
+                self.facts[key] = value
+            return value
+
+    def _count_hit(self, cost):
+        with self._lock:
+            self.hits += 1
+            self.subprocesses_saved += cost
+
+    def count(self, kind, forks=1):
+        """ record subprocesses a caller ran outside of the snapshot """
+        with self._lock:
+            self.subprocesses += forks
+            self.forks[kind] += forks
+
+    def invalidate(self, key=None):
+        """ forget one fact (or all of them) """
+        with self._lock:
+            if key is None:
+                self.facts.clear()
+            else:
+                self.facts.pop(key, None)
+
+    def stats(self):
+        """ counters describing this snapshot's work """
+        return {'facts': len(self.facts),
+                'hits': self.hits,
+                'misses': self.misses,
+                'subprocesses': self.subprocesses,
+                'subprocesses_saved': self.subprocesses_saved,
+                'forks': dict(self.forks),
+                'duration': time.time() - self.started}
+
+
+def _kind(key):
+    """ what a fact key counts as in the fork statistics: the salt function
+        for salt_call facts, the key's leading name otherwise
+    """
+    if isinstance(key, tuple) and key:
+        if key[0] == 'salt' and len(key) > 1:
+            return key[1]
+        return key[0]
+    return key
+
+
+def start_run():
+    """ begin (or join) a run; returns the run's snapshot """
+    global _CURRENT, _DEPTH
+    with _STATE_LOCK:
+        if _CURRENT is None:
+            _CURRENT = FactSnapshot()
+        _DEPTH += 1
+        return _CURRENT
+
+
+def end_run():
+    """ leave a run; when the outermost run ends the snapshot is dropped and
+        its statistics are logged and kept in LAST_RUN
+    """
+    global _CURRENT, _DEPTH
+    with _STATE_LOCK:
+        if _DEPTH <= 0:
+            return
+        _DEPTH -= 1
+        if _DEPTH:
+            return
+        finished, _CURRENT = _CURRENT, None
+    stats = finished.stats()
+    LAST_RUN.clear()
+    LAST_RUN.update(stats)
+    log.info('fact snapshot: %d facts, %d hits, %d subprocesses run, %d subprocesses saved',
+             stats['facts'], stats['hits'], stats['subprocesses'], stats['subprocesses_saved'])
+    log.debug('fact snapshot subprocesses by kind: %s',
+              ', '.join('{0}={1}'.format(kind, forks)
+                        for kind, forks in sorted(stats['forks'].items())) or 'none')
+    return stats
+
+
+class run_scope(object):
+    """ context manager / decorator marking a run
+
+        .. code-block:: python
+
+            @facts.run_scope()
+            def top(...):
+                ...
+    """
+
+    def __enter__(self):
+        return start_run()
+
+    def __exit__(self, *exc):
+        end_run()
+        return False
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return inner
+
+
+class recording(object):
+    """ context manager reporting the key of every fact asked for in this
+        thread (hits included) to ``recorder.note(key)``, and anything else
+        a caller reads through note_input()
+
+        This is how the incremental audit learns what a module's results
+        depend on (see hubblestack.utils.incremental).
+    """
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.previous = None
+
+    def __enter__(self):
+        self.previous = getattr(_RECORDING, 'recorder', None)
+        _RECORDING.recorder = self.recorder
+        return self.recorder
+
+    def __exit__(self, *exc):
+        _RECORDING.recorder = self.previous
+        return False
+
+
+def note_input(key):
+    """ report an input read outside of the snapshot, e.g. ('file', path), or
+        ('volatile', why) for something that can't be fingerprinted
+    """
+    recorder = getattr(_RECORDING, 'recorder', None)
+    if recorder is not None:
+        recorder.note(key)
+
+
+def snapshot():
+    """ the current run's snapshot, or a throwaway one outside of a run """
+    current = _CURRENT
+    if current is None:
+        return FactSnapshot()
+    return current
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def salt_call(salt, fun, *args, **kwargs):
+    """ memoized __salt__[fun](*args, **kwargs)
+
+        Only use this for read-only functions whose answer can't change
+        during a run (pkg.version, file.stats, sysctl.get, service.status...).
+        ``cost`` (not passed on to fun) is the number of subprocesses fun
+        spawns; it defaults to 0, for in-process lookups like file.stats.
+    """
+    cost = kwargs.pop('cost', 0)
+    key = ('salt', fun, _freeze(args), _freeze(kwargs))
+    return snapshot().get(key, lambda: salt[fun](*args, **kwargs), cost=cost)
+
+
+def file_lines(path):
+    """ the lines of a file (without line endings), read once per run; an
+        unreadable file yields an empty list
+    """
+    def collect():
+        try:
+            with open(path) as fh:
+                return fh.read().splitlines()
+        except (IOError, OSError) as exc:
+            log.debug('unable to read %s: %s', path, exc)
+            return []
+    return snapshot().get(('file_lines', path), collect)
+
@@ -0,0 +1,315 @@
+# -*- encoding: utf-8 -*-
+"""
+A minimal fanotify binding (ctypes) for pulsar's fanotify backend.
+
+inotify needs a watch per directory, so watching a large tree means walking
+it, adding tens of thousands of watches and staying under
+``fs.inotify.max_user_watches``. fanotify in FID mode (Linux 5.9+ for
+``FAN_REPORT_DFID_NAME``) marks a whole filesystem at once and reports
+creates, deletes, moves and modifications under it, naming the directory by
+file handle and the entry by name; the path is then looked up with
+open_by_handle_at. It needs CAP_SYS_ADMIN (and CAP_DAC_READ_SEARCH).
+
+.. code-block:: python
+
+    import hubblestack.utils.fanotify as fanotify
+
+    ok, reason = fanotify.available()
+    fan = fanotify.Fanotify()
+    fan.mark('/etc', fanotify.FAN_CREATE | fanotify.FAN_DELETE | fanotify.FAN_MODIFY)
+    if fan.wait(1.0):
+        for event in fan.read_events():
+            event.pathname, event.mask, event.maskname
+
+The event bits have the values of their inotify counterparts (FAN_MODIFY ==
+IN_MODIFY, FAN_ONDIR == IN_ISDIR, ...), and events are split so each carries
+one of them, with a pyinotify style ``maskname`` (``IN_CREATE|IN_ISDIR``).
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Fanotify', 'FanotifyEvent', 'available', 'parse_events']
+
+FAN_CLOEXEC = 0x1
+FAN_NONBLOCK = 0x2
+FAN_CLASS_NOTIF = 0x0
+FAN_REPORT_FID = 0x200
+FAN_REPORT_DIR_FID = 0x400
+FAN_REPORT_NAME = 0x800
+FAN_REPORT_DFID_NAME = FAN_REPORT_DIR_FID | FAN_REPORT_NAME
+
+FAN_MARK_ADD = 0x1
+FAN_MARK_REMOVE = 0x2
+FAN_MARK_FILESYSTEM = 0x100
+
+FAN_ACCESS = 0x1
+FAN_MODIFY = 0x2
+FAN_ATTRIB = 0x4
+FAN_CLOSE_WRITE = 0x8
+FAN_CLOSE_NOWRITE = 0x10
+FAN_OPEN = 0x20
+FAN_MOVED_FROM = 0x40
+FAN_MOVED_TO = 0x80
+FAN_CREATE = 0x100
+FAN_DELETE = 0x200
+FAN_DELETE_SELF = 0x400
+FAN_MOVE_SELF = 0x800
+FAN_Q_OVERFLOW = 0x4000
+FAN_ONDIR = 0x40000000
+
+FAN_EVENT_INFO_TYPE_FID = 1
+FAN_EVENT_INFO_TYPE_DFID_NAME = 2
+FAN_EVENT_INFO_TYPE_DFID = 3
+
+FAN_NOFD = -1
+O_PATH = getattr(os, 'O_PATH', 0o10000000)
+
+# the events a filesystem mark can ask for, by their inotify names, in the
+# order an event merged by the kernel is split in
+EVENT_NAMES = collections.OrderedDict([
+    (FAN_CREATE, 'IN_CREATE'), (FAN_MOVED_TO, 'IN_MOVED_TO'), (FAN_OPEN, 'IN_OPEN'),
+    (FAN_ACCESS, 'IN_ACCESS'), (FAN_MODIFY, 'IN_MODIFY'), (FAN_ATTRIB, 'IN_ATTRIB'),
+    (FAN_CLOSE_WRITE, 'IN_CLOSE_WRITE'), (FAN_CLOSE_NOWRITE, 'IN_CLOSE_NOWRITE'),
+    (FAN_MOVED_FROM, 'IN_MOVED_FROM'), (FAN_DELETE, 'IN_DELETE'),
+    (FAN_DELETE_SELF, 'IN_DELETE_SELF'), (FAN_MOVE_SELF, 'IN_MOVE_SELF')])
+FAN_ALL_EVENTS = sum(EVENT_NAMES)
+
+_METADATA = struct.Struct('=IBBHQii')
+_INFO_HEADER = struct.Struct('=BBH')
+_FID = struct.Struct('=iiIi')     # fsid[2], handle_bytes, handle_type
+_FILE_HANDLE = struct.Struct('=Ii')
+
+_LIBC = []
+
+
+def _libc():
+    if not _LIBC:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.fanotify_init.argtypes = [ctypes.c_uint, ctypes.c_uint]
+        libc.fanotify_init.restype = ctypes.c_int
+        libc.fanotify_mark.argtypes = [ctypes.c_int, ctypes.c_uint, ctypes.c_uint64,
+                                       ctypes.c_int, ctypes.c_char_p]
+        libc.fanotify_mark.restype = ctypes.c_int
+        libc.open_by_handle_at.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        libc.open_by_handle_at.restype = ctypes.c_int
+        _LIBC.append(libc)
+    return _LIBC[0]
+
+
+def _raise(what, path=None):
+    err = ctypes.get_errno()
+    raise OSError(err, '{0}: {1}'.format(what, os.strerror(err)), path)
+
+
+def _fsid(path):
+    fsid = os.statvfs(path).f_fsid
+    return (ctypes.c_int32(fsid & 0xffffffff).value, ctypes.c_int32(fsid >> 32).value)
+
+
+_AVAILABLE = []
+
+
+def available():
+    """ (whether fanotify in FID mode can be used here, why not) """
+    if not _AVAILABLE:
+        try:
+            fan = Fanotify()
+        except (OSError, AttributeError) as exc:
+            _AVAILABLE.append((False, str(exc)))
+        else:
+            fan.close()
+            _AVAILABLE.append((True, None))
+    return _AVAILABLE[0]
+
+
+def parse_events(buf):
+    """ yield (mask, pid, infos) for the events in buf; infos are
+        (info_type, fsid, handle_type, handle, name) tuples
+    """
+    offset = 0
+    while offset + _METADATA.size <= len(buf):
+        event_len, _, _, metadata_len, mask, fd, pid = _METADATA.unpack_from(buf, offset)
+        if event_len < _METADATA.size or offset + event_len > len(buf):
+            break
+        if fd >= 0:
+            os.close(fd)
+        infos = []
+        pos = offset + metadata_len
+        end = offset + event_len
+        while pos + _INFO_HEADER.size <= end:
+            info_type, _, info_len = _INFO_HEADER.unpack_from(buf, pos)
+            if info_len < _INFO_HEADER.size or pos + info_len > end:
+                break
+            if info_type in (FAN_EVENT_INFO_TYPE_FID, FAN_EVENT_INFO_TYPE_DFID_NAME,
+                             FAN_EVENT_INFO_TYPE_DFID):
+                fsid0, fsid1, handle_bytes, handle_type = _FID.unpack_from(
+                    buf, pos + _INFO_HEADER.size)
+                start = pos + _INFO_HEADER.size + _FID.size
+                handle = bytes(buf[start:start + handle_bytes])
+                name = None
+                if info_type == FAN_EVENT_INFO_TYPE_DFID_NAME:
+                    raw = bytes(buf[start + handle_bytes:pos + info_len])
+                    name = raw.split(b'\0', 1)[0].decode('utf-8', 'replace')
+                infos.append((info_type, (fsid0, fsid1), handle_type, handle, name))
+            pos += info_len
+        yield mask, pid, infos
+        offset += event_len
+
+
+class FanotifyEvent(object):
+    """ one change, with the attributes pulsar uses of pyinotify's events """
+
+    def __init__(self, mask, pathname, pid=None):
+        self.mask = mask
+        self.pathname = pathname
+        self.path, self.name = os.path.split(pathname) if pathname else (None, None)
+        self.dir = bool(mask & FAN_ONDIR)
+        self.pid = pid
+        self.cookie = 0
+        self.wd = None
+
+    @property
+    def maskname(self):
+        if self.mask & FAN_Q_OVERFLOW:
+            return 'IN_Q_OVERFLOW'
+        names = [name for bit, name in EVENT_NAMES.items() if self.mask & bit]
+        if self.dir:
+            names.append('IN_ISDIR')
+        return '|'.join(names)
+
+    def __repr__(self):
+        return '<FanotifyEvent {0} {1}>'.format(self.pathname, self.maskname)
+
+
+class Fanotify(object):
+    """ a fanotify group reporting directory handles and entry names, with
+        filesystem marks
+    """
+
+    def __init__(self, flags=FAN_CLASS_NOTIF | FAN_CLOEXEC | FAN_NONBLOCK | FAN_REPORT_DFID_NAME,
+                 buffer_size=65536):
+        self.fd = _libc().fanotify_init(flags, os.O_RDONLY | getattr(os, 'O_LARGEFILE', 0))
+        if self.fd < 0:
+            _raise('fanotify_init')
+        self.buffer_size = buffer_size
+        self.marks = {}      # st_dev -> (path, mask)
+        self.mounts = {}     # fsid -> fd of a directory on that filesystem
+        self.unresolved = 0
+
+    def fileno(self):
+        return self.fd
+
+    def mark(self, path, mask):
+        """ report the events in mask for the whole filesystem of path (the
+            filesystem's mark is set to exactly mask)
+        """
+        dev = os.stat(path).st_dev
+        old = self.marks.get(dev, (None, 0))[1]
+        mask = (mask & FAN_ALL_EVENTS) | FAN_ONDIR
+        libc = _libc()
+        if mask & ~old:
+            if libc.fanotify_mark(self.fd, FAN_MARK_ADD | FAN_MARK_FILESYSTEM, mask & ~old,
+                                  -1, path.encode('utf-8')) < 0:
+                _raise('fanotify_mark', path)
+        if old & ~mask:
+            if libc.fanotify_mark(self.fd, FAN_MARK_REMOVE | FAN_MARK_FILESYSTEM, old & ~mask,
+                                  -1, path.encode('utf-8')) < 0:
+                _raise('fanotify_mark', path)
+        self.marks[dev] = (path, mask)
+        fsid = _fsid(path)
+        if fsid not in self.mounts:
+            top = path if os.path.isdir(path) else os.path.dirname(path)
+            self.mounts[fsid] = os.open(top, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+
+    def unmark(self, path):
+        """ stop reporting the events of the filesystem of path """
+        dev = os.stat(path).st_dev
+        marked = self.marks.pop(dev, None)
+        if marked is None:
+            return
+        if _libc().fanotify_mark(self.fd, FAN_MARK_REMOVE | FAN_MARK_FILESYSTEM, marked[1],
+                                 -1, marked[0].encode('utf-8')) < 0:
+            _raise('fanotify_mark', path)
+        fd = self.mounts.pop(_fsid(path), None)
+        if fd is not None:
+            os.close(fd)
+
+    def wait(self, timeout=None):
+        """ whether events are ready to be read within timeout seconds """
+        try:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+        except (OSError, select.error) as exc:
+            if exc.args and exc.args[0] == errno.EINTR:
+                return False
+            raise
+        return bool(readable)
+
+    def resolve(self, fsid, handle_type, handle):
+        """ the path of a file handle, or None if it's gone """
+        mount_fds = [self.mounts[fsid]] if fsid in self.mounts else list(self.mounts.values())
+        packed = _FILE_HANDLE.pack(len(handle), handle_type) + handle
+        for mount_fd in mount_fds:
+            fd = _libc().open_by_handle_at(mount_fd, packed, O_PATH)
+            if fd < 0:
+                continue
+            try:
+                return os.readlink('/proc/self/fd/{0}'.format(fd))
+            finally:
+                os.close(fd)
+        return None
+
+    def read_events(self, max_reads=64):
+        """ read and resolve the events queued (without blocking), at most
+            max_reads buffers of them
+        """
+        ret = []
+        for _ in range(max_reads):
+            try:
+                buf = os.read(self.fd, self.buffer_size)
+            except OSError as exc:
+                if exc.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            if not buf:
+                break
+            ret.extend(self._events(buf))
+        return ret
+
+    def _events(self, buf):
+        ret = []
+        for mask, pid, infos in parse_events(buf):
+            if mask & FAN_Q_OVERFLOW:
+                ret.append(FanotifyEvent(FAN_Q_OVERFLOW, None, pid))
+                continue
+            pathname = None
+            for info_type, fsid, handle_type, handle, name in infos:
+                pathname = self.resolve(fsid, handle_type, handle)
+                if pathname is not None and name and name != '.':
+                    pathname = os.path.join(pathname, name)
+                if pathname is not None:
+                    break
+            if pathname is None:
+                self.unresolved += 1
+                continue
+            for bit in EVENT_NAMES:
+                if mask & bit:
+                    ret.append(FanotifyEvent(bit | (mask & FAN_ONDIR), pathname, pid))
+        return ret
+
+    def close(self):
+        for fd in self.mounts.values():
+            os.close(fd)
+        self.mounts = {}
+        self.marks = {}
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
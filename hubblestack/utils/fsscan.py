@@ -0,0 +1,366 @@
+# -*- encoding: utf-8 -*-
+"""
+A single-pass filesystem scanner for the whole-filesystem CIS checks.
+
+Unowned/ungrouped files, world-writable files, world-writable directories
+without the sticky bit and SUID/SGID files used to be one ``find / -xdev``
+walk each, which was slow enough that the misc checks got disabled. Here
+every local filesystem is walked once, across a bounded WorkerPool, and every
+registered predicate is evaluated against each entry during that one walk.
+The result is kept for ``ttl`` seconds so the checks (and repeated audits)
+share it.
+
+.. code-block:: python
+
+    import hubblestack.utils.fsscan as fsscan
+
+    result = fsscan.scan(prune=['/var/lib/docker'], max_seconds=600)
+    result.matches['world_writable']    # ['/tmp/foo', ...]
+    result.complete                      # False if the budget ran out
+
+Options (the misc checks read them from ``hubblestack:nova:fsscan``):
+
+roots
+    directories to scan; defaults to the mount points of the local
+    filesystems (what ``df --local`` lists)
+prune
+    paths (or globs) that are skipped along with everything below them
+max_workers
+    threads walking subtrees concurrently (default 4)
+max_seconds, max_entries
+    stop the scan after this long / this many entries; the result is then
+    marked incomplete
+throttle
+    seconds to sleep after every 1000 entries, per worker, to bound the
+    CPU/IO the scan takes (default 0)
+ttl
+    seconds a result is reused for (default 3600)
+"""
+
+import fnmatch
+import grp
+import logging
+import os
+import pwd
+import stat
+import threading
+import time
+
+import hubblestack.utils.procfs as procfs
+from hubblestack.utils.workers import WorkerPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ['ScanResult', 'scan', 'local_filesystems', 'register_predicate',
+           'PREDICATES', 'clear_cache']
+
+# filesystems df --local leaves out: remote ones, and the zero-sized pseudo ones
+REMOTE_FSTYPES = frozenset(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs',
+                            'ceph', 'glusterfs', 'fuse.glusterfs', 'lustre', 'gfs2',
+                            'ocfs2', '9p', 'sshfs', 'fuse.sshfs', 'davfs', 'coda'])
+PSEUDO_FSTYPES = frozenset(['proc', 'sysfs', 'cgroup', 'cgroup2', 'devpts', 'securityfs',
+                            'pstore', 'debugfs', 'tracefs', 'configfs', 'mqueue',
+                            'hugetlbfs', 'bpf', 'autofs', 'binfmt_misc', 'fusectl',
+                            'rpc_pipefs', 'nsfs', 'selinuxfs', 'efivarfs', 'ramfs'])
+
+THROTTLE_EVERY = 1000
+
+_UIDS = {}
+_GIDS = {}
+
+
+def _uid_known(uid):
+    try:
+        return _UIDS[uid]
+    except KeyError:
+        pass
+    try:
+        pwd.getpwuid(uid)
+        known = True
+    except KeyError:
+        known = False
+    _UIDS[uid] = known
+    return known
+
+
+def _gid_known(gid):
+    try:
+        return _GIDS[gid]
+    except KeyError:
+        pass
+    try:
+        grp.getgrgid(gid)
+        known = True
+    except KeyError:
+        known = False
+    _GIDS[gid] = known
+    return known
+
+
+def _unowned(path, st):
+    return not _uid_known(st.st_uid)
+
+
+def _ungrouped(path, st):
+    return not _gid_known(st.st_gid)
+
+
+def _world_writable(path, st):
+    return stat.S_ISREG(st.st_mode) and bool(st.st_mode & stat.S_IWOTH)
+
+
+def _sticky_missing(path, st):
+    return (stat.S_ISDIR(st.st_mode) and bool(st.st_mode & stat.S_IWOTH)
+            and not st.st_mode & stat.S_ISVTX)
+
+
+def _suid(path, st):
+    return stat.S_ISREG(st.st_mode) and bool(st.st_mode & stat.S_ISUID)
+
+
+def _sgid(path, st):
+    return stat.S_ISREG(st.st_mode) and bool(st.st_mode & stat.S_ISGID)
+
+
+# name -> func(path, lstat result); every one is evaluated on every entry
+PREDICATES = {'unowned': _unowned,
+              'ungrouped': _ungrouped,
+              'world_writable': _world_writable,
+              'sticky_missing': _sticky_missing,
+              'suid': _suid,
+              'sgid': _sgid}
+
+
+def register_predicate(name, func):
+    """ add a predicate to every subsequent scan; func(path, st) -> bool """
+    PREDICATES[name] = func
+    clear_cache()
+
+
+class ScanResult(object):
+    """ the outcome of a scan
+
+        * matches: predicate name -> sorted list of matching paths
+        * complete: False if the budget ran out before the walk finished
+        * entries: the number of entries examined
+        * errors: the number of entries/directories that couldn't be read
+        * elapsed: wall clock seconds the scan took
+        * finished: when the scan finished (for the ttl)
+    """
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.matches = dict((name, []) for name in PREDICATES)
+        self.complete = True
+        self.entries = 0
+        self.errors = 0
+        self.elapsed = 0
+        self.finished = None
+
+    def failures(self, name):
+        return self.matches.get(name, [])
+
+
+def local_filesystems(proc=None):
+    """ the mount points of the local, non-pseudo filesystems """
+    mounts = procfs.mounts(proc)
+    if mounts is None:
+        return ['/']
+    ret = []
+    for mount_point, info in sorted(mounts.items()):
+        fstype = info['fstype']
+        if fstype in REMOTE_FSTYPES or fstype in PSEUDO_FSTYPES:
+            continue
+        ret.append(mount_point)
+    return ret
+
+
+def _entries(path):
+    """ (path, lstat, is_dir) of the entries in a directory """
+    if scandir is not None:
+        for entry in scandir(path):
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                yield entry.path, None, False
+                continue
+            yield entry.path, st, stat.S_ISDIR(st.st_mode)
+        return
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        try:
+            st = os.lstat(full)
+        except OSError:
+            yield full, None, False
+            continue
+        yield full, st, stat.S_ISDIR(st.st_mode)
+
+
+class _Walk(object):
+    """ the state shared by the workers of one scan """
+
+    def __init__(self, prune, deadline, max_entries, throttle):
+        self.prune = prune
+        self.deadline = deadline
+        self.max_entries = max_entries
+        self.throttle = throttle
+        self.entries = 0
+        self.errors = 0
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def pruned(self, path):
+        for pattern in self.prune:
+            if path == pattern or fnmatch.fnmatch(path, pattern):
+                return True
+        return False
+
+    def out_of_budget(self):
+        if self.stopped:
+            return True
+        if (self.deadline and time.time() > self.deadline) or \
+                (self.max_entries and self.entries >= self.max_entries):
+            self.stopped = True
+        return self.stopped
+
+    def check(self, path, st, matches):
+        for name, func in PREDICATES.items():
+            try:
+                if func(path, st):
+                    matches.setdefault(name, []).append(path)
+            except Exception:
+                log.exception('fsscan predicate %s failed on %s', name, path)
+
+    def walk(self, top, device):
+        """ walk the tree under top without leaving the filesystem """
+        matches = {}
+        seen = 0
+        stack = [top]
+        while stack:
+            if self.out_of_budget():
+                break
+            path = stack.pop()
+            try:
+                entries = list(_entries(path))
+            except OSError as exc:
+                log.debug('fsscan unable to read %s: %s', path, exc)
+                with self.lock:
+                    self.errors += 1
+                continue
+            for full, st, is_dir in entries:
+                if self.pruned(full):
+                    continue
+                if st is None:
+                    with self.lock:
+                        self.errors += 1
+                    continue
+                self.check(full, st, matches)
+                if is_dir and st.st_dev == device:
+                    stack.append(full)
+            seen += len(entries)
+            with self.lock:
+                self.entries += len(entries)
+            if self.throttle and seen >= THROTTLE_EVERY:
+                seen = 0
+                time.sleep(self.throttle)
+        return matches
+
+
+_CACHE = {}
+_SCAN_LOCK = threading.Lock()
+
+
+def clear_cache():
+    _CACHE.clear()
+
+
+def scan(roots=None, prune=None, max_workers=4, max_seconds=None, max_entries=None,
+         throttle=0, ttl=3600):
+    """ walk the filesystems once, evaluating every predicate; see the module
+        documentation for the options. Returns a ScanResult, possibly a
+        cached one.
+    """
+    roots = tuple(roots or local_filesystems())
+    prune = tuple(prune or ())
+    key = (roots, prune)
+    with _SCAN_LOCK:
+        cached = _CACHE.get(key)
+        if cached is not None and ttl and time.time() - cached.finished < ttl:
+            log.debug('fsscan reusing the scan from %.0fs ago', time.time() - cached.finished)
+            return cached
+        result = _scan(roots, prune, max_workers, max_seconds, max_entries, throttle)
+        _CACHE[key] = result
+        return result
+
+
+def _scan(roots, prune, max_workers, max_seconds, max_entries, throttle):
+    started = time.time()
+    result = ScanResult(roots)
+    deadline = started + max_seconds if max_seconds else None
+    walk = _Walk(prune, deadline, max_entries, throttle)
+    _UIDS.clear()
+    _GIDS.clear()
+
+    # the roots themselves and their immediate entries are checked here; each
+    # subdirectory is then walked by a worker
+    subtrees = []
+    seen_devices = set()
+    for root in roots:
+        try:
+            root_st = os.lstat(root)
+        except OSError as exc:
+            log.debug('fsscan unable to stat %s: %s', root, exc)
+            result.errors += 1
+            continue
+        if root_st.st_dev in seen_devices or walk.pruned(root):
+            # bind mounts of a filesystem that's already being walked
+            continue
+        seen_devices.add(root_st.st_dev)
+        walk.check(root, root_st, result.matches)
+        try:
+            entries = list(_entries(root))
+        except OSError as exc:
+            log.debug('fsscan unable to read %s: %s', root, exc)
+            result.errors += 1
+            continue
+        walk.entries += len(entries)
+        for full, st, is_dir in entries:
+            if walk.pruned(full):
+                continue
+            if st is None:
+                result.errors += 1
+                continue
+            walk.check(full, st, result.matches)
+            if is_dir and st.st_dev == root_st.st_dev:
+                subtrees.append((full, root_st.st_dev))
+
+    with WorkerPool(max_workers=max_workers, name='hubble-fsscan') as pool:
+        tasks = [pool.submit(walk.walk, top, device) for top, device in subtrees]
+        for task in tasks:
+            task.join()
+            if task.exception is not None:
+                log.error('fsscan worker failed: %s', task.traceback)
+                result.complete = False
+                continue
+            for name, paths in task.value.items():
+                result.matches.setdefault(name, []).extend(paths)
+
+    for name in result.matches:
+        result.matches[name] = sorted(set(result.matches[name]))
+    result.complete = result.complete and not walk.stopped
+    result.entries = walk.entries
+    result.errors += walk.errors
+    result.finished = time.time()
+    result.elapsed = result.finished - started
+    log.info('fsscan: %d entries under %d roots in %.1fs (%s, %d unreadable)',
+             result.entries, len(roots), result.elapsed,
+             'complete' if result.complete else 'incomplete', result.errors)
+    return result
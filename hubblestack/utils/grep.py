@@ -0,0 +1,359 @@
+# -*- encoding: utf-8 -*-
+"""
+An in-process stand-in for the ``grep`` command lines built by the grep
+nova module, the grep audit module and misc.
+
+Profiles run a hundred or more grep checks against a couple dozen files, each
+of which used to fork ``grep``. Here every target file is read once per run
+(shared through the run's fact snapshot, see hubblestack.utils.facts) and
+each pattern is translated to a python regex once per process, so checks
+against the same file are just regex scans over the same cached lines.
+
+The common options are understood: ``-G``, ``-E``, ``-F``, ``-i``, ``-v``,
+``-w``, ``-x`` and ``-A``/``-B``/``-C`` (plus their long forms). Anything else
+-- other options, several files, a missing or binary file, a regex construct
+with no exact python equivalent -- makes ``run()`` return None, and the
+caller runs the real binary as before. When it does answer, the answer is
+what ``cmd.run_all`` would have returned for the same command.
+
+.. code-block:: python
+
+    import hubblestack.utils.grep as grep_engine
+
+    ret = grep_engine.run(cmd)
+    if ret is None:
+        ret = __salt__['cmd.run_all'](cmd, python_shell=False, ignore_retcode=True)
+"""
+
+import logging
+import re
+import shlex
+
+import hubblestack.utils.facts as facts
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Unsupported', 'run', 'grep', 'translate', 'parse_args']
+
+# compiled regexes, by (pattern, options); cleared wholesale when full
+_COMPILED = {}
+CACHE_SIZE = 1024
+
+_SHORT_FLAGS = {'G': ('syntax', 'basic'),
+                'E': ('syntax', 'extended'),
+                'F': ('syntax', 'fixed'),
+                'i': ('ignore_case', True),
+                'y': ('ignore_case', True),
+                'v': ('invert', True),
+                'w': ('word', True),
+                'x': ('line', True)}
+_SHORT_CONTEXT = {'A': ('after',), 'B': ('before',), 'C': ('after', 'before')}
+_LONG_FLAGS = {'--basic-regexp': ('syntax', 'basic'),
+               '--extended-regexp': ('syntax', 'extended'),
+               '--fixed-strings': ('syntax', 'fixed'),
+               '--ignore-case': ('ignore_case', True),
+               '--invert-match': ('invert', True),
+               '--word-regexp': ('word', True),
+               '--line-regexp': ('line', True)}
+_LONG_CONTEXT = {'--after-context': ('after',),
+                 '--before-context': ('before',),
+                 '--context': ('after', 'before')}
+
+_CLASSES = {'alpha': 'a-zA-Z',
+            'digit': '0-9',
+            'alnum': '0-9a-zA-Z',
+            'upper': 'A-Z',
+            'lower': 'a-z',
+            'space': ' \\t\\n\\r\\f\\v',
+            'blank': ' \\t',
+            'xdigit': '0-9A-Fa-f',
+            'punct': re.escape('!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'),
+            'cntrl': '\\x00-\\x1f\\x7f',
+            'print': '\\x20-\\x7e',
+            'graph': '\\x21-\\x7e'}
+
+_ESCAPES = {'<': r'\b(?=\w)',
+            '>': r'\b(?<=\w)',
+            'b': r'\b',
+            'B': r'\B',
+            'w': r'\w',
+            'W': r'\W',
+            's': r'\s',
+            'S': r'\S'}
+
+
+class Unsupported(Exception):
+    """ raised for anything the engine won't answer for the real grep """
+
+
+def parse_args(argv):
+    """ parse grep's argv (without the leading 'grep') into
+        (options dict, pattern, [files])
+    """
+    opts = {'syntax': 'basic', 'ignore_case': False, 'invert': False,
+            'word': False, 'line': False, 'after': 0, 'before': 0}
+    operands = []
+    argv = list(argv)
+    while argv:
+        arg = argv.pop(0)
+        if arg == '--':
+            operands.extend(argv)
+            break
+        if not arg.startswith('-') or arg == '-':
+            operands.append(arg)
+        elif arg.startswith('--'):
+            name, sep, value = arg.partition('=')
+            if name in _LONG_FLAGS and not sep:
+                key, val = _LONG_FLAGS[name]
+                opts[key] = val
+            elif name in _LONG_CONTEXT:
+                if not sep:
+                    if not argv:
+                        raise Unsupported(arg)
+                    value = argv.pop(0)
+                for key in _LONG_CONTEXT[name]:
+                    opts[key] = _context(value)
+            else:
+                raise Unsupported(arg)
+        else:
+            i = 1
+            while i < len(arg):
+                flag = arg[i]
+                if flag in _SHORT_FLAGS:
+                    key, val = _SHORT_FLAGS[flag]
+                    opts[key] = val
+                    i += 1
+                elif flag in _SHORT_CONTEXT:
+                    value = arg[i + 1:]
+                    if not value:
+                        if not argv:
+                            raise Unsupported(arg)
+                        value = argv.pop(0)
+                    for key in _SHORT_CONTEXT[flag]:
+                        opts[key] = _context(value)
+                    break
+                else:
+                    raise Unsupported(arg)
+    if not operands:
+        raise Unsupported('no pattern')
+    return opts, operands[0], operands[1:]
+
+
+def _context(value):
+    if not value.isdigit():
+        raise Unsupported('context ' + value)
+    return int(value)
+
+
+def _bracket(pattern, i):
+    """ translate the bracket expression starting at pattern[i] == '[';
+        returns (python class, index after the closing ']')
+    """
+    i += 1
+    out = ['[']
+    if i < len(pattern) and pattern[i] == '^':
+        out.append('^')
+        i += 1
+    first = True
+    while i < len(pattern):
+        char = pattern[i]
+        if char == ']' and not first:
+            out.append(']')
+            return ''.join(out), i + 1
+        first = False
+        if char == '[' and pattern[i + 1:i + 2] in (':', '=', '.'):
+            end = pattern.find(pattern[i + 1] + ']', i + 2)
+            if end < 0 or pattern[i + 1] != ':' or pattern[i + 2:end] not in _CLASSES:
+                raise Unsupported(pattern)
+            out.append(_CLASSES[pattern[i + 2:end]])
+            i = end + 2
+            continue
+        # backslash is literal in POSIX brackets; python needs these escaped
+        # (and &, ~, | doubled up would be set operations to newer pythons)
+        if char in '\\[]^&~|':
+            out.append('\\' + char)
+        else:
+            out.append(char)
+        i += 1
+    raise Unsupported('unmatched [')
+
+
+def translate(pattern, syntax='basic'):
+    """ translate a grep BRE/ERE (or fixed string) into python regex syntax """
+    if '\n' in pattern:
+        # grep treats every line as a separate pattern
+        raise Unsupported('multi-line pattern')
+    if syntax == 'fixed':
+        return re.escape(pattern)
+    extended = syntax == 'extended'
+    out = []
+    # whether the next char starts a (sub)expression, where BRE '^' anchors
+    # and a '*' is literal
+    start = True
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        at_start, start = start, False
+        if char == '\\':
+            if i + 1 >= len(pattern):
+                raise Unsupported('trailing backslash')
+            nxt = pattern[i + 1]
+            i += 2
+            if not extended and nxt in '()|{}+?':
+                if nxt == '(':
+                    out.append('(')
+                    start = True
+                elif nxt == '|':
+                    out.append('|')
+                    start = True
+                elif nxt == '{':
+                    end = pattern.find('\\}', i)
+                    if end < 0 or not re.match(r'^\d*(,\d*)?$', pattern[i:end]) or at_start:
+                        raise Unsupported(pattern)
+                    out.append('{' + pattern[i:end] + '}')
+                    i = end + 2
+                elif nxt == '}':
+                    raise Unsupported(pattern)
+                else:
+                    if at_start:
+                        raise Unsupported(pattern)
+                    out.append(nxt)
+            elif nxt in _ESCAPES:
+                out.append(_ESCAPES[nxt])
+            elif nxt in '123456789':
+                out.append('\\' + nxt)
+            elif nxt.isalnum() or nxt == '`' or nxt == "'":
+                raise Unsupported('\\' + nxt)
+            else:
+                out.append(re.escape(nxt))
+            continue
+        if char == '[':
+            cls, i = _bracket(pattern, i)
+            out.append(cls)
+            continue
+        i += 1
+        if char == '*':
+            if at_start and extended:
+                raise Unsupported(pattern)
+            out.append('\\*' if at_start else '*')
+        elif char == '^':
+            # in a BRE only the first '^' anchors ('^^x' matches '^x'), while
+            # a '*' right after it is still literal
+            if extended or (at_start and not (out and out[-1] == '^')):
+                out.append('^')
+                start = True
+            else:
+                out.append('\\^')
+        elif char == '$':
+            rest = pattern[i:]
+            if extended or not rest or rest.startswith('\\)') or rest.startswith('\\|'):
+                out.append('$')
+            else:
+                out.append('\\$')
+        elif char == '.':
+            out.append('.')
+        elif extended and char in '()|+?{}':
+            if char == '(' and pattern[i:i + 1] == '?':
+                raise Unsupported(pattern)
+            if char in '+?{' and at_start:
+                raise Unsupported(pattern)
+            out.append(char)
+            start = char in '(|'
+        else:
+            out.append(re.escape(char))
+    return ''.join(out)
+
+
+def _compile(pattern, opts):
+    key = (pattern, opts['syntax'], opts['ignore_case'], opts['word'], opts['line'])
+    try:
+        return _COMPILED[key]
+    except KeyError:
+        pass
+    regex = translate(pattern, opts['syntax'])
+    if opts['line']:
+        regex = r'^(?:' + regex + r')$'
+    elif opts['word']:
+        regex = r'(?<!\w)(?:' + regex + r')(?!\w)'
+    try:
+        compiled = re.compile(regex, re.IGNORECASE if opts['ignore_case'] else 0)
+    except re.error as exc:
+        raise Unsupported('{0}: {1}'.format(pattern, exc))
+    if len(_COMPILED) >= CACHE_SIZE:
+        _COMPILED.clear()
+    _COMPILED[key] = compiled
+    return compiled
+
+
+def _file_lines(path):
+    """ the file's lines, read once per run; None if grep itself should look """
+    def collect():
+        try:
+            with open(path, 'rb') as fh:
+                data = fh.read()
+        except (IOError, OSError) as exc:
+            log.debug('grep engine unable to read %s: %s', path, exc)
+            return None
+        if b'\0' in data:
+            return None
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        lines = data.split('\n')
+        if data.endswith('\n'):
+            lines.pop()
+        return lines
+    return facts.snapshot().get(('grep_lines', path), collect, cost=0)
+
+
+def grep(lines, pattern, opts):
+    """ the (retcode, output lines) of grep over lines """
+    regex = _compile(pattern, opts)
+    invert = opts['invert']
+    selected = [idx for idx, line in enumerate(lines)
+                if (regex.search(line) is None) == invert]
+    if not selected:
+        return 1, []
+    before, after = opts['before'], opts['after']
+    if not (before or after):
+        return 0, [lines[idx] for idx in selected]
+    out = []
+    last = -1
+    for idx in selected:
+        first = max(idx - before, last + 1)
+        if out and first > last + 1:
+            out.append('--')
+        upto = min(idx + after, len(lines) - 1)
+        if upto > last:
+            out.extend(lines[first:upto + 1])
+            last = upto
+    return 0, out
+
+
+def run(cmd):
+    """ answer a ``grep [options] pattern file`` command line (as passed to
+        ``cmd.run_all`` with python_shell=False) in-process
+
+        Returns a ``cmd.run_all`` style dict, or None if the real grep has to
+        run.
+    """
+    try:
+        argv = shlex.split(cmd) if not isinstance(cmd, (list, tuple)) else list(cmd)
+    except ValueError:
+        return None
+    if not argv or argv[0] != 'grep':
+        return None
+    try:
+        opts, pattern, files = parse_args(argv[1:])
+        if len(files) != 1:
+            raise Unsupported('{0} files'.format(len(files)))
+        lines = _file_lines(files[0])
+        if lines is None:
+            raise Unsupported('unreadable ' + files[0])
+        retcode, out = grep(lines, pattern, opts)
+    except Unsupported as exc:
+        log.debug('grep engine falling back to grep: %s', exc)
+        return None
+    # cmd.run_all strips trailing whitespace from stdout
+    return {'pid': 0, 'retcode': retcode, 'stdout': '\n'.join(out).rstrip(), 'stderr': ''}
@@ -0,0 +1,243 @@
+# -*- encoding: utf-8 -*-
+"""
+Incremental nova audits: reuse a module's last results while its inputs are
+unchanged.
+
+Most nova checks are pure functions of a few host facts -- a config file, a
+sysctl, the package set. A module that reads *all* of its inputs through
+hubblestack.utils.facts (and says so with ``__incremental__ = True``) has
+every fact key it asks for recorded during its run. Each key is turned into
+an input descriptor and fingerprinted:
+
+file
+    ('file', path): inode, size, mtime, ctime, mode, owner and group (or
+    'missing'); for the grep engine's and file_lines' reads, file.stats, ...
+content
+    ('content', path): a digest of a small file's content; for /proc/sys
+    values and /proc/self/mountinfo
+pkgdb
+    ('pkgdb',): the stat of the package manager's database, for the package
+    index
+
+Anything else (a salt call, netstat, unit states...) is volatile: a module
+that used it is always re-run. The module's results, the fingerprints and a
+digest of its profile data, tags, labels and grains are kept in the cachedir;
+on the next run the module is skipped, and its last results used, if that
+digest and every fingerprint still match. Every ``full_every``-th run
+evaluates everything regardless.
+
+.. code-block:: python
+
+    inc = incremental.IncrementalAudit(path, full_every=12)
+    ret = inc.reusable(key, data_hash)
+    if ret is None:
+        ret = inc.tracked(key, func, data_hash)(data_list, tags, labels)
+    inc.save()
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+import hubblestack.utils.facts as facts
+
+log = logging.getLogger(__name__)
+
+__all__ = ['IncrementalAudit', 'describe', 'fingerprint', 'data_digest', 'declared']
+
+STATE_VERSION = 1
+PKG_DBS = ('/var/lib/rpm/Packages', '/var/lib/rpm/rpmdb.sqlite', '/var/lib/dpkg/status',
+           '/lib/apk/db/installed')
+PROC = '/proc'
+
+_FILE_FACTS = frozenset(['grep_lines', 'file_lines'])
+
+
+def _sysctl_path(proc, name):
+    return os.path.join(proc or PROC, 'sys',
+                        '/'.join(part.replace('/', '.') for part in name.split('.')))
+
+
+def describe(key):
+    """ the input descriptor of a fact key (see the module documentation);
+        None if it can't be fingerprinted
+    """
+    if not isinstance(key, tuple) or not key:
+        return None
+    kind = key[0]
+    if kind == 'file' and len(key) == 2:
+        return ('file', key[1])
+    if kind in _FILE_FACTS and len(key) == 2:
+        return ('file', key[1])
+    if kind == 'pkg_index':
+        return ('pkgdb',)
+    if kind == 'procfs' and len(key) >= 3:
+        if key[1] == 'sysctl' and len(key) == 4:
+            return ('content', _sysctl_path(key[2], key[3]))
+        if key[1] == 'mounts':
+            return ('content', os.path.join(key[2] or PROC, 'self', 'mountinfo'))
+        return None
+    if kind == 'salt' and len(key) == 4 and len(key[2]) == 1 and not key[3]:
+        if key[1] == 'file.stats':
+            return ('file', key[2][0])
+        if key[1] == 'sysctl.get':
+            return ('content', _sysctl_path(None, key[2][0]))
+    return None
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 'missing'
+    return [st.st_ino, st.st_size, st.st_mtime, st.st_ctime, st.st_mode, st.st_uid, st.st_gid]
+
+
+def fingerprint(descriptor):
+    """ the current fingerprint of an input descriptor; None if volatile """
+    kind = descriptor[0]
+    if kind == 'file':
+        return _stat(descriptor[1])
+    if kind == 'content':
+        try:
+            with open(descriptor[1], 'rb') as fh:
+                return hashlib.sha1(fh.read()).hexdigest()
+        except (IOError, OSError):
+            return 'missing'
+    if kind == 'pkgdb':
+        stats = [[path, _stat(path)] for path in PKG_DBS]
+        if all(stat == 'missing' for _, stat in stats):
+            return None
+        return stats
+    return None
+
+
+def data_digest(*parts):
+    """ a digest of a module's arguments (profile data, tags, labels, ...) """
+    blob = json.dumps(parts, sort_keys=True, default=repr)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def declared(func):
+    """ whether the module func belongs to declared ``__incremental__ = True`` """
+    return bool(getattr(func, '__globals__', {}).get('__incremental__'))
+
+
+class _Recorder(object):
+    """ collects the fingerprinted inputs of one module run """
+
+    def __init__(self):
+        self.inputs = {}
+        self.volatile = None
+
+    def note(self, key):
+        descriptor = describe(key)
+        if descriptor is None:
+            if self.volatile is None:
+                self.volatile = key
+            return
+        if descriptor not in self.inputs:
+            # fingerprinted before the fact is read, so a change racing
+            # with the read is seen next time
+            value = fingerprint(descriptor)
+            if value is None and self.volatile is None:
+                self.volatile = descriptor
+            self.inputs[descriptor] = value
+
+
+class IncrementalAudit(object):
+    """ the persisted per-module results of previous audits """
+
+    def __init__(self, path, full_every=12):
+        self.path = path
+        self.full_every = max(1, int(full_every or 1))
+        self.state = self._load()
+        self.run = self.state.get('runs', 0) + 1
+        self.full = self.run % self.full_every == 1 or self.full_every == 1
+        self.reused = []
+        self.evaluated = []
+        self._lock = threading.Lock()
+        if self.full:
+            log.debug('incremental audit: run %d is a full evaluation', self.run)
+
+    def _load(self):
+        try:
+            with open(self.path) as fh:
+                state = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return {'modules': {}}
+        if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+            return {'modules': {}}
+        return state
+
+    def reusable(self, key, data_hash):
+        """ the last results of module key if nothing it depends on changed,
+            None otherwise
+        """
+        if self.full:
+            return None
+        entry = self.state['modules'].get(key)
+        if not entry or entry.get('data') != data_hash:
+            return None
+        for descriptor, value in entry['inputs']:
+            if value is None or fingerprint(tuple(descriptor)) != value:
+                return None
+        with self._lock:
+            self.reused.append(key)
+        return json.loads(entry['result'])
+
+    def tracked(self, key, func, data_hash):
+        """ func, recording what it reads and keeping its results for the
+            next run; the recording happens in whichever thread calls it
+        """
+        def inner(*args, **kwargs):
+            recorder = _Recorder()
+            with facts.recording(recorder):
+                ret = func(*args, **kwargs)
+            self._store(key, data_hash, recorder, ret)
+            return ret
+        return inner
+
+    def _store(self, key, data_hash, recorder, ret):
+        with self._lock:
+            self.evaluated.append(key)
+            modules = self.state['modules']
+            if recorder.volatile is not None:
+                log.debug('incremental audit: %s depends on %s, always re-run', key,
+                          recorder.volatile)
+                modules.pop(key, None)
+                return
+            try:
+                result = json.dumps(ret)
+            except (TypeError, ValueError):
+                modules.pop(key, None)
+                return
+            modules[key] = {'data': data_hash,
+                            'inputs': [[list(descriptor), value]
+                                       for descriptor, value in recorder.inputs.items()],
+                            'result': result}
+
+    def save(self, keep=None):
+        """ persist the state; modules not in keep (when given) are dropped """
+        with self._lock:
+            modules = self.state['modules']
+            if keep is not None:
+                for key in list(modules):
+                    if key not in keep:
+                        modules.pop(key)
+            state = {'version': STATE_VERSION, 'runs': self.run, 'modules': modules}
+        log.debug('incremental audit: run %d reused %d modules, evaluated %d',
+                  self.run, len(self.reused), len(self.evaluated))
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.nova-incremental-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump(state, fh)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as exc:
+            log.warning('unable to save the incremental audit state to %s: %s', self.path, exc)
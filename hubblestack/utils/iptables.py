@@ -0,0 +1,203 @@
+# -*- encoding: utf-8 -*-
+"""
+A parsed, indexed snapshot of the host's iptables/ip6tables ruleset.
+
+``iptables.check`` runs ``iptables -C`` (taking the xtables lock) once per
+rule checked. Here ``iptables-save``/``ip6tables-save`` runs once per family
+per run, its output is parsed into per table/chain rule sets, and rule
+presence and chain policies are answered by lookup.
+
+Rules are compared semantically rather than as strings: option aliases
+(``-p``/``--protocol``, ``--dport``/``--destination-port``, ...), option
+order, the order of ``--state``/``--ctstate`` lists, implicit ``-m tcp``
+style matches, ``/32`` host masks and both ``! -s x`` and ``-s ! x``
+negations all normalize to the same key.
+
+.. code-block:: python
+
+    import hubblestack.utils.iptables as iptables
+
+    ruleset = iptables.ruleset(__salt__, 'ipv4')
+    if ruleset is not None:
+        ruleset.has_rule('filter', 'INPUT', '-p tcp --dport 22 -j ACCEPT')
+        ruleset.policy('filter', 'INPUT')    # 'DROP'
+"""
+
+import collections
+import logging
+import shlex
+
+import hubblestack.utils.facts as facts
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Ruleset', 'ruleset', 'parse_save', 'normalize_rule']
+
+SAVE_COMMANDS = {'ipv4': 'iptables-save', 'ipv6': 'ip6tables-save'}
+
+_ALIASES = {'-p': '--protocol',
+            '-s': '--source',
+            '--src': '--source',
+            '-d': '--destination',
+            '--dst': '--destination',
+            '-i': '--in-interface',
+            '-o': '--out-interface',
+            '-j': '--jump',
+            '-g': '--goto',
+            '-m': '--match',
+            '-f': '--fragment',
+            '--destination-port': '--dport',
+            '--source-port': '--sport',
+            '--destination-ports': '--dports',
+            '--source-ports': '--sports'}
+
+# options whose comma separated values are a set
+_UNORDERED_LISTS = frozenset(['--state', '--ctstate', '--tcp-flags'])
+
+# options that aren't part of the rule itself
+_COMMAND_OPTIONS = {'-A': 1, '--append': 1, '-I': 1, '--insert': 1, '-C': 1, '--check': 1,
+                    '-D': 1, '--delete': 1, '-t': 1, '--table': 1, '-w': 0, '--wait': 0}
+
+# match modules implied by the protocol, which iptables-save spells out
+_PROTOCOL_MATCHES = frozenset(['tcp', 'udp', 'icmp', 'icmpv6', 'icmp6', 'udplite', 'sctp', 'dccp'])
+
+
+def _address(value):
+    if '/' in value or not value:
+        return value
+    return value + ('/128' if ':' in value else '/32')
+
+
+def _value(option, values):
+    if option in ('--source', '--destination'):
+        return ','.join(sorted(_address(v) for v in ','.join(values).split(',')))
+    if option == '--protocol':
+        return ' '.join(values).lower()
+    if option in _UNORDERED_LISTS:
+        return ' '.join(','.join(sorted(v.split(','))) for v in values)
+    return ' '.join(values)
+
+
+def _tokens(rule):
+    if isinstance(rule, (list, tuple)):
+        return list(rule)
+    return shlex.split(rule)
+
+
+def normalize_rule(rule):
+    """ the order-independent key of a rule given as a string or tokens,
+        with or without the leading command, -t table and -A chain
+    """
+    tokens = _tokens(rule)
+    if tokens and not tokens[0].startswith('-') and tokens[0] != '!':
+        # 'iptables ...' (as iptables.build_rule(full=True) returns)
+        tokens = tokens[1:]
+    options = []
+    negate = False
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        i += 1
+        if token == '!':
+            negate = True
+            continue
+        if token in _COMMAND_OPTIONS:
+            i += _COMMAND_OPTIONS[token]
+            if token in ('-I', '--insert') and i < len(tokens) and tokens[i].isdigit():
+                i += 1
+            continue
+        if not token.startswith('-'):
+            # a stray value; keep it so the rule can't match by accident
+            options.append(('', False, token))
+            continue
+        option = _ALIASES.get(token, token)
+        values = []
+        while i < len(tokens) and not (tokens[i].startswith('-') and len(tokens[i]) > 1
+                                       and not tokens[i][1:].isdigit()):
+            if tokens[i] == '!':
+                # old style '-s ! 1.2.3.4'; a '!' before the next option
+                # belongs to that option
+                if values or i + 1 >= len(tokens) or tokens[i + 1].startswith('-'):
+                    break
+                negate = True
+                i += 1
+                continue
+            values.append(tokens[i])
+            i += 1
+        options.append((option, negate, _value(option, values)))
+        negate = False
+    protocols = set(value for option, _, value in options if option == '--protocol')
+    options = [opt for opt in options
+               if not (opt[0] == '--match' and opt[2] in _PROTOCOL_MATCHES and opt[2] in protocols)]
+    return tuple(sorted(options))
+
+
+class Ruleset(object):
+    """ the rules and chain policies of one family, by table and chain """
+
+    def __init__(self):
+        self.policies = {}
+        self.chains = collections.OrderedDict()
+        self._index = {}
+
+    def add_chain(self, table, chain, policy=None):
+        self.chains.setdefault((table, chain), [])
+        self._index.setdefault((table, chain), set())
+        if policy and policy != '-':
+            self.policies[(table, chain)] = policy
+
+    def add_rule(self, table, chain, tokens):
+        self.add_chain(table, chain)
+        self.chains[(table, chain)].append(tokens)
+        self._index[(table, chain)].add(normalize_rule(tokens))
+
+    def rules(self, table, chain):
+        """ the rules of a chain, in order, as option token lists """
+        return self.chains.get((table, chain), [])
+
+    def has_rule(self, table, chain, rule):
+        """ whether ``iptables -t table -C chain rule`` would succeed """
+        return normalize_rule(rule) in self._index.get((table, chain), ())
+
+    def policy(self, table, chain):
+        """ the policy of a built-in chain, or None """
+        return self.policies.get((table, chain))
+
+
+def parse_save(text):
+    """ parse ``iptables-save`` output into a Ruleset """
+    ret = Ruleset()
+    table = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or line == 'COMMIT':
+            continue
+        if line.startswith('*'):
+            table = line[1:]
+        elif line.startswith(':'):
+            comps = line[1:].split()
+            ret.add_chain(table, comps[0], comps[1] if len(comps) > 1 else None)
+        elif line.startswith('-A '):
+            try:
+                tokens = shlex.split(line)
+            except ValueError:
+                log.error('unable to parse iptables-save line: %s', line)
+                continue
+            ret.add_rule(table, tokens[1], tokens[2:])
+    return ret
+
+
+def ruleset(salt, family='ipv4'):
+    """ the Ruleset of a family, from one ``iptables-save`` per run; None if
+        it can't be taken (no binary, no permission, ...)
+    """
+    def collect():
+        command = SAVE_COMMANDS.get(family)
+        if command is None:
+            return None
+        ret = salt['cmd.run_all']([command], python_shell=False, ignore_retcode=True)
+        if ret.get('retcode') or not ret.get('stdout', '').strip():
+            log.debug('%s failed (%s): %s', command, ret.get('retcode'), ret.get('stderr'))
+            return None
+        return parse_save(ret['stdout'])
+    return facts.snapshot().get(('iptables', family), collect)
@@ -0,0 +1,326 @@
+# -*- encoding: utf-8 -*-
+"""
+Streaming compilation of vendor OVAL feeds into a compact, cached
+per-package vulnerability index.
+
+The oval scanner used to download the whole feed on every scan, build a DOM of
+it and join definitions, tests, objects and states with nested loops -- for
+the RHEL feeds hundreds of MB of memory and minutes of CPU each time. Here the
+feed is parsed with ``iterparse`` (each element is dropped as soon as it's
+been read), compiled into an index of the fixed versions per package name,
+and that index is written to the cachedir. The next scan revalidates the feed
+(a conditional GET with the stored ETag/Last-Modified, or the inode, mtime
+and size of a local file) and, when it hasn't changed, just loads the index.
+
+.. code-block:: python
+
+    import hubblestack.utils.oval as oval
+
+    index = oval.load_index(url_or_path, os.path.join(__opts__['cachedir'], 'oval'))
+    for name, fixed, def_id in oval.affected(index, __salt__['pkg.list_pkgs'](), 'rpm'):
+        index['definitions'][def_id]['title']
+
+The index is a plain dict::
+
+    {'version': INDEX_VERSION,
+     'source': {...how to revalidate it...},
+     'generator': {'product_name': ..., 'timestamp': ..., ...},
+     'definitions': {def_id: {'title', 'cve', 'rhsa', 'severity', 'advisories'}},
+     'packages': {name: [[fixed_version, def_id], ...]}}
+
+A definition's package/version pairs are what its tests reference: each test
+with both an object and a state, the object's package name (or every name of
+the variable it refers to, the Ubuntu way) and the state's evr.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+import hubblestack.utils.vercmp as vercmp
+
+try:
+    import requests
+    HAS_REQUESTS = True
+except ImportError:
+    HAS_REQUESTS = False
+
+log = logging.getLogger(__name__)
+
+__all__ = ['compile_feed', 'load_index', 'affected', 'INDEX_VERSION']
+
+# bump whenever the layout of the index changes, so old cache files are rebuilt
+INDEX_VERSION = 1
+
+FETCH_TIMEOUT = 300
+
+_SECTIONS = frozenset(['definitions', 'tests', 'objects', 'states', 'variables'])
+
+# cache file path -> ((mtime, size), index)
+_LOADED = {}
+_LOCK = threading.Lock()
+
+
+def _local(tag):
+    return tag.rpartition('}')[2]
+
+
+def _children(elem, name):
+    return [child for child in elem if _local(child.tag) == name]
+
+
+def _child(elem, name):
+    for child in elem:
+        if _local(child.tag) == name:
+            return child
+    return None
+
+
+def _read_generator(elem):
+    ret = {}
+    for child in elem:
+        name = _local(child.tag)
+        if name in ('product_name', 'product_version', 'schema_version', 'timestamp'):
+            ret[name] = child.text
+    return ret
+
+
+def _read_definition(elem):
+    ret = {'title': None, 'cve': [], 'tests': []}
+    metadata = _child(elem, 'metadata')
+    if metadata is not None:
+        title = _child(metadata, 'title')
+        ret['title'] = title.text if title is not None else None
+        for reference in _children(metadata, 'reference'):
+            source = reference.get('source')
+            ref = {reference.get('ref_id'): reference.get('ref_url')}
+            if source in ('RHSA', 'RHBA', 'RHEA'):
+                ret['rhsa'] = ref
+            elif source == 'CVE':
+                ret['cve'].append(ref)
+        advisory = _child(metadata, 'advisory')
+        if advisory is not None:
+            severity = _child(advisory, 'severity')
+            if severity is not None:
+                ret['severity'] = severity.text
+            ret['advisories'] = [ref.text for ref in _children(advisory, 'ref')]
+    for criterion in elem.iter():
+        if 'test_ref' in criterion.attrib:
+            ret['tests'].append(criterion.attrib['test_ref'])
+    return ret
+
+
+def _read_test(elem):
+    ret = {}
+    obj, state = _child(elem, 'object'), _child(elem, 'state')
+    if obj is not None and 'object_ref' in obj.attrib:
+        ret['object_ref'] = obj.attrib['object_ref']
+    if state is not None and 'state_ref' in state.attrib:
+        ret['state_ref'] = state.attrib['state_ref']
+    return ret
+
+
+def _read_object(elem):
+    name = _child(elem, 'name')
+    if name is None:
+        return None
+    return name.text or name.get('var_ref')
+
+
+def _read_state(elem):
+    evr = _child(elem, 'evr')
+    return evr.text if evr is not None else None
+
+
+def _read_variable(elem):
+    return [value.text for value in elem.iter() if value is not elem and value.text]
+
+
+def compile_feed(source):
+    """ compile an OVAL feed (a path or a file object) into an index,
+        streaming it so only the compact index is ever held in memory
+    """
+    generator = {}
+    definitions = {}
+    tests = {}
+    objects = {}
+    states = {}
+    variables = {}
+    readers = {'definitions': (definitions, _read_definition),
+               'tests': (tests, _read_test),
+               'objects': (objects, _read_object),
+               'states': (states, _read_state),
+               'variables': (variables, _read_variable)}
+    stack = []
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            stack.append(elem)
+            continue
+        stack.pop()
+        depth = len(stack)
+        if depth == 1 and _local(elem.tag) == 'generator':
+            generator = _read_generator(elem)
+        elif depth == 2 and _local(stack[1].tag) in _SECTIONS:
+            store, reader = readers[_local(stack[1].tag)]
+            if 'id' in elem.attrib:
+                value = reader(elem)
+                if value is not None:
+                    store[elem.attrib['id']] = value
+        else:
+            continue
+        # done with it: drop it (and its subtree) from the partial tree
+        elem.clear()
+        stack[-1].remove(elem)
+
+    packages = {}
+    for def_id, definition in definitions.items():
+        seen = set()
+        for test_id in definition.pop('tests'):
+            test = tests.get(test_id)
+            if not test or 'object_ref' not in test or 'state_ref' not in test:
+                continue
+            name = objects.get(test['object_ref'])
+            version = states.get(test['state_ref'])
+            if not name or not version:
+                continue
+            for pkg in variables.get(name, [name]):
+                if (pkg, version) not in seen:
+                    seen.add((pkg, version))
+                    packages.setdefault(pkg, []).append([version, def_id])
+    log.debug('compiled OVAL feed: %d definitions, %d packages, from %d tests',
+              len(definitions), len(packages), len(tests))
+    return {'version': INDEX_VERSION,
+            'generator': generator,
+            'definitions': definitions,
+            'packages': packages}
+
+
+def affected(index, local_pkgs, flavor='rpm'):
+    """ yield (name, fixed_version, def_id) for every installed package that
+        is older than a version fixing one of the index's definitions
+
+        Each installed package is only compared with its own fixed versions,
+        by hubblestack.utils.vercmp with the given flavor ('rpm' or 'dpkg');
+        of several installed versions the newest counts.
+    """
+    packages = index['packages']
+    for name, local_ver in local_pkgs.items():
+        fixes = packages.get(name)
+        if not fixes:
+            continue
+        local_ver = vercmp.newest(local_ver, flavor)
+        if local_ver is None:
+            continue
+        for fixed, def_id in fixes:
+            if vercmp.compare(fixed, local_ver, flavor) > 0:
+                yield name, fixed, def_id
+
+
+def _cache_file(cachedir, source):
+    digest = hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cachedir, 'oval-{0}.json'.format(digest))
+
+
+def _read_cache(path):
+    """ the index in a cache file, kept in memory until the file changes """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_mtime, st.st_size)
+    with _LOCK:
+        cached = _LOADED.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    try:
+        with open(path) as fh:
+            index = json.load(fh)
+    except (IOError, OSError, ValueError) as exc:
+        log.warning('ignoring unreadable OVAL index %s: %s', path, exc)
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    with _LOCK:
+        _LOADED[path] = (key, index)
+    return index
+
+
+def _write_cache(path, index):
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.oval-')
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(index, fh, separators=(',', ':'))
+        os.rename(tmp, path)
+    except (IOError, OSError) as exc:
+        log.warning('unable to cache the OVAL index in %s: %s', path, exc)
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return {'path': path, 'inode': st.st_ino, 'mtime': st.st_mtime, 'size': st.st_size}
+
+
+def _load_local(path, cache_path):
+    cached = _read_cache(cache_path)
+    signature = _file_signature(path)
+    if cached is not None and cached.get('source') == signature:
+        log.debug('OVAL feed %s unchanged, using the cached index', path)
+        return cached
+    log.info('Compiling local OVAL feed: %s', path)
+    index = compile_feed(path)
+    index['source'] = signature
+    _write_cache(cache_path, index)
+    return index
+
+
+def _load_remote(url, cache_path, timeout):
+    cached = _read_cache(cache_path)
+    headers = {}
+    if cached is not None:
+        source = cached.get('source', {})
+        if source.get('etag'):
+            headers['If-None-Match'] = source['etag']
+        if source.get('last_modified'):
+            headers['If-Modified-Since'] = source['last_modified']
+    try:
+        response = requests.get(url, headers=headers, stream=True, timeout=timeout)
+        if cached is not None and response.status_code == 304:
+            response.close()
+            log.debug('OVAL feed %s not modified, using the cached index', url)
+            return cached
+        response.raise_for_status()
+        log.info('Reading remote file: %s, this could take some time...', url)
+        response.raw.decode_content = True
+        try:
+            index = compile_feed(response.raw)
+        finally:
+            response.close()
+    except Exception as exc:
+        if cached is not None:
+            log.warning('unable to refresh OVAL feed %s (%s), using the cached index', url, exc)
+            return cached
+        raise
+    index['source'] = {'url': url,
+                       'etag': response.headers.get('ETag'),
+                       'last_modified': response.headers.get('Last-Modified')}
+    _write_cache(cache_path, index)
+    return index
+
+
+def load_index(source, cachedir, timeout=FETCH_TIMEOUT):
+    """ the index of an OVAL feed (a URL or a local path), compiled only when
+        the feed changed since the index in cachedir was built
+    """
+    cache_path = _cache_file(cachedir, source)
+    if '://' not in source:
+        return _load_local(source, cache_path)
+    if not HAS_REQUESTS:
+        raise RuntimeError('the requests library is needed to fetch {0}'.format(source))
+    return _load_remote(source, cache_path, timeout)
@@ -0,0 +1,278 @@
+# -*- encoding: utf-8 -*-
+"""
+Path matching structures for pulsar.
+
+Pulsar used to wrap every exclude pattern of a watch config in a closure,
+rebuilt (``re.compile`` and all) for every inotify event, and to try the
+closures one after the other -- so each event cost a compile and a test per
+pattern. Here an exclude list is compiled once into an ExcludeMatcher, which
+answers in about the length of the path:
+
+* plain excludes are path prefixes (as before); they go into a character
+  trie, walked once along the path
+* globs are indexed by their literal head (``/var/log/*.gz`` under
+  ``/var/log/``) in the same trie, so only the globs whose head matches the
+  path are tried; ``*<suffix>`` globs go into a trie of reversed suffixes
+* regexes (``{pattern: {regex: True}}``) are combined into a single regex
+
+A PathTrie maps paths by component, and finds the longest mapped prefix of a
+path (the watch config an event falls under, the watched directory above a
+file) in about the depth of the path rather than the number of entries.
+
+.. code-block:: python
+
+    import hubblestack.utils.pathmatch as pathmatch
+
+    excluded = pathmatch.compile_excludes(config[cpath].get('exclude'))
+    if not excluded(pathname):
+        ...
+
+    configs = pathmatch.PathTrie((path, conf) for path, conf in config.items())
+    cpath, conf = configs.longest_prefix(pathname)
+
+Globs are matched with fnmatch's rules against the whole path.
+"""
+
+import fnmatch
+import logging
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+__all__ = ['ExcludeMatcher', 'PathTrie', 'compile_excludes']
+
+COMPILE_CACHE_SIZE = 256
+
+# trie node keys that can't be a character of a path
+_END = ''
+_GLOBS = None
+# PathTrie node key of the entry (path, value); components are non-empty strings
+_ENTRY = None
+
+_WILDCARDS = re.compile(r'[*?[]')
+# backreferences and global flags change meaning in a combined regex
+_SEPARATE = re.compile(r'\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)')
+
+# frozen exclude list -> ExcludeMatcher
+_COMPILED = {}
+_LOCK = threading.Lock()
+
+
+def _insert(root, key):
+    node = root
+    for char in key:
+        node = node.setdefault(char, {})
+    return node
+
+
+class ExcludeMatcher(object):
+    """ whether a path is excluded by any of a list of excludes """
+
+    def __init__(self, excludes=None):
+        self.prefixes = {}
+        self.suffixes = {}
+        self.regex = None
+        self.regexes = []
+        self.count = 0
+        pending = []
+        for exclude in excludes or []:
+            if isinstance(exclude, dict):
+                if not exclude:
+                    continue
+                pattern, options = next(iter(exclude.items()))
+                if isinstance(options, dict) and options.get('regex'):
+                    pending.append(pattern)
+                    continue
+                exclude = pattern
+            self.add(exclude)
+        self._add_regexes(pending)
+
+    def add(self, pattern):
+        """ add a plain (prefix) or glob exclude """
+        pattern = str(pattern)
+        self.count += 1
+        wildcard = _WILDCARDS.search(pattern)
+        if wildcard is None:
+            _insert(self.prefixes, pattern)[_END] = True
+            return
+        head = pattern[:wildcard.start()]
+        rest = pattern[wildcard.start():]
+        if not head and rest.startswith('*') and not _WILDCARDS.search(rest[1:]):
+            # '*<suffix>': anything ending with the suffix
+            _insert(self.suffixes, rest[1:][::-1])[_END] = True
+            return
+        regex = re.compile(fnmatch.translate(pattern))
+        _insert(self.prefixes, head).setdefault(_GLOBS, []).append(regex)
+
+    def _add_regexes(self, patterns):
+        compiled = []
+        for pattern in patterns:
+            try:
+                compiled.append((pattern, re.compile(pattern)))
+            except Exception as exc:
+                log.warning('Failed to compile regex "%s": %s', pattern, exc)
+        self.count += len(compiled)
+        combinable = [pattern for pattern, _ in compiled if not _SEPARATE.search(pattern)]
+        self.regexes = [regex for pattern, regex in compiled if _SEPARATE.search(pattern)]
+        if not combinable:
+            return
+        try:
+            self.regex = re.compile('|'.join('(?:{0})'.format(pattern) for pattern in combinable))
+        except Exception:
+            self.regexes.extend(regex for pattern, regex in compiled
+                                if pattern in combinable)
+
+    def __call__(self, path):
+        node = self.prefixes
+        for char in path:
+            if _END in node:
+                return True
+            globs = node.get(_GLOBS)
+            if globs is not None:
+                for glob in globs:
+                    if glob.match(path):
+                        return True
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if _END in node:
+                return True
+            for glob in node.get(_GLOBS) or ():
+                if glob.match(path):
+                    return True
+        if self.suffixes:
+            node = self.suffixes
+            for char in reversed(path):
+                if _END in node:
+                    return True
+                node = node.get(char)
+                if node is None:
+                    break
+            else:
+                if _END in node:
+                    return True
+        if self.regex is not None and self.regex.search(path):
+            return True
+        for regex in self.regexes:
+            if regex.search(path):
+                return True
+        return False
+
+    def __len__(self):
+        return self.count
+
+
+def _freeze(excludes):
+    ret = []
+    for exclude in excludes:
+        if isinstance(exclude, dict):
+            ret.append(tuple(sorted((str(key), bool(isinstance(val, dict) and val.get('regex')))
+                                    for key, val in exclude.items())))
+        else:
+            ret.append(str(exclude))
+    return tuple(ret)
+
+
+def _never(path):
+    return False
+
+
+def compile_excludes(excludes):
+    """ the ExcludeMatcher of an exclude list, shared by equal lists """
+    if not isinstance(excludes, (list, tuple)) or not excludes:
+        return _never
+    key = _freeze(excludes)
+    with _LOCK:
+        matcher = _COMPILED.get(key)
+    if matcher is None:
+        matcher = ExcludeMatcher(excludes)
+        with _LOCK:
+            if len(_COMPILED) >= COMPILE_CACHE_SIZE:
+                _COMPILED.clear()
+            _COMPILED[key] = matcher
+    return matcher
+
+
+def _components(path):
+    return [part for part in path.split('/') if part]
+
+
+class PathTrie(object):
+    """ a mapping of absolute paths, stored by path component """
+
+    def __init__(self, items=None):
+        self.root = {}
+        self.count = 0
+        for path, value in items or ():
+            self[path] = value
+
+    def _node(self, path):
+        node = self.root
+        for part in _components(path):
+            node = node.get(part)
+            if node is None:
+                return None
+        return node
+
+    def __setitem__(self, path, value):
+        node = self.root
+        for part in _components(path):
+            node = node.setdefault(part, {})
+        if _ENTRY not in node:
+            self.count += 1
+        node[_ENTRY] = (path, value)
+
+    def __getitem__(self, path):
+        node = self._node(path)
+        if node is None or _ENTRY not in node:
+            raise KeyError(path)
+        return node[_ENTRY][1]
+
+    def get(self, path, default=None):
+        node = self._node(path)
+        if node is None or _ENTRY not in node:
+            return default
+        return node[_ENTRY][1]
+
+    def __contains__(self, path):
+        node = self._node(path)
+        return node is not None and _ENTRY in node
+
+    def pop(self, path, default=None):
+        """ remove path, and the nodes left empty by it """
+        trail = [(None, self.root)]
+        for part in _components(path):
+            node = trail[-1][1].get(part)
+            if node is None:
+                return default
+            trail.append((part, node))
+        node = trail[-1][1]
+        if _ENTRY not in node:
+            return default
+        value = node.pop(_ENTRY)[1]
+        self.count -= 1
+        while len(trail) > 1 and not trail[-1][1]:
+            part, _ = trail.pop()
+            del trail[-1][1][part]
+        return value
+
+    def __delitem__(self, path):
+        if path not in self:
+            raise KeyError(path)
+        self.pop(path)
+
+    def longest_prefix(self, path):
+        """ the (path, value) of the deepest entry at or above path, or None """
+        node = self.root
+        found = node.get(_ENTRY)
+        for part in _components(path):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(_ENTRY, found)
+        return found
+
+    def __len__(self):
+        return self.count
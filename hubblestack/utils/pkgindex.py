@@ -0,0 +1,129 @@
+# -*- encoding: utf-8 -*-
+"""
+An in-memory index of the installed packages.
+
+One ``pkg.list_pkgs`` call is turned into a name -> versions index which
+answers "is it installed", "which versions" and "does the installed version
+satisfy <=/>=/==" for any number of checks, including glob package names,
+without going back to rpm/dpkg.
+
+When several versions of a package are installed (kernels, mostly) the
+ordering operators ('<=', '>=', '<', '>') compare the newest of them, so an
+old kernel left next to a new one neither satisfies a minimum nor hides a
+too-new one; '==' passes if the pegged version is one of those installed.
+A package that is not installed satisfies none of the operators. Compared
+with the ``LooseVersion(pkg.version(name))`` checks this replaces, that only
+changes '<=', which used to pass for a missing package ('' compared lowest),
+and '==', which used to need the exact string salt reported and now also
+matches e.g. '4.2.46' against an installed '4.2.46-31.el7'.
+
+.. code-block:: python
+
+    from hubblestack.utils.pkgindex import package_index
+
+    index = package_index(__salt__, __grains__)
+    index.installed('telnet*')
+    index.satisfies('openssh-server', '>=', '7.4p1')
+
+Within a run (see hubblestack.utils.facts) the index is built once and shared.
+"""
+
+import fnmatch
+import logging
+import re
+
+import hubblestack.utils.facts as facts
+from hubblestack.utils.vercmp import compare, flavor_for, newest
+
+log = logging.getLogger(__name__)
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+_GLOB_CHARS = re.compile(r'[*?\[]')
+
+
+class PackageIndex(object):
+    """ name -> [versions] index of installed packages
+
+        packages
+            the return of ``pkg.list_pkgs``; values may be a version string,
+            a comma separated string of versions or a list of versions
+
+        flavor
+            'rpm' or 'dpkg', selecting the version comparison semantics
+    """
+
+    def __init__(self, packages, flavor='rpm'):
+        self.flavor = flavor
+        self.packages = {}
+        for name, versions in (packages or {}).items():
+            if isinstance(versions, string_types):
+                versions = versions.split(',')
+            self.packages[name] = [ver.strip() for ver in versions if ver and ver.strip()]
+        self._globs = {}
+
+    def __len__(self):
+        return len(self.packages)
+
+    def __contains__(self, name):
+        return self.installed(name)
+
+    def names(self, name):
+        """ installed package names matching name (a name or a glob) """
+        if not _GLOB_CHARS.search(name):
+            return [name] if self.packages.get(name) else []
+        matches = self._globs.get(name)
+        if matches is None:
+            regex = re.compile(fnmatch.translate(name))
+            matches = self._globs[name] = sorted(pkg for pkg in self.packages
+                                                 if regex.match(pkg) and self.packages[pkg])
+        return matches
+
+    def versions(self, name):
+        """ every installed version of the package(s) matching name """
+        ret = []
+        for pkg in self.names(name):
+            ret.extend(self.packages[pkg])
+        return ret
+
+    def version(self, name):
+        """ like ``pkg.version``: the installed versions joined with commas,
+            or '' if not installed
+        """
+        return ','.join(self.versions(name))
+
+    def installed(self, name):
+        return bool(self.names(name))
+
+    def compare(self, one, two):
+        return compare(one, two, self.flavor)
+
+    def satisfies(self, name, operator, version):
+        """ whether ``<installed> <operator> <version>`` holds; operator is
+            one of '<=', '>=', '<', '>' (compared with the newest installed
+            version) or '==' (any installed version); a missing package
+            never satisfies
+        """
+        versions = self.versions(name)
+        if not versions:
+            return False
+        if operator == '==':
+            return any(installed == version or self.compare(installed, version) == 0
+                       for installed in versions)
+        ret = self.compare(newest(versions, self.flavor), version)
+        return ((operator == '<=' and ret <= 0) or (operator == '>=' and ret >= 0) or
+                (operator == '<' and ret < 0) or (operator == '>' and ret > 0))
+
+def package_index(salt, grains=None):
+    """ the PackageIndex for this host, built from a single ``pkg.list_pkgs``
+        and shared for the rest of the run
+    """
+    def collect():
+        packages = salt['pkg.list_pkgs'](versions_as_list=True)
+        index = PackageIndex(packages, flavor_for(grains))
+        log.debug('indexed %d installed packages', len(index))
+        return index
+    return facts.snapshot().get(('pkg_index',), collect)
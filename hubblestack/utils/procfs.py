@@ -0,0 +1,246 @@
+# -*- encoding: utf-8 -*-
+"""
+Direct readers for the procfs sources behind ``sysctl.get``,
+``mount.active`` and ``network.netstat``.
+
+Those salt functions shell out (``sysctl -n``, ``netstat -tulpnea``/``ss``)
+once per call even though everything they report sits in ``/proc/sys``,
+``/proc/self/mountinfo`` and ``/proc/net/{tcp,tcp6,udp,udp6}``. The readers
+here parse the files in-process, in one pass, and memoize the result in the
+run's fact snapshot (see hubblestack.utils.facts).
+
+Every reader returns None when its source isn't there (not linux, no /proc
+mounted, ...) so callers can fall back to the salt function.
+
+.. code-block:: python
+
+    import hubblestack.utils.procfs as procfs
+
+    procfs.sysctl('kernel.randomize_va_space')    # '2'
+    procfs.mounts()['/tmp']['opts']              # ['rw', 'nosuid', 'nodev']
+    procfs.netstat()[0]['local-address']          # '0.0.0.0:22'
+"""
+
+import logging
+import os
+import pwd
+import socket
+import struct
+
+import hubblestack.utils.facts as facts
+
+log = logging.getLogger(__name__)
+
+__all__ = ['sysctl', 'mounts', 'netstat', 'PROC']
+
+PROC = '/proc'
+
+# include/net/tcp_states.h
+TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+}
+
+_NET_TABLES = ('tcp', 'tcp6', 'udp', 'udp6')
+
+
+def _read(path):
+    try:
+        with open(path) as fh:
+            return fh.read()
+    except (IOError, OSError) as exc:
+        log.debug('unable to read %s: %s', path, exc)
+        return None
+
+
+def sysctl(name, proc=None):
+    """ the value of a kernel parameter, as ``sysctl -n`` prints it, or None
+        if it can't be read from /proc/sys
+    """
+    proc = proc or PROC
+
+    def collect():
+        # sysctl swaps '.' and '/' (net.ipv4.conf.eth0/100.rp_filter)
+        relpath = '/'.join(part.replace('/', '.') for part in name.split('.'))
+        value = _read(os.path.join(proc, 'sys', relpath))
+        if value is None:
+            return None
+        return value.rstrip('\n')
+    return facts.snapshot().get(('procfs', 'sysctl', proc, name), collect, cost=0)
+
+
+def _unescape(field):
+    # mountinfo escapes space, tab, newline and backslash as \ooo
+    if '\\' not in field:
+        return field
+    ret = []
+    i = 0
+    while i < len(field):
+        if field[i] == '\\' and field[i + 1:i + 4].isdigit():
+            ret.append(chr(int(field[i + 1:i + 4], 8)))
+            i += 4
+        else:
+            ret.append(field[i])
+            i += 1
+    return ''.join(ret)
+
+
+def _parse_mountinfo(text):
+    ret = {}
+    for line in text.splitlines():
+        comps = line.split()
+        try:
+            sep = comps.index('-', 6)
+        except ValueError:
+            continue
+        if len(comps) < sep + 3:
+            continue
+        major, _, minor = comps[2].partition(':')
+        mount_point = _unescape(comps[4])
+        # a later mount on the same point hides the earlier one
+        ret[mount_point] = {'mountid': comps[0],
+                            'parentid': comps[1],
+                            'major': major,
+                            'minor': minor,
+                            'root': _unescape(comps[3]),
+                            'opts': comps[5].split(','),
+                            'fstype': comps[sep + 1],
+                            'device': _unescape(comps[sep + 2]),
+                            'superopts': comps[sep + 3].split(',') if len(comps) > sep + 3 else []}
+    return ret
+
+
+def mounts(proc=None):
+    """ the active mounts keyed by mount point, shaped like ``mount.active``
+        (opts are the per-mount options, superopts the filesystem's), or None
+    """
+    proc = proc or PROC
+
+    def collect():
+        text = _read(os.path.join(proc, 'self', 'mountinfo'))
+        if text is None:
+            return None
+        return _parse_mountinfo(text)
+    return facts.snapshot().get(('procfs', 'mounts', proc), collect, cost=0)
+
+
+def _ipv4(hexaddr):
+    # the kernel prints the raw __be32 as a host-order integer
+    return socket.inet_ntoa(struct.pack('=I', int(hexaddr, 16)))
+
+
+def _ipv6(hexaddr):
+    packed = b''.join(struct.pack('=I', int(hexaddr[i:i + 8], 16)) for i in range(0, 32, 8))
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+def _endpoint(value, ipv6):
+    hexaddr, _, hexport = value.partition(':')
+    address = _ipv6(hexaddr) if ipv6 else _ipv4(hexaddr)
+    port = int(hexport, 16)
+    return '{0}:{1}'.format(address, port if port else '*')
+
+
+def _socket_owners(proc, inodes):
+    """ map socket inode -> 'pid/comm' (netstat -p style) for the wanted
+        inodes; processes we can't look into are skipped, as netstat does
+    """
+    ret = {}
+    if not inodes:
+        return ret
+    try:
+        pids = [pid for pid in os.listdir(proc) if pid.isdigit()]
+    except OSError:
+        return ret
+    for pid in pids:
+        fd_dir = os.path.join(proc, pid, 'fd')
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        comm = None
+        for fd in fds:
+            try:
+                target = os.readlink(os.path.join(fd_dir, fd))
+            except OSError:
+                continue
+            if not target.startswith('socket:['):
+                continue
+            inode = target[8:-1]
+            if inode not in inodes or inode in ret:
+                continue
+            if comm is None:
+                comm = (_read(os.path.join(proc, pid, 'comm')) or '').strip()
+            ret[inode] = '{0}/{1}'.format(pid, comm)
+        if len(ret) == len(inodes):
+            break
+    return ret
+
+
+def _user(uid, cache):
+    if uid not in cache:
+        try:
+            cache[uid] = pwd.getpwuid(int(uid)).pw_name
+        except (KeyError, ValueError):
+            cache[uid] = uid
+    return cache[uid]
+
+
+def _parse_net_table(text, proto, users):
+    ret = []
+    ipv6 = proto.endswith('6')
+    for line in text.splitlines()[1:]:
+        comps = line.split()
+        if len(comps) < 10:
+            continue
+        tx_queue, _, rx_queue = comps[4].partition(':')
+        state = ''
+        if proto.startswith('tcp'):
+            state = TCP_STATES.get(comps[3], comps[3])
+        elif comps[3] == '01':
+            state = 'ESTABLISHED'
+        ret.append({'proto': proto,
+                    'recv-q': str(int(rx_queue, 16)),
+                    'send-q': str(int(tx_queue, 16)),
+                    'local-address': _endpoint(comps[1], ipv6),
+                    'remote-address': _endpoint(comps[2], ipv6),
+                    'state': state,
+                    'user': _user(comps[7], users),
+                    'inode': comps[9],
+                    'program': '-'})
+    return ret
+
+
+def netstat(proc=None):
+    """ the tcp/udp sockets, shaped like linux ``network.netstat``, or None
+
+        Entries are shared for the rest of the run; copy before modifying.
+    """
+    proc = proc or PROC
+
+    def collect():
+        ret = []
+        users = {}
+        found = False
+        for proto in _NET_TABLES:
+            text = _read(os.path.join(proc, 'net', proto))
+            if text is None:
+                continue
+            found = True
+            ret.extend(_parse_net_table(text, proto, users))
+        if not found:
+            return None
+        owners = _socket_owners(proc, set(entry['inode'] for entry in ret if entry['inode'] != '0'))
+        for entry in ret:
+            entry['program'] = owners.get(entry['inode'], '-')
+        return ret
+    return facts.snapshot().get(('procfs', 'netstat', proc), collect, cost=0)
@@ -0,0 +1,305 @@
+# -*- encoding: utf-8 -*-
+"""
+Warm restarts for pulsar: a snapshot of its watches and of the files under
+them.
+
+After a restart pulsar walked every configured tree again to rebuild its
+watches, and knew nothing of what the files looked like before -- a change
+made while hubble was down went unnoticed. A Snapshot, kept in the cachedir,
+holds a digest of the config, the watched paths under each configured path,
+and a baseline of each watched path and of the entries of the watched
+directories: ``[inode, size, mtime_ns, is_dir, checksum]`` (the checksum if
+pulsar had one; is_dir is 2 for the watched directories, whose entries are
+baselined too). On start, if the config digest still matches,
+``reconcile()`` stats the baselined paths and returns an OfflineEvent for
+each that was deleted, replaced or modified, and for each new entry of a
+directory that changed (and, for a new directory, everything below it).
+The watches are then added from the snapshot without walking the trees;
+only the new directories are scanned.
+
+.. code-block:: python
+
+    import hubblestack.utils.snapshot as snapshot
+
+    snap = snapshot.Snapshot('/var/cache/hubble/pulsar_snapshot.z')
+    state = snap.load(snapshot.config_digest(config))
+    if state is not None:
+        found = snapshot.reconcile(state['baselines'])
+        found.events      # [OfflineEvent('/etc/passwd', 'IN_MODIFY'), ...]
+        found.deleted     # set of the baselined paths that are gone
+        found.new_dirs    # directories created while we were down
+    ...
+    snap.save(digest, watches, snapshot.scan_baselines(dirs, checksums))
+    snap.touch(alerted_paths)
+    if snap.refresh_due():
+        snap.refresh(checksums)
+
+The baselines are rescanned every ``interval`` seconds. In between, the
+files pulsar alerted on are ``touch()``-ed and ``refresh()`` re-baselines
+just those in the saved state, so a change already alerted on isn't
+reported again as offline after a restart.
+
+The snapshot is zlib compressed JSON, written to a temporary file and
+renamed into place.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import stat
+import tempfile
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Snapshot', 'OfflineEvent', 'Reconciled', 'config_digest', 'baseline',
+           'scan_baselines', 'reconcile']
+
+STATE_VERSION = 1
+DEFAULT_INTERVAL = 300
+DEFAULT_REFRESH = 10
+
+# inotify's values, for the events pulsar builds its alerts from
+IN_MODIFY = 0x00000002
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+_MASKS = {'IN_MODIFY': IN_MODIFY, 'IN_CREATE': IN_CREATE, 'IN_DELETE': IN_DELETE}
+
+# config keys that don't change what's watched
+_VOLATILE = ('verbose',)
+
+Reconciled = collections.namedtuple('Reconciled', 'events deleted new_dirs counts')
+
+
+def config_digest(config):
+    """ a digest of the config, less the keys that don't affect the watches """
+    blob = json.dumps(dict((k, v) for k, v in config.items() if k not in _VOLATILE),
+                      sort_keys=True, default=repr)
+    return hashlib.sha1(blob.encode('utf-8')).hexdigest()
+
+
+def _mtime_ns(st):
+    value = getattr(st, 'st_mtime_ns', None)
+    if value is None:
+        value = int(st.st_mtime * 1000000000)
+    return value
+
+
+def baseline(st, checksum=None):
+    """ [inode, size, mtime_ns, is_dir, checksum] of an lstat() result """
+    return [st.st_ino, st.st_size, _mtime_ns(st), int(stat.S_ISDIR(st.st_mode)), checksum]
+
+
+def _entries(path):
+    try:
+        return [os.path.join(path, name) for name in os.listdir(path)]
+    except OSError:
+        return []
+
+
+def scan_baselines(paths, checksums=None):
+    """ the baselines of the paths and, for directories, of their entries;
+        checksums maps paths to the last checksum known for them
+    """
+    checksums = checksums or {}
+    ret = {}
+    for path in paths:
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        ret[path] = baseline(st, checksums.get(path))
+        if not stat.S_ISDIR(st.st_mode):
+            continue
+        ret[path][3] = 2
+        for entry in _entries(path):
+            if entry in ret:
+                continue
+            try:
+                ret[entry] = baseline(os.lstat(entry), checksums.get(entry))
+            except OSError:
+                pass
+    return ret
+
+
+class OfflineEvent(object):
+    """ a change found by reconcile(), with the attributes of the pyinotify
+        events pulsar uses
+    """
+
+    def __init__(self, pathname, change, isdir=False):
+        self.pathname = pathname
+        self.path, self.name = os.path.split(pathname)
+        self.wd = None
+        self.cookie = 0
+        self.dir = bool(isdir)
+        self.mask = _MASKS[change] | (IN_ISDIR if isdir else 0)
+        self.maskname = '{0}|IN_ISDIR'.format(change) if isdir else change
+
+    def __repr__(self):
+        return '<OfflineEvent {0} {1}>'.format(self.pathname, self.maskname)
+
+
+def _created(path, events, counts):
+    """ an IN_CREATE for path and, if it's a directory, everything below it """
+    isdir = os.path.isdir(path) and not os.path.islink(path)
+    events.append(OfflineEvent(path, 'IN_CREATE', isdir))
+    counts['created'] += 1
+    if not isdir:
+        return
+    for dirpath, dirs, files in os.walk(path):
+        for name in dirs:
+            events.append(OfflineEvent(os.path.join(dirpath, name), 'IN_CREATE', True))
+        for name in files:
+            events.append(OfflineEvent(os.path.join(dirpath, name), 'IN_CREATE'))
+        counts['created'] += len(dirs) + len(files)
+
+
+def reconcile(baselines):
+    """ compare the baselines with the filesystem; returns the OfflineEvents,
+        the paths deleted, the directories created and the counts
+    """
+    events = []
+    deleted = set()
+    new_dirs = []
+    counts = dict((key, 0) for key in ('checked', 'modified', 'created', 'deleted'))
+    started = time.time()
+    for path, base in baselines.items():
+        counts['checked'] += 1
+        try:
+            st = os.lstat(path)
+        except OSError:
+            deleted.add(path)
+            events.append(OfflineEvent(path, 'IN_DELETE', base[3]))
+            counts['deleted'] += 1
+            continue
+        isdir = stat.S_ISDIR(st.st_mode)
+        if st.st_ino != base[0] or isdir != bool(base[3]):
+            # replaced by something else
+            _created(path, events, counts)
+            if isdir:
+                new_dirs.append(path)
+        elif st.st_size != base[1] or _mtime_ns(st) != base[2]:
+            if not isdir:
+                events.append(OfflineEvent(path, 'IN_MODIFY'))
+                counts['modified'] += 1
+                continue
+            if base[3] != 2:
+                continue
+            # entries were added or removed; the removed ones have baselines
+            for entry in _entries(path):
+                if entry not in baselines:
+                    _created(entry, events, counts)
+                    if os.path.isdir(entry) and not os.path.islink(entry):
+                        new_dirs.append(entry)
+    counts['elapsed'] = time.time() - started
+    return Reconciled(events, deleted, new_dirs, counts)
+
+
+class Snapshot(object):
+    """ the persisted watches and baselines of a pulsar """
+
+    def __init__(self, path, interval=DEFAULT_INTERVAL, refresh_interval=DEFAULT_REFRESH):
+        self.path = path
+        self.interval = interval
+        self.refresh_interval = refresh_interval
+        self.saved = 0
+        self.refreshed = 0
+        # the state last loaded or saved, and the paths to re-baseline in it
+        self.state = None
+        self.touched = set()
+
+    def due(self, now=None):
+        """ whether interval seconds passed since the last save """
+        now = time.time() if now is None else now
+        return now - self.saved >= self.interval
+
+    def refresh_due(self, now=None):
+        """ whether there are touched paths and refresh_interval seconds
+            passed since the last refresh
+        """
+        now = time.time() if now is None else now
+        return bool(self.touched) and now - self.refreshed >= self.refresh_interval
+
+    def touch(self, paths):
+        """ note paths alerted on, for refresh() to re-baseline """
+        self.touched.update(paths)
+
+    def load(self, digest):
+        """ the state saved for the config digest, or None """
+        try:
+            with open(self.path, 'rb') as fh:
+                state = json.loads(zlib.decompress(fh.read()).decode('utf-8'))
+        except (IOError, OSError, ValueError, zlib.error):
+            return None
+        if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+            return None
+        if state.get('config') != digest:
+            log.info('pulsar snapshot %s is of another config; ignoring it', self.path)
+            return None
+        self.state = state
+        return state
+
+    def save(self, digest, watches, baselines, now=None):
+        """ persist the watches ({configured path: [watched paths]}) and the
+            baselines for the config digest
+        """
+        now = time.time() if now is None else now
+        state = {'version': STATE_VERSION, 'config': digest, 'saved': now,
+                 'watches': dict((k, sorted(v)) for k, v in watches.items()),
+                 'baselines': baselines}
+        # the baselines were just scanned
+        self.touched = set()
+        if not self._write(state):
+            return False
+        self.saved = self.refreshed = now
+        return True
+
+    def refresh(self, checksums=None, now=None):
+        """ re-baseline the touched files in the state last saved (or
+            loaded) and write it; directories are left to the next save, so
+            the ones created meanwhile are still found by reconcile()
+        """
+        now = time.time() if now is None else now
+        touched, self.touched = self.touched, set()
+        if self.state is None or not touched:
+            return False
+        checksums = checksums or {}
+        baselines = self.state['baselines']
+        for path in touched:
+            old = baselines.get(path)
+            if old is not None and old[3]:
+                continue
+            if old is None:
+                # only entries of the watched directories have baselines
+                parent = baselines.get(os.path.dirname(path))
+                if parent is None or parent[3] != 2:
+                    continue
+            try:
+                st = os.lstat(path)
+            except OSError:
+                baselines.pop(path, None)
+                continue
+            if not stat.S_ISDIR(st.st_mode):
+                baselines[path] = baseline(st, checksums.get(path))
+        self.refreshed = now
+        return self._write(self.state)
+
+    def _write(self, state):
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.pulsar-snapshot-')
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(zlib.compress(json.dumps(state).encode('utf-8')))
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as exc:
+            log.warning('unable to save the pulsar snapshot to %s: %s', self.path, exc)
+            return False
+        self.state = state
+        return True
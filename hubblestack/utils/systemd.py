@@ -0,0 +1,218 @@
+# -*- encoding: utf-8 -*-
+"""
+A per-run snapshot of systemd's unit states.
+
+The service, systemctl and misc nova modules used to ask systemd about one
+unit at a time -- ``service.available``, ``service.status`` and
+``service.enabled`` are a ``systemctl`` each, ``check_service_status`` two or
+three more -- so a CIS profile ran dozens of ``systemctl`` per audit. Here
+``systemctl list-unit-files`` and ``systemctl list-units --all`` run once per
+run, their output is parsed into a UnitTable, and every unit question is a
+lookup.
+
+.. code-block:: python
+
+    import hubblestack.utils.systemd as systemd
+
+    table = systemd.unit_table(__salt__)
+    if table is not None:
+        table.is_enabled('sshd')     # True/False, or None if unsure
+        table.is_active('sshd')
+
+The answers follow ``systemctl is-enabled``/``is-active``: a unit is enabled
+when is-enabled would exit 0 (enabled, static, indirect, generated, ...) and
+running when is-active would. Whenever the table can't be sure -- an alias or
+template it didn't list, a SysV init script -- it answers None and the caller
+asks systemd (through salt) as before.
+"""
+
+import logging
+import os
+
+import hubblestack.utils.facts as facts
+
+log = logging.getLogger(__name__)
+
+__all__ = ['Unit', 'UnitTable', 'unit_table', 'unit_name', 'parse_unit_files',
+           'parse_units', 'booted']
+
+# unit file states for which ``systemctl is-enabled`` exits 0
+ENABLED_STATES = frozenset(['enabled', 'enabled-runtime', 'static', 'alias', 'indirect',
+                            'generated', 'transient'])
+# active states for which ``systemctl is-active`` exits 0
+ACTIVE_STATES = frozenset(['active', 'reloading', 'refreshing'])
+
+UNIT_PATHS = ('/etc/systemd/system', '/run/systemd/system', '/usr/local/lib/systemd/system',
+              '/lib/systemd/system', '/usr/lib/systemd/system')
+INIT_D = '/etc/init.d'
+
+_UNIT_TYPES = ('service', 'socket', 'target', 'device', 'mount', 'automount', 'swap',
+               'timer', 'path', 'slice', 'scope')
+
+LIST_UNIT_FILES = ['systemctl', 'list-unit-files', '--no-legend', '--no-pager', '--plain']
+LIST_UNITS = ['systemctl', 'list-units', '--all', '--no-legend', '--no-pager', '--plain']
+
+
+def booted():
+    """ whether the host runs systemd (what sd_booted() checks) """
+    return os.path.isdir('/run/systemd/system')
+
+
+def unit_name(name):
+    """ the full unit name systemctl would use for name ('sshd' -> 'sshd.service') """
+    if name.rpartition('.')[2] in _UNIT_TYPES:
+        return name
+    return name + '.service'
+
+
+class Unit(object):
+    """ what systemd says about one unit
+
+        * file_state: the unit file state (enabled, disabled, static,
+          masked, ...), or None if the unit has no unit file listed
+        * load, active, sub: the list-units columns, or None if the unit
+          isn't loaded
+    """
+
+    __slots__ = ('name', 'file_state', 'load', 'active', 'sub')
+
+    def __init__(self, name):
+        self.name = name
+        self.file_state = None
+        self.load = None
+        self.active = None
+        self.sub = None
+
+
+class UnitTable(object):
+    """ the units known to systemd, by full unit name """
+
+    def __init__(self, unit_paths=UNIT_PATHS, init_d=INIT_D):
+        self.units = {}
+        self.unit_paths = unit_paths
+        self.init_d = init_d
+
+    def _unit(self, name):
+        unit = self.units.get(name)
+        if unit is None:
+            unit = self.units[name] = Unit(name)
+        return unit
+
+    def add_unit_file(self, name, state):
+        self._unit(name).file_state = state
+
+    def add_unit(self, name, load, active, sub):
+        unit = self._unit(name)
+        unit.load, unit.active, unit.sub = load, active, sub
+
+    def get(self, name):
+        return self.units.get(unit_name(name))
+
+    def names(self):
+        """ the listed unit file names, as ``list-unit-files`` shows them """
+        return sorted(name for name, unit in self.units.items() if unit.file_state)
+
+    def _absent(self, name):
+        """ whether name certainly isn't a unit systemd (or SysV init) knows:
+            no unit file of that name anywhere and no init script
+        """
+        full = unit_name(name)
+        if '@' in full:
+            return False
+        for path in self.unit_paths:
+            if os.path.lexists(os.path.join(path, full)):
+                return False
+        return not os.path.lexists(os.path.join(self.init_d, full.rpartition('.')[0]))
+
+    def file_state(self, name):
+        """ what ``systemctl is-enabled name`` prints; 'not-found' for a unit
+            that certainly doesn't exist, None if unsure
+        """
+        unit = self.get(name)
+        if unit is not None and unit.file_state:
+            return unit.file_state
+        full = unit_name(name)
+        if '@' in full:
+            # an instance is enabled through its template
+            template = full.split('@', 1)[0] + '@.' + full.rpartition('.')[2]
+            unit = self.units.get(template)
+            if unit is not None and unit.file_state in ('disabled', 'masked'):
+                return unit.file_state
+            return None
+        if self._absent(name):
+            return 'not-found'
+        return None
+
+    def is_enabled(self, name):
+        """ whether ``systemctl is-enabled name`` would succeed, or None """
+        state = self.file_state(name)
+        if state is None:
+            return None
+        return state in ENABLED_STATES
+
+    def is_active(self, name):
+        """ whether ``systemctl is-active name`` would succeed, or None """
+        unit = self.get(name)
+        if unit is not None and unit.active is not None:
+            return unit.active in ACTIVE_STATES
+        if unit is not None or self._absent(name):
+            # known but not loaded, or not there at all
+            return False
+        return None
+
+    def exists(self, name):
+        """ whether systemd knows the unit (what service.available checks), or None """
+        unit = self.get(name)
+        if unit is not None and (unit.file_state or unit.load not in (None, 'not-found')):
+            return True
+        if self._absent(name):
+            return False
+        return None
+
+
+def parse_unit_files(text, table=None):
+    """ add ``list-unit-files --no-legend`` output to a UnitTable """
+    table = table if table is not None else UnitTable()
+    for line in text.splitlines():
+        comps = line.split()
+        if len(comps) >= 2:
+            table.add_unit_file(comps[0], comps[1])
+    return table
+
+
+def parse_units(text, table=None):
+    """ add ``list-units --all --no-legend --plain`` output to a UnitTable """
+    table = table if table is not None else UnitTable()
+    for line in text.splitlines():
+        comps = line.split()
+        if comps and comps[0] in ('*', u'●'):
+            # failed units are marked when --plain isn't honored
+            comps = comps[1:]
+        if len(comps) >= 4:
+            table.add_unit(comps[0], comps[1], comps[2], comps[3])
+    return table
+
+
+def _systemctl(salt, argv):
+    ret = salt['cmd.run_all'](argv, python_shell=False, ignore_retcode=True)
+    if ret.get('retcode'):
+        log.debug('%s failed (%s): %s', ' '.join(argv), ret.get('retcode'), ret.get('stderr'))
+        return None
+    return ret.get('stdout', '')
+
+
+def unit_table(salt):
+    """ the UnitTable of this host, from two ``systemctl`` per run; None if
+        the host doesn't run systemd or systemctl fails
+    """
+    def collect():
+        if not booted():
+            return None
+        unit_files = _systemctl(salt, LIST_UNIT_FILES)
+        units = _systemctl(salt, LIST_UNITS)
+        if unit_files is None or units is None:
+            return None
+        table = parse_units(units, parse_unit_files(unit_files))
+        log.debug('systemd unit table: %d units from 2 systemctl calls', len(table.units))
+        return table
+    return facts.snapshot().get(('systemd_units',), collect, cost=2)
@@ -0,0 +1,242 @@
+# -*- encoding: utf-8 -*-
+"""
+Pure python package version comparison with rpm and dpkg semantics.
+
+``LooseVersion`` gets distro versions wrong (``1.0~rc1`` vs ``1.0``, epochs,
+``el7_4`` style releases, ...) and ``pkg.version_cmp`` can be expensive on some
+platforms. These are straight ports of rpm's ``rpmvercmp()``/EVR comparison and
+dpkg's ``verrevcmp()``/``dpkg_version_compare()``.
+
+All comparison functions return -1, 0 or 1. ``compare()`` picks the algorithm
+by flavor and memoizes results, since audits compare the same few version pairs
+over and over.
+"""
+
+import logging
+
+log = logging.getLogger(__name__)
+
+__all__ = ['rpmvercmp', 'rpm_evr_cmp', 'dpkg_verrevcmp', 'dpkg_cmp', 'compare',
+           'newest', 'flavor_for', 'parse_rpm_evr', 'parse_dpkg_version']
+
+_DIGITS = frozenset('0123456789')
+_ALPHA = frozenset('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
+_ALNUM = _DIGITS | _ALPHA
+
+# memo for compare(); cleared wholesale when it gets too large
+_CACHE = {}
+CACHE_SIZE = 65536
+
+
+def _sign(value):
+    return (value > 0) - (value < 0)
+
+
+def rpmvercmp(one, two):
+    """ compare two version (or release) strings the way rpm does """
+    if one == two:
+        return 0
+    i = j = 0
+    len1, len2 = len(one), len(two)
+    while i < len1 or j < len2:
+        while i < len1 and one[i] not in _ALNUM and one[i] not in '~^':
+            i += 1
+        while j < len2 and two[j] not in _ALNUM and two[j] not in '~^':
+            j += 1
+
+        # tilde sorts before everything else, even the end of the string
+        c1 = one[i] if i < len1 else ''
+        c2 = two[j] if j < len2 else ''
+        if c1 == '~' or c2 == '~':
+            if c1 != '~':
+                return 1
+            if c2 != '~':
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        # caret is like tilde, except the end of the string sorts before it
+        if c1 == '^' or c2 == '^':
+            if not c1:
+                return -1
+            if not c2:
+                return 1
+            if c1 != '^':
+                return 1
+            if c2 != '^':
+                return -1
+            i += 1
+            j += 1
+            continue
+
+        if not (c1 and c2):
+            break
+
+        start1, start2 = i, j
+        if c1 in _DIGITS:
+            while i < len1 and one[i] in _DIGITS:
+                i += 1
+            while j < len2 and two[j] in _DIGITS:
+                j += 1
+            isnum = True
+        else:
+            while i < len1 and one[i] in _ALPHA:
+                i += 1
+            while j < len2 and two[j] in _ALPHA:
+                j += 1
+            isnum = False
+
+        seg1 = one[start1:i]
+        seg2 = two[start2:j]
+        if not seg1:
+            return -1  # arbitrary, as in rpm
+        if not seg2:
+            return 1 if isnum else -1
+
+        if isnum:
+            seg1 = seg1.lstrip('0')
+            seg2 = seg2.lstrip('0')
+            if len(seg1) != len(seg2):
+                return 1 if len(seg1) > len(seg2) else -1
+        if seg1 != seg2:
+            return 1 if seg1 > seg2 else -1
+
+    if i >= len1 and j >= len2:
+        return 0
+    # whichever version still has characters left over wins
+    return -1 if i >= len1 else 1
+
+
+def parse_rpm_evr(version):
+    """ split '[epoch:]version[-release]' into (epoch, version, release);
+        missing parts are None (epoch defaults to 0)
+    """
+    epoch = 0
+    if ':' in version:
+        head, _, rest = version.partition(':')
+        if head.isdigit():
+            epoch, version = int(head), rest
+        elif not head:
+            version = rest
+    release = None
+    if '-' in version:
+        version, _, release = version.rpartition('-')
+    return epoch, version, release
+
+
+def rpm_evr_cmp(one, two):
+    """ compare full rpm EVR strings; a release only matters when both
+        sides have one (as rpm does when matching dependencies)
+    """
+    e1, v1, r1 = parse_rpm_evr(one)
+    e2, v2, r2 = parse_rpm_evr(two)
+    if e1 != e2:
+        return 1 if e1 > e2 else -1
+    ret = rpmvercmp(v1, v2)
+    if ret or r1 is None or r2 is None:
+        return ret
+    return rpmvercmp(r1, r2)
+
+
+def _dpkg_order(char):
+    if not char or char in _DIGITS:
+        return 0
+    if char in _ALPHA:
+        return ord(char)
+    if char == '~':
+        return -1
+    return ord(char) + 256
+
+
+def dpkg_verrevcmp(one, two):
+    """ compare two upstream versions (or revisions) the way dpkg does """
+    i = j = 0
+    len1, len2 = len(one), len(two)
+    while i < len1 or j < len2:
+        first_diff = 0
+        while (i < len1 and one[i] not in _DIGITS) or (j < len2 and two[j] not in _DIGITS):
+            ac = _dpkg_order(one[i] if i < len1 else '')
+            bc = _dpkg_order(two[j] if j < len2 else '')
+            if ac != bc:
+                return _sign(ac - bc)
+            i += 1
+            j += 1
+        while i < len1 and one[i] == '0':
+            i += 1
+        while j < len2 and two[j] == '0':
+            j += 1
+        while i < len1 and one[i] in _DIGITS and j < len2 and two[j] in _DIGITS:
+            if not first_diff:
+                first_diff = ord(one[i]) - ord(two[j])
+            i += 1
+            j += 1
+        if i < len1 and one[i] in _DIGITS:
+            return 1
+        if j < len2 and two[j] in _DIGITS:
+            return -1
+        if first_diff:
+            return _sign(first_diff)
+    return 0
+
+
+def parse_dpkg_version(version):
+    """ split '[epoch:]upstream[-revision]' into (epoch, upstream, revision) """
+    version = version.strip()
+    epoch = 0
+    head, sep, rest = version.partition(':')
+    if sep and head.isdigit():
+        epoch, version = int(head), rest
+    revision = ''
+    if '-' in version:
+        version, _, revision = version.rpartition('-')
+    return epoch, version, revision
+
+
+def dpkg_cmp(one, two):
+    """ compare full debian version strings """
+    e1, u1, r1 = parse_dpkg_version(one)
+    e2, u2, r2 = parse_dpkg_version(two)
+    if e1 != e2:
+        return 1 if e1 > e2 else -1
+    return dpkg_verrevcmp(u1, u2) or dpkg_verrevcmp(r1, r2)
+
+
+_COMPARATORS = {'rpm': rpm_evr_cmp, 'dpkg': dpkg_cmp}
+
+
+def compare(one, two, flavor='rpm'):
+    """ memoized comparison of two package versions; flavor is 'rpm' or
+        'dpkg' (see flavor_for())
+    """
+    key = (flavor, one, two)
+    try:
+        return _CACHE[key]
+    except KeyError:
+        pass
+    ret = _COMPARATORS[flavor](one, two)
+    if len(_CACHE) >= CACHE_SIZE:
+        _CACHE.clear()
+    _CACHE[key] = ret
+    return ret
+
+
+def newest(versions, flavor='rpm'):
+    """ the newest of several versions; a string is split on commas, as
+        pkg.list_pkgs joins the versions of multiply installed packages
+    """
+    if not isinstance(versions, (list, tuple)):
+        versions = versions.split(',')
+    ret = None
+    for version in versions:
+        version = version.strip()
+        if version and (ret is None or compare(version, ret, flavor) > 0):
+            ret = version
+    return ret
+
+
+def flavor_for(grains):
+    """ the version flavor used by the host's package manager """
+    if (grains or {}).get('os_family') == 'Debian':
+        return 'dpkg'
+    return 'rpm'
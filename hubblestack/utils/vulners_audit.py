@@ -0,0 +1,170 @@
+# -*- encoding: utf-8 -*-
+"""
+A cached client for the vulners.com Linux audit API.
+
+The vulners scanner used to send the full package list to the API on every
+scheduled run, although the installed packages rarely change between runs.
+Here the package set (with the OS name and version) is fingerprinted, the
+parsed audit response is stored in the cachedir next to its fingerprint, and
+the API is only asked again when the fingerprint changes or the cached
+response is older than the ttl.
+
+.. code-block:: python
+
+    import hubblestack.utils.vulners_audit as vulners_audit
+
+    fetch = vulners_audit.HTTPFetcher(api_key=key)
+    data = vulners_audit.audit(packages, 'centos', '7', fetch,
+                               cache_path=os.path.join(__opts__['cachedir'], 'vulners.json'),
+                               ttl=21600)
+
+A fetcher is any ``fetch(os_name, os_version, packages)`` callable returning
+the audit data (a dict with 'packages', ...) or an error dict
+``{'result': 'ERROR', 'data': {'error': ...}}``. LibraryFetcher goes through
+the ``vulners`` library, HTTPFetcher posts to the API (or any stand-in for
+it) itself. Errors are never cached.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+try:
+    from urllib2 import Request, urlopen, HTTPError, URLError
+except ImportError:
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+
+try:
+    import vulners
+    HAS_VULNERS = True
+except ImportError:
+    HAS_VULNERS = False
+
+log = logging.getLogger(__name__)
+
+__all__ = ['fingerprint', 'audit', 'ResponseCache', 'HTTPFetcher', 'LibraryFetcher',
+           'error', 'is_error']
+
+AUDIT_URL = 'https://vulners.com/api/v3/audit/audit/'
+DEFAULT_TTL = 21600
+
+
+def error(message):
+    """ the error dict the scanner expects from a failed query """
+    return {'result': 'ERROR', 'data': {'error': message}}
+
+
+def is_error(data):
+    return not isinstance(data, dict) or data.get('result') == 'ERROR'
+
+
+def fingerprint(packages, os_name, os_version):
+    """ a digest of the package set and OS; the order of packages is irrelevant """
+    digest = hashlib.sha256()
+    digest.update('{0}\0{1}\0'.format(os_name, os_version).encode('utf-8'))
+    for package in sorted(set(packages)):
+        digest.update(package.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+class ResponseCache(object):
+    """ the last successful audit response, stored as JSON in one file """
+
+    def __init__(self, path, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+
+    def get(self, key):
+        """ the cached response for fingerprint key, or None if there is none
+            or it's older than the ttl
+        """
+        try:
+            with open(self.path) as fh:
+                entry = json.load(fh)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get('fingerprint') != key:
+            return None
+        age = time.time() - entry.get('stored', 0)
+        if self.ttl is not None and not 0 <= age < self.ttl:
+            return None
+        return entry.get('response')
+
+    def put(self, key, response):
+        directory = os.path.dirname(self.path) or '.'
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix='.vulners-')
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({'fingerprint': key, 'stored': time.time(), 'response': response}, fh)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as exc:
+            log.warning('unable to cache the vulners response in %s: %s', self.path, exc)
+
+
+class HTTPFetcher(object):
+    """ posts the audit request to url (the vulners API by default) """
+
+    def __init__(self, api_key=None, url=AUDIT_URL, timeout=60):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+
+    def __call__(self, os_name, os_version, packages):
+        body = {'os': os_name, 'version': os_version, 'package': list(packages)}
+        if self.api_key:
+            body['apiKey'] = self.api_key
+        request = Request(self.url, data=json.dumps(body).encode('utf-8'),
+                          headers={'Content-Type': 'application/json'})
+        try:
+            response = urlopen(request, timeout=self.timeout)
+            try:
+                reply = json.loads(response.read().decode('utf-8'))
+            finally:
+                response.close()
+        except HTTPError as exc:
+            return error('vulners audit request failed: HTTP {0}'.format(exc.code))
+        except (URLError, IOError, ValueError) as exc:
+            return error('vulners audit request failed: {0}'.format(exc))
+        if not isinstance(reply, dict):
+            return error('unexpected vulners audit response')
+        if reply.get('result') != 'OK':
+            return error((reply.get('data') or {}).get('error') or 'vulners audit request failed')
+        return reply.get('data') or {}
+
+
+class LibraryFetcher(object):
+    """ goes through the ``vulners`` library """
+
+    def __init__(self, api_key=None):
+        self.api_key = api_key
+
+    def __call__(self, os_name, os_version, packages):
+        if not HAS_VULNERS:
+            return error('The vulners library is missing')
+        return vulners.Vulners(api_key=self.api_key).audit(str(os_name), str(os_version),
+                                                           list(packages))
+
+
+def audit(packages, os_name, os_version, fetch, cache_path=None, ttl=DEFAULT_TTL):
+    """ the audit data for packages, from the cache while the package set is
+        unchanged and the cached response younger than ttl, from fetch
+        otherwise
+    """
+    cache = ResponseCache(cache_path, ttl) if cache_path else None
+    key = fingerprint(packages, os_name, os_version)
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            log.debug('vulners: package set unchanged, using the cached audit')
+            return cached
+    data = fetch(os_name, os_version, packages)
+    if cache is not None and not is_error(data):
+        cache.put(key, data)
+    return data
@@ -0,0 +1,184 @@
+# -*- encoding: utf-8 -*-
+"""
+Resumable, parallel setup of pulsar's watches over directory trees.
+
+Pulsar used to add a recursive watch in one go -- pyinotify walks the whole
+tree with os.walk and adds a watch per directory, and watch_files then walked
+it again -- all inside a sweep, so a config path like ``/usr`` held up the
+sweep for minutes (and events went unread meanwhile). A TreeSetup instead
+scans directories with scandir, a batch of them at a time across a bounded
+WorkerPool, skips excluded directories before descending into them, and
+hands what it finds to the watch callbacks in batches. ``run()`` stops at
+its deadline; the next call resumes where it left off.
+
+.. code-block:: python
+
+    import hubblestack.utils.watchsetup as watchsetup
+
+    setup = watchsetup.TreeSetup('/var/lib', add_dirs, add_files=None,
+                                 excluded=matcher, recurse=True)
+    with WorkerPool(max_workers=4) as pool:
+        done = setup.run(pool, deadline=time.time() + 5)
+    setup.progress()   # {'scanned': 1200, 'dirs': 1199, 'pending': 310, ...}
+
+``add_dirs(paths)`` and ``add_files(paths)`` are called with lists of at
+most ``batch_size`` paths, and return the number of watches they added.
+Given the directories and files already known to be there (e.g. from a
+pulsar snapshot) with ``restore()``, a setup watches those without scanning,
+and walks only the directories given to rescan.
+"""
+
+import collections
+import logging
+import os
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+log = logging.getLogger(__name__)
+
+__all__ = ['TreeSetup']
+
+DEFAULT_BATCH_SIZE = 1000
+# directories scanned per round (spread over the pool)
+SCAN_BATCH = 64
+
+
+def _never(path):
+    return False
+
+
+def _scan_dir(path, excluded, files):
+    """ the subdirectories and (optionally) files of path that aren't
+        excluded, the number pruned, and the error reading it if any
+    """
+    dirs = []
+    found = []
+    pruned = 0
+    try:
+        if scandir is not None:
+            entries = [(entry.path, entry.is_dir(follow_symlinks=False),
+                        files and entry.is_file(follow_symlinks=False))
+                       for entry in scandir(path)]
+        else:
+            entries = []
+            for name in os.listdir(path):
+                full = os.path.join(path, name)
+                entries.append((full, os.path.isdir(full) and not os.path.islink(full),
+                                files and os.path.isfile(full) and not os.path.islink(full)))
+    except OSError as exc:
+        return path, dirs, found, pruned, exc
+    for full, is_dir, is_file in entries:
+        if not (is_dir or is_file):
+            continue
+        if excluded(full):
+            pruned += 1
+        elif is_dir:
+            dirs.append(full)
+        else:
+            found.append(full)
+    return path, dirs, found, pruned, None
+
+
+class TreeSetup(object):
+    """ the directories (and files) under root still to be scanned and watched """
+
+    def __init__(self, root, add_dirs, add_files=None, excluded=None, recurse=True,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        self.root = root
+        self.add_dirs = add_dirs
+        self.add_files = add_files
+        self.excluded = excluded or _never
+        self.recurse = recurse
+        self.batch_size = max(int(batch_size), 1)
+        self.frontier = collections.deque([root])
+        self.dirs = collections.deque()
+        self.files = collections.deque()
+        self.counts = dict((key, 0) for key in ('scanned', 'dirs', 'files', 'watched',
+                                                'pruned', 'errors', 'batches', 'runs',
+                                                'restored'))
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return not (self.frontier or self.dirs or self.files)
+
+    def restore(self, dirs, files=(), rescan=()):
+        """ watch the known dirs (and files) instead of scanning the tree;
+            only the directories in rescan are scanned (and watched)
+        """
+        files = list(files) if self.add_files is not None else []
+        self.frontier = collections.deque(rescan if self.recurse else ())
+        self.dirs = collections.deque(list(dirs) + list(self.frontier))
+        self.files = collections.deque(files)
+        self.counts['restored'] += len(self.dirs) + len(self.files)
+
+    def _scan(self, pool):
+        batch = [self.frontier.popleft() for _ in range(min(len(self.frontier), SCAN_BATCH))]
+        files = self.add_files is not None
+        if pool is None or len(batch) == 1:
+            results = [_scan_dir(path, self.excluded, files) for path in batch]
+        else:
+            tasks = [pool.submit(_scan_dir, path, self.excluded, files) for path in batch]
+            results = []
+            for task in tasks:
+                task.join()
+                if task.exception is not None:
+                    results.append((task.args[0], [], [], 0, task.exception))
+                else:
+                    results.append(task.value)
+        for path, dirs, found, pruned, error in results:
+            self.counts['scanned'] += 1
+            self.counts['pruned'] += pruned
+            if error is not None:
+                log.debug('watch setup unable to read %s: %s', path, error)
+                self.counts['errors'] += 1
+                continue
+            if path == self.root or self.recurse:
+                self.files.extend(found)
+                self.counts['files'] += len(found)
+            if self.recurse:
+                self.dirs.extend(dirs)
+                self.frontier.extend(dirs)
+                self.counts['dirs'] += len(dirs)
+
+    def _add_batch(self):
+        pending, add = (self.dirs, self.add_dirs) if self.dirs else (self.files, self.add_files)
+        batch = [pending.popleft() for _ in range(min(len(pending), self.batch_size))]
+        self.counts['watched'] += add(batch) or 0
+        self.counts['batches'] += 1
+
+    def run(self, pool=None, deadline=None):
+        """ scan and watch until done or past the deadline (an absolute
+            time.time()); returns whether the setup is complete
+        """
+        self.counts['runs'] += 1
+        while not self.done:
+            if deadline is not None and time.time() >= deadline:
+                break
+            # watch what was found before scanning further, so the watches
+            # come in (roughly) top down and the queues stay short
+            if self.dirs or self.files:
+                self._add_batch()
+            else:
+                self._scan(pool)
+        if self.done and self.finished is None:
+            self.finished = time.time()
+        log.debug('watch setup %s: %s', self.root, self.progress())
+        return self.done
+
+    def progress(self):
+        """ the counts so far, with the directories and watches pending """
+        ret = dict(self.counts)
+        ret['pending'] = len(self.frontier) + len(self.dirs) + len(self.files)
+        ret['done'] = self.done
+        ret['elapsed'] = (self.finished or time.time()) - self.started
+        return ret
+
@@ -0,0 +1,215 @@
+# -*- encoding: utf-8 -*-
+"""
+A small bounded thread pool for hubble's I/O bound work (subprocesses, network
+fetches, filesystem walks).
+
+Python threads can't be interrupted, so a task that runs past its timeout is
+abandoned rather than killed: the caller stops waiting for it, the result is
+discarded when it eventually finishes, and the worker it occupied is lost for
+the remainder of that pool's life. Pools are cheap; create one per batch of
+work and shut it down afterwards.
+
+.. code-block:: python
+
+    from hubblestack.utils.workers import WorkerPool
+
+    with WorkerPool(max_workers=4) as pool:
+        tasks = [pool.submit(fetch, url) for url in urls]
+        for task in tasks:
+            if task.join(timeout=10):
+                print(task.name, task.elapsed, task.value)
+"""
+
+import logging
+import threading
+import time
+import traceback
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+log = logging.getLogger(__name__)
+
+
+class TaskTimeout(Exception):
+    """ Raised by Task.result() when a task did not finish in time """
+    pass
+
+
+class Task(object):
+    """ A unit of work submitted to a WorkerPool
+
+        Task objects have the following properties
+
+        * name: a label for the task (used in logging)
+        * value: the return value of the function (once done)
+        * exception: the exception raised by the function (if any)
+        * traceback: the formatted traceback of that exception
+        * started/finished: wall clock start and end times
+        * elapsed: the time the task ran (or has been running)
+    """
+
+    def __init__(self, func, args=(), kwargs=None, name=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.name = name or getattr(func, '__name__', 'task')
+        self.value = None
+        self.exception = None
+        self.traceback = None
+        self.started = None
+        self.finished = None
+        self.cancelled = False
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def run(self):
+        """ execute the task (called by the worker thread) """
+        with self._lock:
+            if self.cancelled:
+                self._done.set()
+                return
+            self.started = time.time()
+        try:
+            self.value = self.func(*self.args, **self.kwargs)
+        except Exception as exc:
+            self.exception = exc
+            self.traceback = traceback.format_exc()
+        finally:
+            self.finished = time.time()
+            self._done.set()
+
+    def cancel(self):
+        """ prevent the task from starting if it hasn't yet; returns True if
+            the task will not run
+        """
+        with self._lock:
+            if self.started is None:
+                self.cancelled = True
+            return self.cancelled
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def join(self, timeout=None, deadline=None):
+        """ wait for the task to finish
+
+            timeout
+                seconds the task may *run* (time spent queued behind other
+                tasks doesn't count against it, so a task queued behind
+                abandoned ones may never start; give a deadline too)
+
+            deadline
+                absolute time.time() after which we stop waiting regardless
+
+            returns True if the task finished, False otherwise
+        """
+        while not self._done.is_set():
+            limits = []
+            if deadline is not None:
+                limits.append(deadline)
+            if timeout is not None and self.started is not None:
+                limits.append(self.started + timeout)
+            remaining = None
+            if limits:
+                remaining = min(limits) - time.time()
+                if remaining <= 0:
+                    return False
+            if timeout is not None and self.started is None:
+                # not started yet, poll until it is so the timeout can apply
+                remaining = 0.05 if remaining is None else min(remaining, 0.05)
+            self._done.wait(remaining)
+        return True
+
+    def result(self, timeout=None, deadline=None):
+        """ wait for the task and return its value, re-raising its exception
+            or raising TaskTimeout
+        """
+        if not self.join(timeout=timeout, deadline=deadline):
+            raise TaskTimeout('{0} did not finish within {1}s'.format(self.name, timeout))
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+class WorkerPool(object):
+    """ A fixed upper bound of daemon threads consuming a task queue
+
+        Threads are started lazily as tasks are submitted, so a pool that only
+        ever sees one task only ever starts one thread.
+    """
+
+    def __init__(self, max_workers=4, name='hubble-worker'):
+        self.max_workers = max(1, int(max_workers))
+        self.name = name
+        self.queue = queue.Queue()
+        self.threads = []
+        self.submitted = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+
+    def submit(self, func, *args, **kwargs):
+        """ queue func(*args, **kwargs) and return its Task """
+        return self.submit_task(Task(func, args, kwargs))
+
+    def submit_task(self, task):
+        """ queue an already constructed Task """
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError('cannot submit to a pool that was shut down')
+            self.submitted += 1
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker,
+                                          name='{0}-{1}'.format(self.name, len(self.threads)))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        self.queue.put(task)
+        return task
+
+    def map(self, func, items, timeout=None, deadline=None):
+        """ run func(item) for every item and return the finished Tasks in
+            the order of items (unfinished tasks are cancelled if possible)
+        """
+        tasks = [self.submit(func, item) for item in items]
+        for task in tasks:
+            if not task.join(timeout=timeout, deadline=deadline):
+                task.cancel()
+        return tasks
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                break
+            try:
+                task.run()
+            except Exception:
+                log.exception('unexpected error in %s', self.name)
+
+    def shutdown(self):
+        """ stop the worker threads once the queue drains; abandoned tasks
+            keep their threads until they return
+        """
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            for _ in self.threads:
+                self.queue.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
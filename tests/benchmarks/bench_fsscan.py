@@ -0,0 +1,117 @@
+# -*- encoding: utf-8 -*-
+"""
+Benchmark the shared filesystem scan of the misc checks against the find
+walks it replaced.
+
+Run it from the top of the repo:
+
+    python tests/benchmarks/bench_fsscan.py [--dirs 5000] [--files 10] [--root /usr]
+
+Without ``--root`` it builds a tree of ``--dirs`` directories (``--files``
+files each, a few of them world writable or SUID) under ``--base``. It
+then times
+
+* find: one ``find <root> -xdev ...`` per check, the way the unowned,
+  ungrouped, world writable, sticky bit and SUID/SGID checks used to run
+* scan: hubblestack.utils.fsscan evaluating all of those predicates in one
+  walk, with ``--workers`` threads
+* cached: the second check of an audit, which reuses the scan (ttl)
+
+and checks that both ways found the same world writable files.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import hubblestack.utils.fsscan as fsscan  # pylint: disable=wrong-import-position
+
+FINDS = (
+    ('unowned', ['-nouser']),
+    ('ungrouped', ['-nogroup']),
+    ('world_writable', ['-type', 'f', '-perm', '-0002']),
+    ('sticky_missing', ['-type', 'd', '-perm', '-0002', '!', '-perm', '-1000']),
+    ('suid_sgid', ['-type', 'f', '(', '-perm', '-4000', '-o', '-perm', '-2000', ')']),
+)
+
+
+def make_tree(base, dirs, files, fanout=20):
+    root = tempfile.mkdtemp(prefix='bench-fsscan-', dir=base)
+    made = [root]
+    i = 0
+    while len(made) < dirs + 1:
+        path = os.path.join(made[i // fanout], 'd{0}'.format(i))
+        os.mkdir(path)
+        made.append(path)
+        for j in range(files):
+            name = os.path.join(path, 'f{0}'.format(j))
+            with open(name, 'w') as fh:
+                fh.write('x')
+            if (i + j) % 97 == 0:
+                os.chmod(name, 0o666)
+            elif (i + j) % 101 == 0:
+                os.chmod(name, 0o4755)
+        i += 1
+    return root
+
+
+def run_finds(root):
+    found = {}
+    for name, args in FINDS:
+        out = subprocess.check_output(['find', root, '-xdev'] + args)
+        found[name] = sorted(out.decode().splitlines())
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dirs', type=int, default=5000)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--root', default=None, help='scan this instead of a generated tree')
+    parser.add_argument('--base', default=None, help='where to build the tree (default: $TMPDIR)')
+    args = parser.parse_args()
+
+    root = args.root
+    if root is None:
+        started = time.time()
+        root = make_tree(args.base, args.dirs, args.files)
+        print('built {0} directories, {1} files in {2:.1f}s under {3}'.format(
+            args.dirs, args.dirs * args.files, time.time() - started, root))
+    try:
+        started = time.time()
+        found = run_finds(root)
+        finds = time.time() - started
+        print('find    {0:>9.1f} ms  {1} walks'.format(finds * 1000, len(FINDS)))
+
+        fsscan.clear_cache()
+        started = time.time()
+        result = fsscan.scan(roots=[root], max_workers=args.workers, ttl=3600)
+        scan = time.time() - started
+        print('scan    {0:>9.1f} ms  1 walk, {1} entries, {2} workers, {3}'.format(
+            scan * 1000, result.entries, args.workers,
+            'complete' if result.complete else 'incomplete'))
+
+        started = time.time()
+        fsscan.scan(roots=[root], max_workers=args.workers, ttl=3600)
+        print('cached  {0:>9.1f} ms'.format((time.time() - started) * 1000))
+
+        print('scan took {0:.0%} of the finds'.format(scan / finds if finds else 0))
+        same = sorted(result.failures('world_writable')) == found['world_writable']
+        print('world writable files: {0} found, {1}'.format(
+            len(found['world_writable']), 'same as find' if same else 'DIFFERENT from find'))
+    finally:
+        if args.root is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
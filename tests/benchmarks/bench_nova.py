@@ -0,0 +1,473 @@
+# -*- encoding: utf-8 -*-
+"""
+Benchmark of a nova audit, end to end, against a synthetic host.
+
+Run it from the top of the repo:
+
+    python tests/benchmarks/bench_nova.py [--checks 500] [--repeat 5]
+    python tests/benchmarks/bench_nova.py --save baseline.json
+    python tests/benchmarks/bench_nova.py --compare baseline.json [--threshold 1.25]
+
+It builds a fake host root in a temporary directory -- /etc/passwd, an
+sshd_config, config files to grep and stat, a /proc/sys tree and a package
+list -- and profiles with ``--checks`` grep, pkg, sysctl and stat checks each
+(``--fail-ratio`` of them failing, ``--controls`` of the failing tags under
+compensating controls). ``__salt__`` is a stub: package, sysctl and file
+stats come from the fake root, and ``cmd.run``/``cmd.run_all`` return the
+outputs recorded in ``--recorded`` (a JSON file of {"command line":
+{"retcode", "stdout", "stderr"}}), or fail for unrecorded commands.
+
+The audit goes through the real pipeline, one phase at a time:
+
+sync
+    copying the nova modules and profiles into place (what ``hubble.sync``
+    leaves behind)
+load
+    ``NovaLazyLoader`` loading the modules and profile data
+merge
+    selecting the profile data and each module's ``_merge_yaml``
+plan
+    looking up each module's check plan (hubblestack.utils.checkplan), keyed
+    on the stamp of the profile files; ``plan.digest`` does the same keyed on
+    a digest of the merged data, as data without a stamp is
+module.<name>
+    each module's ``audit()``
+filter
+    applying the compensating controls to the failures
+
+Each phase is timed ``--repeat`` times; the best time is reported along with
+the first (cold) one, plus the salt calls, subprocesses (stubbed command
+executions and the forks hubblestack.utils.facts counted) and memory. With
+``--save`` the report is written as JSON, with ``--compare`` a saved report is
+used as the baseline and the exit status is 1 if any phase got slower than
+``--threshold`` times the baseline.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import copy
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import yaml  # pylint: disable=wrong-import-position
+
+import hubblestack.utils.checkplan as checkplan  # pylint: disable=wrong-import-position
+import hubblestack.utils.facts as facts  # pylint: disable=wrong-import-position
+import hubblestack.utils.procfs as procfs  # pylint: disable=wrong-import-position
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+MODULES = ('grep', 'pkg', 'sysctl', 'stat_nova')
+PROFILE_DIR = 'hubblestack_nova_profiles'
+OSFINGER = 'Bench Linux-1'
+# phases whose best time is below this many seconds aren't compared
+NOISE_FLOOR = 0.002
+
+SSHD_CONFIG = """\
+Protocol 2
+PermitRootLogin no
+PermitEmptyPasswords no
+X11Forwarding no
+MaxAuthTries 4
+IgnoreRhosts yes
+HostbasedAuthentication no
+ClientAliveInterval 300
+LoginGraceTime 60
+"""
+
+
+class FakeHost(object):
+    """ the files of a synthetic host under root """
+
+    def __init__(self, root, checks, rnd):
+        self.root = root
+        self.checks = checks
+        self.uid, self.gid = os.getuid(), os.getgid()
+        self.packages = dict(('bench-pkg{0}'.format(i),
+                              '{0}.{1}.{2}-{3}'.format(rnd.randint(0, 9), rnd.randint(0, 30),
+                                                       rnd.randint(0, 99), rnd.randint(1, 9)))
+                             for i in range(checks))
+        self.sysctls = dict(('bench.k{0}'.format(i), str(rnd.randint(0, 2))) for i in range(checks))
+        self.proc = self.path('proc')
+        self._write('etc/passwd', ''.join('user{0}:x:{0}:{0}::/home/user{0}:/bin/sh\n'.format(i)
+                                          for i in range(1000, 1000 + checks)))
+        self._write('etc/ssh/sshd_config', SSHD_CONFIG)
+        for i in range(checks):
+            self._write('etc/bench/conf{0}'.format(i),
+                        ''.join('option{0} = value{0}\n'.format(line) for line in range(50)),
+                        mode=0o644)
+        for name, value in self.sysctls.items():
+            self._write(os.path.join('proc', 'sys', *name.split('.')), value + '\n')
+        self._write('var/lib/bench/packages.json', json.dumps(self.packages))
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _write(self, name, content, mode=None):
+        path = self.path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fh:
+            fh.write(content)
+        if mode is not None:
+            os.chmod(path, mode)
+
+
+def _failing(i, ratio):
+    return ratio and i % max(1, int(round(1 / ratio))) == 0
+
+
+def make_profiles(host, fail_ratio, controls):
+    """ {profile name: profile data} with host.checks checks per module """
+    profiles = {}
+    whitelist = []
+    for i in range(host.checks):
+        pattern = 'option{0} = value{0}'.format(i % 50)
+        if _failing(i, fail_ratio):
+            pattern = 'option{0} = wrong'.format(i)
+        whitelist.append({host.path('etc', 'bench', 'conf{0}'.format(i)):
+                          {'tag': 'BENCH-GREP-{0}'.format(i), 'pattern': pattern}})
+    whitelist.append({host.path('etc', 'ssh', 'sshd_config'):
+                      {'tag': 'BENCH-GREP-SSH', 'pattern': '^PermitRootLogin',
+                       'match_output': 'no'}})
+    profiles['bench_grep'] = {'grep': {'whitelist': {'bench_files': {
+        'data': {OSFINGER: whitelist, '*': []},
+        'description': 'synthetic grep checks'}}}}
+
+    packages = sorted(host.packages)
+    pkgs = []
+    for i, name in enumerate(packages):
+        if _failing(i, fail_ratio):
+            pkgs.append({name: {'tag': 'BENCH-PKG-{0}'.format(i), 'version': '>=99'}})
+        else:
+            pkgs.append({name: {'tag': 'BENCH-PKG-{0}'.format(i),
+                                'version': '>=' + host.packages[name]}})
+    profiles['bench_pkg'] = {'pkg': {'whitelist': {'bench_packages': {
+        'data': {OSFINGER: pkgs}, 'description': 'synthetic package checks'}}}}
+
+    sysctls = {}
+    for i, name in enumerate(sorted(host.sysctls)):
+        value = host.sysctls[name]
+        if _failing(i, fail_ratio):
+            value = 'wrong'
+        sysctls['bench_sysctl_{0}'.format(i)] = {
+            'data': {OSFINGER: [{name: {'tag': 'BENCH-SYSCTL-{0}'.format(i),
+                                        'match_output': value}}]},
+            'description': 'synthetic sysctl check'}
+    profiles['bench_sysctl'] = {'sysctl': sysctls}
+
+    stats = {}
+    for i in range(host.checks):
+        mode = 600 if _failing(i, fail_ratio) else 644
+        stats['bench_stat_{0}'.format(i)] = {
+            'data': {OSFINGER: [{host.path('etc', 'bench', 'conf{0}'.format(i)):
+                                 {'tag': 'BENCH-STAT-{0}'.format(i), 'mode': mode,
+                                  'uid': host.uid, 'gid': host.gid}}]},
+            'description': 'synthetic stat check'}
+    profiles['bench_stat'] = {'stat': stats}
+
+    failing = [i for i in range(host.checks) if _failing(i, fail_ratio)]
+    profiles['bench_stat']['control'] = ['BENCH-STAT-{0}'.format(i) for i in failing[:controls]]
+    return profiles
+
+
+class StubSalt(dict):
+    """ the __salt__ the modules see; every call is counted """
+
+    def __init__(self, host, recorded, config):
+        super(StubSalt, self).__init__()
+        self.host = host
+        self.recorded = recorded
+        self.config = config
+        self.calls = collections.Counter()
+        self.commands = 0
+        funcs = {'config.get': self._config_get,
+                 'pkg.list_pkgs': self._list_pkgs,
+                 'sysctl.get': self._sysctl_get,
+                 'file.stats': self._file_stats,
+                 'cmd.run': self._cmd_run,
+                 'cmd.run_all': self._cmd_run_all,
+                 'cp.cache_dir': lambda *args, **kwargs: []}
+        for name, func in funcs.items():
+            self[name] = self._counted(name, func)
+
+    def _counted(self, name, func):
+        def inner(*args, **kwargs):
+            self.calls[name] += 1
+            return func(*args, **kwargs)
+        return inner
+
+    def _config_get(self, key, default=''):
+        return self.config.get(key, default)
+
+    def _list_pkgs(self, versions_as_list=False, **kwargs):
+        with open(self.host.path('var', 'lib', 'bench', 'packages.json')) as fh:
+            packages = json.load(fh)
+        if versions_as_list:
+            return dict((name, [version]) for name, version in packages.items())
+        return packages
+
+    def _sysctl_get(self, name):
+        path = os.path.join(self.host.proc, 'sys', *name.split('.'))
+        try:
+            with open(path) as fh:
+                return fh.read().strip()
+        except (IOError, OSError):
+            return ''
+
+    def _file_stats(self, path, *args, **kwargs):
+        st = os.stat(path)
+        return {'inode': st.st_ino, 'uid': st.st_uid, 'gid': st.st_gid,
+                'user': str(st.st_uid), 'group': str(st.st_gid),
+                'atime': st.st_atime, 'mtime': st.st_mtime, 'ctime': st.st_ctime,
+                'size': st.st_size, 'mode': '0{0:o}'.format(st.st_mode & 0o7777),
+                'type': 'file', 'target': path}
+
+    def _cmd_run_all(self, cmd, *args, **kwargs):
+        self.commands += 1
+        if not isinstance(cmd, str):
+            cmd = ' '.join(cmd)
+        ret = self.recorded.get(cmd)
+        if ret is None:
+            return {'retcode': 127, 'stdout': '', 'stderr': 'not recorded: ' + cmd, 'pid': 0}
+        return dict({'retcode': 0, 'stdout': '', 'stderr': '', 'pid': 0}, **ret)
+
+    def _cmd_run(self, cmd, *args, **kwargs):
+        return self._cmd_run_all(cmd)['stdout']
+
+
+class Phases(object):
+    """ the timings of every phase across the repeats """
+
+    def __init__(self):
+        self.times = collections.OrderedDict()
+
+    def timed(self, name, func, *args, **kwargs):
+        started = time.time()
+        ret = func(*args, **kwargs)
+        self.times.setdefault(name, []).append(time.time() - started)
+        return ret
+
+
+def sync(workdir, profiles):
+    """ lay out the nova modules and profiles the way hubble.sync leaves them """
+    install_dir = os.path.join(workdir, 'install')
+    module_dir = os.path.join(install_dir, 'files', 'hubblestack_nova')
+    profile_dir = os.path.join(workdir, 'cache', 'files', 'base', PROFILE_DIR)
+    for directory in (module_dir, profile_dir):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+    os.makedirs(module_dir)
+    os.makedirs(os.path.join(profile_dir, 'bench'))
+    source = os.path.join(os.path.dirname(__file__), '..', '..', 'hubblestack', 'files',
+                          'hubblestack_nova')
+    for module in MODULES:
+        shutil.copy(os.path.join(source, module + '.py'), module_dir)
+    for name, data in profiles.items():
+        with open(os.path.join(profile_dir, 'bench', name + '.yaml'), 'w') as fh:
+            yaml.safe_dump(data, fh, default_flow_style=False)
+    return install_dir, (module_dir, profile_dir)
+
+
+def load(hubble_dirs, opts, grains, stub):
+    from hubblestack.extmods.modules.nova_loader import NovaLazyLoader
+    return NovaLazyLoader(hubble_dirs, opts, grains, {}, stub)
+
+
+def merge(hubble, nova):
+    results = {}
+    data_list = hubble._build_audit_data([os.path.join(os.path.sep, 'bench')], results)
+    for _, func in nova._dict.items():
+        merged = {}
+        for profile, data in data_list:
+            func.__globals__['_merge_yaml'](merged, copy.deepcopy(data), profile)
+    return data_list
+
+
+def merged_data(nova, data_list):
+    """ {module: its merged profile data} """
+    ret = {}
+    for key, func in nova._dict.items():
+        merged = ret[key.split('.')[0]] = {}
+        for profile, data in data_list:
+            func.__globals__['_merge_yaml'](merged, copy.deepcopy(data), profile)
+    return ret
+
+
+def plans(nova, merged, profiles, distro, prefix=''):
+    """ every module's check plan, from the cache but for the first run """
+    for key, func in nova._dict.items():
+        module = key.split('.')[0]
+        checkplan.compile_plan(prefix + module, merged[module], func.__globals__['_get_tags'],
+                               distro, profiles, [])
+
+
+def filter_failures(hubble, results, data_list):
+    controls = hubble._build_processed_controls(data_list, False)
+    for index in reversed(sorted(set(hubble._build_failures_to_remove(results, controls)))):
+        results['Failure'].pop(index)
+    return results
+
+
+def run_once(phases, workdir, profiles, stub, grains):
+    import hubblestack.extmods.modules.hubble as hubble
+    install_dir, hubble_dirs = phases.timed('sync', sync, workdir, profiles)
+    opts = {'install_dir': install_dir, 'cachedir': os.path.join(workdir, 'cache'),
+            'extension_modules': os.path.join(workdir, 'cache', 'extmods'),
+            'file_roots': {'base': []}, 'grains': grains}
+    try:
+        import salt.config
+        opts = dict(copy.deepcopy(salt.config.DEFAULT_MINION_OPTS), **opts)
+    except ImportError:
+        pass
+    nova = phases.timed('load', load, hubble_dirs, opts, grains, stub)
+    hubble.__salt__, hubble.__grains__, hubble.__opts__, hubble.__pillar__ = stub, grains, opts, {}
+    hubble.__nova__ = nova
+
+    with facts.run_scope():
+        data_list = phases.timed('merge', merge, hubble, nova)
+        merged = merged_data(nova, data_list)
+        phases.timed('plan', plans, nova, merged, data_list, OSFINGER)
+        phases.timed('plan.digest', plans, nova, merged, list(data_list), OSFINGER, 'digest.')
+        results = {}
+        for key, func in sorted(nova._dict.items()):
+            ret = phases.timed('module.' + key.split('.')[0], func, data_list, '*', [])
+            for ret_key, ret_val in ret.items():
+                results.setdefault(ret_key, []).extend(ret_val)
+        phases.timed('filter', filter_failures, hubble, results, data_list)
+    return results
+
+
+def report(args, phases, salt, results, memory):
+    ret = {'args': {'checks': args.checks, 'repeat': args.repeat,
+                    'fail_ratio': args.fail_ratio, 'controls': args.controls},
+           'python': sys.version.split()[0],
+           'phases': collections.OrderedDict(),
+           'salt_calls': dict(salt.calls),
+           'subprocesses': {'stubbed_commands': salt.commands // args.repeat,
+                            'facts_forks': dict(facts.LAST_RUN.get('forks', {}))},
+           'results': dict((key, len(val)) for key, val in results.items()
+                           if isinstance(val, list)),
+           'memory': memory}
+    for name, times in phases.times.items():
+        ret['phases'][name] = {'best': min(times), 'first': times[0]}
+    ret['phases']['total'] = {'best': sum(val['best'] for val in ret['phases'].values()),
+                              'first': sum(val['first'] for val in ret['phases'].values())}
+    return ret
+
+
+def show(ret, baseline=None):
+    print('{0:<22} {1:>10} {2:>10} {3:>10}'.format('phase', 'best ms', 'first ms',
+                                                   'baseline' if baseline else ''))
+    for name, timing in ret['phases'].items():
+        line = '{0:<22} {1:>10.1f} {2:>10.1f}'.format(name, timing['best'] * 1000,
+                                                      timing['first'] * 1000)
+        base = (baseline or {}).get('phases', {}).get(name)
+        if base and base['best']:
+            line += ' {0:>9.2f}x'.format(timing['best'] / base['best'])
+        print(line)
+    print('results:', ', '.join('{0}={1}'.format(key, val)
+                                for key, val in sorted(ret['results'].items())))
+    print('salt calls:', ', '.join('{0}={1}'.format(key, val)
+                                   for key, val in sorted(ret['salt_calls'].items())))
+    print('subprocesses per run:', ret['subprocesses']['stubbed_commands'], 'stubbed,',
+          sum(ret['subprocesses']['facts_forks'].values()), 'counted by facts')
+    print('memory:', ', '.join('{0}={1}'.format(key, val)
+                               for key, val in sorted(ret['memory'].items())))
+
+
+def regressions(ret, baseline, threshold):
+    ret_phases = ret['phases']
+    found = []
+    for name, base in baseline.get('phases', {}).items():
+        if name not in ret_phases or base['best'] < NOISE_FLOOR:
+            continue
+        if ret_phases[name]['best'] > base['best'] * threshold:
+            found.append(name)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checks', type=int, default=500, help='checks per module')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--fail-ratio', type=float, default=0.1)
+    parser.add_argument('--controls', type=int, default=10)
+    parser.add_argument('--recorded', help='JSON file of recorded command outputs')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--save', help='write the report to this JSON file')
+    parser.add_argument('--compare', help='a JSON report to compare with')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown factor of a phase that counts as a regression')
+    parser.add_argument('--keep', action='store_true', help="don't remove the fake host")
+    args = parser.parse_args()
+
+    recorded = {}
+    if args.recorded:
+        with open(args.recorded) as fh:
+            recorded = json.load(fh)
+    workdir = tempfile.mkdtemp(prefix='hubble-bench-')
+    try:
+        host = FakeHost(os.path.join(workdir, 'root'), args.checks, random.Random(args.seed))
+        profiles = make_profiles(host, args.fail_ratio, args.controls)
+        grains = {'osfinger': OSFINGER, 'os': 'Bench', 'os_family': 'RedHat',
+                  'osrelease': '1', 'kernel': 'Linux', 'id': 'bench'}
+        salt = StubSalt(host, recorded, {'hubblestack:nova:autoload': False,
+                                         'hubblestack:nova:autosync': False})
+        procfs.PROC = host.proc
+
+        if tracemalloc is not None:
+            tracemalloc.start()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        phases = Phases()
+        results = {}
+        for _ in range(args.repeat):
+            results = run_once(phases, workdir, profiles, salt, grains)
+        memory = {'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  'maxrss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                      - rss_before}
+        if tracemalloc is not None:
+            memory['traced_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        for name in salt.calls:
+            salt.calls[name] //= args.repeat
+        ret = report(args, phases, salt, results, memory)
+    finally:
+        if args.keep:
+            print('fake host left in', workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    show(ret, baseline)
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(ret, fh, indent=2, sort_keys=True)
+    if baseline is not None:
+        if baseline.get('args') != ret['args']:
+            print('warning: the baseline was taken with', baseline.get('args'))
+        slower = regressions(ret, baseline, args.threshold)
+        if slower:
+            print('regressions (> {0}x the baseline): {1}'.format(args.threshold,
+                                                                  ', '.join(slower)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- encoding: utf-8 -*-
+"""
+Microbenchmark for pulsar's compiled exclude matcher.
+
+Run it from the top of the repo:
+
+    python tests/benchmarks/bench_pulsar_excludes.py [--patterns 10000] [--events 100000]
+
+It builds an exclude list of plain prefixes, globs, ``*<suffix>`` globs and
+regexes, and event paths of which some fall under the excludes, then reports
+the time hubblestack.utils.pathmatch takes to compile the list and to match
+every event. For comparison, the way pulsar used to do it -- the exclude
+closures built for every event and tried one by one -- is timed on the first
+``--reference-events`` events and extrapolated.
+"""
+
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import hubblestack.utils.pathmatch as pathmatch  # pylint: disable=wrong-import-position
+
+TOPS = ('/var/log', '/var/lib', '/usr/share', '/opt', '/srv', '/home', '/etc', '/tmp')
+
+
+def make_excludes(rnd, count):
+    ret = []
+    for idx in range(count):
+        top = rnd.choice(TOPS)
+        kind = rnd.random()
+        if kind < 0.7:
+            ret.append('{0}/dir{1}/'.format(top, idx))
+        elif kind < 0.9:
+            ret.append('{0}/app{1}/*.log'.format(top, idx))
+        elif kind < 0.95:
+            ret.append('*.ext{0}'.format(idx))
+        else:
+            ret.append({r'{0}/data{1}/[0-9]+$'.format(top, idx): {'regex': True}})
+    return ret
+
+
+def make_events(rnd, count, patterns):
+    ret = []
+    for _ in range(count):
+        top = rnd.choice(TOPS)
+        idx = rnd.randint(0, patterns * 2)
+        kind = rnd.random()
+        if kind < 0.4:
+            ret.append('{0}/dir{1}/sub/file{2}'.format(top, idx, rnd.randint(0, 99)))
+        elif kind < 0.6:
+            ret.append('{0}/app{1}/out.log'.format(top, idx))
+        elif kind < 0.7:
+            ret.append('{0}/data{1}/{2}'.format(top, idx, rnd.randint(0, 999)))
+        else:
+            ret.append('{0}/other/file{1}.ext{2}'.format(top, idx, rnd.randint(0, patterns)))
+    return ret
+
+
+def linear_excludes(excludes):
+    """ pulsar's former _preprocess_excludes, with the glob arguments in order """
+    the_list = []
+    for exclude in excludes:
+        if isinstance(exclude, dict):
+            pattern, options = list(exclude.items())[0]
+            if options.get('regex'):
+                regex = re.compile(pattern)
+                the_list.append(lambda val, regex=regex: bool(regex.search(val)))
+                continue
+            exclude = pattern
+        if '*' in exclude:
+            the_list.append(lambda val, pat=exclude: fnmatch.fnmatch(val, pat))
+        else:
+            the_list.append(lambda val, prefix=exclude: val.startswith(prefix))
+    return lambda val: any(check(val) for check in the_list)
+
+
+def timed(label, func, count):
+    started = time.time()
+    ret = func()
+    elapsed = time.time() - started
+    print('{0:<36} {1:>10.1f} ms  {2:>11.0f} /s'.format(label, elapsed * 1000,
+                                                        count / elapsed if elapsed else 0))
+    return ret, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--patterns', type=int, default=10000)
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--reference-events', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    excludes = make_excludes(rnd, args.patterns)
+    events = make_events(rnd, args.events, args.patterns)
+
+    matcher, _ = timed('compile {0} excludes'.format(args.patterns),
+                       lambda: pathmatch.ExcludeMatcher(excludes), args.patterns)
+    hits, elapsed = timed('match {0} events'.format(args.events),
+                          lambda: sum(1 for path in events if matcher(path)), args.events)
+    print('{0} of {1} events excluded'.format(hits, args.events))
+
+    sample = events[:args.reference_events]
+    ref_hits, ref_elapsed = timed('former: {0} events'.format(len(sample)),
+                                  lambda: sum(1 for path in sample
+                                              if linear_excludes(excludes)(path)),
+                                  len(sample))
+    assert ref_hits == sum(1 for path in sample if matcher(path)), 'the matchers disagree'
+    if sample:
+        per_event = ref_elapsed / len(sample)
+        print('former, extrapolated to {0} events: {1:.1f} s ({2:.0f}x slower)'.format(
+            args.events, per_event * args.events,
+            per_event * args.events / elapsed if elapsed else 0))
+
+
+if __name__ == '__main__':
+    main()
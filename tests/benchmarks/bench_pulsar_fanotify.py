@@ -0,0 +1,179 @@
+# -*- encoding: utf-8 -*-
+"""
+Benchmark pulsar's fanotify backend against inotify on a large tree.
+
+Run it from the top of the repo, as root, on a kernel with fanotify
+FAN_REPORT_DFID_NAME (5.9+):
+
+    python tests/benchmarks/bench_pulsar_fanotify.py [--dirs 20000] [--changes 5000] [--base /var/tmp]
+
+It builds a tree of ``--dirs`` directories (``--files`` files each) under
+``--base``, then for each backend times
+
+* setup: inotify needs a watch per directory (walked and added the way a
+  recursive pulsar watch is); fanotify needs one filesystem mark
+* delivery: modify ``--changes`` distinct files and read (and, for
+  fanotify, resolve to paths and filter to the tree) the events until all
+  of them arrived
+
+The inotify side talks to the kernel directly through ctypes, so neither
+pyinotify nor salt is needed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import os
+import random
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import hubblestack.utils.fanotify as fanotify  # pylint: disable=wrong-import-position
+
+IN_MODIFY, IN_CREATE, IN_DELETE = 0x2, 0x100, 0x200
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+MASK = IN_MODIFY | IN_CREATE | IN_DELETE
+_INOTIFY_EVENT = struct.Struct('=iIII')
+
+
+def make_tree(base, dirs, files, fanout):
+    root = tempfile.mkdtemp(prefix='bench-pulsar-', dir=base)
+    made = [root]
+    paths = []
+    i = 0
+    while len(made) < dirs + 1:
+        parent = made[i // fanout]
+        path = os.path.join(parent, 'd{0}'.format(i))
+        os.mkdir(path)
+        made.append(path)
+        for j in range(files):
+            name = os.path.join(path, 'f{0}'.format(j))
+            with open(name, 'w') as fh:
+                fh.write('x')
+            paths.append(name)
+        i += 1
+    return root, paths
+
+
+class Inotify(object):
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1')
+        self.wds = {}
+
+    def watch_tree(self, root):
+        for path, _, _ in os.walk(root):
+            wd = self.libc.inotify_add_watch(self.fd, path.encode(), MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_add_watch {0} (max_user_watches?)'.format(path))
+            self.wds[wd] = path
+
+    def read_events(self):
+        ret = []
+        while True:
+            try:
+                buf = os.read(self.fd, 65536)
+            except OSError as exc:
+                if exc.errno == errno.EAGAIN:
+                    return ret
+                raise
+            offset = 0
+            while offset < len(buf):
+                wd, mask, _, length = _INOTIFY_EVENT.unpack_from(buf, offset)
+                name = buf[offset + 16:offset + 16 + length].split(b'\0', 1)[0].decode()
+                ret.append((os.path.join(self.wds.get(wd, '?'), name), mask))
+                offset += 16 + length
+
+    def wait(self, timeout):
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def close(self):
+        os.close(self.fd)
+
+
+def deliver(backend, changed, root, read):
+    """ modify the files, then read until an event of each arrived """
+    want = set(changed)
+    started = time.time()
+    for path in changed:
+        with open(path, 'a') as fh:
+            fh.write('y')
+    seen = set()
+    deadline = time.time() + 60
+    while seen != want and time.time() < deadline:
+        if backend.wait(0.5):
+            for path, mask in read():
+                if mask & IN_MODIFY and path.startswith(root):
+                    seen.add(path)
+    return time.time() - started, len(seen & want)
+
+
+def report(name, setup, marks, delivery, received, changes):
+    elapsed, _ = delivery
+    print('{0:<9} setup {1:>9.1f} ms  {2:>7} watches/marks  delivery {3:>8.1f} ms  '
+          '{4}/{5} events  {6:>6.1f} us/event'.format(name, setup * 1000, marks, elapsed * 1000,
+                                                     received, changes,
+                                                     elapsed / max(received, 1) * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dirs', type=int, default=20000)
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=20)
+    parser.add_argument('--changes', type=int, default=5000)
+    parser.add_argument('--base', default=None, help='where to build the tree (default: $TMPDIR)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.time()
+    root, files = make_tree(args.base, args.dirs, args.files, args.fanout)
+    print('built {0} directories, {1} files in {2:.1f}s under {3}'.format(
+        args.dirs, len(files), time.time() - started, root))
+    changed = random.Random(args.seed).sample(files, min(args.changes, len(files)))
+    try:
+        ino = Inotify()
+        started = time.time()
+        try:
+            ino.watch_tree(root)
+            setup = time.time() - started
+            delivery = deliver(ino, changed, root, ino.read_events)
+            report('inotify', setup, len(ino.wds), delivery, delivery[1], len(changed))
+        except OSError as exc:
+            print('inotify: {0}'.format(exc))
+        finally:
+            ino.close()
+
+        ok, reason = fanotify.available()
+        if not ok:
+            print('fanotify: unavailable ({0})'.format(reason))
+            return
+        fan = fanotify.Fanotify()
+        try:
+            started = time.time()
+            fan.mark(root, fanotify.FAN_MODIFY | fanotify.FAN_CREATE | fanotify.FAN_DELETE)
+            setup = time.time() - started
+            read = lambda: [(event.pathname or '', event.mask) for event in fan.read_events()]
+            delivery = deliver(fan, changed, root, read)
+            report('fanotify', setup, len(fan.marks), delivery, delivery[1], len(changed))
+            if fan.unresolved:
+                print('fanotify: {0} events could not be resolved to a path'.format(fan.unresolved))
+        finally:
+            fan.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
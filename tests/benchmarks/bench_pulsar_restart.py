@@ -0,0 +1,130 @@
+# -*- encoding: utf-8 -*-
+"""
+Benchmark a pulsar restart from a snapshot against a cold one.
+
+Run it from the top of the repo:
+
+    python tests/benchmarks/bench_pulsar_restart.py [--dirs 20000] [--offline 500] [--base /var/tmp]
+
+It builds a tree of ``--dirs`` directories (``--files`` files each) under
+``--base`` and times
+
+* cold: walking the tree with a TreeSetup and adding an inotify watch per
+  directory, the way pulsar sets up a recursive watch
+* save: baselining the watched directories' entries and writing the snapshot
+* warm: loading the snapshot, reconciling it with the tree after
+  ``--offline`` files were modified (and a new directory created) while
+  "down", and adding the watches from the snapshot
+
+The inotify side talks to the kernel directly through ctypes (see
+bench_pulsar_fanotify), so neither pyinotify nor salt is needed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import hubblestack.utils.snapshot as snapshot  # pylint: disable=wrong-import-position
+import hubblestack.utils.watchsetup as watchsetup  # pylint: disable=wrong-import-position
+from hubblestack.utils.workers import WorkerPool  # pylint: disable=wrong-import-position
+from bench_pulsar_fanotify import MASK, Inotify, make_tree  # pylint: disable=wrong-import-position
+
+
+def adder(ino, root):
+    """ an add_dirs callback adding inotify watches, and the paths watched by root """
+    watched = {root: []}
+    def add_dirs(paths):
+        for path in paths:
+            wd = ino.libc.inotify_add_watch(ino.fd, path.encode(), MASK)
+            if wd < 0:
+                raise OSError('inotify_add_watch {0} failed (max_user_watches?)'.format(path))
+            ino.wds[wd] = path
+            watched[root].append(path)
+        return len(paths)
+    return watched, add_dirs
+
+
+def setup(root, restore=None, workers=4):
+    ino = Inotify()
+    ino.libc.inotify_add_watch(ino.fd, root.encode(), MASK)
+    watched, add_dirs = adder(ino, root)
+    tree = watchsetup.TreeSetup(root, add_dirs)
+    if restore is not None:
+        tree.restore(*restore)
+    with WorkerPool(max_workers=workers) as pool:
+        tree.run(pool)
+    return ino, watched, tree.progress()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dirs', type=int, default=20000)
+    parser.add_argument('--files', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=20)
+    parser.add_argument('--offline', type=int, default=500)
+    parser.add_argument('--base', default=None, help='where to build the tree (default: $TMPDIR)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.time()
+    root, files = make_tree(args.base, args.dirs, args.files, args.fanout)
+    print('built {0} directories, {1} files in {2:.1f}s under {3}'.format(
+        args.dirs, len(files), time.time() - started, root))
+    cache = tempfile.mkdtemp(prefix='bench-pulsar-cache-')
+    try:
+        digest = snapshot.config_digest({root: {'recurse': True}})
+        snap = snapshot.Snapshot(os.path.join(cache, 'pulsar_snapshot.z'))
+
+        started = time.time()
+        ino, watched, progress = setup(root)
+        cold = time.time() - started
+        print('cold   {0:>9.1f} ms  {1} watches, {2} directories scanned'.format(
+            cold * 1000, len(ino.wds) + 1, progress['scanned']))
+
+        started = time.time()
+        baselines = snapshot.scan_baselines([root] + watched[root])
+        snap.save(digest, watched, baselines)
+        print('save   {0:>9.1f} ms  {1} baselines, {2} bytes'.format(
+            (time.time() - started) * 1000, len(baselines), os.path.getsize(snap.path)))
+        ino.close()
+
+        # changes while hubble is "down"
+        time.sleep(0.01)
+        changed = random.Random(args.seed).sample(files, min(args.offline, len(files)))
+        for path in changed:
+            with open(path, 'a') as fh:
+                fh.write('y')
+        os.makedirs(os.path.join(root, 'offline', 'sub'))
+
+        started = time.time()
+        state = snap.load(digest)
+        loaded = time.time() - started
+        found = snapshot.reconcile(state['baselines'])
+        reconciled = time.time() - started - loaded
+        dirs = [path for path in state['watches'][root] if path not in found.deleted]
+        new_dirs = [path for path in found.new_dirs if path.startswith(root)]
+        ino, _, progress = setup(root, restore=(dirs, (), new_dirs))
+        warm = time.time() - started
+        print('warm   {0:>9.1f} ms  (load {1:.1f} ms, reconcile {2:.1f} ms) {3} watches, '
+              '{4} directories scanned'.format(warm * 1000, loaded * 1000, reconciled * 1000,
+                                               len(ino.wds) + 1, progress['scanned']))
+        print('offline changes: {modified} modified, {created} created, {deleted} deleted '
+              'of {checked} checked ({0} files were modified)'.format(len(changed),
+                                                                    **found.counts))
+        print('warm restart took {0:.0%} of the cold one'.format(warm / cold if cold else 0))
+        ino.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(cache, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- encoding: utf-8 -*-
+"""
+Microbenchmark for hubblestack.utils.vercmp and the OVAL per-package lookup.
+
+Run it from the top of the repo:
+
+    python tests/benchmarks/bench_vercmp.py [--pairs 20000] [--packages 2000]
+
+It reports the throughput of uncached rpm and dpkg comparisons, of memoized
+comparisons (the second time the same pairs are seen, as in a repeat scan),
+and the time ``oval.affected()`` takes for a synthetic index of packages with
+several fixed versions each.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import hubblestack.utils.oval as oval  # pylint: disable=wrong-import-position
+import hubblestack.utils.vercmp as vercmp  # pylint: disable=wrong-import-position
+
+
+def rpm_version(rnd):
+    return '{0}:{1}.{2}.{3}-{4}.el7_{5}'.format(rnd.randint(0, 2), rnd.randint(0, 10),
+                                                 rnd.randint(0, 30), rnd.randint(0, 200),
+                                                 rnd.randint(1, 1200), rnd.randint(0, 9))
+
+
+def dpkg_version(rnd):
+    return '{0}:{1}.{2}~rc{3}-{4}ubuntu{5}.{6}'.format(rnd.randint(0, 2), rnd.randint(0, 10),
+                                                       rnd.randint(0, 30), rnd.randint(0, 5),
+                                                       rnd.randint(0, 9), rnd.randint(0, 3),
+                                                       rnd.randint(0, 20))
+
+
+def timed(label, func, count):
+    started = time.time()
+    func()
+    elapsed = time.time() - started
+    print('{0:<34} {1:>9.1f} ms  {2:>11.0f} /s'.format(label, elapsed * 1000,
+                                                       count / elapsed if elapsed else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pairs', type=int, default=20000)
+    parser.add_argument('--packages', type=int, default=2000)
+    parser.add_argument('--fixes', type=int, default=10, help='fixed versions per package')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+
+    for flavor, make, raw in (('rpm', rpm_version, vercmp.rpm_evr_cmp),
+                              ('dpkg', dpkg_version, vercmp.dpkg_cmp)):
+        pairs = [(make(rnd), make(rnd)) for _ in range(args.pairs)]
+        timed('{0} uncached'.format(flavor), lambda: [raw(a, b) for a, b in pairs], args.pairs)
+        vercmp._CACHE.clear()
+        timed('{0} compare() first pass'.format(flavor),
+              lambda: [vercmp.compare(a, b, flavor) for a, b in pairs], args.pairs)
+        timed('{0} compare() memoized'.format(flavor),
+              lambda: [vercmp.compare(a, b, flavor) for a, b in pairs], args.pairs)
+
+    index = {'packages': {}}
+    local = {}
+    for idx in range(args.packages):
+        name = 'pkg{0}'.format(idx)
+        index['packages'][name] = [[rpm_version(rnd), 'def{0}'.format(fix)]
+                                   for fix in range(args.fixes)]
+        local[name] = rpm_version(rnd)
+    count = args.packages * args.fixes
+    vercmp._CACHE.clear()
+    timed('oval.affected() first scan', lambda: list(oval.affected(index, local, 'rpm')), count)
+    timed('oval.affected() repeat scan', lambda: list(oval.affected(index, local, 'rpm')), count)
+
+
+if __name__ == '__main__':
+    main()
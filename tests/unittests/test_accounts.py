@@ -0,0 +1,79 @@
+import os
+
+import hubblestack.utils.accounts as accounts
+
+PASSWD = """\
+root:x:0:0:root:/root:/bin/bash
+daemon:x:1:1:daemon:/usr/sbin:/usr/sbin/nologin
+toor:x:0:0::/root:/bin/sh
+alice:x:1000:1000:Alice:/home/alice:/bin/bash
+alice:x:1001:4242::/home/alice2:/bin/bash
+
++::::::
+"""
+
+GROUP = """\
+root:x:0:
+daemon:x:1:
+alice:x:1000:
+daemon:x:1000:
+"""
+
+SHADOW = """\
+root:$6$salt$hash:17000:0:99999:7:::
+nopass::17000:0:99999:7:::
+"""
+
+
+def make_etc(tmpdir):
+    tmpdir.join('passwd').write(PASSWD)
+    tmpdir.join('group').write(GROUP)
+    tmpdir.join('shadow').write(SHADOW)
+    return str(tmpdir)
+
+def test_lookups(tmpdir):
+    db = accounts.account_db(make_etc(tmpdir))
+    assert [u.name for u in db.users_by_uid(0)] == ['root', 'toor']
+    assert db.user('daemon').shell == '/usr/sbin/nologin'
+    assert db.groups_by_gid('1000')[1].name == 'daemon'
+    assert db.shadow_entry('nopass').passwd == ''
+    # NIS lines are kept but flagged, and padded to the full width
+    assert len(db.passwd) == 6
+    assert len(db.users()) == 5
+    assert db.passwd[-1].shell == ''
+    assert accounts.is_nis(db.passwd[-1])
+
+def test_duplicates(tmpdir):
+    db = accounts.account_db(make_etc(tmpdir))
+    assert db.duplicate_uids() == ['0']
+    assert db.duplicate_user_names() == ['alice']
+    assert db.duplicate_gids() == ['1000']
+    assert db.duplicate_group_names() == ['daemon']
+
+def test_group_exists(tmpdir):
+    db = accounts.account_db(make_etc(tmpdir))
+    assert db.group_exists('1000')
+    assert db.group_exists('daemon')
+    # what getent does with an empty key
+    assert db.group_exists('')
+    assert not db.group_exists('4242424242')
+
+def test_reparsed_on_change(tmpdir):
+    root = make_etc(tmpdir)
+    first = accounts.account_db(root)
+    assert accounts.account_db(root) is first
+    tmpdir.join('passwd').write(PASSWD + 'bob:x:1002:1002::/home/bob:/bin/bash\n')
+    os.utime(str(tmpdir.join('passwd')), (1, 1))
+    second = accounts.account_db(root)
+    assert second is not first
+    assert second.user('bob').uid == '1002'
+
+def test_unreadable(tmpdir):
+    tmpdir.join('passwd').write(PASSWD)
+    db = accounts.account_db(str(tmpdir))
+    assert list(db.shadow) == []
+    assert db.duplicate_uids() == ['0']
+    assert isinstance(db.shadow, accounts.Unreadable)
+    assert db.error('passwd') is None
+    assert db.error('passwd', 'shadow').startswith(
+        'unable to read {0}: '.format(tmpdir.join('shadow')))
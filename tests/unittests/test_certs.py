@@ -0,0 +1,119 @@
+import os
+import socket
+import ssl
+import subprocess
+import threading
+import time
+
+import pytest
+
+import hubblestack.utils.certs as certs
+
+
+def make_cert(tmpdir, name='localhost'):
+    key, crt = str(tmpdir.join(name + '.key')), str(tmpdir.join(name + '.crt'))
+    try:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                               '-keyout', key, '-out', crt, '-days', '2',
+                               '-subj', '/CN=' + name],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip('unable to generate a certificate with the openssl binary')
+    return key, crt
+
+
+class TLSServer(object):
+    """ a loopback TLS server handing out one certificate """
+
+    def __init__(self, key, crt):
+        self.context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+        self.context.load_cert_chain(crt, key)
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+        self.accepted = 0
+        thread = threading.Thread(target=self.serve)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.accepted += 1
+            try:
+                self.context.wrap_socket(conn, server_side=True).close()
+            except (ssl.SSLError, OSError):
+                conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture(autouse=True)
+def clean_cache():
+    certs.clear_cache()
+    yield
+    certs.clear_cache()
+
+
+def test_fetch_and_cache(tmpdir):
+    key, crt = make_cert(tmpdir)
+    server = TLSServer(key, crt)
+    try:
+        endpoint = ('127.0.0.1', server.port)
+        pem = certs.fetch([endpoint, endpoint], timeout=5)[endpoint]
+        with open(crt) as fh:
+            assert certs.fingerprint(pem) == certs.fingerprint(fh.read())
+        assert certs.fetch([endpoint])[endpoint] == pem
+        assert server.accepted == 1
+        # ttl'd out (or expired) certificates are fetched again
+        certs.fetch([endpoint], ttl=0, expires=lambda pem: time.time() - 1)
+        assert server.accepted == 2
+        certs.fetch([endpoint])
+        assert server.accepted == 3
+    finally:
+        server.close()
+
+
+def test_slow_endpoint_does_not_block_the_rest(tmpdir):
+    key, crt = make_cert(tmpdir)
+    server = TLSServer(key, crt)
+    # accepts connections (through the backlog) but never handshakes
+    silent = socket.socket()
+    silent.bind(('127.0.0.1', 0))
+    silent.listen(8)
+    try:
+        good, bad = ('127.0.0.1', server.port), ('127.0.0.1', silent.getsockname()[1])
+        started = time.time()
+        pems = certs.fetch([bad, good], timeout=0.5, deadline=time.time() + 5)
+        assert time.time() - started < 2
+        assert pems[bad] is None
+        assert pems[good]
+        started = time.time()
+        pems = certs.fetch([bad], timeout=5, deadline=time.time() + 0.3)
+        assert time.time() - started < 1
+        assert pems[bad] is None
+    finally:
+        silent.close()
+        server.close()
+
+
+def test_read_file_and_parsed(tmpdir):
+    _, crt = make_cert(tmpdir)
+    first = certs.read_file(crt)
+    assert certs.read_file(crt) is first
+    loads = []
+
+    def load(pem):
+        loads.append(pem)
+        return object()
+    assert certs.parsed(first, load) is certs.parsed(first, load)
+    assert len(loads) == 1
+    _, other = make_cert(tmpdir, 'other')
+    os.rename(other, crt)
+    assert certs.read_file(crt) != first
+    assert certs.read_file(str(tmpdir.join('missing.pem'))) is None
@@ -0,0 +1,84 @@
+import fnmatch
+
+import hubblestack.utils.checkplan as checkplan
+
+TAGS_DICT = {'CentOS Linux-6, Red Hat Enterprise Linux Server-6': [{'/etc/a': 'CIS-1'}],
+             'CentOS*-7': [{'/etc/b': 'CIS-2'}],
+             'Ubuntu-16.04': None,
+             '*': [{'/etc/c': 'CIS-3'}]}
+
+
+def test_matches_like_fnmatch():
+    for name, pattern in [('CIS-1.1.1', 'CIS-1*'), ('CIS-1.1.1', 'CIS-2*'), ('CIS-1', '*'),
+                          ('CIS-1', 'CIS-?'), ('CIS-10', 'CIS-?'), ('a.b', 'a[.]b'),
+                          ('', '*'), ('CIS-1', '')]:
+        assert checkplan.matches(name, pattern) == fnmatch.fnmatch(name, pattern)
+        # and again, from the cache
+        assert checkplan.matches(name, pattern) == fnmatch.fnmatch(name, pattern)
+
+def test_select_target():
+    assert checkplan.select_target(TAGS_DICT, 'CentOS Linux-6') == [{'/etc/a': 'CIS-1'}]
+    assert checkplan.select_target(TAGS_DICT, 'Red Hat Enterprise Linux Server-6') \
+        == [{'/etc/a': 'CIS-1'}]
+    assert checkplan.select_target(TAGS_DICT, 'CentOS Linux-7') == [{'/etc/b': 'CIS-2'}]
+    # a matching target without checks falls through to '*'
+    assert checkplan.select_target(TAGS_DICT, 'Ubuntu-16.04') == [{'/etc/c': 'CIS-3'}]
+    assert checkplan.select_target(TAGS_DICT, 'Debian-9') == [{'/etc/c': 'CIS-3'}]
+    assert checkplan.select_target(TAGS_DICT, None) == [{'/etc/c': 'CIS-3'}]
+    assert checkplan.select_target({'CentOS*-7': []}, 'Debian-9') == []
+
+def test_compile_plan_is_cached():
+    checkplan.clear_cache()
+    calls = []
+
+    def build(data):
+        calls.append(data)
+        return {'CIS-1': [{'name': name, 'tag': 'CIS-1'} for name in data['files']]}
+
+    data = {'files': ['/etc/a', '/etc/b']}
+    plan = checkplan.compile_plan('test', data, build, 'CentOS Linux-7')
+    assert plan == build(data)
+    del calls[:]
+    # the caller's changes don't leak into the cached plan
+    plan['CIS-1'][0]['failure_reason'] = 'nope'
+    again = checkplan.compile_plan('test', {'files': ['/etc/a', '/etc/b']}, build, 'CentOS Linux-7')
+    assert not calls
+    assert 'failure_reason' not in again['CIS-1'][0]
+    # rebuilt when the grain or the data change
+    checkplan.compile_plan('test', data, build, 'CentOS Linux-6')
+    assert len(calls) == 1
+    checkplan.compile_plan('test', {'files': ['/etc/a']}, build, 'CentOS Linux-7')
+    assert len(calls) == 2
+
+def test_compile_plan_keyed_on_profile_stamp(tmpdir):
+    checkplan.clear_cache()
+    calls = []
+
+    def build(data):
+        calls.append(data)
+        return {'CIS-1': [{'name': name, 'tag': 'CIS-1'} for name in data['files']]}
+
+    path = tmpdir.join('profile.yaml')
+    path.write('files: [/etc/a]\n')
+    stamp = checkplan.file_stamp(str(path))
+    assert stamp == (str(path), path.stat().mtime, path.size())
+    assert checkplan.file_stamp(str(tmpdir.join('missing.yaml'))) is None
+
+    data = {'files': ['/etc/a']}
+    profiles = checkplan.Profiles([('profile', data)], (stamp,))
+    checkplan.compile_plan('test', data, build, 'CentOS Linux-7', profiles, ['web'])
+    assert len(calls) == 1
+    # same files and labels: the data isn't looked at
+    plan = checkplan.compile_plan('test', {'files': []}, build, 'CentOS Linux-7', profiles, ['web'])
+    assert len(calls) == 1
+    assert plan == {'CIS-1': [{'name': '/etc/a', 'tag': 'CIS-1'}]}
+    # rebuilt when the labels or a file change
+    checkplan.compile_plan('test', data, build, 'CentOS Linux-7', profiles, None)
+    assert len(calls) == 2
+    changed = checkplan.Profiles(profiles, ((str(path), stamp[1] + 1, stamp[2]),))
+    checkplan.compile_plan('test', data, build, 'CentOS Linux-7', changed, None)
+    assert len(calls) == 3
+    # without a stamp the data is digested
+    checkplan.compile_plan('test', data, build, 'CentOS Linux-7', checkplan.Profiles(profiles))
+    checkplan.compile_plan('test', data, build, 'CentOS Linux-7', list(profiles))
+    assert len(calls) == 4
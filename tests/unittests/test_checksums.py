@@ -0,0 +1,67 @@
+import hashlib
+import os
+import time
+
+import hubblestack.utils.checksums as checksums
+
+
+def write(path, data):
+    with open(path, 'wb') as fh:
+        fh.write(data)
+
+def test_cached_per_version(tmpdir):
+    path = str(tmpdir.join('a'))
+    write(path, b'hello')
+    service = checksums.ChecksumService()
+    res = service.checksum(path, 'sha256')
+    assert res.checksum == hashlib.sha256(b'hello').hexdigest()
+    assert res.checksum_type == 'sha256'
+    assert not res.cached and res.previous is None
+    res = service.checksum(path, 'sha256')
+    assert res.cached and res.previous == res.checksum
+    write(path, b'hello world')
+    res = service.checksum(path, 'sha256')
+    assert not res.cached
+    assert res.checksum == hashlib.sha256(b'hello world').hexdigest()
+    assert res.previous == hashlib.sha256(b'hello').hexdigest()
+    stats = service.stats()
+    assert (stats['hits'], stats['misses'], stats['bytes_hashed']) == (1, 2, 16)
+    assert service.checksum(str(tmpdir), 'sha256').checksum is None
+
+def test_bounded(tmpdir):
+    service = checksums.ChecksumService(max_entries=2)
+    for i in range(4):
+        path = str(tmpdir.join(str(i)))
+        write(path, str(i).encode())
+        service.checksum(path, 'md5')
+    assert len(service.cache) == 2 and len(service.last) == 2
+    assert service.stats()['evicted'] == 2
+
+def test_large_files_in_the_background(tmpdir):
+    path = str(tmpdir.join('big'))
+    write(path, b'x' * 4096)
+    service = checksums.ChecksumService(inline_size=1024)
+    # no time to wait: picked up from the cache later on
+    res = service.checksum(path, 'sha1', deadline=time.time() - 1)
+    if res.checksum is None:
+        assert res.pending
+        assert service.stats()['timeouts'] == 1
+        service.running[path].join(timeout=5)
+    res = service.checksum(path, 'sha1', deadline=time.time() + 5)
+    assert res.checksum == hashlib.sha1(b'x' * 4096).hexdigest()
+    assert not res.pending
+    assert service.stats()['background'] == 1
+    service.shutdown()
+
+def test_size_cap_and_sampling(tmpdir):
+    path = str(tmpdir.join('big'))
+    write(path, os.urandom(10000))
+    service = checksums.ChecksumService(size_cap=1000)
+    res = service.checksum(path, 'sha256')
+    assert res.checksum is None and not res.pending
+    assert service.stats()['skipped'] == 1
+    service.configure(size_cap=1000, sample=True, sample_size=100, sample_blocks=4)
+    res = service.checksum(path, 'sha256')
+    assert res.checksum_type == 'sha256-sampled'
+    assert res.checksum == checksums.hash_file(path, 'sha256', None, 100, 4)[0]
+    assert service.stats()['bytes_hashed'] == 400
@@ -0,0 +1,80 @@
+import collections
+
+import hubblestack.utils.coalesce as coalesce
+
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_CREATE, IN_DELETE = 0x2, 0x4, 0x8, 0x100, 0x200
+IN_ISDIR = 0x40000000
+
+
+class Event(object):
+    def __init__(self, pathname, mask, maskname, cookie=0):
+        self.pathname = pathname
+        self.mask = mask
+        self.maskname = maskname
+        self.cookie = cookie
+        self.wd = 1
+
+def burst(path, *changes):
+    return [Event(path, mask, name) for mask, name in changes]
+
+def test_burst_becomes_one_event():
+    c = coalesce.EventCoalescer(window=0.5, max_delay=5)
+    c.add_all(collections.deque(burst('/etc/a', (IN_CREATE, 'IN_CREATE'),
+                                      (IN_MODIFY, 'IN_MODIFY'), (IN_MODIFY, 'IN_MODIFY'),
+                                      (IN_CLOSE_WRITE, 'IN_CLOSE_WRITE'))), now=100)
+    c.add(Event('/etc/b', IN_ATTRIB, 'IN_ATTRIB'), now=100.2)
+    # nothing is ready within the window
+    assert c.ready(now=100.3) == []
+    c.add(Event('/etc/b', IN_MODIFY, 'IN_MODIFY'), now=100.4)
+    events = c.ready(now=100.6)
+    assert [e.pathname for e in events] == ['/etc/a']
+    assert events[0].maskname == 'IN_CREATE'
+    assert events[0].mask == IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE
+    assert events[0].count == 4
+    assert events[0].changes == {'IN_CREATE': 1, 'IN_MODIFY': 2, 'IN_CLOSE_WRITE': 1}
+    events = c.ready(now=101)
+    assert [(e.pathname, e.maskname, e.count) for e in events] == [('/etc/b', 'IN_MODIFY', 2)]
+    assert c.sweep_stats() == {'raw': 6, 'emitted': 2, 'evicted': 0, 'pending': 0}
+    assert c.sweep_stats()['raw'] == 0
+
+def test_last_structural_change_and_dirs():
+    c = coalesce.EventCoalescer(window=1)
+    c.add_all(collections.deque(burst('/tmp/d', (IN_CREATE | IN_ISDIR, 'IN_CREATE|IN_ISDIR'),
+                                      (IN_DELETE | IN_ISDIR, 'IN_DELETE|IN_ISDIR'))), now=0)
+    event, = c.flush()
+    assert event.maskname == 'IN_DELETE|IN_ISDIR'
+    assert event.dir
+
+def test_max_delay_and_max_pending():
+    c = coalesce.EventCoalescer(window=1, max_delay=3, max_pending=2)
+    for t in range(5):
+        c.add(Event('/var/log/x', IN_MODIFY, 'IN_MODIFY'), now=t * 0.5)
+    # still changing, but held for max_delay at most
+    assert [e.count for e in c.ready(now=3)] == [5]
+    c.add(Event('/a', IN_MODIFY, 'IN_MODIFY'), now=10)
+    c.add(Event('/b', IN_MODIFY, 'IN_MODIFY'), now=10)
+    c.add(Event('/c', IN_MODIFY, 'IN_MODIFY'), now=10)
+    assert len(c.pending) == 2
+    assert [e.pathname for e in c.ready(now=10)] == ['/a']
+    assert c.sweep_stats()['evicted'] == 1
+
+def test_cookies_and_passthrough():
+    c = coalesce.EventCoalescer(window=1)
+    c.add(Event('/x', IN_MODIFY, 'IN_MODIFY', cookie=0), now=0)
+    c.add(Event('/x', 0x80, 'IN_MOVED_TO', cookie=7), now=0)
+    c.add(Event(None, 0x4000, 'IN_Q_OVERFLOW'), now=0)
+    events = c.ready(now=0)
+    assert [e.maskname for e in events] == ['IN_Q_OVERFLOW']
+    assert len(c.flush()) == 2
+    c.configure(window=None)
+    c.add(Event('/x', IN_MODIFY, 'IN_MODIFY'), now=0)
+    c.add(Event('/x', IN_MODIFY, 'IN_MODIFY'), now=0)
+    assert len(c.ready(now=0)) == 2
+
+def test_window_turned_off_with_events_held():
+    c = coalesce.EventCoalescer(window=1)
+    c.add(Event('/etc/a', IN_MODIFY, 'IN_MODIFY'), now=0)
+    c.configure(None)
+    c.add(Event('/etc/b', IN_MODIFY, 'IN_MODIFY'), now=0.1)
+    assert sorted(e.pathname for e in c.ready(now=0.2)) == ['/etc/a', '/etc/b']
+    assert len(c) == 0
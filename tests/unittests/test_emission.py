@@ -0,0 +1,91 @@
+import hubblestack.utils.emission as emission
+
+
+def results(failure=(), success=(), controlled=()):
+    return {'Failure': [{tag: desc} for tag, desc in failure],
+            'Success': [{tag: desc} for tag, desc in success],
+            'Controlled': [{tag: desc} for tag, desc in controlled],
+            'Compliance': '50%'}
+
+def emit(tmpdir, data, now, heartbeat=3600, delivered=True, show_success=True):
+    state = emission.DeltaState(str(tmpdir.join('state.json')))
+    ret = emission.emit(data, state, heartbeat=heartbeat, now=now, show_success=show_success)
+    if delivered:
+        assert emission.commit(ret)
+    return ret
+
+def test_first_run_is_full(tmpdir):
+    data = results(failure=[('CIS-1', 'telnet')], success=[('CIS-2', 'ssh')])
+    ret = emit(tmpdir, data, 1000)
+    assert ret['Emission']['mode'] == 'full'
+    assert ret['Failure'] == data['Failure'] and ret['Success'] == data['Success']
+    assert [(r['check_result'], r['check_id'], r['transition']) for r in emission.records(ret)] \
+        == [('Failure', 'CIS-1', None), ('Success', 'CIS-2', None)]
+    assert emission.summary(ret)['checks'] == 2
+    assert emission.summary(ret)['compliance_percentage'] == '50%'
+    assert emission.summary({'Failure': []}) is None
+    assert 'pending' not in emission.summary(ret)
+
+def test_only_transitions(tmpdir):
+    emit(tmpdir, results(failure=[('CIS-1', 'telnet'), ('CIS-3', 'rsh')],
+                         success=[('CIS-2', 'ssh'), ('CIS-4', 'nfs')]), 1000)
+    # unchanged: nothing but the summary
+    ret = emit(tmpdir, results(failure=[('CIS-1', 'telnet'), ('CIS-3', 'rsh')],
+                               success=[('CIS-2', 'ssh'), ('CIS-4', 'nfs')]), 1100)
+    assert ret['Emission']['mode'] == 'delta'
+    assert ret['Emission']['transitions'] == 0
+    assert list(emission.records(ret)) == []
+    assert ret['Compliance'] == '50%'
+
+    ret = emit(tmpdir, results(failure=[('CIS-1', 'telnet'), ('CIS-2', 'ssh')],
+                               success=[('CIS-3', 'rsh'), ('CIS-5', 'new')],
+                               controlled=[('CIS-4', 'waived')]), 1200)
+    got = sorted((r['check_result'], r['check_id'], r['transition'])
+                 for r in emission.records(ret))
+    assert got == [('Controlled', 'CIS-4', 'controlled'),
+                   ('Failure', 'CIS-2', 'failed'),
+                   ('Success', 'CIS-3', 'fixed'),
+                   ('Success', 'CIS-5', 'new')]
+
+    ret = emit(tmpdir, results(failure=[('CIS-1', 'telnet'), ('CIS-2', 'ssh')],
+                               success=[('CIS-3', 'rsh')],
+                               controlled=[('CIS-4', 'waived')]), 1300)
+    assert [(r['check_result'], r['check_id']) for r in emission.records(ret)] \
+        == [('Removed', 'CIS-5')]
+
+def test_heartbeat(tmpdir):
+    data = results(failure=[('CIS-1', 'telnet')])
+    emit(tmpdir, data, 1000)
+    assert emit(tmpdir, data, 2000)['Emission']['mode'] == 'delta'
+    ret = emit(tmpdir, data, 4600)
+    assert ret['Emission']['mode'] == 'full'
+    assert ret['Failure'] == data['Failure']
+    assert emit(tmpdir, data, 4700)['Emission']['mode'] == 'delta'
+
+def test_verbose_checks_keyed_by_target():
+    one = emission.check_key('CIS-1', {'name': '/etc/passwd', 'module': 'stat', 'tag': 'CIS-1'})
+    two = emission.check_key('CIS-1', {'name': '/etc/shadow', 'module': 'stat', 'tag': 'CIS-1'})
+    assert one != two
+    assert one == emission.check_key('CIS-1', {'name': '/etc/passwd', 'module': 'stat',
+                                               'tag': 'CIS-1', 'failure_reason': 'mode'})
+
+def test_undelivered_results_are_reported_again(tmpdir):
+    emit(tmpdir, results(failure=[('CIS-1', 'telnet')]), 1000)
+    fixed = results(success=[('CIS-1', 'telnet')])
+    # e.g. a CLI call, or a returner that failed
+    ret = emit(tmpdir, fixed, 1100, delivered=False)
+    assert ret['Emission']['run'] == 2
+    ret = emit(tmpdir, fixed, 1200)
+    assert ret['Emission']['run'] == 2
+    assert [(r['check_id'], r['transition']) for r in emission.records(ret)] == [('CIS-1', 'fixed')]
+    assert emit(tmpdir, fixed, 1300)['Emission']['transitions'] == 0
+    assert not emission.commit({'Failure': []})
+
+def test_hidden_successes_still_report_fixes(tmpdir):
+    ret = emit(tmpdir, results(failure=[('CIS-1', 'telnet')], success=[('CIS-2', 'ssh')]), 1000,
+               show_success=False)
+    assert 'Success' not in ret and ret['Emission']['Success'] == 1
+    ret = emit(tmpdir, results(success=[('CIS-1', 'telnet'), ('CIS-2', 'ssh'), ('CIS-3', 'new')]),
+               1100, show_success=False)
+    assert [(r['check_result'], r['check_id'], r['transition']) for r in emission.records(ret)] \
+        == [('Success', 'CIS-1', 'fixed')]
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+
+import hubblestack.utils.eventloop as eventloop
+
+
+def wait_for(cond, timeout=5):
+    deadline = time.time() + timeout
+    while not cond() and time.time() < deadline:
+        time.sleep(0.01)
+    return cond()
+
+def test_queue_latency_and_order():
+    alerts = eventloop.AlertQueue(max_size=10)
+    assert alerts.put([1, 2], arrived=100) == 0
+    alerts.put([3], arrived=101)
+    assert alerts.get_all(max_items=2, now=102) == [1, 2]
+    assert alerts.get_all(now=102) == [3]
+    assert alerts.get_all() == []
+    stats = alerts.stats()
+    assert stats['put'] == 3 and stats['delivered'] == 3 and stats['queued'] == 0
+    assert stats['latency']['max'] == 2
+    assert abs(stats['latency']['avg'] - 5 / 3.0) < 1e-9
+
+def test_queue_drops_oldest_when_full():
+    alerts = eventloop.AlertQueue(max_size=3, block=0)
+    alerts.put([1, 2])
+    assert alerts.put([3, 4, 5]) == 2
+    assert alerts.get_all() == [3, 4, 5]
+    stats = alerts.stats()
+    assert stats['dropped'] == 2 and stats['overflows'] == 1 and stats['blocked'] == 1
+
+def test_queue_backpressure_waits_for_consumer():
+    alerts = eventloop.AlertQueue(max_size=2, block=5)
+    alerts.put([1, 2])
+    drained = []
+    timer = threading.Timer(0.2, lambda: drained.extend(alerts.get_all()))
+    timer.start()
+    started = time.time()
+    assert alerts.put([3]) == 0
+    assert time.time() - started >= 0.1
+    timer.join()
+    assert drained == [1, 2]
+    assert alerts.get_all() == [3]
+    assert alerts.stats()['dropped'] == 0
+
+def test_loop_wakes_on_readable_fd_and_ticks():
+    rfd, wfd = os.pipe()
+    seen = []
+    def on_ready(now):
+        seen.append(os.read(rfd, 64))
+    ticks = []
+    loop = eventloop.EventLoop(rfd, on_ready, ticks.append, interval=0.05, name='test-loop')
+    loop.start()
+    try:
+        assert wait_for(lambda: len(ticks) >= 1)
+        os.write(wfd, b'event')
+        assert wait_for(lambda: seen == [b'event'])
+        assert wait_for(lambda: len(ticks) >= 3)
+    finally:
+        assert loop.stop(timeout=5)
+        os.close(rfd)
+        os.close(wfd)
+    stats = loop.stats()
+    assert stats['wakeups'] == 1 and not stats['alive'] and stats['errors'] == 0
+
+def test_loop_survives_errors():
+    rfd, wfd = os.pipe()
+    calls = []
+    def on_tick(now):
+        calls.append(now)
+        if len(calls) == 1:
+            raise ValueError('boom')
+    loop = eventloop.EventLoop(rfd, lambda now: None, on_tick, interval=0.01)
+    loop.start()
+    try:
+        assert wait_for(lambda: len(calls) >= 2)
+    finally:
+        loop.stop(timeout=5)
+        os.close(rfd)
+        os.close(wfd)
+    assert loop.stats()['errors'] == 1
+
+def test_queue_waits_for_room_by_default():
+    alerts = eventloop.AlertQueue(max_size=2)
+    alerts.put([1, 2])
+    drained = []
+    timer = threading.Timer(1.5, lambda: drained.extend(alerts.get_all()))
+    timer.start()
+    started = time.time()
+    assert alerts.put([3]) == 0
+    assert time.time() - started >= 1.4
+    timer.join()
+    assert drained == [1, 2]
+    assert alerts.get_all() == [3]
+    # a batch larger than the queue still goes into an empty one
+    assert alerts.put([4, 5, 6]) == 0
+    assert alerts.get_all() == [4, 5, 6]
+    stats = alerts.stats()
+    assert stats['dropped'] == 0 and stats['blocked'] == 2
@@ -0,0 +1,105 @@
+import threading
+import time
+
+import hubblestack.utils.facts as facts
+
+
+def counting_salt():
+    calls = []
+    def version(name):
+        calls.append(name)
+        return '1.0-' + name
+    return {'pkg.version': version}, calls
+
+def test_memoized_within_a_run():
+    salt, calls = counting_salt()
+    with facts.run_scope():
+        assert facts.salt_call(salt, 'pkg.version', 'bash', cost=1) == '1.0-bash'
+        assert facts.salt_call(salt, 'pkg.version', 'bash', cost=1) == '1.0-bash'
+        assert facts.salt_call(salt, 'pkg.version', 'zsh', cost=1) == '1.0-zsh'
+    assert calls == ['bash', 'zsh']
+    assert facts.LAST_RUN['subprocesses'] == 2
+    assert facts.LAST_RUN['subprocesses_saved'] == 1
+
+def test_in_process_lookups_save_no_subprocesses(tmpdir):
+    salt, calls = counting_salt()
+    path = str(tmpdir.join('f'))
+    with facts.run_scope():
+        facts.salt_call(salt, 'pkg.version', 'bash')
+        facts.salt_call(salt, 'pkg.version', 'bash')
+        facts.file_lines(path)
+        facts.file_lines(path)
+    assert calls == ['bash']
+    assert facts.LAST_RUN['hits'] == 2
+    assert facts.LAST_RUN['subprocesses'] == 0
+    assert facts.LAST_RUN['subprocesses_saved'] == 0
+
+def test_dropped_at_run_end():
+    salt, calls = counting_salt()
+    with facts.run_scope():
+        facts.salt_call(salt, 'pkg.version', 'bash')
+    with facts.run_scope():
+        facts.salt_call(salt, 'pkg.version', 'bash')
+    assert calls == ['bash', 'bash']
+
+def test_no_memo_outside_a_run():
+    salt, calls = counting_salt()
+    facts.salt_call(salt, 'pkg.version', 'bash')
+    facts.salt_call(salt, 'pkg.version', 'bash')
+    assert calls == ['bash', 'bash']
+
+def test_nested_runs_share_a_snapshot():
+    salt, calls = counting_salt()
+    with facts.run_scope() as outer:
+        with facts.run_scope() as inner:
+            assert inner is outer
+            facts.salt_call(salt, 'pkg.version', 'bash')
+        # the inner end_run() must not drop the snapshot
+        assert facts.snapshot() is outer
+        facts.salt_call(salt, 'pkg.version', 'bash')
+    assert calls == ['bash']
+
+def test_kwargs_are_part_of_the_key():
+    seen = []
+    salt = {'cmd.run': lambda cmd, **kw: seen.append((cmd, kw)) or cmd}
+    with facts.run_scope():
+        facts.salt_call(salt, 'cmd.run', ['grep', 'x'], python_shell=False)
+        facts.salt_call(salt, 'cmd.run', ['grep', 'x'], python_shell=False)
+        facts.salt_call(salt, 'cmd.run', ['grep', 'x'], python_shell=True)
+    assert len(seen) == 2
+
+def test_concurrent_callers_collect_once():
+    calls = []
+    def slow(name):
+        calls.append(name)
+        time.sleep(0.1)
+        return name
+    salt = {'sysctl.get': slow}
+    results = []
+    with facts.run_scope():
+        threads = [threading.Thread(target=lambda: results.append(
+            facts.salt_call(salt, 'sysctl.get', 'kernel.randomize_va_space'))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert calls == ['kernel.randomize_va_space']
+    assert len(results) == 5
+
+def test_file_lines(tmpdir):
+    passwd = tmpdir.join('passwd')
+    passwd.write('root:x:0:0:root:/root:/bin/bash\n+::::::\n\nbin:x:1:1:bin:/bin:/sbin/nologin\n')
+    with facts.run_scope():
+        lines = facts.file_lines(str(passwd))
+        passwd.write('changed:x:9:9::/:/bin/sh\n')
+        assert facts.file_lines(str(passwd)) is lines
+    assert len(lines) == 4 and lines[0].startswith('root:')
+    assert facts.file_lines(str(tmpdir.join('missing'))) == []
+
+def test_decorator_form():
+    @facts.run_scope()
+    def top():
+        """ doc """
+        return facts.snapshot()
+    assert top.__name__ == 'top'
+    assert top() is not facts.snapshot()
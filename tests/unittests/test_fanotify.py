@@ -0,0 +1,60 @@
+import os
+import struct
+import time
+
+import pytest
+
+import hubblestack.utils.fanotify as fanotify
+
+
+def event(mask, infos, pid=42):
+    body = b''
+    for info_type, handle, name in infos:
+        record = struct.pack('=iiIi', 1, 2, len(handle), 1) + handle
+        if name is not None:
+            record += name.encode() + b'\0'
+        record += b'\0' * (-(len(record) + 4) % 4)
+        body += struct.pack('=BBH', info_type, 0, len(record) + 4) + record
+    return struct.pack('=IBBHQii', 24 + len(body), 3, 0, 24, mask, -1, pid) + body
+
+def test_parse_events():
+    buf = event(fanotify.FAN_CREATE | fanotify.FAN_ONDIR,
+                [(fanotify.FAN_EVENT_INFO_TYPE_DFID_NAME, b'\x01' * 8, 'newdir')])
+    buf += event(fanotify.FAN_Q_OVERFLOW, [], pid=0)
+    events = list(fanotify.parse_events(buf))
+    assert len(events) == 2
+    mask, pid, infos = events[0]
+    assert mask == fanotify.FAN_CREATE | fanotify.FAN_ONDIR and pid == 42
+    assert infos == [(fanotify.FAN_EVENT_INFO_TYPE_DFID_NAME, (1, 2), 1, b'\x01' * 8, 'newdir')]
+    assert events[1] == (fanotify.FAN_Q_OVERFLOW, 0, [])
+    # a truncated event is left alone
+    assert list(fanotify.parse_events(buf[:30])) == []
+
+def test_masknames_match_inotify():
+    assert fanotify.FanotifyEvent(fanotify.FAN_CREATE | fanotify.FAN_ONDIR, '/a/b').maskname \
+        == 'IN_CREATE|IN_ISDIR'
+    assert fanotify.FanotifyEvent(fanotify.FAN_MODIFY, '/a/b').maskname == 'IN_MODIFY'
+    assert fanotify.FanotifyEvent(fanotify.FAN_Q_OVERFLOW, None).maskname == 'IN_Q_OVERFLOW'
+
+@pytest.mark.skipif(not fanotify.available()[0], reason='fanotify is not available here')
+def test_filesystem_mark(tmpdir):
+    top = str(tmpdir)
+    fan = fanotify.Fanotify()
+    try:
+        fan.mark(top, fanotify.FAN_CREATE | fanotify.FAN_DELETE | fanotify.FAN_MODIFY)
+        os.mkdir(os.path.join(top, 'sub'))
+        with open(os.path.join(top, 'sub', 'f'), 'w') as fh:
+            fh.write('x')
+        os.unlink(os.path.join(top, 'sub', 'f'))
+        seen = []
+        deadline = time.time() + 5
+        while len(seen) < 4 and time.time() < deadline:
+            if fan.wait(0.5):
+                seen.extend((e.pathname, e.maskname) for e in fan.read_events()
+                            if e.pathname and e.pathname.startswith(top))
+        assert seen == [(os.path.join(top, 'sub'), 'IN_CREATE|IN_ISDIR'),
+                        (os.path.join(top, 'sub', 'f'), 'IN_CREATE'),
+                        (os.path.join(top, 'sub', 'f'), 'IN_MODIFY'),
+                        (os.path.join(top, 'sub', 'f'), 'IN_DELETE')]
+    finally:
+        fan.close()
@@ -0,0 +1,66 @@
+import os
+import time
+
+import hubblestack.utils.fsscan as fsscan
+
+
+def make_tree(tmpdir):
+    tmpdir.mkdir('etc').join('passwd').write('')
+    ww = tmpdir.mkdir('tmp').join('world')
+    ww.write('')
+    os.chmod(str(ww), 0o666)
+    sticky = tmpdir.join('tmp').mkdir('sticky')
+    os.chmod(str(sticky), 0o1777)
+    loose = tmpdir.join('tmp').mkdir('loose')
+    os.chmod(str(loose), 0o777)
+    suid = tmpdir.mkdir('bin').join('su')
+    suid.write('')
+    os.chmod(str(suid), 0o4755)
+    deep = tmpdir.mkdir('a').mkdir('b').mkdir('c').join('world')
+    deep.write('')
+    os.chmod(str(deep), 0o646)
+    pruned = tmpdir.mkdir('cache').join('world')
+    pruned.write('')
+    os.chmod(str(pruned), 0o666)
+    return str(tmpdir)
+
+def test_single_pass_predicates(tmpdir):
+    root = make_tree(tmpdir)
+    result = fsscan.scan(roots=[root], prune=[os.path.join(root, 'cache')], ttl=0)
+    assert result.complete
+    assert result.matches['world_writable'] == [os.path.join(root, 'a/b/c/world'),
+                                                os.path.join(root, 'tmp/world')]
+    assert result.matches['sticky_missing'] == [os.path.join(root, 'tmp/loose')]
+    assert result.matches['suid'] == [os.path.join(root, 'bin/su')]
+    assert result.matches['sgid'] == []
+    assert result.entries >= 12
+
+def test_unknown_owner(tmpdir, monkeypatch):
+    root = make_tree(tmpdir)
+    monkeypatch.setattr(fsscan, '_uid_known', lambda uid: False)
+    result = fsscan.scan(roots=[root], ttl=0)
+    assert os.path.join(root, 'etc/passwd') in result.matches['unowned']
+    assert result.matches['ungrouped'] == []
+
+def test_ttl_cache(tmpdir):
+    root = make_tree(tmpdir)
+    first = fsscan.scan(roots=[root], ttl=60)
+    tmpdir.join('tmp', 'world').remove()
+    assert fsscan.scan(roots=[root], ttl=60) is first
+    fresh = fsscan.scan(roots=[root], ttl=0)
+    assert fresh is not first
+    assert os.path.join(root, 'tmp/world') not in fresh.matches['world_writable']
+
+def test_budget(tmpdir):
+    root = make_tree(tmpdir)
+    result = fsscan.scan(roots=[root], max_entries=1, ttl=0, max_workers=1)
+    assert not result.complete
+
+def test_registered_predicate(tmpdir):
+    root = make_tree(tmpdir)
+    fsscan.register_predicate('named_su', lambda path, st: path.endswith('/su'))
+    try:
+        result = fsscan.scan(roots=[root], ttl=0)
+    finally:
+        fsscan.PREDICATES.pop('named_su')
+    assert result.matches['named_su'] == [os.path.join(root, 'bin/su')]
@@ -0,0 +1,85 @@
+import pytest
+
+import hubblestack.utils.facts as facts
+import hubblestack.utils.grep as grep_engine
+
+SSHD_CONFIG = """\
+# comment
+PermitRootLogin no
+  PermitRootLogin yes
+Protocol 2
+ClientAliveInterval 300
+ClientAliveCountMax 0
+a+b (c) x*y
+root:$6$abc:17000:0:99999:7:::
+nobody:!!:17000:0:99999:7:::
+word wordy sword
+last line"""
+
+
+@pytest.fixture
+def sample(tmpdir):
+    path = tmpdir.join('sshd_config')
+    path.write(SSHD_CONFIG)
+    return str(path)
+
+@pytest.mark.parametrize('args,pattern,expected', [
+    ('', 'PermitRootLogin', 'PermitRootLogin no\n  PermitRootLogin yes'),
+    ('', '^PermitRootLogin', 'PermitRootLogin no'),
+    ('-i', '^permitrootlogin', 'PermitRootLogin no'),
+    ('-E', '^ClientAlive(Interval|CountMax) [1-9]', 'ClientAliveInterval 300'),
+    ('', 'ClientAlive\\(Interval\\|CountMax\\) [0-9]\\{3\\}', 'ClientAliveInterval 300'),
+    ('', 'a+b', 'a+b (c) x*y'),
+    ('-E', 'a\\+b', 'a+b (c) x*y'),
+    ('-E', '^[^:]+:[^\\!*]', 'root:$6$abc:17000:0:99999:7:::'),
+    ('-w', 'word', 'word wordy sword'),
+    ('-w', 'ord', ''),
+    ('-x', 'Protocol 2', 'Protocol 2'),
+    ('-v -E', '^[#A-Z ]|[a-z]$', 'root:$6$abc:17000:0:99999:7:::\nnobody:!!:17000:0:99999:7:::'),
+    ('-B1', '^Protocol', '  PermitRootLogin yes\nProtocol 2'),
+    ('-A 1', 'PermitRootLogin', 'PermitRootLogin no\n  PermitRootLogin yes\nProtocol 2'),
+    ('-A1', 'ClientAliveInterval\\|^root', 'ClientAliveInterval 300\nClientAliveCountMax 0\n--\nroot:$6$abc:17000:0:99999:7:::\nnobody:!!:17000:0:99999:7:::'),
+    ('-F', 'x*y', 'a+b (c) x*y'),
+    ('', '[[:digit:]]\\{5\\}', 'root:$6$abc:17000:0:99999:7:::\nnobody:!!:17000:0:99999:7:::'),
+])
+def test_matches_grep(sample, args, pattern, expected):
+    cmd = "grep {0} '{1}' {2}".format(args, pattern, sample)
+    ret = grep_engine.run(cmd)
+    assert ret['stdout'] == expected
+    assert ret['retcode'] == (0 if expected else 1)
+
+@pytest.mark.parametrize('cmd', [
+    'grep -l PermitRootLogin {0}',
+    'grep PermitRootLogin {0} {0}',
+    'grep PermitRootLogin {0}.missing',
+    "grep -P '\\d+' {0}",
+    "grep 'a\\d' {0}",
+    "grep '[[=a=]]' {0}",
+    "grep -E '(?i)x' {0}",
+    "grep 'unbalanced {0}",
+])
+def test_falls_back(sample, cmd):
+    assert grep_engine.run(cmd.format(sample)) is None
+
+def test_binary_file_falls_back(tmpdir):
+    path = tmpdir.join('binary')
+    path.write_binary(b'PermitRootLogin\0no\n')
+    assert grep_engine.run('grep PermitRootLogin ' + str(path)) is None
+
+def test_file_read_once_per_run(sample):
+    with facts.run_scope() as snap:
+        grep_engine.run('grep Protocol ' + sample)
+        grep_engine.run('grep -i root ' + sample)
+        assert snap.stats()['misses'] == 1
+        assert snap.stats()['hits'] == 1
+
+@pytest.mark.parametrize('pattern,expected', [
+    ('^^caret', '^caret'),
+    ('^*x', '*x'),
+    ('^caret', 'caret'),
+])
+def test_caret_after_anchor_is_literal(tmpdir, pattern, expected):
+    path = tmpdir.join('carets')
+    path.write('^caret\ncaret\n*x\n')
+    ret = grep_engine.run("grep '{0}' {1}".format(pattern, path))
+    assert ret['stdout'] == expected
@@ -35,17 +35,22 @@ class TestGrep():
             val = hubblestack.files.hubblestack_nova.grep._merge_yaml(ret, data, profile)
         assert (len(val['grep']['blacklist'])) == 2
 
-    def test_audit_for_success(self):
+    def test_audit_for_success(self, tmpdir):
+        sshd_config = tmpdir.join('sshd_config')
+        sshd_config.write('IgnoreRhosts yes\nPermitUserEnvironment no\n')
+        sshd_config = str(sshd_config)
         val = {}
         data_list = [('ubuntu-1604-level-1-scored-v1-0-0',
                      {'grep':
                       {'blacklist': {'talk': {'data': {'Ubuntu-16.04': [{'/etc/inetd.conf': {'pattern': '^talk', 'tag': 'CIS-5.1.4'}}, {'/etc/inetd.conf': {'pattern': '^ntalk', 'tag': 'CIS-5.1.4'}}]}, 'description': 'Ensure talk server is not enabled'}},
-                       'whitelist': {'ssh_permit_user_env': {'data': {'Ubuntu-16.04': [{'/etc/ssh/sshd_config': {'pattern': 'PermitUserEnvironment', 'tag': 'CIS-9.3.10', 'match_output': 'no'}}]}, 'description': 'Do Not Allow Users to Set Environment Options'},
-                                     'ssh_ignore_rhosts': {'data': {'Ubuntu-16.04': [{'/etc/ssh/sshd_config': {'pattern': 'IgnoreRhosts', 'tag': 'CIS-9.3.6', 'match_output': 'yes'}}]}, 'description': 'Set SSH IgnoreRhosts to Yes'}}}})]
+                       'whitelist': {'ssh_permit_user_env': {'data': {'Ubuntu-16.04': [{sshd_config: {'pattern': 'PermitUserEnvironment', 'tag': 'CIS-9.3.10', 'match_output': 'no'}}]}, 'description': 'Do Not Allow Users to Set Environment Options'},
+                                     'ssh_ignore_rhosts': {'data': {'Ubuntu-16.04': [{sshd_config: {'pattern': 'IgnoreRhosts', 'tag': 'CIS-9.3.6', 'match_output': 'yes'}}]}, 'description': 'Set SSH IgnoreRhosts to Yes'}}}})]
         __tags__ = 'CIS-9.3.10'
         __salt__ = {}
+        calls = []
 
         def cmd_run_all(cmd, python_shell=False, ignore_retcode=False):
+            calls.append(cmd)
             test_val = {'pid': 28191, 'retcode': 0, 'stderr': '', 'stdout': 'tmpfs /dev/shm tmpfs rw,nosuid,nodev 0 0'}
             return test_val
         __salt__['cmd.run_all'] = cmd_run_all
@@ -54,6 +59,8 @@ class TestGrep():
         val = hubblestack.files.hubblestack_nova.grep.audit(data_list, __tags__, [], debug=False)
         assert len(val['Success']) != 0
         assert len(val['Failure']) == 0
+        # readable files are grepped in-process
+        assert calls == []
 
     def test_audit_for_value_error(self):
         val = {}
@@ -122,3 +129,29 @@ class TestGrep():
         val = hubblestack.files.hubblestack_nova.grep._grep(path, pattern, arg)
         hubblestack.files.hubblestack_nova.grep.__salt__ = {}
         assert val['stdout'] == 'tmpfs /dev/shm tmpfs rw,nosuid,nodev 0 0'
+
+    def test_grep_fallback_inputs(self, tmpdir):
+        import hubblestack.utils.facts as facts
+        tmpdir.join('conf').write('x\n')
+
+        class Recorder(object):
+            def __init__(self):
+                self.keys = []
+
+            def note(self, key):
+                self.keys.append(key)
+
+        def cmd_run_all(cmd, python_shell=False, ignore_retcode=False):
+            return {'pid': 1, 'retcode': 1, 'stderr': '', 'stdout': ''}
+        grep = hubblestack.files.hubblestack_nova.grep
+        grep.__salt__ = {'cmd.run_all': cmd_run_all}
+        try:
+            for path, args in ((str(tmpdir), ('-r',)), (str(tmpdir.join('conf')), ('-Rn',)),
+                               (str(tmpdir), ('--recursive',))):
+                with facts.recording(Recorder()) as recorder:
+                    grep._grep(path, 'x', *args)
+                assert recorder.keys == [('volatile', 'grep ' + path)]
+        finally:
+            grep.__salt__ = {}
+        assert not grep._recursive(('-i -B2', '--regexp=r'))
+        assert grep._recursive(('-i -rn',))
@@ -0,0 +1,13 @@
+import os
+
+import hubblestack.extmods.modules.hubble as hubble
+
+def test_timed_module_call_status_resource():
+    assert hubble._timed_module_call('grep.audit', lambda x: x * 2, 21) == 42
+    for key in ('grep.audit', os.path.join('', 'grep.audit')):
+        hubble._timed_module_call(key, lambda: None)
+    hubble._timed_module_call(os.path.join('linux', 'mount.audit'), lambda: None)
+    resources = hubble.hubble_status.resources
+    assert 'hubblestack.extmods.modules.hubble.nova_module.grep' in resources
+    assert 'hubblestack.extmods.modules.hubble.nova_module.linux.mount' in resources
+    assert not [name for name in resources if 'nova_modulegrep' in name or '..' in name]
@@ -0,0 +1,79 @@
+import hubblestack.utils.facts as facts
+import hubblestack.utils.incremental as incremental
+
+
+def test_describe():
+    assert incremental.describe(('grep_lines', '/etc/ssh/sshd_config')) == \
+        ('file', '/etc/ssh/sshd_config')
+    assert incremental.describe(('salt', 'file.stats', ('/etc/passwd',), ())) == \
+        ('file', '/etc/passwd')
+    assert incremental.describe(('procfs', 'sysctl', None, 'net.ipv4.conf.eth0/1.rp_filter')) == \
+        ('content', '/proc/sys/net/ipv4/conf/eth0.1/rp_filter')
+    assert incremental.describe(('pkg_index',)) == ('pkgdb',)
+    assert incremental.describe(('salt', 'cmd.run', ('sshd -T',), ())) is None
+    assert incremental.describe(('procfs', 'netstat', None)) is None
+
+def test_fingerprint(tmpdir):
+    path = tmpdir.join('conf')
+    path.write('a')
+    before = incremental.fingerprint(('file', str(path)))
+    assert incremental.fingerprint(('file', str(path))) == before
+    path.write('ab')
+    assert incremental.fingerprint(('file', str(path))) != before
+    assert incremental.fingerprint(('file', str(tmpdir.join('gone')))) == 'missing'
+    assert incremental.fingerprint(('content', str(path))) != \
+        incremental.fingerprint(('content', str(tmpdir.join('gone'))))
+
+
+def make_module(path, calls, volatile=False):
+    def audit(data_list, tags, labels):
+        calls.append(1)
+        if volatile:
+            facts.note_input(('volatile', 'test'))
+        lines = facts.file_lines(path)
+        return {'Success': [{'tag': 'T-1', 'lines': lines}], 'Failure': []}
+    return audit
+
+
+def run(state, func, digest='d1', full_every=12):
+    inc = incremental.IncrementalAudit(state, full_every=full_every)
+    ret = inc.reusable('mod.py', digest)
+    if ret is None:
+        with facts.run_scope():
+            ret = inc.tracked('mod.py', func, digest)([], '*', None)
+    inc.save()
+    return ret
+
+def test_reuse_until_inputs_change(tmpdir):
+    state = str(tmpdir.join('state.json'))
+    conf = tmpdir.join('conf')
+    conf.write('one\n')
+    calls = []
+    func = make_module(str(conf), calls)
+    first = run(state, func)
+    assert run(state, func) == first
+    assert len(calls) == 1
+    # a changed input, or changed profile data, re-runs the module
+    conf.write('one\ntwo\n')
+    assert run(state, func)['Success'][0]['lines'] == ['one', 'two']
+    assert len(calls) == 2
+    run(state, func, digest='d2')
+    assert len(calls) == 3
+    run(state, func, digest='d2')
+    assert len(calls) == 3
+
+def test_full_every_and_volatile(tmpdir):
+    state = str(tmpdir.join('state.json'))
+    conf = tmpdir.join('conf')
+    conf.write('one\n')
+    calls = []
+    func = make_module(str(conf), calls)
+    for _ in range(6):
+        run(state, func, full_every=3)
+    # runs 1 and 4 are full evaluations
+    assert len(calls) == 2
+    volatile_calls = []
+    func = make_module(str(conf), volatile_calls, volatile=True)
+    for _ in range(3):
+        run(str(tmpdir.join('other.json')), func)
+    assert len(volatile_calls) == 3
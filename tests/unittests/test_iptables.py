@@ -0,0 +1,69 @@
+import pytest
+
+import hubblestack.utils.facts as facts
+import hubblestack.utils.iptables as iptables
+
+SAVE = """\
+# Generated by iptables-save
+*nat
+:PREROUTING ACCEPT [0:0]
+-A PREROUTING -p tcp -m tcp --dport 8080 -j REDIRECT --to-ports 80
+COMMIT
+*filter
+:INPUT DROP [10:600]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+:logdrop - [0:0]
+-A INPUT -m state --state RELATED,ESTABLISHED -j ACCEPT
+-A INPUT -s 10.0.0.1/32 -p tcp -m tcp --dport 22 -j ACCEPT
+-A INPUT ! -i lo -p udp -m udp --dport 53 -m comment --comment "dns server" -j ACCEPT
+-A logdrop -j DROP
+COMMIT
+"""
+
+
+@pytest.fixture
+def ruleset():
+    return iptables.parse_save(SAVE)
+
+def test_policies(ruleset):
+    assert ruleset.policy('filter', 'INPUT') == 'DROP'
+    assert ruleset.policy('nat', 'PREROUTING') == 'ACCEPT'
+    assert ruleset.policy('filter', 'logdrop') is None
+    assert len(ruleset.rules('filter', 'INPUT')) == 3
+
+@pytest.mark.parametrize('rule', [
+    '-m state --state RELATED,ESTABLISHED -j ACCEPT',
+    '-j ACCEPT -m state --state ESTABLISHED,RELATED',
+    '-p tcp --dport 22 -s 10.0.0.1 -j ACCEPT',
+    'iptables -t filter -A INPUT --protocol tcp --destination-port 22 --source 10.0.0.1/32 --jump ACCEPT',
+    '-i ! lo -p udp --dport 53 -m comment --comment "dns server" -j ACCEPT',
+    '! -i lo -p udp -m udp --dport 53 -m comment --comment "dns server" -j ACCEPT',
+])
+def test_present(ruleset, rule):
+    assert ruleset.has_rule('filter', 'INPUT', rule)
+
+@pytest.mark.parametrize('rule', [
+    '-p tcp --dport 23 -j ACCEPT',
+    '-p tcp --dport 22 -j ACCEPT',
+    '-i lo -p udp --dport 53 -m comment --comment "dns server" -j ACCEPT',
+    '-m state --state ESTABLISHED -j ACCEPT',
+])
+def test_absent(ruleset, rule):
+    assert not ruleset.has_rule('filter', 'INPUT', rule)
+
+def test_one_save_per_run():
+    calls = []
+    def run_all(cmd, **kwargs):
+        calls.append(cmd)
+        return {'retcode': 0, 'stdout': SAVE, 'stderr': ''}
+    salt = {'cmd.run_all': run_all}
+    with facts.run_scope():
+        first = iptables.ruleset(salt, 'ipv4')
+        assert iptables.ruleset(salt, 'ipv4') is first
+        assert first.has_rule('nat', 'PREROUTING', '-p tcp --dport 8080 -j REDIRECT --to-ports 80')
+    assert calls == [['iptables-save']]
+
+def test_unavailable():
+    salt = {'cmd.run_all': lambda cmd, **kwargs: {'retcode': 1, 'stdout': '', 'stderr': 'permission denied'}}
+    assert iptables.ruleset(salt, 'ipv6') is None
@@ -0,0 +1,48 @@
+import sys
+import os
+myPath = os.path.abspath(os.getcwd())
+sys.path.insert(0, myPath)
+import hubblestack.files.hubblestack_nova.misc as misc
+import hubblestack.utils.accounts as accounts
+import hubblestack.utils.fsscan as fsscan
+
+
+def scan_result(complete, **matches):
+    result = fsscan.ScanResult(['/'])
+    result.complete = complete
+    result.matches.update(matches)
+    return result
+
+
+class TestMiscFsScanChecks():
+
+    CHECKS = (misc.check_unowned_files, misc.check_ungrouped_files,
+              misc.unowned_files_or_dir, misc.world_writable_file)
+
+    def test_incomplete_scan_does_not_pass(self, monkeypatch):
+        monkeypatch.setattr(misc, '_fs_scan', lambda: scan_result(False))
+        for check in self.CHECKS:
+            assert check() == misc._INCOMPLETE_SCAN
+
+    def test_complete_scan(self, monkeypatch):
+        monkeypatch.setattr(misc, '_fs_scan', lambda: scan_result(True))
+        for check in self.CHECKS:
+            assert check() is True
+        monkeypatch.setattr(misc, '_fs_scan', lambda: scan_result(
+            False, unowned=['/a', '/b'], ungrouped=['/c']))
+        assert misc.check_unowned_files() == '/a\n/b'
+        assert misc.check_ungrouped_files() == '/c'
+
+
+class TestMiscAccountChecks():
+
+    def test_unreadable_tables_do_not_pass(self, monkeypatch, tmpdir):
+        # no passwd, group or shadow under tmpdir
+        monkeypatch.setattr(misc, 'account_db', lambda: accounts.account_db(str(tmpdir)))
+        for check in (misc.check_password_fields_not_empty, misc.root_is_only_uid_0_account,
+                      misc.check_duplicate_uids, misc.check_duplicate_gnames,
+                      misc.default_group_for_root, misc.check_groups_validity):
+            assert check().startswith('unable to read ')
+        assert str(tmpdir.join('shadow')) in misc.check_password_fields_not_empty()
+        tmpdir.join('passwd').write('root:x:0:0:root:/root:/bin/bash\n')
+        assert misc.root_is_only_uid_0_account() is True
@@ -0,0 +1,157 @@
+import os
+import threading
+
+import pytest
+
+import hubblestack.utils.oval as oval
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+FEED = """\
+<?xml version="1.0" encoding="utf-8"?>
+<oval_definitions xmlns="http://oval.mitre.org/XMLSchema/oval-definitions-5"
+    xmlns:oval="http://oval.mitre.org/XMLSchema/oval-common-5"
+    xmlns:red-def="http://oval.mitre.org/XMLSchema/oval-definitions-5#linux">
+  <generator>
+    <oval:product_name>Red Hat OVAL Patch Definition Merger</oval:product_name>
+    <oval:schema_version>5.10</oval:schema_version>
+    <oval:timestamp>2020-01-01T00:00:00</oval:timestamp>
+  </generator>
+  <definitions>
+    <definition class="patch" id="oval:com.redhat.rhsa:def:20200001" version="1">
+      <metadata>
+        <title>RHSA-2020:0001: openssl security update (Important)</title>
+        <reference ref_id="RHSA-2020:0001" ref_url="https://access.redhat.com/errata/RHSA-2020:0001" source="RHSA"/>
+        <reference ref_id="CVE-2020-0001" ref_url="https://access.redhat.com/security/cve/CVE-2020-0001" source="CVE"/>
+        <advisory from="secalert@redhat.com">
+          <severity>Important</severity>
+          <ref>USN-1</ref>
+        </advisory>
+      </metadata>
+      <criteria operator="AND">
+        <criterion comment="openssl is earlier than 1:1.0.2k-19.el7" test_ref="oval:com.redhat.rhsa:tst:20200001001"/>
+        <criteria operator="OR">
+          <criterion comment="pkgs earlier than 2.0" test_ref="oval:com.redhat.rhsa:tst:20200001002"/>
+          <criterion comment="no state" test_ref="oval:com.redhat.rhsa:tst:20200001003"/>
+        </criteria>
+      </criteria>
+    </definition>
+  </definitions>
+  <tests>
+    <red-def:rpminfo_test check="at least one" comment="openssl" id="oval:com.redhat.rhsa:tst:20200001001" version="1">
+      <red-def:object object_ref="oval:com.redhat.rhsa:obj:20200001001"/>
+      <red-def:state state_ref="oval:com.redhat.rhsa:ste:20200001001"/>
+    </red-def:rpminfo_test>
+    <red-def:rpminfo_test check="at least one" comment="group" id="oval:com.redhat.rhsa:tst:20200001002" version="1">
+      <red-def:object object_ref="oval:com.redhat.rhsa:obj:20200001002"/>
+      <red-def:state state_ref="oval:com.redhat.rhsa:ste:20200001002"/>
+    </red-def:rpminfo_test>
+    <red-def:rpminfo_test check="at least one" comment="signed" id="oval:com.redhat.rhsa:tst:20200001003" version="1">
+      <red-def:object object_ref="oval:com.redhat.rhsa:obj:20200001001"/>
+    </red-def:rpminfo_test>
+  </tests>
+  <objects>
+    <red-def:rpminfo_object id="oval:com.redhat.rhsa:obj:20200001001" version="1">
+      <red-def:name>openssl</red-def:name>
+    </red-def:rpminfo_object>
+    <red-def:rpminfo_object id="oval:com.redhat.rhsa:obj:20200001002" version="1">
+      <red-def:name var_ref="oval:com.redhat.rhsa:var:1" var_check="at least one"/>
+    </red-def:rpminfo_object>
+  </objects>
+  <states>
+    <red-def:rpminfo_state id="oval:com.redhat.rhsa:ste:20200001001" version="1">
+      <red-def:evr datatype="evr_string" operation="less than">1:1.0.2k-19.el7</red-def:evr>
+    </red-def:rpminfo_state>
+    <red-def:rpminfo_state id="oval:com.redhat.rhsa:ste:20200001002" version="1">
+      <red-def:evr datatype="evr_string" operation="less than">0:2.0-1</red-def:evr>
+    </red-def:rpminfo_state>
+  </states>
+  <variables>
+    <constant_variable id="oval:com.redhat.rhsa:var:1" version="1" datatype="string" comment="pkgs">
+      <value>libfoo</value>
+      <value>libbar</value>
+    </constant_variable>
+  </variables>
+</oval_definitions>
+"""
+
+DEF_ID = 'oval:com.redhat.rhsa:def:20200001'
+
+
+def test_compile_feed(tmpdir):
+    path = tmpdir.join('feed.xml')
+    path.write(FEED)
+    index = oval.compile_feed(str(path))
+    assert index['generator']['schema_version'] == '5.10'
+    definition = index['definitions'][DEF_ID]
+    assert definition['title'].startswith('RHSA-2020:0001')
+    assert definition['rhsa'] == {'RHSA-2020:0001': 'https://access.redhat.com/errata/RHSA-2020:0001'}
+    assert definition['cve'] == [{'CVE-2020-0001': 'https://access.redhat.com/security/cve/CVE-2020-0001'}]
+    assert definition['severity'] == 'Important'
+    assert definition['advisories'] == ['USN-1']
+    assert index['packages'] == {'openssl': [['1:1.0.2k-19.el7', DEF_ID]],
+                                 'libfoo': [['0:2.0-1', DEF_ID]],
+                                 'libbar': [['0:2.0-1', DEF_ID]]}
+
+def test_affected(tmpdir):
+    path = tmpdir.join('feed.xml')
+    path.write(FEED)
+    index = oval.compile_feed(str(path))
+    local = {'openssl': '1:1.0.2k-16.el7', 'libfoo': '0:2.1-1', 'bash': '4.2',
+             'libbar': '0:1.9-1,0:2.0-1'}
+    assert list(oval.affected(index, local, 'rpm')) == [('openssl', '1:1.0.2k-19.el7', DEF_ID)]
+    local['libbar'] = '0:1.9-1,0:1.10-1'
+    assert sorted(oval.affected(index, local, 'rpm')) == [('libbar', '0:2.0-1', DEF_ID),
+                                                          ('openssl', '1:1.0.2k-19.el7', DEF_ID)]
+
+def test_local_feed_is_cached(tmpdir, monkeypatch):
+    path = tmpdir.join('feed.xml')
+    path.write(FEED)
+    cachedir = str(tmpdir.join('cache'))
+    first = oval.load_index(str(path), cachedir)
+    assert len(os.listdir(cachedir)) == 1
+    compiled = []
+    monkeypatch.setattr(oval, 'compile_feed', lambda src: compiled.append(src))
+    assert oval.load_index(str(path), cachedir)['packages'] == first['packages']
+    assert not compiled
+    path.write(FEED.replace('libbar', 'libbarbaz'))
+    monkeypatch.undo()
+    assert 'libbarbaz' in oval.load_index(str(path), cachedir)['packages']
+
+def test_remote_feed_revalidates(tmpdir):
+    pytest.importorskip('requests')
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests_seen.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = FEED.encode('utf-8')
+            self.send_response(200)
+            self.send_header('ETag', '"v1"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        url = 'http://127.0.0.1:{0}/feed.xml'.format(server.server_address[1])
+        cachedir = str(tmpdir.join('cache'))
+        first = oval.load_index(url, cachedir)
+        second = oval.load_index(url, cachedir)
+        assert second['packages'] == first['packages']
+        assert requests_seen == [None, '"v1"']
+    finally:
+        server.shutdown()
@@ -0,0 +1,87 @@
+import fnmatch
+import re
+
+import hubblestack.utils.pathmatch as pathmatch
+
+EXCLUDES = ['/var/log/',
+            '/tmp/cache',
+            '/etc/*.swp',
+            '*.pyc',
+            '/opt/app/*/tmp/*',
+            {'/srv/data/[0-9]+$': {'regex': True}},
+            {'/home/[^/]+/\\.cache': {'regex': True}},
+            {'/plain/dict': {'regex': False}}]
+
+
+def reference(excludes, path):
+    """ what each exclude means, one at a time """
+    for exclude in excludes:
+        if isinstance(exclude, dict):
+            pattern, options = list(exclude.items())[0]
+            if options.get('regex'):
+                if re.search(pattern, path):
+                    return True
+                continue
+            exclude = pattern
+        if any(char in exclude for char in '*?['):
+            if fnmatch.fnmatch(path, exclude):
+                return True
+        elif path.startswith(exclude):
+            return True
+    return False
+
+def test_matches_like_the_excludes():
+    matcher = pathmatch.compile_excludes(EXCLUDES)
+    for path in ['/var/log/messages', '/var/log', '/var/logs', '/tmp/cache', '/tmp/cached/x',
+                 '/tmp/other', '/etc/.passwd.swp', '/etc/passwd', '/etc/x/y.swp',
+                 '/usr/lib/python/a.pyc', '/usr/lib/python/a.py', '/opt/app/one/tmp/f',
+                 '/opt/app/one/log/f', '/srv/data/123', '/srv/data/123/x', '/home/bob/.cache/f',
+                 '/home/.cache', '/plain/dict/x', '/plain', '']:
+        assert matcher(path) == reference(EXCLUDES, path), path
+
+def test_empty_and_shared():
+    assert pathmatch.compile_excludes(None)('/anything') is False
+    assert pathmatch.compile_excludes([])('/anything') is False
+    assert pathmatch.compile_excludes(list(EXCLUDES)) is pathmatch.compile_excludes(EXCLUDES)
+    assert len(pathmatch.compile_excludes(EXCLUDES)) == len(EXCLUDES)
+
+def test_regexes_that_do_not_combine():
+    excludes = [{'(a)\\1$': {'regex': True}}, {'[bad': {'regex': True}},
+                {'(?i)/UPPER': {'regex': True}}, {'/x+$': {'regex': True}}]
+    matcher = pathmatch.ExcludeMatcher(excludes)
+    assert matcher('/aa')
+    assert not matcher('/ab')
+    assert matcher('/upper')
+    assert matcher('/xx')
+    assert not matcher('/y')
+
+def test_path_trie_longest_prefix():
+    trie = pathmatch.PathTrie([('/etc', 1), ('/etc/ssh', 2), ('/var/log/', 3)])
+    assert len(trie) == 3
+    assert trie.longest_prefix('/etc/ssh/sshd_config') == ('/etc/ssh', 2)
+    assert trie.longest_prefix('/etc/sshd') == ('/etc', 1)
+    assert trie.longest_prefix('/etc') == ('/etc', 1)
+    assert trie.longest_prefix('/var/log/messages') == ('/var/log/', 3)
+    assert trie.longest_prefix('/var/lib') is None
+    trie['/'] = 0
+    assert trie.longest_prefix('/var/lib') == ('/', 0)
+    assert trie['/etc/ssh'] == 2
+    assert trie.get('/etc/pam.d') is None
+    assert '/var/log' in trie and '/var' not in trie
+
+def test_path_trie_pop():
+    trie = pathmatch.PathTrie([('/a/b/c', 1), ('/a', 2)])
+    assert trie.pop('/a/b') is None
+    assert trie.pop('/a/b/c') == 1
+    assert trie.pop('/a/b/c', 'gone') == 'gone'
+    assert len(trie) == 1
+    # the emptied nodes go with it
+    assert trie.root == {'a': {None: ('/a', 2)}}
+    del trie['/a']
+    assert trie.root == {} and not len(trie)
+    try:
+        del trie['/a']
+    except KeyError:
+        pass
+    else:
+        assert False, 'expected a KeyError'
@@ -45,9 +45,9 @@ class TestPkg():
         hubblestack.files.hubblestack_nova.pkg.__grains__ = {'osfinger': 'Ubuntu-16.04'}
         __salt__ = {}
 
-        def pkg_version(name):
-            return name
-        __salt__['pkg.version'] = pkg_version
+        def list_pkgs(versions_as_list=False):
+            return {'ntp': ['1:4.2.8p4+dfsg-3ubuntu5'], 'rsyslog': ['8.16.0-1ubuntu3']}
+        __salt__['pkg.list_pkgs'] = list_pkgs
         hubblestack.files.hubblestack_nova.pkg.__salt__ = __salt__
         val = hubblestack.files.hubblestack_nova.pkg.audit(data_list, __tags__, [], debug=False)
         assert len(val['Success']) != 0
@@ -61,9 +61,9 @@ class TestPkg():
         __salt__ = {}
         expected_val = {'Failure': [], 'Controlled': [], 'Success': []}
 
-        def pkg_version(name):
-            return name
-        __salt__['pkg.version'] = pkg_version
+        def list_pkgs(versions_as_list=False):
+            return {'ntp': ['1:4.2.8p4+dfsg-3ubuntu5'], 'rsyslog': ['8.16.0-1ubuntu3']}
+        __salt__['pkg.list_pkgs'] = list_pkgs
         hubblestack.files.hubblestack_nova.pkg.__salt__ = __salt__
         val = hubblestack.files.hubblestack_nova.pkg.audit(data_list, __tags__, [], debug=False)
         assert val == expected_val
@@ -75,9 +75,9 @@ class TestPkg():
         hubblestack.files.hubblestack_nova.pkg.__grains__ = {'osfinger': 'Ubuntu-16.04'}
         __salt__ = {}
 
-        def pkg_version(name):
-            return name
-        __salt__['pkg.version'] = pkg_version
+        def list_pkgs(versions_as_list=False):
+            return {'ntp': ['1:4.2.8p4+dfsg-3ubuntu5'], 'rsyslog': ['8.16.0-1ubuntu3']}
+        __salt__['pkg.list_pkgs'] = list_pkgs
         hubblestack.files.hubblestack_nova.pkg.__salt__ = __salt__
         try:
             val = hubblestack.files.hubblestack_nova.pkg.audit(data_list, __tags__, [], debug=False)
@@ -99,3 +99,26 @@ class TestPkg():
         hubblestack.files.hubblestack_nova.pkg.__grains__ = {'osfinger': 'Ubuntu-16.04'}
         ret = hubblestack.files.hubblestack_nova.pkg._get_tags(data)
         assert ret == {}
+
+    def test_audit_versions_and_globs(self):
+        data_list = [('ubuntu-1604-level-1-scored-v1-0-0',
+                     {'pkg':
+                      {'blacklist': {'telnet': {'data': {'Ubuntu-16.04': [{'telnet*': 'CIS-5.1.1'}]}, 'description': 'No telnet'}},
+                       'whitelist': {'ssh': {'data': {'Ubuntu-16.04': [{'openssh-server': {'tag': 'CIS-5.2', 'version': '>=1:7.2p2'}},
+                                                                      {'openssh-client': {'tag': 'CIS-5.3', 'version': '<=1:7.2p2-4ubuntu2.8'}},
+                                                                      {'openssh-sftp-server': {'tag': 'CIS-5.4', 'version': '>=1:7.2p2'}},
+                                                                      {'open*': 'CIS-5.5'}]},
+                                            'description': 'Need ssh'}}}})]
+        hubblestack.files.hubblestack_nova.pkg.__grains__ = {'osfinger': 'Ubuntu-16.04', 'os_family': 'Debian'}
+        calls = []
+
+        def list_pkgs(versions_as_list=False):
+            calls.append(versions_as_list)
+            return {'telnetd': ['0.17-40'],
+                    'openssh-server': ['1:7.2p2-4ubuntu2.10'],
+                    'openssh-client': ['1:7.2p2-4ubuntu2.10']}
+        hubblestack.files.hubblestack_nova.pkg.__salt__ = {'pkg.list_pkgs': list_pkgs}
+        val = hubblestack.files.hubblestack_nova.pkg.audit(data_list, '*', [], debug=False)
+        assert calls == [True]
+        assert sorted(x['tag'] for x in val['Success']) == ['CIS-5.2', 'CIS-5.5']
+        assert sorted(x['tag'] for x in val['Failure']) == ['CIS-5.1.1', 'CIS-5.3', 'CIS-5.4']
@@ -0,0 +1,91 @@
+import os
+
+import hubblestack.utils.facts as facts
+import hubblestack.utils.procfs as procfs
+
+MOUNTINFO = """\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw,errors=remount-ro
+23 22 0:21 / /tmp rw,nosuid,nodev shared:2 - tmpfs tmpfs rw,size=1024k
+24 22 0:22 / /mnt/with\\040space rw - nfs server:/export rw,vers=4.2
+25 23 0:23 / /tmp rw,noexec - tmpfs tmpfs rw
+"""
+
+TCP = """\
+  sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000:0016 00000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1001 1 0 100 0 0 10 0
+   1: 0100007F:0277 0100007F:D431 01 00000002:00000001 00:00000000 00000000 99999        0 1002 1 0 100 0 0 10 0
+"""
+
+TCP6 = """\
+  sl  local_address                         remote_address                        st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode
+   0: 00000000000000000000000000000000:0016 00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1003 1 0 100 0 0 10 0
+   1: 00000000000000000000000001000000:0277 00000000000000000000000000000000:0000 0A 00000000:00000000 00:00000000 00000000     0        0 1004 1 0 100 0 0 10 0
+"""
+
+UDP = """\
+   sl  local_address rem_address   st tx_queue rx_queue tr tm->when retrnsmt   uid  timeout inode ref pointer drops
+  100: 00000000:0044 00000000:0000 07 00000000:00000000 00:00000000 00000000     0        0 1005 2 0 0
+"""
+
+
+def fake_proc(tmpdir):
+    tmpdir.mkdir('sys').mkdir('kernel').join('randomize_va_space').write('2\n')
+    conf = tmpdir.join('sys').mkdir('net').mkdir('ipv4').mkdir('conf')
+    conf.mkdir('eth0.100').join('rp_filter').write('1\n')
+    tmpdir.join('sys', 'net', 'ipv4').join('ip_local_port_range').write('32768\t60999\n')
+    tmpdir.mkdir('self').join('mountinfo').write(MOUNTINFO)
+    net = tmpdir.mkdir('net')
+    net.join('tcp').write(TCP)
+    net.join('tcp6').write(TCP6)
+    net.join('udp').write(UDP)
+    pid = tmpdir.mkdir('4242')
+    pid.join('comm').write('sshd\n')
+    os.symlink('socket:[1001]', str(pid.mkdir('fd').join('3')))
+    return str(tmpdir)
+
+def test_sysctl(tmpdir):
+    proc = fake_proc(tmpdir)
+    assert procfs.sysctl('kernel.randomize_va_space', proc) == '2'
+    assert procfs.sysctl('net.ipv4.ip_local_port_range', proc) == '32768\t60999'
+    # '/' in a sysctl name is a '.' in the path
+    assert procfs.sysctl('net.ipv4.conf.eth0/100.rp_filter', proc) == '1'
+    assert procfs.sysctl('kernel.no_such_thing', proc) is None
+
+def test_mounts(tmpdir):
+    mounts = procfs.mounts(fake_proc(tmpdir))
+    assert sorted(mounts) == ['/', '/mnt/with space', '/tmp']
+    # the last mount on a mount point is the visible one
+    assert mounts['/tmp']['opts'] == ['rw', 'noexec']
+    assert mounts['/']['device'] == '/dev/sda1'
+    assert mounts['/']['superopts'] == ['rw', 'errors=remount-ro']
+    assert mounts['/mnt/with space']['fstype'] == 'nfs'
+    assert procfs.mounts(str(tmpdir.join('nothing'))) is None
+
+def test_netstat(tmpdir):
+    conns = procfs.netstat(fake_proc(tmpdir))
+    by_inode = dict((c['inode'], c) for c in conns)
+    assert by_inode['1001']['proto'] == 'tcp'
+    assert by_inode['1001']['local-address'] == '0.0.0.0:22'
+    assert by_inode['1001']['remote-address'] == '0.0.0.0:*'
+    assert by_inode['1001']['state'] == 'LISTEN'
+    assert by_inode['1001']['program'] == '4242/sshd'
+    assert by_inode['1001']['user'] == 'root'
+    assert by_inode['1002']['local-address'] == '127.0.0.1:631'
+    assert by_inode['1002']['remote-address'] == '127.0.0.1:54321'
+    assert by_inode['1002']['state'] == 'ESTABLISHED'
+    assert (by_inode['1002']['send-q'], by_inode['1002']['recv-q']) == ('2', '1')
+    assert by_inode['1002']['user'] == '99999'
+    assert by_inode['1002']['program'] == '-'
+    assert by_inode['1003']['local-address'] == ':::22'
+    assert by_inode['1004']['local-address'] == '::1:631'
+    assert by_inode['1005']['proto'] == 'udp'
+    assert by_inode['1005']['state'] == ''
+    assert len(conns) == 5
+
+def test_memoized_per_run(tmpdir):
+    proc = fake_proc(tmpdir)
+    with facts.run_scope():
+        first = procfs.mounts(proc)
+        tmpdir.join('self', 'mountinfo').write('')
+        assert procfs.mounts(proc) is first
+    assert procfs.mounts(proc) == {}
@@ -218,6 +218,13 @@ class TestPulsar2():
             with open(self.more_fname(i), 'w') as fh:
                 fh.write(to_write.format(count))
 
+    def test_config_paths_kept_across_sweeps(self):
+        self.reset(**{self.atdir: {}})
+        pulsar.ConfigManager._last_update = 0
+        paths = pulsar.ConfigManager().config_paths
+        assert pulsar.ConfigManager().config_paths is paths
+        assert pulsar.ConfigManager().path_of_config(self.atfile) == self.atdir
+
     def test_listify_anything(self):
         la = pulsar.PulsarWatchManager._listify_anything
         def lla(x,e):
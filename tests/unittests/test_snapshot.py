@@ -0,0 +1,99 @@
+import os
+import time
+
+import hubblestack.utils.snapshot as snapshot
+
+
+def write(path, data='x'):
+    with open(path, 'w') as fh:
+        fh.write(data)
+
+def changes(found, top):
+    return sorted((os.path.relpath(event.pathname, top), event.maskname) for event in found.events)
+
+def test_save_and_load(tmpdir):
+    top = str(tmpdir.mkdir('tree'))
+    write(os.path.join(top, 'a'))
+    snap = snapshot.Snapshot(str(tmpdir.join('cache', 'pulsar_snapshot.z')), interval=60)
+    assert snap.due()
+    digest = snapshot.config_digest({top: {'recurse': True}, 'verbose': False})
+    assert digest == snapshot.config_digest({top: {'recurse': True}, 'verbose': True})
+    baselines = snapshot.scan_baselines([top], {os.path.join(top, 'a'): 'abc'})
+    assert snap.save(digest, {top: set([os.path.join(top, 'a')])}, baselines)
+    assert not snap.due()
+
+    state = snap.load(digest)
+    assert state['watches'] == {top: [os.path.join(top, 'a')]}
+    assert state['baselines'][os.path.join(top, 'a')][4] == 'abc'
+    assert state['baselines'][top][3] == 2
+    assert snap.load(snapshot.config_digest({top: {}})) is None
+    assert snapshot.Snapshot(str(tmpdir.join('nope'))).load(digest) is None
+
+def test_reconcile_finds_offline_changes(tmpdir):
+    top = str(tmpdir.mkdir('tree'))
+    for name in ('same', 'modified', 'deleted', 'replaced'):
+        write(os.path.join(top, name))
+    os.mkdir(os.path.join(top, 'unwatched'))
+    baselines = snapshot.scan_baselines([top])
+    found = snapshot.reconcile(baselines)
+    assert found.events == [] and found.counts['checked'] == 6
+
+    time.sleep(0.01)
+    write(os.path.join(top, 'modified'), 'longer')
+    os.unlink(os.path.join(top, 'deleted'))
+    # renamed over it, so the inode can't be reused
+    write(str(tmpdir.join('replacement')))
+    os.rename(str(tmpdir.join('replacement')), os.path.join(top, 'replaced'))
+    write(os.path.join(top, 'new'))
+    os.makedirs(os.path.join(top, 'newdir', 'sub'))
+    write(os.path.join(top, 'newdir', 'sub', 'f'))
+    # entries of directories that aren't watched have no baselines
+    write(os.path.join(top, 'unwatched', 'f'))
+
+    found = snapshot.reconcile(baselines)
+    assert changes(found, top) == [
+        ('deleted', 'IN_DELETE'),
+        ('modified', 'IN_MODIFY'),
+        ('new', 'IN_CREATE'),
+        ('newdir', 'IN_CREATE|IN_ISDIR'),
+        ('newdir/sub', 'IN_CREATE|IN_ISDIR'),
+        ('newdir/sub/f', 'IN_CREATE'),
+        ('replaced', 'IN_CREATE'),
+    ]
+    assert found.deleted == set([os.path.join(top, 'deleted')])
+    assert found.new_dirs == [os.path.join(top, 'newdir')]
+    assert found.counts['modified'] == 1 and found.counts['deleted'] == 1
+    assert found.counts['created'] == 5
+    event = [e for e in found.events if e.name == 'deleted'][0]
+    assert event.path == top and event.mask == snapshot.IN_DELETE
+
+def test_refresh_rebaselines_alerted_files(tmpdir):
+    top = str(tmpdir.mkdir('tree'))
+    for name in ('alerted', 'deleted', 'quiet'):
+        write(os.path.join(top, name))
+    path = str(tmpdir.join('pulsar_snapshot.z'))
+    digest = snapshot.config_digest({top: {}})
+    snap = snapshot.Snapshot(path, refresh_interval=10)
+    snap.save(digest, {top: [top]}, snapshot.scan_baselines([top]), now=1000)
+    assert not snap.refresh_due(now=2000)
+
+    time.sleep(0.01)
+    # changes alerted on live
+    write(os.path.join(top, 'alerted'), 'longer')
+    os.unlink(os.path.join(top, 'deleted'))
+    write(os.path.join(top, 'new'))
+    os.mkdir(os.path.join(top, 'newdir'))
+    snap.touch([os.path.join(top, name) for name in ('alerted', 'deleted', 'new', 'newdir')])
+    assert not snap.refresh_due(now=1005)
+    assert snap.refresh_due(now=1010)
+    assert snap.refresh({os.path.join(top, 'alerted'): 'abc'}, now=1010)
+    assert not snap.touched and not snap.refresh_due(now=2000)
+    # a change that wasn't alerted on
+    write(os.path.join(top, 'quiet'), 'longer')
+
+    state = snapshot.Snapshot(path).load(digest)
+    assert state['baselines'][os.path.join(top, 'alerted')][4] == 'abc'
+    found = snapshot.reconcile(state['baselines'])
+    # the new directory is left for the next save, to be watched after a restart
+    assert changes(found, top) == [('newdir', 'IN_CREATE|IN_ISDIR'), ('quiet', 'IN_MODIFY')]
+    assert found.new_dirs == [os.path.join(top, 'newdir')]
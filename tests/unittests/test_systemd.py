@@ -0,0 +1,85 @@
+import hubblestack.utils.facts as facts
+import hubblestack.utils.systemd as systemd
+
+UNIT_FILES = """\
+auditd.service                         enabled         enabled
+getty@.service                         enabled         enabled
+rsyncd.service                         disabled        disabled
+dbus.service                           static          -
+ctrl-alt-del.target                    alias           -
+autofs.service                         masked          enabled
+"""
+
+UNITS = """\
+auditd.service        loaded    active   running Security Auditing Service
+getty@tty1.service    loaded    active   running Getty on tty1
+dbus.service          loaded    active   running D-Bus System Message Bus
+rsyncd.service        loaded    inactive dead    fast remote file copy
+* nfs.service         not-found inactive dead    nfs.service
+"""
+
+
+def table(tmpdir):
+    unit_paths = (str(tmpdir.mkdir('system')),)
+    tmpdir.join('system').join('cups.service').write('')
+    tmpdir.mkdir('init.d').join('ntp').write('')
+    ret = systemd.UnitTable(unit_paths=unit_paths, init_d=str(tmpdir.join('init.d')))
+    return systemd.parse_units(UNITS, systemd.parse_unit_files(UNIT_FILES, ret))
+
+def test_unit_name():
+    assert systemd.unit_name('sshd') == 'sshd.service'
+    assert systemd.unit_name('cups.socket') == 'cups.socket'
+    assert systemd.unit_name('org.cups.cupsd') == 'org.cups.cupsd.service'
+
+def test_is_enabled(tmpdir):
+    units = table(tmpdir)
+    assert units.is_enabled('auditd') is True
+    assert units.is_enabled('dbus.service') is True
+    assert units.is_enabled('ctrl-alt-del.target') is True
+    assert units.is_enabled('rsyncd') is False
+    assert units.is_enabled('autofs') is False
+    assert units.file_state('autofs') == 'masked'
+    # instances follow their template, when that's conclusive
+    assert units.is_enabled('getty@tty1') is None
+    # certainly absent vs. a unit file or init script the table didn't list
+    assert units.is_enabled('telnet') is False
+    assert units.file_state('telnet') == 'not-found'
+    assert units.is_enabled('cups') is None
+    assert units.is_enabled('ntp') is None
+
+def test_is_active_and_exists(tmpdir):
+    units = table(tmpdir)
+    assert units.is_active('auditd') is True
+    assert units.is_active('getty@tty1') is True
+    assert units.is_active('rsyncd') is False
+    assert units.is_active('autofs') is False
+    assert units.is_active('telnet') is False
+    assert units.is_active('cups') is None
+    assert units.exists('rsyncd') is True
+    assert units.exists('nfs') is False
+    assert units.exists('telnet') is False
+    assert units.exists('ntp') is None
+    assert units.names()[0] == 'auditd.service'
+
+def test_unit_table_one_snapshot(monkeypatch):
+    calls = []
+
+    def run_all(argv, **kwargs):
+        calls.append(argv)
+        out = UNIT_FILES if argv[1] == 'list-unit-files' else UNITS
+        return {'retcode': 0, 'stdout': out, 'stderr': ''}
+    monkeypatch.setattr(systemd, 'booted', lambda: True)
+    salt = {'cmd.run_all': run_all}
+    with facts.run_scope():
+        first = systemd.unit_table(salt)
+        assert systemd.unit_table(salt) is first
+        assert first.is_active('auditd')
+    assert len(calls) == 2
+    assert facts.LAST_RUN['forks'] == {'systemd_units': 2}
+
+def test_unit_table_unavailable(monkeypatch):
+    salt = {'cmd.run_all': lambda argv, **kw: {'retcode': 1, 'stdout': '', 'stderr': 'no'}}
+    monkeypatch.setattr(systemd, 'booted', lambda: True)
+    assert systemd.unit_table(salt) is None
+    monkeypatch.setattr(systemd, 'booted', lambda: False)
+    assert systemd.unit_table({}) is None
@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from hubblestack.utils.vercmp import rpmvercmp, rpm_evr_cmp, dpkg_cmp, compare, flavor_for, newest
+from hubblestack.utils.pkgindex import PackageIndex
+
+
+@pytest.mark.parametrize('one,two,expected', [
+    ('1.0', '1.0', 0),
+    ('1.0', '2.0', -1),
+    ('2.0.1', '2.0', 1),
+    ('1.0a', '1.0', 1),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0^git1', '1.0', 1),
+    ('10', '9', 1),
+    ('1.010', '1.9', 1),
+    ('1.0', '1_0', 0),
+    ('a', '1', -1),
+])
+def test_rpmvercmp(one, two, expected):
+    assert rpmvercmp(one, two) == expected
+    assert rpmvercmp(two, one) == -expected
+
+def test_rpm_evr():
+    assert rpm_evr_cmp('1:1.0-1.el7', '2.0-1.el7') == 1
+    assert rpm_evr_cmp('1.0-2.el7', '1.0-10.el7') == -1
+    # a missing release matches any release
+    assert rpm_evr_cmp('1.0', '1.0-10.el7') == 0
+
+@pytest.mark.parametrize('one,two,expected', [
+    ('1.0', '1.0', 0),
+    ('1.0~rc1', '1.0', -1),
+    ('1.0-1', '1.0-1ubuntu1', -1),
+    ('1:0.9', '1.0', 1),
+    ('7.2p2-4ubuntu2.10', '7.2p2-4ubuntu2.8', 1),
+    ('1.0+dfsg', '1.0', 1),
+])
+def test_dpkg_cmp(one, two, expected):
+    assert dpkg_cmp(one, two) == expected
+    assert dpkg_cmp(two, one) == -expected
+
+def test_compare_flavors():
+    assert flavor_for({'os_family': 'Debian'}) == 'dpkg'
+    assert flavor_for({'os_family': 'RedHat'}) == 'rpm'
+    # '~' in a revision sorts before the bare revision in both
+    assert compare('1.0-1~bpo1', '1.0-1', 'dpkg') == -1
+    assert compare('1.0-1~bpo1', '1.0-1', 'rpm') == -1
+
+def test_package_index():
+    index = PackageIndex({'kernel': '3.10.0-862.el7,3.10.0-957.el7', 'bash': ['4.2.46-31.el7'],
+                          'gone': []})
+    assert index.version('kernel') == '3.10.0-862.el7,3.10.0-957.el7'
+    assert index.installed('bash')
+    assert not index.installed('gone')
+    assert index.names('ker*') == ['kernel']
+    assert 'b?sh' in index
+    assert index.satisfies('kernel', '>=', '3.10.0-900.el7')
+    assert not index.satisfies('kernel', '>=', '3.10.0-1000.el7')
+    # the ordering operators look at the newest kernel, not at any of them
+    assert not index.satisfies('kernel', '<=', '3.10.0-900.el7')
+    assert index.satisfies('kernel', '<=', '3.10.0-957.el7')
+    assert not index.satisfies('kernel', '>', '3.10.0-957.el7')
+    assert index.satisfies('kernel', '<', '3.10.0-1000.el7')
+    assert index.satisfies('kernel', '==', '3.10.0-862.el7')
+    assert index.satisfies('bash', '==', '4.2.46')
+    for operator in ('<=', '>=', '<', '>', '=='):
+        assert not index.satisfies('zsh', operator, '99')
+
+def _corpus(name):
+    path = os.path.join(os.path.dirname(__file__), 'resources', 'vercmp', name)
+    with open(path) as fh:
+        for line in fh:
+            if line.strip() and not line.startswith('#'):
+                one, two, expected = line.split()
+                yield one, two, int(expected)
+
+@pytest.mark.parametrize('one,two,expected', list(_corpus('rpm.txt')))
+def test_rpmvercmp_corpus(one, two, expected):
+    assert rpmvercmp(one, two) == expected
+
+@pytest.mark.parametrize('one,two,expected', list(_corpus('dpkg.txt')))
+def test_dpkg_corpus(one, two, expected):
+    assert dpkg_cmp(one, two) == expected
+    assert compare(one, two, 'dpkg') == expected
+    assert dpkg_cmp(two, one) == -expected
+
+def test_newest():
+    assert newest('3.10.0-862.el7,3.10.0-1062.el7,3.10.0-957.el7') == '3.10.0-1062.el7'
+    assert newest(['1.0~rc1-1', '1.0-1'], 'dpkg') == '1.0-1'
+    assert newest('') is None
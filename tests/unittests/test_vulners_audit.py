@@ -0,0 +1,85 @@
+import json
+import threading
+
+import pytest
+
+import hubblestack.utils.vulners_audit as vulners_audit
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+PACKAGES = ['openssl-1.0.2k-16.el7.x86_64', 'bash-4.2.46-31.el7.x86_64']
+
+
+@pytest.fixture
+def api():
+    """ a stand-in for the vulners audit endpoint """
+    seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            seen.append(body)
+            if body.get('apiKey') != 'secret':
+                reply = {'result': 'ERROR', 'data': {'error': 'Wrong API key'}}
+            else:
+                reply = {'result': 'OK',
+                         'data': {'packages': {PACKAGES[0]: {'RHSA-2020:0001': []}}}}
+            data = json.dumps(reply).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    server.url = 'http://127.0.0.1:{0}/api/v3/audit/audit/'.format(server.server_address[1])
+    server.seen = seen
+    yield server
+    server.shutdown()
+
+
+def test_fingerprint():
+    one = vulners_audit.fingerprint(PACKAGES, 'centos', '7')
+    assert one == vulners_audit.fingerprint(list(reversed(PACKAGES)), 'centos', '7')
+    assert one != vulners_audit.fingerprint(PACKAGES, 'centos', '8')
+    assert one != vulners_audit.fingerprint(PACKAGES[:1], 'centos', '7')
+
+def test_http_fetcher(api):
+    data = vulners_audit.HTTPFetcher('secret', url=api.url)('centos', '7', PACKAGES)
+    assert list(data['packages']) == [PACKAGES[0]]
+    assert api.seen[0] == {'os': 'centos', 'version': '7', 'package': PACKAGES, 'apiKey': 'secret'}
+    data = vulners_audit.HTTPFetcher('wrong', url=api.url)('centos', '7', PACKAGES)
+    assert data == vulners_audit.error('Wrong API key')
+    assert vulners_audit.is_error(vulners_audit.HTTPFetcher(
+        'secret', url='http://127.0.0.1:1/', timeout=1)('centos', '7', PACKAGES))
+
+def test_audit_is_cached(api, tmpdir):
+    cache_path = str(tmpdir.join('vulners_audit.json'))
+    fetch = vulners_audit.HTTPFetcher('secret', url=api.url)
+    first = vulners_audit.audit(PACKAGES, 'centos', '7', fetch, cache_path=cache_path)
+    assert vulners_audit.audit(list(reversed(PACKAGES)), 'centos', '7', fetch,
+                               cache_path=cache_path) == first
+    assert len(api.seen) == 1
+    # a changed package set, or an expired response, queries again
+    vulners_audit.audit(PACKAGES[:1], 'centos', '7', fetch, cache_path=cache_path)
+    assert len(api.seen) == 2
+    vulners_audit.audit(PACKAGES[:1], 'centos', '7', fetch, cache_path=cache_path, ttl=0)
+    assert len(api.seen) == 3
+
+def test_errors_are_not_cached(api, tmpdir):
+    cache_path = str(tmpdir.join('vulners_audit.json'))
+    fetch = vulners_audit.HTTPFetcher('wrong', url=api.url)
+    for _ in range(2):
+        data = vulners_audit.audit(PACKAGES, 'centos', '7', fetch, cache_path=cache_path)
+        assert vulners_audit.is_error(data)
+    assert len(api.seen) == 2
+    assert not tmpdir.join('vulners_audit.json').check()
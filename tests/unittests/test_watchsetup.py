@@ -0,0 +1,79 @@
+import os
+import time
+
+import hubblestack.utils.watchsetup as watchsetup
+from hubblestack.utils.workers import WorkerPool
+
+
+def make_tree(top, dirs, files_per_dir=2):
+    for d in dirs:
+        os.makedirs(os.path.join(top, d))
+        for i in range(files_per_dir):
+            with open(os.path.join(top, d, 'f{0}'.format(i)), 'w') as fh:
+                fh.write('x')
+
+def collect():
+    seen = {'dirs': [], 'files': []}
+    def add(kind):
+        def _add(paths):
+            seen[kind].extend(paths)
+            return len(paths)
+        return _add
+    return seen, add('dirs'), add('files')
+
+def test_walk_prunes_and_batches(tmpdir):
+    top = str(tmpdir)
+    make_tree(top, ['a/b/c', 'a/skip/deep', 'd'])
+    seen, add_dirs, add_files = collect()
+    excluded = lambda path: path.startswith(os.path.join(top, 'a', 'skip'))
+    setup = watchsetup.TreeSetup(top, add_dirs, add_files, excluded=excluded, batch_size=2)
+    with WorkerPool(max_workers=3) as pool:
+        assert setup.run(pool)
+    rel = lambda paths: sorted(os.path.relpath(p, top) for p in paths)
+    assert rel(seen['dirs']) == ['a', 'a/b', 'a/b/c', 'd']
+    assert rel(seen['files']) == ['a/b/c/f0', 'a/b/c/f1', 'd/f0', 'd/f1']
+    progress = setup.progress()
+    assert progress['pruned'] == 1
+    assert progress['watched'] == 8
+    assert progress['pending'] == 0 and progress['done']
+    assert progress['batches'] >= 4
+
+def test_not_recursive(tmpdir):
+    top = str(tmpdir)
+    make_tree(top, ['a/b'])
+    with open(os.path.join(top, 'top'), 'w') as fh:
+        fh.write('x')
+    seen, add_dirs, add_files = collect()
+    assert watchsetup.TreeSetup(top, add_dirs, add_files, recurse=False).run()
+    assert seen['dirs'] == []
+    assert seen['files'] == [os.path.join(top, 'top')]
+
+def test_resumes_after_the_deadline(tmpdir):
+    top = str(tmpdir)
+    make_tree(top, ['d{0}/e'.format(i) for i in range(20)], files_per_dir=0)
+    seen, add_dirs, _ = collect()
+    setup = watchsetup.TreeSetup(top, add_dirs, batch_size=5)
+    assert not setup.run(deadline=time.time() - 1)
+    assert setup.progress()['pending'] == 1
+    runs = 1
+    while not setup.done:
+        # enough time for about one step per run
+        setup.run(deadline=time.time() + 0.0001)
+        runs += 1
+        assert runs < 1000
+    assert len(seen['dirs']) == 40 and len(set(seen['dirs'])) == 40
+
+def test_restore_scans_only_new_dirs(tmpdir):
+    top = str(tmpdir)
+    make_tree(top, ['a/b', 'c', 'new/deep'])
+    seen, add_dirs, add_files = collect()
+    setup = watchsetup.TreeSetup(top, add_dirs, add_files)
+    known = [os.path.join(top, d) for d in ('a', 'a/b', 'c')]
+    setup.restore(known, [os.path.join(top, 'c', 'f0')], rescan=[os.path.join(top, 'new')])
+    assert setup.run()
+    rel = lambda paths: sorted(os.path.relpath(p, top) for p in paths)
+    assert rel(seen['dirs']) == ['a', 'a/b', 'c', 'new', 'new/deep']
+    assert rel(seen['files']) == ['c/f0', 'new/deep/f0', 'new/deep/f1']
+    progress = setup.progress()
+    assert progress['restored'] == 5
+    assert progress['scanned'] == 2
@@ -0,0 +1,106 @@
+import time
+import threading
+import pytest
+
+from hubblestack.utils.workers import WorkerPool, Task, TaskTimeout
+
+def test_results_in_submission_order():
+    def slow_echo(x):
+        time.sleep(0.05 * (5 - x))
+        return x
+    with WorkerPool(max_workers=5) as pool:
+        tasks = pool.map(slow_echo, range(5))
+    assert [ t.value for t in tasks ] == [0, 1, 2, 3, 4]
+    assert all(t.done for t in tasks)
+
+def test_bounded_threads():
+    active = []
+    peak = []
+    lock = threading.Lock()
+    def work(x):
+        with lock:
+            active.append(x)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.remove(x)
+    with WorkerPool(max_workers=3) as pool:
+        pool.map(work, range(12))
+        assert len(pool.threads) == 3
+    assert max(peak) <= 3
+
+def test_exception_is_captured():
+    def boom():
+        raise ValueError('nope')
+    with WorkerPool(max_workers=1) as pool:
+        task = pool.submit(boom)
+        assert task.join(timeout=1)
+    assert isinstance(task.exception, ValueError)
+    assert 'ValueError: nope' in task.traceback
+    with pytest.raises(ValueError):
+        task.result()
+
+def test_timeout_counts_run_time_only():
+    with WorkerPool(max_workers=1) as pool:
+        first = pool.submit(time.sleep, 0.3)
+        second = pool.submit(time.sleep, 0.01)
+        # second is queued behind first for 0.3s but only runs for 0.01s
+        assert second.join(timeout=0.2)
+        assert first.done
+
+def test_timeout_abandons_task():
+    with WorkerPool(max_workers=2) as pool:
+        task = pool.submit(time.sleep, 1)
+        t0 = time.time()
+        assert not task.join(timeout=0.1)
+        assert time.time() - t0 < 0.5
+        with pytest.raises(TaskTimeout):
+            task.result(timeout=0.1)
+
+def test_deadline_and_cancel():
+    with WorkerPool(max_workers=1) as pool:
+        blocker = pool.submit(time.sleep, 0.3)
+        queued = pool.submit(lambda: 'ran')
+        assert not queued.join(deadline=time.time() + 0.05)
+        assert queued.cancel()
+        assert blocker.join()
+    assert queued.join(timeout=1)
+    assert queued.value is None
+    assert queued.cancelled
+
+def test_submit_after_shutdown():
+    pool = WorkerPool()
+    pool.shutdown()
+    with pytest.raises(RuntimeError):
+        pool.submit(time.time)
+
+def test_task_runs_standalone():
+    task = Task(lambda a, b=1: a + b, (1,), {'b': 2})
+    task.run()
+    assert task.value == 3
+    assert task.elapsed >= 0
+
+def test_deadline_bounds_tasks_queued_behind_hung_ones():
+    hang = threading.Event()
+    with WorkerPool(max_workers=2) as pool:
+        tasks = [pool.submit(hang.wait) for _ in range(4)]
+        started = time.time()
+        deadline = started + 0.3
+        joined = [task.join(timeout=0.1, deadline=deadline) for task in tasks]
+        assert time.time() - started < 2
+        assert joined == [False] * 4
+        # the hung ones can't be cancelled; the queued ones never start
+        assert [task.cancel() for task in tasks] == [False, False, True, True]
+        hang.set()
+        assert tasks[0].join(timeout=1) and tasks[1].join(timeout=1)
+        assert tasks[2].join(timeout=1) and tasks[2].started is None
+
+def test_cancel_and_run_dont_race():
+    for _ in range(200):
+        task = Task(lambda: 'ran')
+        runner = threading.Thread(target=task.run)
+        runner.start()
+        cancelled = task.cancel()
+        runner.join()
+        assert cancelled == (task.started is None)
+        assert task.value == (None if cancelled else 'ran')